@@ -0,0 +1,145 @@
+# src/alerts/expiry_alerts.py
+
+import os
+import sys
+import json
+import logging
+from datetime import date, datetime
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import span, traced, inc, configure_logging
+
+try:
+    from src.config import EXPIRY_ALERT_DAYS # 期限まであと何日になったら通知するか
+except ImportError:
+    EXPIRY_ALERT_DAYS = 2
+
+try:
+    from src.config import EXPIRY_ALERT_LOOKBACK_DAYS # 通知し損ねた期限切れの食材を何日前までさかのぼって通知するか
+except ImportError:
+    EXPIRY_ALERT_LOOKBACK_DAYS = 7
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------
+# 賞味期限アラートのバッチ生成
+# ----------------------------------------------------
+# 全世帯の「期限が近い食材」を、世帯ごとに問い合わせる (N+1) のではなく、シャードごとに1回の
+# 範囲検索 (部分インデックス idx_food_items_active_expiry) でまとめて取り出し、世帯ごとに1件の通知にする。
+# 通知した (食材, 期限) の組は expiry_alerts に記録し、同じ期限で二度通知しない
+# (期限を更新した食材は、新しい期限で再び通知される)。
+
+ALERT_COLUMNS = ('id', 'standard_name', 'quantity', 'unit', 'expiry_date', 'expiry_day')
+
+
+def log_notification(household_id, items):
+    """既定の通知先: ログに出力する"""
+    names = ", ".join(f"{item['standard_name']} ({item['expiry_date']})" for item in items)
+    logger.info("Expiry alert for %s: %s", household_id, names)
+
+
+class JsonlOutbox:
+    """通知を1行1件のJSONとしてファイルに追記する（送信は別のプロセスが行う想定）"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __call__(self, household_id, items):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'household_id': household_id, 'created_at': datetime.now().isoformat(),
+                                'items': items}, ensure_ascii=False) + '\n')
+
+
+def _pending_alerts(conn, start_day, end_day):
+    """シャード内の、期限が [start_day, end_day] で未通知の在庫を (世帯, 期限) 順に返す"""
+    return conn.execute(f'''
+        SELECT f.household_id, {', '.join(f'f.{c}' for c in ALERT_COLUMNS)}
+        FROM food_items f INDEXED BY idx_food_items_active_expiry
+        WHERE f.status = 'active' AND f.expiry_day IS NOT NULL AND f.expiry_day BETWEEN ? AND ?
+          AND NOT EXISTS (SELECT 1 FROM expiry_alerts a
+                          WHERE a.household_id = f.household_id AND a.item_id = f.id AND a.expiry_day = f.expiry_day)
+        ORDER BY f.household_id, f.expiry_day
+    ''', (start_day, end_day)).fetchall()
+
+
+@traced('alerts.generate_expiry_alerts')
+def generate_expiry_alerts(within_days=EXPIRY_ALERT_DAYS, router=None, notify=log_notification, today=None,
+                           lookback_days=EXPIRY_ALERT_LOOKBACK_DAYS, dry_run=False):
+    """
+    全シャードを1回ずつ走査し、期限が近い (または最近期限が切れた) 未通知の食材を世帯ごとに通知する。
+
+    Args:
+        within_days (int): 今日から何日後までに期限が来る食材を通知するか。
+        router (ShardRouter): Noneの場合は db_manager のルーター。
+        notify (callable): notify(household_id, items) で呼ばれる。items は ALERT_COLUMNS の辞書のリスト。
+        today (date): 基準日。Noneの場合は今日。
+        lookback_days (int): 期限切れの食材を何日前の期限までさかのぼって通知するか。
+        dry_run (bool): Trueの場合は通知済みとして記録しない。
+
+    Returns:
+        dict: {'households': 通知した世帯数, 'items': 通知した食材数}
+    """
+    if router is None:
+        from src.database.db_manager import get_router
+        router = get_router()
+    today_day = (today or date.today()).toordinal()
+    start_day, end_day = today_day - lookback_days, today_day + within_days
+    assignments = router.households()
+    alerted_at = datetime.now().isoformat(timespec='seconds')
+    totals = {'households': 0, 'items': 0}
+
+    for shard_id in router.existing_shards():
+        conn = router.shard_connection(shard_id)
+        with span('alerts.scan_shard', shard=shard_id):
+            rows = _pending_alerts(conn, start_day, end_day)
+
+        by_household = {}
+        for row in rows:
+            # 移行の途中で残った行など、ディレクトリ上このシャードに属さない世帯は扱わない
+            if assignments.get(row['household_id']) != shard_id:
+                continue
+            by_household.setdefault(row['household_id'], []).append({c: row[c] for c in ALERT_COLUMNS})
+
+        sent = []
+        for household_id, items in by_household.items():
+            try:
+                notify(household_id, items)
+            except Exception as e:
+                # 1世帯の通知に失敗しても他の世帯は続ける (記録しないので次回また通知される)
+                logger.error("Failed to notify %s: %s", household_id, e)
+                continue
+            sent.extend((household_id, item['id'], item['expiry_day'], alerted_at) for item in items)
+            totals['households'] += 1
+            totals['items'] += len(items)
+
+        if sent and not dry_run:
+            with conn:
+                conn.executemany('INSERT OR IGNORE INTO expiry_alerts (household_id, item_id, expiry_day, alerted_at) '
+                                 'VALUES (?, ?, ?, ?)', sent)
+                # 通知対象の範囲より古い記録は不要
+                conn.execute('DELETE FROM expiry_alerts WHERE expiry_day < ?', (start_day,))
+
+    inc('expiry_alert_households_total', totals['households'])
+    inc('expiry_alert_items_total', totals['items'])
+    logger.info("Expiry alerts: %d items for %d households.", totals['items'], totals['households'])
+    return totals
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate expiry alerts for all households in one pass.')
+    parser.add_argument('--days', type=int, default=EXPIRY_ALERT_DAYS, help='今日から何日後までの期限を通知するか')
+    parser.add_argument('--outbox', default=None, help='通知をJSONLで追記するファイル (省略時はログに出力)')
+    parser.add_argument('--dry-run', action='store_true', help='通知済みとして記録しない')
+    args = parser.parse_args()
+
+    configure_logging()
+    notifier = JsonlOutbox(args.outbox) if args.outbox else log_notification
+    result = generate_expiry_alerts(within_days=args.days, notify=notifier, dry_run=args.dry_run)
+    print(f"Notified {result['households']} households about {result['items']} items.")
@@ -0,0 +1,301 @@
+# src/analytics/consumption_forecast.py
+
+import os
+import sys
+import time
+import logging
+from datetime import datetime
+
+import numpy as np
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import span, traced, inc, configure_logging
+from src.database.shard_router import DEFAULT_HOUSEHOLD_ID
+from src.database.scan_history import POINT_DTYPE
+
+try:
+    from src.config import FORECAST_WINDOW_DAYS # 消費ペースの計算に使う直近の日数
+except ImportError:
+    FORECAST_WINDOW_DAYS = 28
+
+try:
+    from src.config import FORECAST_MIN_SAMPLES # 回帰に必要な (補充後の) スキャン数。足りなければ減少量の合計から求める
+except ImportError:
+    FORECAST_MIN_SAMPLES = 3
+
+try:
+    from src.config import FORECAST_MAX_HORIZON_DAYS # これより先の在庫切れは「予測なし」として扱う
+except ImportError:
+    FORECAST_MAX_HORIZON_DAYS = 365
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------
+# 消費ペースと在庫切れ日の予測
+# ----------------------------------------------------
+# scan_series の (世帯, クラス) ごとの時系列から、1日あたりの消費量と在庫が0になる日時を予測する。
+# 全系列をまとめてNumPyで計算する (系列ごとのPythonループはない)。
+#   - 個数が前回より増えたスキャンを「補充」とみなし、最後の補充以降の点に最小二乗で直線を当てはめ、
+#     傾き (の符号を反転したもの) を消費ペースとする。
+#   - 補充以降の点が FORECAST_MIN_SAMPLES 未満なら、窓内の減少量の合計 / 経過日数 を使う。
+#   - 在庫切れ予測 = 最後のスキャン時刻 + 最後の個数 / 消費ペース。
+# 結果はシャードの consumption_forecasts にキャッシュし、世帯の最新のスキャンIDと
+# キャッシュのスキャンIDが異なる世帯 (新しいスキャンがあった世帯) だけを再計算する。
+
+SECONDS_PER_DAY = 86400.0
+
+
+def compute_forecasts(lengths, scanned_at, counts, window_days=FORECAST_WINDOW_DAYS,
+                      min_samples=FORECAST_MIN_SAMPLES, max_horizon_days=FORECAST_MAX_HORIZON_DAYS):
+    """
+    連結した時系列の点から系列ごとの予測を計算する。
+
+    Args:
+        lengths (array): 系列ごとの点の数 (1以上)。点は系列の順に、各系列の中では古い順に並んでいること。
+        scanned_at (array): 各点のスキャン時刻 (UNIX秒)。
+        counts (array): 各点の個数。
+        window_days (float): 最後のスキャンからさかのぼってこの日数以内の点だけを使う。
+        min_samples (int): 回帰を使うのに必要な補充後の点の数。
+        max_horizon_days (float): 最後のスキャンからこの日数より先の在庫切れは予測なし (NaN) とする。
+
+    Returns:
+        dict: 系列ごとの配列 'samples', 'last_count', 'last_scanned_at',
+              'rate_per_day' (1日あたりの消費量、求まらなければNaN), 'runout_at' (UNIX秒、予測できなければNaN)
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    t = np.asarray(scanned_at, dtype=np.int64)
+    c = np.asarray(counts, dtype=np.float64)
+    n_series = len(lengths)
+    n_points = len(t)
+    if n_series == 0:
+        empty = np.empty(0)
+        return {'samples': empty.astype(np.int64), 'last_count': empty, 'last_scanned_at': empty.astype(np.int64),
+                'rate_per_day': empty, 'runout_at': empty}
+
+    # 系列の境界
+    ends = np.cumsum(lengths) - 1
+    starts = ends - lengths + 1
+    series_id = np.repeat(np.arange(n_series), lengths)
+    new_series = np.zeros(n_points, dtype=bool)
+    new_series[starts] = True
+
+    t_last = t[ends]
+    # 精度を保つため、時刻は系列の最後のスキャンからの日数 (<= 0) にする
+    days = (t - t_last[series_id]) / SECONDS_PER_DAY
+    in_window = days >= -window_days
+
+    # 最後の補充 (個数が増えた点) 以降の区間
+    delta = np.zeros(n_points)
+    delta[1:] = c[1:] - c[:-1]
+    delta[new_series] = 0.0
+    segment_start = new_series | (delta > 0)
+    segment_of = np.maximum.accumulate(np.where(segment_start, np.arange(n_points), 0))
+    in_segment = segment_of == segment_of[ends][series_id]
+
+    # 最小二乗の傾き (系列ごとの和は bincount で求める)
+    fit = (in_segment & in_window).astype(np.float64)
+    n = np.bincount(series_id, weights=fit, minlength=n_series)
+    sum_x = np.bincount(series_id, weights=fit * days, minlength=n_series)
+    sum_y = np.bincount(series_id, weights=fit * c, minlength=n_series)
+    sum_xx = np.bincount(series_id, weights=fit * days * days, minlength=n_series)
+    sum_xy = np.bincount(series_id, weights=fit * days * c, minlength=n_series)
+    denominator = n * sum_xx - sum_x * sum_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denominator > 0, (n * sum_xy - sum_x * sum_y) / denominator, np.nan)
+    regression_rate = np.clip(-slope, 0.0, None)
+
+    # 点が少ない系列: 窓内の減少量の合計 / 窓内の経過日数
+    drops = np.where(in_window, np.clip(-delta, 0.0, None), 0.0)
+    total_drop = np.bincount(series_id, weights=drops, minlength=n_series)
+    first_day = np.minimum.reduceat(np.where(in_window, days, 0.0), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drop_rate = np.where(first_day < 0, total_drop / -first_day, np.nan)
+
+    rate = np.where(n >= min_samples, regression_rate, drop_rate)
+    last_count = c[ends]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_left = np.where(last_count <= 0, 0.0, np.where(rate > 0, last_count / rate, np.nan))
+    days_left[days_left > max_horizon_days] = np.nan
+    return {
+        'samples': n.astype(np.int64),
+        'last_count': last_count,
+        'last_scanned_at': t_last,
+        'rate_per_day': rate,
+        'runout_at': t_last + days_left * SECONDS_PER_DAY,
+    }
+
+
+def _stale_households(conn, household_ids=None):
+    """
+    キャッシュが最新のスキャンを反映していない世帯と、その最新のスキャンID (スキャンがなければ0)。
+    household_ids を指定した場合はその世帯だけを調べる。
+    """
+    if household_ids is None:
+        scope, params = '', []
+    else:
+        household_ids = list(household_ids)
+        scope = f"WHERE household_id IN ({', '.join('?' * len(household_ids))})"
+        params = household_ids * 3
+    rows = conn.execute(f'''
+        SELECT f.household_id, f.latest
+        FROM (SELECT household_id, MAX(scan_id) AS latest FROM fridge_scans {scope} GROUP BY household_id) f
+        LEFT JOIN (SELECT household_id, MAX(scan_id) AS cached FROM consumption_forecasts {scope}
+                   GROUP BY household_id) c ON c.household_id = f.household_id
+        WHERE c.cached IS NULL OR c.cached != f.latest
+        UNION ALL
+        SELECT household_id, 0 FROM consumption_forecasts {scope}
+        {'AND' if scope else 'WHERE'} household_id NOT IN (SELECT household_id FROM fridge_scans)
+        GROUP BY household_id
+    ''', params).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+def refresh_shard(conn, household_ids=None, window_days=FORECAST_WINDOW_DAYS, min_samples=FORECAST_MIN_SAMPLES):
+    """
+    シャード内で新しいスキャンがあった世帯の予測を再計算してキャッシュに書き込む。
+
+    読み取り中に新しいスキャンが記録されても、キャッシュには読み取った時点のスキャンIDを記録するため、
+    次回の更新で再計算される。
+
+    Returns:
+        dict: {'households': 再計算した世帯数, 'series': 書き込んだ系列数}
+    """
+    stale = _stale_households(conn, household_ids)
+    if not stale:
+        return {'households': 0, 'series': 0}
+
+    with conn:
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS forecast_refresh (
+                household_id TEXT PRIMARY KEY,
+                latest INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('DELETE FROM temp.forecast_refresh')
+        conn.executemany('INSERT INTO temp.forecast_refresh (household_id, latest) VALUES (?, ?)', stale)
+
+    rows = conn.execute('''
+        SELECT r.household_id, r.latest, c.yolo_class, c.points
+        FROM temp.forecast_refresh r JOIN scan_series c ON c.household_id = r.household_id
+    ''').fetchall()
+    # 全系列の点を1つの配列にし、キャッシュに記録するスキャンIDより新しい点を除く
+    points = np.frombuffer(b''.join(row['points'] for row in rows), dtype=POINT_DTYPE)
+    lengths = np.array([len(row['points']) // POINT_DTYPE.itemsize for row in rows], dtype=np.int64)
+    series_id = np.repeat(np.arange(len(rows)), lengths)
+    latest = np.array([row['latest'] for row in rows], dtype=np.int64)
+    keep = points['scan_id'] <= latest[series_id]
+    points = points[keep]
+    lengths = np.bincount(series_id[keep], minlength=len(rows))
+    present = lengths > 0
+    forecasts = compute_forecasts(lengths[present], points['scanned_at'], points['count'],
+                                  window_days=window_days, min_samples=min_samples)
+
+    keys = [(row['household_id'], row['yolo_class'], row['latest']) for row, p in zip(rows, present) if p]
+    records = [
+        (household_id, yolo_class, scan_id, samples, int(last_count), last_scanned_at,
+         None if np.isnan(rate) else rate, None if np.isnan(runout_at) else int(runout_at))
+        for (household_id, yolo_class, scan_id), samples, last_count, last_scanned_at, rate, runout_at in zip(
+            keys, forecasts['samples'].tolist(), forecasts['last_count'].tolist(),
+            forecasts['last_scanned_at'].tolist(), forecasts['rate_per_day'].tolist(), forecasts['runout_at'].tolist())
+    ]
+    with conn:
+        conn.execute('DELETE FROM consumption_forecasts '
+                     'WHERE household_id IN (SELECT household_id FROM temp.forecast_refresh)')
+        conn.executemany('''
+            INSERT INTO consumption_forecasts (household_id, yolo_class, scan_id, samples, last_count,
+                                               last_scanned_at, rate_per_day, runout_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', records)
+    return {'households': len(stale), 'series': len(records)}
+
+
+@traced('forecast.refresh')
+def refresh_forecasts(router=None, household_ids=None, window_days=FORECAST_WINDOW_DAYS,
+                      min_samples=FORECAST_MIN_SAMPLES):
+    """
+    全シャード (household_ids を指定した場合はその世帯のシャード) の予測のキャッシュを更新する。
+
+    Returns:
+        dict: {'households': 再計算した世帯数, 'series': 系列数, 'seconds': 所要時間}
+    """
+    if router is None:
+        from src.database.db_manager import get_router
+        router = get_router()
+
+    if household_ids is None:
+        targets = {shard_id: None for shard_id in router.existing_shards()}
+    else:
+        targets = {}
+        for household_id in household_ids:
+            targets.setdefault(router.shard_for(household_id), []).append(household_id)
+
+    start = time.perf_counter()
+    totals = {'households': 0, 'series': 0}
+    for shard_id, shard_households in targets.items():
+        with span('forecast.refresh_shard', shard=shard_id):
+            result = refresh_shard(router.shard_connection(shard_id), shard_households,
+                                   window_days=window_days, min_samples=min_samples)
+        totals['households'] += result['households']
+        totals['series'] += result['series']
+    inc('forecast_households_recomputed_total', totals['households'])
+    totals['seconds'] = time.perf_counter() - start
+    logger.debug("Refreshed consumption forecasts: %s", totals)
+    return totals
+
+
+@traced('forecast.get')
+def get_forecasts(household_id=DEFAULT_HOUSEHOLD_ID, router=None, refresh=True):
+    """
+    世帯のクラスごとの消費ペースと在庫切れ予測を返す（新しいスキャンがあればその世帯だけ再計算する）。
+
+    Returns:
+        list: 在庫切れが近い順の辞書のリスト。'runout_date' は予測できなければNone
+    """
+    if router is None:
+        from src.database.db_manager import get_router
+        router = get_router()
+    if refresh:
+        refresh_forecasts(router, household_ids=[household_id])
+    rows = router.connection(household_id).execute('''
+        SELECT yolo_class, samples, last_count, last_scanned_at, rate_per_day, runout_at
+        FROM consumption_forecasts WHERE household_id = ?
+        ORDER BY runout_at IS NULL, runout_at, yolo_class
+    ''', (household_id,)).fetchall()
+    forecasts = []
+    for row in rows:
+        forecast = dict(row)
+        forecast['runout_date'] = (datetime.fromtimestamp(row['runout_at']).strftime('%Y-%m-%d')
+                                   if row['runout_at'] is not None else None)
+        forecasts.append(forecast)
+    return forecasts
+
+
+def print_forecasts(forecasts):
+    print(f"{'YOLO Class':<15} {'Qty':>5} {'Per Day':>8} {'Runs Out':<12} {'Samples':>7}")
+    print("-" * 52)
+    for f in forecasts:
+        rate = f"{f['rate_per_day']:.2f}" if f['rate_per_day'] is not None else '-'
+        print(f"{f['yolo_class']:<15} {f['last_count']:>5} {rate:>8} {f['runout_date'] or '-':<12} {f['samples']:>7}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Forecast consumption rates and run-out dates from fridge scans.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    refresh_parser = subparsers.add_parser('refresh', help='新しいスキャンがあった全世帯の予測を再計算する')
+    refresh_parser.add_argument('--window-days', type=float, default=FORECAST_WINDOW_DAYS)
+    show_parser = subparsers.add_parser('show', help='世帯の予測を表示する')
+    show_parser.add_argument('--household', default=DEFAULT_HOUSEHOLD_ID)
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.command == 'refresh':
+        result = refresh_forecasts(window_days=args.window_days)
+        print(f"Recomputed {result['households']} households ({result['series']} series) in {result['seconds']:.2f}s")
+    elif args.command == 'show':
+        print_forecasts(get_forecasts(args.household))
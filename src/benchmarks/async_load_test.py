@@ -0,0 +1,199 @@
+# src/benchmarks/async_load_test.py
+
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.benchmarks.synthetic_data import populate_inventory
+
+# ----------------------------------------------------
+# 非同期DBファサードの負荷試験
+# ----------------------------------------------------
+# 多数のコルーチンが AsyncInventoryDB 経由で複数の世帯の在庫を並行して読み書きし、
+#   - 操作の種類ごとのレイテンシ (中央値・p95) とスループット
+#   - イベントループの遅れ (LAG_INTERVAL ごとに起きるタスクが、予定よりどれだけ遅れて起きたか)
+# を計測する。ループの遅れが DB の処理時間と同じ桁になっていれば、どこかでループを止めている。
+# 最後に、世帯ごとの在庫の行数が「初期の行数 + 追加した行数」と一致し、在庫キャッシュとDBの内容が
+# 一致することを確かめる (一致しなければ終了コード1)。
+
+LAG_INTERVAL = 0.005
+FOOD_NAMES = [('牛乳', 'milk'), ('卵', 'egg'), ('りんご', 'apple'), ('にんじん', 'carrot'), ('トマト', 'tomato'),
+              ('キャベツ', 'cabbage'), ('ヨーグルト', 'yogurt'), ('豆腐', 'tofu')]
+
+
+def _percentile(values, q):
+    """q パーセンタイル。method='inclusive' で標本の範囲内 (最大値以下) に収める"""
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+async def _monitor_loop_lag(stop, lags):
+    """LAG_INTERVAL ごとに起き、予定より遅れた時間を lags に記録する"""
+    while not stop.is_set():
+        expected = time.perf_counter() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def _client(db, rng, households, ops, read_ratio, latencies, added, item_ids):
+    """1つのクライアント: 読み出しと書き込みを read_ratio の割合で ops 回行う"""
+    for _ in range(ops):
+        household_id = rng.choice(households)
+        start = time.perf_counter()
+        if rng.random() < read_ratio:
+            kind = rng.choice(('get_all', 'iter', 'distinct'))
+            if kind == 'get_all':
+                await db.get_all_food_items(household_id=household_id)
+            elif kind == 'iter':
+                async for _ in db.iter_food_items(['standard_name', 'quantity'], household_id=household_id,
+                                                  batch_size=100):
+                    pass
+            else:
+                await db.get_distinct_standard_names(household_id=household_id)
+        else:
+            kind = rng.choice(('add', 'update', 'transaction'))
+            name, yolo_class = rng.choice(FOOD_NAMES)
+            if kind == 'add':
+                item_ids[household_id].append(
+                    await db.add_food_item(name, yolo_class, rng.randint(1, 5), 'manual', household_id=household_id))
+                added[household_id] += 1
+            elif kind == 'update' and item_ids[household_id]:
+                await db.update_food_item_quantity(rng.choice(item_ids[household_id]), rng.randint(1, 9),
+                                                   household_id=household_id)
+            else:
+                kind = 'transaction'
+                # 追加2件と更新1件を1つのトランザクション・取り込みバッチで行う
+                async with db.transaction(household_id):
+                    new_ids = [await db.add_food_item(name, yolo_class, 1, 'receipt', household_id=household_id)
+                               for _ in range(2)]
+                    await db.update_food_item_quantity(new_ids[0], 3, household_id=household_id)
+                item_ids[household_id].extend(new_ids)
+                added[household_id] += 2
+        latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+
+async def run_load_test(num_households=20, clients=200, ops=50, read_ratio=0.8, initial_rows=200, seed=0):
+    """
+    負荷試験を実行し、結果の辞書を返す (db_manager の現在のルーターを使う)。
+
+    Args:
+        num_households (int): 読み書きする世帯の数。
+        clients (int): 同時に動くコルーチンの数。
+        ops (int): コルーチンごとの操作の回数。
+        read_ratio (float): 操作のうち読み出しの割合。
+        initial_rows (int): 世帯ごとの初期の在庫の行数。
+    """
+    from src.database import db_manager
+    from src.database.async_db import AsyncInventoryDB
+
+    households = [f'load-{i:04d}' for i in range(num_households)]
+    initial = {}
+    for index, household_id in enumerate(households):
+        populate_inventory(initial_rows, seed=seed + index, household_id=household_id)
+        initial[household_id] = len(db_manager.get_all_food_items(household_id=household_id))
+    db_manager.get_inventory_cache().reset_stats()
+
+    latencies = {}
+    added = {household_id: 0 for household_id in households}
+    item_ids = {household_id: [] for household_id in households}
+    lags = []
+    stop = asyncio.Event()
+
+    async with AsyncInventoryDB() as db:
+        monitor = asyncio.create_task(_monitor_loop_lag(stop, lags))
+        start = time.perf_counter()
+        await asyncio.gather(*(_client(db, random.Random(seed * 100_003 + i), households, ops, read_ratio,
+                                       latencies, added, item_ids) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await monitor
+
+        mismatches = []
+        for household_id in households:
+            cached = [tuple(row) for row in await db.get_all_food_items(household_id=household_id)]
+            if len(cached) != initial[household_id] + added[household_id]:
+                mismatches.append((household_id, 'row_count', len(cached), initial[household_id] + added[household_id]))
+            stored = [tuple(row) for row in await db.execute(
+                household_id, f"SELECT {', '.join(db_manager.CACHED_COLUMNS)} FROM food_items "
+                              "WHERE household_id = ? AND status = 'active' ORDER BY standard_name, id",
+                (household_id,))]
+            if cached != stored:
+                mismatches.append((household_id, 'cache', len(cached), len(stored)))
+        cache_stats = await db.inventory_cache_stats()
+
+    total_ops = sum(len(values) for values in latencies.values())
+    return {
+        'clients': clients,
+        'households': num_households,
+        'ops': total_ops,
+        'elapsed_s': elapsed,
+        'ops_per_s': total_ops / elapsed if elapsed else 0.0,
+        'latency_ms': {kind: {'count': len(values), 'median': statistics.median(values) * 1000,
+                              'p95': _percentile(values, 95) * 1000}
+                       for kind, values in sorted(latencies.items())},
+        'loop_lag_ms': {'median': statistics.median(lags) * 1000 if lags else 0.0,
+                        'p99': _percentile(lags, 99) * 1000, 'max': max(lags, default=0.0) * 1000},
+        'cache': cache_stats,
+        'mismatches': mismatches,
+    }
+
+
+def print_report(result):
+    print(f"{result['clients']} clients, {result['households']} households: {result['ops']} ops in "
+          f"{result['elapsed_s']:.2f} s ({result['ops_per_s']:.0f} ops/s)")
+    print(f"{'Operation':<12} {'Count':>7} {'Median ms':>10} {'p95 ms':>10}")
+    print("-" * 42)
+    for kind, stats in result['latency_ms'].items():
+        print(f"{kind:<12} {stats['count']:>7} {stats['median']:>10.2f} {stats['p95']:>10.2f}")
+    lag = result['loop_lag_ms']
+    print(f"Event loop lag: median {lag['median']:.2f} ms, p99 {lag['p99']:.2f} ms, max {lag['max']:.2f} ms")
+    cache = result['cache']
+    print(f"Inventory cache: {cache['hits']} hits, {cache['misses']} misses (hit rate {cache['hit_rate']:.1%}), "
+          f"{cache['updates']} row updates")
+    if result['mismatches']:
+        print(f"MISMATCHES: {result['mismatches']}")
+    else:
+        print("Consistency check passed.")
+
+
+if __name__ == '__main__':
+    from src.database import db_manager
+    from src.database.shard_router import ShardRouter
+
+    parser = argparse.ArgumentParser(description='Load test the async inventory DB facade with concurrent coroutines.')
+    parser.add_argument('--households', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--ops', type=int, default=50, help='コルーチンごとの操作の回数')
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    parser.add_argument('--initial-rows', type=int, default=200, help='世帯ごとの初期の在庫の行数')
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--output', default=None, help='結果をJSONで書き出すファイル')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='re2_yolo_async_load_')
+    original = db_manager.use_router(ShardRouter(shard_dir=work_dir, num_shards=args.shards))
+    try:
+        result = asyncio.run(run_load_test(num_households=args.households, clients=args.clients, ops=args.ops,
+                                           read_ratio=args.read_ratio, initial_rows=args.initial_rows))
+    finally:
+        db_manager.get_router().close()
+        db_manager.use_router(original)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
+    sys.exit(1 if result['mismatches'] else 0)
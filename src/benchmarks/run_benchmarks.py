@@ -0,0 +1,399 @@
+# src/benchmarks/run_benchmarks.py
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.benchmarks.synthetic_data import generate_receipts, render_receipt_image, generate_fridge_images, \
+                                         populate_inventory, populate_scan_history, SYNTHETIC_TODAY
+
+# ----------------------------------------------------
+# エンドツーエンドのベンチマーク
+# ----------------------------------------------------
+# 合成データで各ステージ（レシート解析・DB問い合わせ・OCR・YOLO推論）と、
+# analyze_fridge_image / process_receipt_image の全体フローの時間を計測し、JSONに書き出す。
+# ベースラインのJSONを指定すると、中央値がベースラインより tolerance 以上遅くなったステージを回帰として報告し、
+# 終了コード1で終了する（CIで使う想定）。
+# ultralytics / easyocr / 日本語フォントがない環境では、該当ステージは 'skipped' として記録する。
+
+BENCHMARK_DIR = os.path.join(project_root, 'data', 'benchmarks')
+DEFAULT_OUTPUT_PATH = os.path.join(BENCHMARK_DIR, 'latest.json')
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baseline.json')
+DEFAULT_TOLERANCE = 0.2          # 中央値がベースラインの (1 + tolerance) 倍を超えたら回帰
+MIN_REGRESSION_SECONDS = 0.001   # これより小さい差はノイズとして無視する
+
+
+class StageSkipped(Exception):
+    """依存パッケージやデータがなく、ステージを実行できない"""
+
+
+@contextlib.contextmanager
+def _quiet(enabled=True):
+    """計測中は各モジュールの print を抑制する"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def use_database(shard_dir):
+    """db_manager の接続先を、shard_dir の単一シャードに一時的に差し替える"""
+    from src.database import db_manager
+    from src.database.shard_router import ShardRouter
+    router = ShardRouter(shard_dir=shard_dir, num_shards=1)
+    original = db_manager.use_router(router)
+    try:
+        yield db_manager
+    finally:
+        router.close()
+        db_manager.use_router(original)
+
+
+def time_stage(fn, repeat=5, warmup=1, quiet=True):
+    """fn を warmup + repeat 回実行し、所要秒数の統計を返す。fn の戻り値（最後の回）も返す"""
+    result = None
+    with _quiet(quiet):
+        for _ in range(warmup):
+            result = fn()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'repeat': repeat,
+        'median_s': samples[len(samples) // 2],
+        'p95_s': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'min_s': samples[0],
+        'mean_s': sum(samples) / len(samples),
+    }, result
+
+
+class BenchmarkRunner:
+    """ステージを順に実行し、結果を辞書にまとめる"""
+
+    def __init__(self, work_dir, repeat=5, quiet=True):
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.quiet = quiet
+        self.results = {}
+
+    def run(self, name, fn, repeat=None, warmup=1, items=None, extra=None):
+        try:
+            stats, result = time_stage(fn, repeat=repeat or self.repeat, warmup=warmup, quiet=self.quiet)
+        except StageSkipped as e:
+            self.results[name] = {'skipped': str(e)}
+            print(f"{name:<48} skipped ({e})")
+            return None
+        except ImportError as e:
+            self.results[name] = {'skipped': f'missing dependency: {e}'}
+            print(f"{name:<48} skipped (missing dependency: {e})")
+            return None
+        if items:
+            stats['items'] = items
+            stats['per_item_ms'] = stats['median_s'] / items * 1000
+        if extra:
+            stats.update(extra(result) if callable(extra) else extra)
+        self.results[name] = stats
+        per_item = f"  ({stats['per_item_ms']:.3f} ms/item)" if items else ''
+        print(f"{name:<48} median {stats['median_s'] * 1000:>10.2f} ms  p95 {stats['p95_s'] * 1000:>10.2f} ms{per_item}")
+        return result
+
+
+def bench_receipt_parsing(runner, num_receipts):
+    from src.ocr_processing.receipt_parser import parse_receipt_text_simple, HybridReceiptParser, \
+                                                 _stub_receipt_responder
+    from src.llm.llm_client import StubLLMClient
+    from src.llm.response_cache import LLMResponseCache
+
+    receipts = generate_receipts(num_receipts, seed=1)
+
+    def parse_simple():
+        return [parse_receipt_text_simple(lines) for lines, _ in receipts]
+
+    def accuracy(parsed):
+        expected = sum(len(set(names)) for _, names in receipts)
+        found = sum(len(set(names) & {item['item_name'] for item in items})
+                    for (_, names), items in zip(receipts, parsed))
+        return {'recall': found / expected if expected else None}
+
+    runner.run(f'receipt_parse_simple[receipts={num_receipts}]', parse_simple, items=num_receipts, extra=accuracy)
+
+    def parse_hybrid():
+        # 毎回コールドキャッシュで計測する（LLMはレイテンシ0のスタブ）
+        client = StubLLMClient(model_name='stub', responder=_stub_receipt_responder)
+        cache = LLMResponseCache(':memory:', ttl_seconds=None, max_entries=200_000)
+        parser = HybridReceiptParser(client=client, cache=cache)
+        return parser.parse_many([lines for lines, _ in receipts]), client.call_count
+
+    runner.run(f'receipt_parse_hybrid_stub[receipts={num_receipts}]', parse_hybrid, items=num_receipts,
+               extra=lambda result: {'llm_calls': result[1]})
+
+
+def bench_inventory(runner, num_rows):
+    from src.recipes.recipe_store import build_ingredient_weights
+
+    shard_dir = os.path.join(runner.work_dir, f'inventory_{num_rows}')
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    with use_database(shard_dir) as db_manager:
+        with _quiet(runner.quiet):
+            db_manager.create_table()
+
+        def populate():
+            populate_inventory(num_rows)
+        runner.run(f'db_populate[rows={num_rows}]', populate, repeat=1, warmup=0, items=num_rows)
+
+        runner.run(f'db_get_all_active[rows={num_rows}]', lambda: len(db_manager.get_all_food_items(status='active')))
+        runner.run(f'db_distinct_names_both[rows={num_rows}]',
+                   lambda: db_manager.get_distinct_standard_names(detected_by='both'))
+        runner.run(f'db_iter_recipe_columns[rows={num_rows}]',
+                   lambda: sum(1 for _ in db_manager.iter_food_items(['standard_name', 'detected_by'])))
+        runner.run(f'db_expiring_items[rows={num_rows}]',
+                   lambda: len(db_manager.get_expiring_items(3, include_expired=True, today=SYNTHETIC_TODAY)))
+        runner.run(f'recipe_ingredient_weights[rows={num_rows}]',
+                   lambda: build_ingredient_weights(
+                       db_manager.iter_food_items(['standard_name', 'detected_by']),
+                       today=SYNTHETIC_TODAY,
+                       expiring_items=db_manager.get_expiring_items(
+                           3, include_expired=True, today=SYNTHETIC_TODAY,
+                           columns=['standard_name', 'detected_by', 'expiry_day'])))
+
+        # 在庫キャッシュに載る大きさの世帯: キャッシュからの読み出しと、1行更新した直後の読み出し
+        cache = db_manager.get_inventory_cache()
+        cached_rows = min(num_rows, cache.max_rows)
+        populate_inventory(cached_rows, household_id='cached')
+        first_id = db_manager.get_all_food_items(household_id='cached')[0]['id']
+        runner.run(f'db_get_all_active_cached[rows={cached_rows}]',
+                   lambda: len(db_manager.get_all_food_items(household_id='cached')),
+                   extra=lambda _: {'cache_hit_rate': round(cache.stats()['hit_rate'], 3)})
+
+        def update_then_read():
+            db_manager.update_food_item_quantity(first_id, 2, household_id='cached')
+            return len(db_manager.get_all_food_items(household_id='cached'))
+        runner.run(f'db_update_then_read_cached[rows={cached_rows}]', update_then_read)
+
+        # 列指向フォーマットでの一括エクスポートと、そのファイルからの一括取り込み (pyarrow がなければ skipped)
+        export_dir = os.path.join(runner.work_dir, f'export_{num_rows}')
+
+        def export_parquet():
+            from src.database.inventory_export import export_tables
+            return export_tables(export_dir, tables=['food_items'])['food_items']
+        runner.run(f'db_export_parquet[rows={num_rows}]', export_parquet, repeat=1, items=num_rows)
+
+        def import_parquet():
+            from src.database.inventory_export import import_food_items
+            return import_food_items(os.path.join(export_dir, 'food_items.parquet'), household_id='imported')
+        runner.run(f'db_import_parquet[rows={num_rows}]', import_parquet, repeat=1, warmup=0, items=num_rows)
+
+
+def bench_forecast(runner, num_households, scans_per_household=30):
+    from src.analytics.consumption_forecast import refresh_forecasts
+    from src.database.scan_history import record_scan
+
+    shard_dir = os.path.join(runner.work_dir, f'forecast_{num_households}')
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    with use_database(shard_dir) as db_manager:
+        router = db_manager.get_router()
+        runner.run(f'scan_history_populate[households={num_households}]',
+                   lambda: populate_scan_history(num_households, scans_per_household=scans_per_household),
+                   repeat=1, warmup=0, items=num_households)
+
+        def full_refresh():
+            for shard_id in router.existing_shards():
+                conn = router.shard_connection(shard_id)
+                with conn:
+                    conn.execute('DELETE FROM consumption_forecasts')
+            return refresh_forecasts(router)
+        runner.run(f'forecast_full[households={num_households}]', full_refresh, repeat=3, items=num_households,
+                   extra=lambda result: {'series': result['series']})
+
+        # 一部の世帯に新しいスキャンが届いた後の差分更新
+        changed = [f'household-{i:06d}' for i in range(0, num_households, max(num_households // 100, 1))]
+
+        def incremental_refresh():
+            for household_id in changed:
+                conn = router.connection(household_id)
+                with conn:
+                    record_scan(conn, household_id, {'egg': 3})
+            return refresh_forecasts(router)
+        runner.run(f'forecast_incremental[households={num_households},changed={len(changed)}]',
+                   incremental_refresh, items=len(changed),
+                   extra=lambda result: {'recomputed': result['households']})
+
+
+def bench_ocr(runner, num_receipts):
+    receipt_dir = os.path.join(runner.work_dir, 'receipts')
+    os.makedirs(receipt_dir, exist_ok=True)
+    receipts = generate_receipts(num_receipts, seed=2)
+    try:
+        paths = [render_receipt_image(lines, os.path.join(receipt_dir, f'receipt_{i:04d}.jpg'))
+                 for i, (lines, _) in enumerate(receipts)]
+    except (RuntimeError, ImportError) as e:
+        runner.results[f'ocr[receipts={num_receipts}]'] = {'skipped': str(e)}
+        runner.results[f'flow_process_receipt[receipts={num_receipts}]'] = {'skipped': str(e)}
+        print(f"ocr / flow_process_receipt skipped ({e})")
+        return
+
+    def ocr():
+        from src.ocr_processing.run_ocr import perform_ocr
+        return [perform_ocr(path, detail=1) for path in paths]
+    runner.run(f'ocr[receipts={num_receipts}]', ocr, repeat=1, items=num_receipts)
+
+    def flow():
+        from src.main import process_receipt_image
+        return [process_receipt_image(path) for path in paths]
+    with use_database(os.path.join(runner.work_dir, 'flow_receipt')) as db_manager:
+        with _quiet(runner.quiet):
+            db_manager.create_table()
+        runner.run(f'flow_process_receipt[receipts={num_receipts}]', flow, repeat=1, items=num_receipts)
+        # 同じ画像をもう一度取り込む: 画像の指紋で重複と分かり、OCRをせずに終わる
+        runner.run(f'flow_process_receipt_duplicate[receipts={num_receipts}]', flow, repeat=1, items=num_receipts)
+
+
+def bench_yolo(runner, num_images):
+    try:
+        paths = generate_fridge_images(num_images, os.path.join(runner.work_dir, 'fridge'), seed=3)
+    except ImportError as e:
+        runner.results[f'yolo_predict[images={num_images}]'] = {'skipped': f'missing dependency: {e}'}
+        runner.results[f'flow_analyze_fridge[images={num_images}]'] = {'skipped': f'missing dependency: {e}'}
+        print(f"yolo_predict / flow_analyze_fridge skipped (missing dependency: {e})")
+        return
+
+    def predict():
+        from src.yolo_detection.predict_yolo import predict_on_image, yolo_model
+        if yolo_model is None:
+            raise StageSkipped('YOLO model not loaded')
+        return [predict_on_image(path) for path in paths]
+    runner.run(f'yolo_predict[images={num_images}]', predict, repeat=3, items=num_images)
+
+    def flow():
+        from src.main import analyze_fridge_image
+        return [analyze_fridge_image(path) for path in paths]
+    with use_database(os.path.join(runner.work_dir, 'flow_fridge')) as db_manager:
+        with _quiet(runner.quiet):
+            db_manager.create_table()
+        runner.run(f'flow_analyze_fridge[images={num_images}]', flow, repeat=1, items=num_images)
+
+    def train_smoke():
+        # デコード済み画像キャッシュを使う学習を1エポック (mosaic あり) 通す。学習ループが壊れていれば例外で失敗する
+        from src.yolo_detection.image_cache import smoke_train_cached
+        return smoke_train_cached(work_dir=os.path.join(runner.work_dir, 'train_smoke'))
+    runner.run('yolo_train_smoke_cached[epochs=1]', train_smoke, repeat=1, warmup=0)
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    ベースラインより遅くなったステージのリストを返す。
+    両方で計測されたステージだけを比較し、差が MIN_REGRESSION_SECONDS 未満のものは無視する。
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base or 'median_s' not in base or 'median_s' not in current:
+            continue
+        limit = base['median_s'] * (1 + tolerance)
+        if current['median_s'] > limit and current['median_s'] - base['median_s'] >= MIN_REGRESSION_SECONDS:
+            regressions.append({'stage': name, 'baseline_s': base['median_s'], 'current_s': current['median_s'],
+                                'ratio': current['median_s'] / base['median_s']})
+    return regressions
+
+
+def run_all(receipts=200, inventory_rows=(10_000, 100_000), images=10, repeat=5, stages=None, quiet=True,
+            forecast_households=10_000):
+    """
+    すべてのステージを実行し、結果の辞書を返す。
+
+    Args:
+        receipts (int): 合成レシートの枚数（解析ステージ）。OCR・フローは min(receipts, 20) 枚。
+        inventory_rows (iterable): 在庫の行数（それぞれ別のDBで計測する。数百万行も可）。
+        images (int): 合成冷蔵庫画像の枚数。
+        stages (set): 実行するステージ群 ('receipt', 'inventory', 'forecast', 'ocr', 'yolo')。Noneの場合はすべて。
+        forecast_households (int): 消費予測を計算する世帯数（各世帯30スキャン）。
+    """
+    work_dir = tempfile.mkdtemp(prefix='re2_yolo_bench_')
+    runner = BenchmarkRunner(work_dir, repeat=repeat, quiet=quiet)
+    stages = set(stages or ('receipt', 'inventory', 'forecast', 'ocr', 'yolo'))
+    try:
+        if 'receipt' in stages:
+            bench_receipt_parsing(runner, receipts)
+        if 'inventory' in stages:
+            for num_rows in inventory_rows:
+                bench_inventory(runner, num_rows)
+        if 'forecast' in stages:
+            bench_forecast(runner, forecast_households)
+        if 'ocr' in stages:
+            bench_ocr(runner, min(receipts, 20))
+        if 'yolo' in stages:
+            bench_yolo(runner, images)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return runner.results
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks with synthetic fridge and receipt workloads.')
+    parser.add_argument('--receipts', type=int, default=200)
+    parser.add_argument('--inventory-rows', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--images', type=int, default=10)
+    parser.add_argument('--forecast-households', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--stages', nargs='+', choices=['receipt', 'inventory', 'forecast', 'ocr', 'yolo'], default=None)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='今回の結果をベースラインとして保存する')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--verbose', action='store_true', help='各モジュールの出力を抑制しない')
+    args = parser.parse_args()
+
+    results = run_all(receipts=args.receipts, inventory_rows=args.inventory_rows, images=args.images,
+                      repeat=args.repeat, stages=args.stages, quiet=not args.verbose,
+                      forecast_households=args.forecast_households)
+    report = {
+        'created_at': time.time(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'params': {'receipts': args.receipts, 'inventory_rows': args.inventory_rows, 'images': args.images,
+                   'forecast_households': args.forecast_households, 'repeat': args.repeat},
+        'results': results,
+    }
+    _write_json(args.output, report)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        _write_json(args.baseline, report)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline.get('results', {}), tolerance=args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed more than {args.tolerance:.0%} against {args.baseline}:")
+            for r in regressions:
+                print(f"  {r['stage']}: {r['baseline_s'] * 1000:.2f} ms -> {r['current_s'] * 1000:.2f} ms "
+                      f"({r['ratio']:.2f}x)")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
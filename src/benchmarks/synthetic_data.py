@@ -0,0 +1,264 @@
+# src/benchmarks/synthetic_data.py
+
+import os
+import sys
+import random
+from datetime import date, datetime, timedelta
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.ocr_processing.receipt_parser import FOOD_KEYWORDS_MAP, REVERSE_KEYWORD_MAP
+from src.database.shard_router import DEFAULT_HOUSEHOLD_ID
+
+try:
+    from src.config import BENCHMARK_FONT_PATH # レシート画像の描画に使う日本語フォント
+except ImportError:
+    BENCHMARK_FONT_PATH = None
+
+# ----------------------------------------------------
+# ベンチマーク用の決定的な合成データ
+# ----------------------------------------------------
+# すべての生成関数は seed が同じなら同じデータを返す。
+#   - レシート: 既知のテキスト（と期待される品目）を持つ行リストと、それを描画した画像
+#   - 冷蔵庫画像: 棚の背景に食材（アノテーション済み画像の切り抜き、なければ図形）を配置した合成画像
+#   - 在庫: food_items テーブルに数百万行まで投入できる行ジェネレータ
+#   - スキャン履歴: 世帯ごとに食材が一定のペースで減り、ときどき補充される検出数の時系列
+
+CJK_FONT_CANDIDATES = [
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/fonts-japanese-gothic.ttf',
+    '/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc',
+    'C:/Windows/Fonts/msgothic.ttc',
+]
+STORE_SPECIFIC_LINES = [f'PB特選ﾎﾟｰｸ{i}' for i in range(50)] + [f'ｵｰｶﾞﾆｯｸﾍﾞｼﾞ{i}' for i in range(50)]
+FRIDGE_IMAGE_SIZE = (960, 1280) # (高さ, 幅)
+SYNTHETIC_TODAY = date(2025, 7, 15) # 合成の在庫の基準日
+
+
+def generate_receipts(num_receipts, seed=0, max_items=8):
+    """
+    既知のキーワード行・店舗固有の行・ヘッダ/合計行からなる合成レシートを作る。
+
+    Returns:
+        list: (行のリスト, 期待される標準名のリスト) のタプルのリスト
+    """
+    rng = random.Random(seed)
+    keywords = sorted(REVERSE_KEYWORD_MAP)
+    receipts = []
+    for _ in range(num_receipts):
+        lines = ['〇〇スーパー', f'2025/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d} {rng.randint(9, 21)}:{rng.randint(0, 59):02d}']
+        expected = []
+        for keyword in rng.sample(keywords, rng.randint(1, max_items)):
+            lines.append(f'{keyword} {rng.randint(98, 998)}円')
+            expected.append(REVERSE_KEYWORD_MAP[keyword])
+        lines += [f'{name} {rng.randint(98, 998)}円' for name in rng.sample(STORE_SPECIFIC_LINES, rng.randint(0, 3))]
+        lines.append(f'合計 {rng.randint(500, 8000)}円')
+        receipts.append((lines, expected))
+    return receipts
+
+
+def find_cjk_font():
+    """日本語を描画できるフォントのパス。見つからない場合はNone"""
+    for path in [BENCHMARK_FONT_PATH] + CJK_FONT_CANDIDATES:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
+def render_receipt_image(lines, output_path, font_path=None, font_size=28, width=600):
+    """
+    レシートの行を白地に描画して保存する（OCRのベンチマーク用）。
+
+    Raises:
+        RuntimeError: 日本語フォントが見つからない場合。
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    font_path = font_path or find_cjk_font()
+    if font_path is None:
+        raise RuntimeError("No CJK font found. Set BENCHMARK_FONT_PATH in src/config.py to render receipts.")
+    font = ImageFont.truetype(font_path, font_size)
+    line_height = int(font_size * 1.6)
+    image = Image.new('RGB', (width, line_height * (len(lines) + 2)), 'white')
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((24, line_height * (i + 1)), line, fill='black', font=font)
+    image.save(output_path, quality=90)
+    return output_path
+
+
+def _load_object_crops(annotated_dir, max_crops=200, seed=0):
+    """アノテーション済み画像から物体の切り抜きを集める（冷蔵庫画像の合成用）"""
+    import cv2
+
+    crops = []
+    if not os.path.isdir(annotated_dir):
+        return crops
+    filenames = sorted(f for f in os.listdir(annotated_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    random.Random(seed).shuffle(filenames)
+    for filename in filenames:
+        label_path = os.path.join(annotated_dir, os.path.splitext(filename)[0] + '.txt')
+        if not os.path.exists(label_path):
+            continue
+        img = cv2.imread(os.path.join(annotated_dir, filename))
+        if img is None:
+            continue
+        h, w = img.shape[:2]
+        with open(label_path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 5:
+                    continue
+                _, xc, yc, bw, bh = map(float, parts)
+                x1, y1 = int((xc - bw / 2) * w), int((yc - bh / 2) * h)
+                x2, y2 = int((xc + bw / 2) * w), int((yc + bh / 2) * h)
+                crop = img[max(y1, 0):y2, max(x1, 0):x2]
+                if crop.size:
+                    crops.append(crop)
+                if len(crops) >= max_crops:
+                    return crops
+    return crops
+
+
+def generate_fridge_images(num_images, output_dir, seed=0, annotated_dir=None, objects_per_image=(4, 12)):
+    """
+    冷蔵庫の棚を模した合成画像を作る。アノテーション済み画像があれば物体の切り抜きを配置し、
+    なければ色付きの図形を配置する。
+
+    Returns:
+        list: 画像パスのリスト
+    """
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    annotated_dir = annotated_dir or os.path.join(project_root, 'data', 'annotated_images')
+    crops = _load_object_crops(annotated_dir, seed=seed)
+    os.makedirs(output_dir, exist_ok=True)
+    height, width = FRIDGE_IMAGE_SIZE
+    shelf_count = 3
+
+    paths = []
+    for index in range(num_images):
+        # 明るい背景と棚板
+        base = rng.integers(200, 240)
+        image = np.full((height, width, 3), base, dtype=np.uint8)
+        image += rng.integers(0, 8, (height, width, 1), dtype=np.uint8)
+        for shelf in range(1, shelf_count + 1):
+            y = shelf * height // (shelf_count + 1)
+            cv2.rectangle(image, (0, y - 6), (width, y + 6), (170, 170, 170), -1)
+
+        for _ in range(int(rng.integers(*objects_per_image))):
+            shelf = int(rng.integers(0, shelf_count))
+            bottom = (shelf + 1) * height // (shelf_count + 1) - 8
+            obj_h = int(rng.integers(height // 10, height // (shelf_count + 1) - 20))
+            obj_w = int(rng.integers(width // 16, width // 6))
+            x = int(rng.integers(0, width - obj_w))
+            y = bottom - obj_h
+            if crops:
+                crop = crops[int(rng.integers(0, len(crops)))]
+                image[y:bottom, x:x + obj_w] = cv2.resize(crop, (obj_w, obj_h))
+            else:
+                color = tuple(int(c) for c in rng.integers(0, 256, 3))
+                if rng.random() < 0.5:
+                    cv2.rectangle(image, (x, y), (x + obj_w, bottom), color, -1)
+                else:
+                    cv2.ellipse(image, (x + obj_w // 2, y + obj_h // 2), (obj_w // 2, obj_h // 2), 0, 0, 360, color, -1)
+
+        path = os.path.join(output_dir, f'fridge_{seed}_{index:04d}.jpg')
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return paths
+
+
+def iter_inventory_rows(num_rows, seed=0, today=None):
+    """
+    food_items に投入する行を生成する（standard_name, yolo_class, quantity, unit, purchase_date,
+    expiry_date, detected_by, last_seen_date, status, notes）。
+    """
+    rng = random.Random(seed)
+    today = today or SYNTHETIC_TODAY
+    standard_names = sorted(FOOD_KEYWORDS_MAP)
+    for _ in range(num_rows):
+        name = rng.choice(standard_names)
+        purchased = today - timedelta(days=rng.randint(0, 30))
+        expiry = purchased + timedelta(days=rng.randint(2, 20)) if rng.random() < 0.7 else None
+        status = 'active' if rng.random() < 0.8 else rng.choice(['consumed', 'discarded'])
+        yield (name, name, float(rng.randint(1, 6)), None, purchased.isoformat(),
+               expiry.isoformat() if expiry else None, rng.choice(['yolo', 'receipt', 'both']),
+               (purchased + timedelta(days=rng.randint(0, 5))).isoformat(), status, None)
+
+
+def populate_inventory(num_rows, seed=0, batch_size=50_000, household_id=DEFAULT_HOUSEHOLD_ID):
+    """世帯の在庫に合成データを batch_size 行ずつ一括投入する（db_manager の現在のルーターに書き込む）"""
+    from src.database.db_manager import add_food_items
+
+    rows = iter_inventory_rows(num_rows, seed=seed)
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        add_food_items(batch, household_id=household_id)
+    return num_rows
+
+
+def iter_scan_histories(num_households, scans_per_household=30, classes_per_household=8, seed=0, start=None):
+    """
+    世帯ごとの冷蔵庫スキャンの時系列を生成する。各クラスは一定のペースで減り、0になると確率的に補充される。
+    検出漏れを模して、ときどき個数が1少なく見えるスキャンを混ぜる。
+
+    Yields:
+        (household_id, [(scanned_at (UNIX秒), {クラス: 個数}), ...])
+    """
+    rng = random.Random(seed)
+    start = start or datetime(2025, 6, 1, 8, 0).timestamp()
+    yolo_classes = sorted(FOOD_KEYWORDS_MAP)
+    for index in range(num_households):
+        classes = rng.sample(yolo_classes, min(classes_per_household, len(yolo_classes)))
+        stock = {name: float(rng.randint(2, 8)) for name in classes}
+        rates = {name: rng.uniform(0.1, 1.0) for name in classes}
+        scans = []
+        scanned_at = start + rng.uniform(0, 86400)
+        for _ in range(scans_per_household):
+            counts = {}
+            for name in classes:
+                observed = int(stock[name]) - (1 if stock[name] >= 1 and rng.random() < 0.05 else 0)
+                if observed > 0:
+                    counts[name] = observed
+            scans.append((scanned_at, counts))
+            elapsed_days = rng.uniform(0.5, 1.5)
+            scanned_at += elapsed_days * 86400
+            for name in classes:
+                stock[name] = max(stock[name] - rates[name] * elapsed_days, 0.0)
+                if stock[name] == 0.0 and rng.random() < 0.3:
+                    stock[name] = float(rng.randint(2, 8))
+        yield f'household-{index:06d}', scans
+
+
+def populate_scan_history(num_households, scans_per_household=30, classes_per_household=8, seed=0,
+                          households_per_commit=1000):
+    """合成のスキャン履歴を世帯のシャードに書き込む（db_manager の現在のルーターに書き込む）"""
+    from src.database.db_manager import get_router
+    from src.database.scan_history import record_scans
+
+    router = get_router()
+    pending = {} # shard_id -> [(household_id, scans)]
+
+    def flush(shard_id):
+        conn = router.shard_connection(shard_id)
+        with conn:
+            for household_id, scans in pending.pop(shard_id):
+                record_scans(conn, household_id, scans)
+
+    for household_id, scans in iter_scan_histories(num_households, scans_per_household, classes_per_household, seed):
+        shard_id = router.shard_for(household_id)
+        pending.setdefault(shard_id, []).append((household_id, scans))
+        if len(pending[shard_id]) >= households_per_commit:
+            flush(shard_id)
+    for shard_id in list(pending):
+        flush(shard_id)
+    return num_households
@@ -1,7 +1,14 @@
 # src/data_preparation/convert_class_ids.py
 
 import os
+import json
 import shutil
+import hashlib
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import yaml 
 
 # プロジェクトルート設定 (config.pyから読み込むのがベストだが、ここでは直接計算)
@@ -47,37 +54,185 @@ def create_class_id_map(old_classes_file, new_classes_list):
             print(f"Warning: Class '{old_name}' (old ID: {old_id}) not found in new class list. It will be skipped.")
     return id_map
 
-def convert_annotations(input_label_dir, output_label_dir, old_id_to_new_id_map):
+# 変換済みファイルの内容ハッシュを記録する状態ファイル（出力ディレクトリごと）
+CONVERT_STATE_FILENAME = '.convert_class_ids_state.json'
+
+
+def build_lookup_array(old_id_to_new_id_map):
+    """古いID -> 新しいID の辞書を、NumPyのルックアップ配列に変換する（未定義のIDは -1）"""
+    size = max(old_id_to_new_id_map, default=-1) + 1
+    lookup = np.full(size, -1, dtype=np.int64)
+    for old_id, new_id in old_id_to_new_id_map.items():
+        lookup[old_id] = new_id
+    return lookup
+
+
+def _file_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _map_hash(old_id_to_new_id_map):
+    return _file_hash(json.dumps(sorted(old_id_to_new_id_map.items())).encode('utf-8'))
+
+
+def _atomic_write(filepath, data):
+    """同じディレクトリの一時ファイルに書き込んでから置き換える（途中で中断しても壊れたファイルを残さない）"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix='.tmp_', suffix='.txt')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remap_label_text(text, lookup):
+    """
+    YOLOラベルファイルの内容のクラスID列をルックアップ配列で一括変換する。
+    座標部分は元の文字列をそのまま残す（数値の丸めを発生させない）。
+
+    Returns:
+        tuple: (変換後のテキスト, 新しいIDの配列, スキップした古いIDの配列)
+    """
+    lines = [line.split(None, 1) for line in text.splitlines()]
+    lines = [parts for parts in lines if parts]
+    if not lines:
+        return '', np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    old_ids = np.fromiter((int(parts[0]) for parts in lines), dtype=np.int64, count=len(lines))
+    in_range = (old_ids >= 0) & (old_ids < len(lookup))
+    new_ids = np.full(len(old_ids), -1, dtype=np.int64)
+    new_ids[in_range] = lookup[old_ids[in_range]]
+    keep = new_ids >= 0
+
+    out_lines = [f"{new_id} {parts[1] if len(parts) > 1 else ''}".rstrip() + '\n'
+                 for new_id, parts, k in zip(new_ids.tolist(), lines, keep.tolist()) if k]
+    return ''.join(out_lines), new_ids[keep], old_ids[~keep]
+
+
+def _convert_one(task):
+    """1ファイル分の変換（プロセスプールのワーカーで実行する）"""
+    input_filepath, output_filepath, lookup, previous, map_hash, in_place = task
+    with open(input_filepath, 'rb') as f:
+        data = f.read()
+    input_hash = _file_hash(data)
+
+    # 前回から内容もIDマップも変わっていなければスキップする。
+    # 入力と出力が同じファイル（上書き変換）の場合、前回の出力そのものなら変換済みなので二重変換しない。
+    if previous and previous.get('map') == map_hash and os.path.exists(output_filepath):
+        if input_hash == previous.get('input') or (in_place and input_hash == previous.get('output')):
+            return {'file': input_filepath, 'status': 'skipped', 'record': previous,
+                    'class_ids': None, 'skipped_ids': None}
+
+    text, new_ids, skipped_ids = remap_label_text(data.decode('utf-8'), lookup)
+    out_data = text.encode('utf-8')
+    _atomic_write(output_filepath, out_data)
+    return {'file': input_filepath, 'status': 'converted',
+            'record': {'input': input_hash, 'output': _file_hash(out_data), 'map': map_hash},
+            'class_ids': new_ids, 'skipped_ids': skipped_ids}
+
+
+def _load_state(output_label_dir):
+    state_path = os.path.join(output_label_dir, CONVERT_STATE_FILENAME)
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(output_label_dir, state):
+    _atomic_write(os.path.join(output_label_dir, CONVERT_STATE_FILENAME),
+                  json.dumps(state, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def convert_label_dirs(jobs, workers=None):
+    """
+    複数のラベルディレクトリのクラスIDをまとめて変換する。全ディレクトリのファイルを1つのプロセスプールで処理する。
+
+    Args:
+        jobs (list): (input_label_dir, output_label_dir, old_id_to_new_id_map) のリスト。
+        workers (int): プロセス数。Noneの場合はCPUコア数。
+
+    Returns:
+        dict: {'converted': int, 'skipped_files': int, 'class_counts': Counter(新ID -> 件数),
+               'skipped_ids': Counter(古いID -> 件数)}
+    """
+    tasks = []
+    states = {} # output_label_dir -> 状態
+    state_keys = {} # input_filepath -> (output_label_dir, ファイル名)
+
+    # 別ディレクトリから出力ディレクトリへ書き込まれるファイル。
+    # 出力先を上書き変換するジョブがこれらを別のIDマップで二重に変換しないよう除外する。
+    claimed_outputs = set()
+    for input_label_dir, output_label_dir, _ in jobs:
+        if os.path.abspath(input_label_dir) != os.path.abspath(output_label_dir):
+            claimed_outputs.update(
+                os.path.abspath(os.path.join(output_label_dir, f)) for f in os.listdir(input_label_dir)
+                if f.endswith('.txt') and f != 'classes.txt')
+
+    for input_label_dir, output_label_dir, id_map in jobs:
+        os.makedirs(output_label_dir, exist_ok=True)
+        if output_label_dir not in states:
+            states[output_label_dir] = _load_state(output_label_dir)
+        state = states[output_label_dir]
+        lookup = build_lookup_array(id_map)
+        map_hash = _map_hash(id_map)
+        in_place = os.path.abspath(input_label_dir) == os.path.abspath(output_label_dir)
+        for filename in sorted(os.listdir(input_label_dir)):
+            if filename.endswith('.txt') and filename != 'classes.txt':
+                input_filepath = os.path.join(input_label_dir, filename)
+                if in_place and os.path.abspath(input_filepath) in claimed_outputs:
+                    continue
+                tasks.append((input_filepath, os.path.join(output_label_dir, filename),
+                              lookup, state.get(filename), map_hash, in_place))
+                state_keys[input_filepath] = (output_label_dir, filename)
+
+    summary = {'converted': 0, 'skipped_files': 0, 'class_counts': Counter(), 'skipped_ids': Counter()}
+    if not tasks:
+        return summary
+
+    # 小さなファイルが大量にあるため、chunksizeを大きめにしてプロセス間通信の回数を減らす
+    chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(_convert_one, tasks, chunksize=chunksize):
+            output_label_dir, filename = state_keys[result['file']]
+            states[output_label_dir][filename] = result['record']
+            if result['status'] == 'skipped':
+                summary['skipped_files'] += 1
+                continue
+            summary['converted'] += 1
+            summary['class_counts'].update(result['class_ids'].tolist())
+            summary['skipped_ids'].update(result['skipped_ids'].tolist())
+
+    for output_label_dir, state in states.items():
+        _save_state(output_label_dir, state)
+    return summary
+
+
+def print_conversion_summary(summary, class_names=None):
+    """クラスごとのラベル数と、スキップされた古いIDの集計を表示する"""
+    print(f"\nConverted files: {summary['converted']}, unchanged (skipped) files: {summary['skipped_files']}")
+    if summary['class_counts']:
+        print(f"{'ID':<4} {'Class':<25} {'Labels':>8}")
+        print("-" * 40)
+        for class_id, count in sorted(summary['class_counts'].items()):
+            name = class_names[class_id] if class_names and class_id < len(class_names) else '-'
+            print(f"{class_id:<4} {name:<25} {count:>8}")
+    if summary['skipped_ids']:
+        skipped = ', '.join(f"{old_id} x{count}" for old_id, count in sorted(summary['skipped_ids'].items()))
+        print(f"Skipped labels with unknown old class IDs: {skipped}")
+
+
+def convert_annotations(input_label_dir, output_label_dir, old_id_to_new_id_map, workers=None):
     """
     指定されたディレクトリ内のアノテーションファイルを新しいクラスIDに変換する。
     """
     print(f"Converting annotations in {input_label_dir}...")
-    for filename in os.listdir(input_label_dir):
-        if filename.endswith('.txt') and filename != 'classes.txt':
-            input_filepath = os.path.join(input_label_dir, filename)
-            output_filepath = os.path.join(output_label_dir, filename)
-
-            print(f"DEBUG: Processing file: {input_filepath}")
-
-            new_lines = []
-            with open(input_filepath, 'r') as f_in:
-                for line in f_in:
-                    parts = line.strip().split()
-                    if not parts:
-                        continue
-
-                    old_class_id = int(parts[0])
-                    if old_class_id in old_id_to_new_id_map:
-                        new_class_id = old_id_to_new_id_map[old_class_id]
-                        new_line = f"{new_class_id} {' '.join(parts[1:])}\n"
-                        new_lines.append(new_line)
-                    else:
-                        print(f"Skipping line for unknown old class ID {old_class_id} in {filename}")
-
-            with open(output_filepath, 'w') as f_out:
-                f_out.writelines(new_lines)
-
+    summary = convert_label_dirs([(input_label_dir, output_label_dir, old_id_to_new_id_map)], workers=workers)
     print(f"Conversion for {input_label_dir} completed.")
+    return summary
 
 if __name__ == '__main__':
     # --- 1. 新しい統合されたクラスリストを読み込む ---
@@ -107,7 +262,6 @@ if __name__ == '__main__':
             shutil.copy(os.path.join(YOUR_OLD_ANNOTATED_IMAGES_DIR, img_file), 
                         os.path.join(project_root, 'data', 'datasets', 'train', 'images'))
 
-    convert_annotations(YOUR_OLD_ANNOTATED_DIR, OUTPUT_TRAIN_LABELS_DIR, your_id_map)
 
     # --- 3. Roboflowデータのアノテーションを変換 ---
     # RoboflowのデータセットにもクラスIDが存在するため、それも新しいマップに合わせる必要があります。
@@ -128,9 +282,14 @@ if __name__ == '__main__':
 
     print(f"Roboflow old ID map: {roboflow_id_map}")
 
-    convert_annotations(ROBOFLOW_TRAIN_LABELS_DIR, OUTPUT_TRAIN_LABELS_DIR, roboflow_id_map)
-    convert_annotations(ROBOFLOW_VAL_LABELS_DIR, OUTPUT_VAL_LABELS_DIR, roboflow_id_map)
-    convert_annotations(ROBOFLOW_TEST_LABELS_DIR, OUTPUT_TEST_LABELS_DIR, roboflow_id_map)
+    # 全ディレクトリのファイルを1つのプロセスプールで並列に変換する（前回から変わっていないファイルはスキップ）
+    summary = convert_label_dirs([
+        (YOUR_OLD_ANNOTATED_DIR, OUTPUT_TRAIN_LABELS_DIR, your_id_map),
+        (ROBOFLOW_TRAIN_LABELS_DIR, OUTPUT_TRAIN_LABELS_DIR, roboflow_id_map),
+        (ROBOFLOW_VAL_LABELS_DIR, OUTPUT_VAL_LABELS_DIR, roboflow_id_map),
+        (ROBOFLOW_TEST_LABELS_DIR, OUTPUT_TEST_LABELS_DIR, roboflow_id_map),
+    ])
+    print_conversion_summary(summary, class_names=new_classes_list)
 
     print("\nAll annotation class IDs converted and data combined!")
     print("You can now proceed to train YOLOv8 with the combined dataset.")
\ No newline at end of file
@@ -1,72 +1,319 @@
+# src/data_preparation/data_splitter.py
+
 import os
+import sys
+import json
 import random
 import shutil
+import argparse
+from collections import Counter, defaultdict
+
+import yaml
+
+# プロジェクトルート設定 (実行ディレクトリに依存しないよう、このファイルの位置から計算)
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.data_preparation.label_cache import build_label_cache
 
 # 設定
-source_dir = '../../data/annotated_images'
-target_base_dir = '../../data/datasets'
-
-train_ratio = 0.7  # トレーニングデータの割合
-val_ratio = 0.15   # バリデーションデータの割合
-test_ratio = 0.15  # テストデータの割合
-
-# 各ディレクトリのパス
-train_img_dir = os.path.join(target_base_dir, 'train/images')
-train_label_dir = os.path.join(target_base_dir, 'train/labels')
-val_img_dir = os.path.join(target_base_dir, 'val/images')
-val_label_dir = os.path.join(target_base_dir, 'val/labels')
-test_img_dir = os.path.join(target_base_dir, 'test/images')
-test_label_dir = os.path.join(target_base_dir, 'test/labels')
-
-# ターゲットディレクトリが存在しない場合は作成
-os.makedirs(train_img_dir, exist_ok=True)
-os.makedirs(train_label_dir, exist_ok=True)
-os.makedirs(val_img_dir, exist_ok=True)
-os.makedirs(val_label_dir, exist_ok=True)
-os.makedirs(test_img_dir, exist_ok=True)
-os.makedirs(test_label_dir, exist_ok=True)
-
-# 画像ファイルのリストを取得（拡張子が.jpgのファイルのみ）
-image_files = [f for f in os.listdir(source_dir) if f.endswith('.jpg')]
-random.shuffle(image_files) # ファイルの順序をシャッフル
-
-num_images = len(image_files)
-num_train = int(num_images * train_ratio)
-num_val = int(num_images * val_ratio)
-# num_testは残りの全て
-num_test = num_images - num_train - num_val
-
-# ファイルを分割してコピー
-current_idx = 0
-
-# train
-for i in range(num_train):
-    img_name = image_files[current_idx]
-    label_name = img_name.replace('.jpg', '.txt') # .txtファイル名を取得
-
-    shutil.copy(os.path.join(source_dir, img_name), train_img_dir)
-    shutil.copy(os.path.join(source_dir, label_name), train_label_dir)
-    current_idx += 1
-
-# val
-for i in range(num_val):
-    img_name = image_files[current_idx]
-    label_name = img_name.replace('.jpg', '.txt')
-
-    shutil.copy(os.path.join(source_dir, img_name), val_img_dir)
-    shutil.copy(os.path.join(source_dir, label_name), val_label_dir)
-    current_idx += 1
-
-# test
-for i in range(num_test):
-    img_name = image_files[current_idx]
-    label_name = img_name.replace('.jpg', '.txt')
-
-    shutil.copy(os.path.join(source_dir, img_name), test_img_dir)
-    shutil.copy(os.path.join(source_dir, label_name), test_label_dir)
-    current_idx += 1
-
-print(f"データ分割が完了しました。")
-print(f"Train: {num_train} images")
-print(f"Val: {num_val} images")
-print(f"Test: {num_test} images")
\ No newline at end of file
+SOURCE_DIR = os.path.join(project_root, 'data', 'annotated_images')
+TARGET_BASE_DIR = os.path.join(project_root, 'data', 'datasets')
+
+SPLIT_RATIOS = {
+    'train': 0.7,  # トレーニングデータの割合
+    'val': 0.15,   # バリデーションデータの割合
+    'test': 0.15,  # テストデータの割合
+}
+DEFAULT_SEED = 42
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+MANIFEST_DIRNAME = 'splits'
+ASSIGNMENTS_FILENAME = 'split_assignments.json'
+SPLIT_DATA_YAML_FILENAME = 'data_split.yaml'
+
+NO_LABEL_STRATUM = 'none'
+
+
+def list_annotated_images(source_dir, extensions=IMAGE_EXTENSIONS):
+    """ラベルファイル (.txt) が対になっている画像ファイル名の一覧を返す"""
+    images = []
+    for filename in sorted(os.listdir(source_dir)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() in extensions and os.path.exists(os.path.join(source_dir, stem + '.txt')):
+            images.append(filename)
+    return images
+
+
+def dominant_class(label_path):
+    """ラベルファイル内で最も多いクラスID（層化分割のキー）を返す。ラベルがない場合は 'none'"""
+    counts = Counter()
+    with open(label_path, 'r') as f:
+        for line in f:
+            parts = line.split(None, 1)
+            if parts:
+                counts[parts[0]] += 1
+    if not counts:
+        return NO_LABEL_STRATUM
+    # 件数が同じ場合はIDの小さい方を選び、結果を決定的にする
+    return min(counts.items(), key=lambda kv: (-kv[1], int(kv[0])))[0]
+
+
+def _target_counts(n, ratios):
+    """n件を比率で分けたときの件数（最大剰余法で合計がnになるようにする）"""
+    raw = {split: n * ratio for split, ratio in ratios.items()}
+    counts = {split: int(value) for split, value in raw.items()}
+    remainder = n - sum(counts.values())
+    for split in sorted(raw, key=lambda s: raw[s] - counts[s], reverse=True)[:remainder]:
+        counts[split] += 1
+    return counts
+
+
+def assign_splits(images, strata, ratios=SPLIT_RATIOS, seed=DEFAULT_SEED, previous=None):
+    """
+    画像を train/val/test に割り当てる。
+
+    Args:
+        images (list): 画像ファイル名のリスト。
+        strata (dict): 画像ファイル名 -> 層 (例: 主クラスID)。層化しない場合はすべて同じ値。
+        ratios (dict): 分割名 -> 比率。
+        seed (int): シャッフルの乱数シード。
+        previous (dict): 前回の割り当て (画像ファイル名 -> 分割名)。
+                         指定した場合、既存の画像の割り当ては変えず、新しい画像だけを
+                         各層の目標比率に足りない分割へ割り当てる。
+
+    Returns:
+        dict: 画像ファイル名 -> 分割名
+    """
+    previous = previous or {}
+    rng = random.Random(seed)
+    assignments = {}
+
+    by_stratum = defaultdict(list)
+    for image in images:
+        by_stratum[strata[image]].append(image)
+
+    for stratum in sorted(by_stratum):
+        members = by_stratum[stratum]
+        kept = [image for image in members if previous.get(image) in ratios]
+        new_images = sorted(image for image in members if previous.get(image) not in ratios)
+        rng.shuffle(new_images)
+
+        current = Counter()
+        for image in kept:
+            assignments[image] = previous[image]
+            current[previous[image]] += 1
+
+        # 層全体の目標件数に対して不足が最も大きい分割へ順に割り当てる
+        targets = _target_counts(len(members), ratios)
+        split_order = list(ratios)
+        for image in new_images:
+            split = max(split_order, key=lambda s: (targets[s] - current[s], -split_order.index(s)))
+            assignments[image] = split
+            current[split] += 1
+
+    return assignments
+
+
+def write_manifests(assignments, source_dir, target_dir, ratios=SPLIT_RATIOS, stale_splits=()):
+    """
+    分割ごとの画像リスト (train.txt など) と、それを参照する data_split.yaml を書き出す。
+    ultralyticsは画像リストのtxtを train/val/test に指定でき、ラベルは画像と同じ場所の .txt から読む。
+    stale_splits (前回はあったが ratios にない分割) の画像リストは削除する。
+    """
+    manifest_dir = os.path.join(target_dir, MANIFEST_DIRNAME)
+    os.makedirs(manifest_dir, exist_ok=True)
+    for split in set(stale_splits) - set(ratios):
+        stale_path = os.path.join(manifest_dir, f'{split}.txt')
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+    split_paths = {}
+    for split in ratios:
+        images = sorted(image for image, s in assignments.items() if s == split)
+        manifest_path = os.path.join(manifest_dir, f'{split}.txt')
+        with open(manifest_path, 'w') as f:
+            f.writelines(os.path.join(os.path.abspath(source_dir), image) + '\n' for image in images)
+        split_paths[split] = manifest_path
+
+    # 既存の data.yaml からクラス名を引き継ぐ
+    data_yaml = {'path': os.path.abspath(target_dir)}
+    data_yaml.update({split: os.path.relpath(path, target_dir) for split, path in split_paths.items()})
+    base_yaml_path = os.path.join(target_dir, 'data.yaml')
+    if os.path.exists(base_yaml_path):
+        with open(base_yaml_path, 'r') as f:
+            base_yaml = yaml.safe_load(f) or {}
+        for key in ('nc', 'names'):
+            if key in base_yaml:
+                data_yaml[key] = base_yaml[key]
+    split_yaml_path = os.path.join(target_dir, SPLIT_DATA_YAML_FILENAME)
+    with open(split_yaml_path, 'w') as f:
+        yaml.safe_dump(data_yaml, f, allow_unicode=True, sort_keys=False)
+    return split_yaml_path
+
+
+def _reflink(src, dst):
+    """Linuxのreflink (FICLONE) でデータを共有するコピーを作る。対応していないファイルシステムでは例外"""
+    import fcntl
+    FICLONE = 0x40049409
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+
+
+def _link_file(src, dst, mode):
+    """mode に応じてハードリンク/reflinkを作る。作れない場合はコピーにフォールバックする"""
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return 'exists'
+        os.remove(dst)
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+        else:
+            _reflink(src, dst)
+        return mode
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        shutil.copy2(src, dst)
+        return 'copy'
+
+
+def materialize_links(assignments, source_dir, target_dir, ratios=SPLIT_RATIOS, mode='hardlink', previous_links=()):
+    """
+    train/images, train/labels などのディレクトリ構成を、コピーではなくハードリンク/reflinkで作る。
+
+    前回このツールが作ったリンク (previous_links) のうち、割り当てが変わった画像・ソースから削除された画像・
+    ratios から外れた分割の画像のものを先に削除する。分割ディレクトリにある他のファイル
+    (convert_class_ids.py が書き出した Roboflow の画像など) には触れない。
+
+    Args:
+        previous_links (iterable): 前回作ったリンクの (画像ファイル名, 分割名)。load_links の戻り値。
+    """
+    stats = Counter()
+    for image, split in previous_links:
+        if assignments.get(image) == split:
+            continue
+        label = os.path.splitext(image)[0] + '.txt'
+        for sub, filename in (('images', image), ('labels', label)):
+            stale = os.path.join(target_dir, split, sub, filename)
+            if os.path.lexists(stale):
+                os.remove(stale)
+                stats['removed'] += 1
+
+    for split in ratios:
+        for sub in ('images', 'labels'):
+            os.makedirs(os.path.join(target_dir, split, sub), exist_ok=True)
+    for image, split in assignments.items():
+        label = os.path.splitext(image)[0] + '.txt'
+        for sub, filename in (('images', image), ('labels', label)):
+            result = _link_file(os.path.join(source_dir, filename), os.path.join(target_dir, split, sub, filename), mode)
+            stats[result] += 1
+    if stats['copy']:
+        print(f"Warning: {stats['copy']} files were copied because {mode} is not supported here.")
+    return stats
+
+
+def _load_assignments_file(target_dir):
+    path = os.path.join(target_dir, MANIFEST_DIRNAME, ASSIGNMENTS_FILENAME)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def load_assignments(target_dir):
+    return _load_assignments_file(target_dir).get('assignments', {})
+
+
+def load_links(target_dir):
+    """materialize_links で作ったリンクの (画像ファイル名, 分割名) の集合"""
+    return {tuple(link) for link in _load_assignments_file(target_dir).get('links', [])}
+
+
+def save_assignments(target_dir, assignments, seed, stratify, ratios=SPLIT_RATIOS, links=()):
+    manifest_dir = os.path.join(target_dir, MANIFEST_DIRNAME)
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = os.path.join(manifest_dir, ASSIGNMENTS_FILENAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'seed': seed, 'stratify': stratify, 'ratios': ratios,
+                   'assignments': dict(sorted(assignments.items())),
+                   'links': sorted(list(link) for link in links)}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def split_dataset(source_dir=SOURCE_DIR, target_dir=TARGET_BASE_DIR, ratios=SPLIT_RATIOS, seed=DEFAULT_SEED,
+                  stratify=True, mode='manifest', reshuffle=False, use_label_cache=True):
+    """
+    アノテーション済み画像を train/val/test に分割する。
+
+    Args:
+        source_dir (str): 画像とラベル (.txt) が置かれたディレクトリ。
+        target_dir (str): 出力先のデータセットディレクトリ。
+        ratios (dict): 分割名 -> 比率。
+        seed (int): 乱数シード。
+        stratify (bool): 主クラスごとに比率を保って分割する（クラス層化）。
+        mode (str): 'manifest' - 画像リスト (splits/*.txt) と data_split.yaml のみ書き出す（ファイルは動かさない）
+                    'hardlink' / 'reflink' - 分割ディレクトリにリンクを作る（コピーしない）
+        reshuffle (bool): Trueの場合は前回の割り当てを無視して全体を分割し直す。
+                          Falseの場合は新しく追加された画像だけを割り当てる。
+        use_label_cache (bool): 層化のための主クラスを label_cache から引く（ラベルを毎回パースしない）。
+
+    Returns:
+        dict: 画像ファイル名 -> 分割名
+    """
+    images = list_annotated_images(source_dir)
+    if stratify and use_label_cache:
+        # ラベルのバイナリキャッシュ（変更されたファイルだけ再パース）から主クラスを引く
+        dominant = build_label_cache(source_dir, verbose=False).dominant_classes()
+        strata = {}
+        for image in images:
+            class_id = dominant.get(os.path.splitext(image)[0])
+            strata[image] = NO_LABEL_STRATUM if class_id is None else str(class_id)
+    elif stratify:
+        strata = {image: dominant_class(os.path.join(source_dir, os.path.splitext(image)[0] + '.txt'))
+                  for image in images}
+    else:
+        strata = {image: 'all' for image in images}
+
+    saved = load_assignments(target_dir)
+    previous = {} if reshuffle else saved
+    assignments = assign_splits(images, strata, ratios=ratios, seed=seed, previous=previous)
+    new_count = sum(1 for image in assignments if image not in previous)
+    # 前回の割り当てにあって今回の ratios にない分割 (画像リストを片付ける)
+    stale_splits = set(saved.values()) - set(ratios)
+
+    if mode not in ('manifest', 'hardlink', 'reflink'):
+        raise ValueError(f"Unknown split mode: {mode}")
+    links = load_links(target_dir)
+    if mode != 'manifest':
+        # 途中で失敗しても次回に片付けられるよう、これから作るリンクも先に記録しておく
+        links |= set(assignments.items())
+    save_assignments(target_dir, assignments, seed, stratify, ratios=ratios, links=links)
+    split_yaml_path = write_manifests(assignments, source_dir, target_dir, ratios=ratios, stale_splits=stale_splits)
+    if mode != 'manifest':
+        materialize_links(assignments, source_dir, target_dir, ratios=ratios, mode=mode, previous_links=links)
+        save_assignments(target_dir, assignments, seed, stratify, ratios=ratios, links=assignments.items())
+
+    counts = Counter(assignments.values())
+    print(f"データ分割が完了しました。（新規割り当て: {new_count} 枚, 既存: {len(assignments) - new_count} 枚）")
+    for split in ratios:
+        print(f"{split.capitalize()}: {counts[split]} images")
+    print(f"Data YAML for training: {split_yaml_path}")
+    return assignments
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split annotated images into train/val/test without copying.')
+    parser.add_argument('--source', default=SOURCE_DIR, help='画像とラベルのディレクトリ')
+    parser.add_argument('--target', default=TARGET_BASE_DIR, help='データセットの出力先')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--mode', choices=['manifest', 'hardlink', 'reflink'], default='manifest')
+    parser.add_argument('--no-stratify', action='store_true', help='クラス層化を行わない')
+    parser.add_argument('--reshuffle', action='store_true', help='既存の割り当てを破棄して分割し直す')
+    args = parser.parse_args()
+
+    split_dataset(source_dir=args.source, target_dir=args.target, seed=args.seed,
+                  stratify=not args.no_stratify, mode=args.mode, reshuffle=args.reshuffle)
@@ -0,0 +1,253 @@
+# src/data_preparation/label_cache.py
+
+import os
+import json
+import time
+import hashlib
+import argparse
+
+import numpy as np
+
+# プロジェクトルート設定 (config.pyから読み込むのがベストだが、ここでは直接計算)
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# ----------------------------------------------------
+# YOLOラベルのバイナリキャッシュ
+# ----------------------------------------------------
+# 数千個の小さな .txt ラベルファイルを毎回パースする代わりに、全ラベルを1つの配列ファイルにまとめる。
+#   boxes.npy   : (N, 5) float32 [class_id, x_center, y_center, width, height]
+#   offsets.npy : (M + 1,) int64  画像 i のボックスは boxes[offsets[i]:offsets[i + 1]]
+#   index.json  : 画像キー・ファイルサイズ/mtime/SHA-1・クラス別件数・ボックスサイズのヒストグラム
+# 配列は np.load(mmap_mode='r') で読み込むため、巨大なデータセットでも即座に問い合わせできる。
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIRNAME = '.label_cache'
+SIZE_HIST_BINS = np.linspace(0.0, 1.0, 21) # sqrt(w * h) (画像サイズに対する相対値) のビン
+
+
+def default_cache_dir(label_dir):
+    return os.path.join(label_dir, DEFAULT_CACHE_DIRNAME)
+
+
+def parse_label_file(data):
+    """
+    YOLOラベルファイルの内容を (K, 5) float32 配列に変換する。
+    ポリゴン (セグメンテーション) 形式の行は外接矩形に変換する。
+    """
+    rows = []
+    for line in data.decode('utf-8').splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        values = [float(v) for v in parts]
+        if len(values) == 5:
+            rows.append(values)
+        elif len(values) > 5 and len(values) % 2 == 1:
+            xs, ys = values[1::2], values[2::2]
+            x1, x2, y1, y2 = min(xs), max(xs), min(ys), max(ys)
+            rows.append([values[0], (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+    if not rows:
+        return np.empty((0, 5), dtype=np.float32)
+    return np.asarray(rows, dtype=np.float32)
+
+
+def _list_label_files(label_dir):
+    """ラベルディレクトリ以下の .txt を再帰的に列挙し、(キー, パス) のリストを返す。キーは拡張子なしの相対パス"""
+    entries = []
+    for root, dirs, files in os.walk(label_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for filename in sorted(files):
+            if filename.endswith('.txt') and filename != 'classes.txt':
+                path = os.path.join(root, filename)
+                entries.append((os.path.splitext(os.path.relpath(path, label_dir))[0], path))
+    return entries
+
+
+def _atomic_save_npy(path, array):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def compute_statistics(boxes, num_classes=None):
+    """クラス別のボックス数と、クラス別のボックスサイズのヒストグラムを計算する"""
+    class_ids = boxes[:, 0].astype(np.int64) if len(boxes) else np.empty(0, dtype=np.int64)
+    minlength = num_classes or (int(class_ids.max()) + 1 if len(class_ids) else 0)
+    class_counts = np.bincount(class_ids, minlength=minlength)
+
+    sizes = np.sqrt(np.clip(boxes[:, 3] * boxes[:, 4], 0.0, 1.0)) if len(boxes) else np.empty(0)
+    bin_index = np.clip(np.digitize(sizes, SIZE_HIST_BINS) - 1, 0, len(SIZE_HIST_BINS) - 2)
+    size_hist = np.zeros((len(class_counts), len(SIZE_HIST_BINS) - 1), dtype=np.int64)
+    np.add.at(size_hist, (class_ids, bin_index), 1)
+    return class_counts, size_hist
+
+
+def build_label_cache(label_dir, cache_dir=None, verbose=True):
+    """
+    ラベルディレクトリからキャッシュを作成・更新する。
+    サイズとmtimeが変わっていないファイルはそのまま再利用し、変わったファイルも内容ハッシュが同じなら再パースしない。
+
+    Returns:
+        LabelCache: 構築したキャッシュ
+    """
+    start = time.perf_counter()
+    cache_dir = cache_dir or default_cache_dir(label_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    previous = None
+    try:
+        previous = LabelCache(cache_dir)
+        if previous.version != CACHE_VERSION:
+            previous = None
+    except FileNotFoundError:
+        pass
+    previous_entries = {e['key']: (i, e) for i, e in enumerate(previous.entries)} if previous else {}
+
+    entries = []
+    chunks = []
+    reused = parsed = 0
+    for key, path in _list_label_files(label_dir):
+        stat = os.stat(path)
+        old = previous_entries.get(key)
+        if old and old[1]['size'] == stat.st_size and old[1]['mtime_ns'] == stat.st_mtime_ns:
+            # 変更なし: 前回の行をそのまま使う（ファイルを開かない）
+            chunks.append(np.asarray(previous.boxes_for_index(old[0])))
+            entries.append(dict(old[1]))
+            reused += 1
+            continue
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+        if old and old[1]['sha1'] == sha1:
+            chunks.append(np.asarray(previous.boxes_for_index(old[0]))) # touchされただけ
+            reused += 1
+        else:
+            chunks.append(parse_label_file(data))
+            parsed += 1
+        entries.append({'key': key, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1})
+
+    counts = np.array([len(c) for c in chunks], dtype=np.int64)
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    boxes = np.concatenate(chunks).astype(np.float32, copy=False) if chunks else np.empty((0, 5), dtype=np.float32)
+    class_counts, size_hist = compute_statistics(boxes)
+
+    if previous is not None:
+        previous.close()
+    _atomic_save_npy(os.path.join(cache_dir, 'boxes.npy'), boxes)
+    _atomic_save_npy(os.path.join(cache_dir, 'offsets.npy'), offsets)
+    index = {
+        'version': CACHE_VERSION,
+        'label_dir': os.path.abspath(label_dir),
+        'built_at': time.time(),
+        'entries': entries,
+        'class_counts': class_counts.tolist(),
+        'size_hist_bins': SIZE_HIST_BINS.tolist(),
+        'size_hist': size_hist.tolist(),
+    }
+    # インデックスは最後に置き換える（読み手は常に揃った配列を参照する）
+    tmp_index = os.path.join(cache_dir, 'index.json.tmp')
+    with open(tmp_index, 'w') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_index, os.path.join(cache_dir, 'index.json'))
+
+    if verbose:
+        print(f"Label cache updated at {cache_dir}: {len(entries)} images, {len(boxes)} boxes "
+              f"(reused {reused}, parsed {parsed}) in {time.perf_counter() - start:.2f}s")
+    return LabelCache(cache_dir)
+
+
+class LabelCache:
+    """build_label_cache() が作成したキャッシュを読み込み、問い合わせるクラス"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'index.json'), 'r') as f:
+            index = json.load(f)
+        self.version = index['version']
+        self.label_dir = index['label_dir']
+        self.entries = index['entries']
+        self.class_counts = np.asarray(index['class_counts'], dtype=np.int64)
+        self.size_hist_bins = np.asarray(index['size_hist_bins'])
+        self.size_hist = np.asarray(index['size_hist'], dtype=np.int64)
+        self.boxes = np.load(os.path.join(cache_dir, 'boxes.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(cache_dir, 'offsets.npy'), mmap_mode='r')
+        self._key_to_index = {e['key']: i for i, e in enumerate(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return [e['key'] for e in self.entries]
+
+    def boxes_for_index(self, i):
+        return self.boxes[self.offsets[i]:self.offsets[i + 1]]
+
+    def boxes_for(self, key):
+        """画像キー（拡張子なしの相対パス）のボックス (K, 5) を返す。存在しない場合はKeyError"""
+        return self.boxes_for_index(self._key_to_index[key])
+
+    def image_hash(self, key):
+        return self.entries[self._key_to_index[key]]['sha1']
+
+    def box_image_indices(self):
+        """各ボックスがどの画像に属するか (N,) を返す"""
+        return np.repeat(np.arange(len(self.entries)), np.diff(self.offsets))
+
+    def images_with_class(self, class_id):
+        """指定クラスのボックスを含む画像キーのリスト"""
+        mask = self.boxes[:, 0].astype(np.int64) == class_id
+        return [self.entries[i]['key'] for i in np.unique(self.box_image_indices()[mask])]
+
+    def dominant_classes(self):
+        """
+        画像キー -> 最も多いクラスID（ラベルがない画像は None）。
+        件数が同じ場合はIDの小さい方を選ぶ。
+        """
+        result = {}
+        num_classes = max(len(self.class_counts), 1)
+        if len(self.boxes):
+            image_indices = self.box_image_indices()
+            per_image = np.zeros((len(self.entries), num_classes), dtype=np.int64)
+            np.add.at(per_image, (image_indices, self.boxes[:, 0].astype(np.int64)), 1)
+            dominant = per_image.argmax(axis=1)
+            has_labels = per_image.sum(axis=1) > 0
+        else:
+            dominant = np.zeros(len(self.entries), dtype=np.int64)
+            has_labels = np.zeros(len(self.entries), dtype=bool)
+        for i, e in enumerate(self.entries):
+            result[e['key']] = int(dominant[i]) if has_labels[i] else None
+        return result
+
+    def close(self):
+        # memmapを解放して、キャッシュファイルを置き換えられるようにする
+        self.boxes = None
+        self.offsets = None
+
+
+def print_label_statistics(cache, class_names=None):
+    """クラス別のボックス数とサイズ分布を表示する"""
+    print(f"Images: {len(cache)}, boxes: {len(cache.boxes)}")
+    print(f"{'ID':<4} {'Class':<25} {'Boxes':>8}  size histogram (sqrt(w*h), {len(cache.size_hist_bins) - 1} bins)")
+    print("-" * 80)
+    for class_id, count in enumerate(cache.class_counts):
+        name = class_names[class_id] if class_names and class_id < len(class_names) else '-'
+        hist = ' '.join(str(v) for v in cache.size_hist[class_id])
+        print(f"{class_id:<4} {name:<25} {count:>8}  {hist}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or inspect the binary YOLO label cache.')
+    parser.add_argument('label_dir', nargs='?', default=os.path.join(project_root, 'data', 'datasets', 'train', 'labels'))
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--classes', default=os.path.join(project_root, 'data', 'datasets', 'classes.txt'),
+                        help='クラス名の一覧 (表示用)')
+    args = parser.parse_args()
+
+    label_cache = build_label_cache(args.label_dir, cache_dir=args.cache_dir)
+    class_names = None
+    if os.path.exists(args.classes):
+        with open(args.classes, 'r') as f:
+            class_names = [line.strip() for line in f if line.strip()]
+    print_label_statistics(label_cache, class_names)
@@ -0,0 +1,316 @@
+# src/database/async_db.py
+
+import os
+import sys
+import queue
+import asyncio
+import logging
+import threading
+import itertools
+import contextvars
+from collections import deque
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.database import db_manager
+from src.database.shard_router import DEFAULT_HOUSEHOLD_ID
+
+try:
+    from src.config import ASYNC_DB_MAX_PENDING # DBスレッドに積める未処理の要求の数 (超えると呼び出し側のコルーチンが待つ)
+except ImportError:
+    ASYNC_DB_MAX_PENDING = 1000
+
+try:
+    from src.config import ASYNC_DB_ITER_BATCH_SIZE # 非同期イテレータが DB スレッドから1回に受け取る行数
+except ImportError:
+    ASYNC_DB_ITER_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------
+# asyncio から使う在庫DBのファサード
+# ----------------------------------------------------
+# db_manager の関数は sqlite3 を直接呼ぶため、イベントループの上で呼ぶとその間ループが止まる。
+# AsyncInventoryDB は専用の DB スレッドを1本持ち、要求 (関数と引数) をキューで渡して、結果を Future で受け取る。
+#   - DB スレッドは db_manager の同じ関数を呼ぶので、スキーマ・イベントログ・在庫キャッシュの扱いは同期版と同じ。
+#     接続はスレッドごとにキャッシュされるため、DB スレッドは自分の接続だけを使う。
+#   - 要求は1つずつ順に処理する (SQLite の書き込みはどのみち1つずつ)。未処理の要求が ASYNC_DB_MAX_PENDING 件を
+#     超えると、呼び出し側のコルーチンは (ループを止めずに) 空きを待つ。
+#   - `async with db.transaction(household_id):` のブロック内の要求は1つのトランザクション・1つの取り込みバッチで行う。
+#     その間 DB スレッドは他の要求を処理しないので、ブロック内で DB 以外の長い await をしないこと。
+#     ブロック内の要求は contextvars で見分けるため、同じタスクからの db.add_food_item(...) などはそのまま加わる。
+#   - `async for row in db.iter_food_items(...):` は ASYNC_DB_ITER_BATCH_SIZE 行ずつ DB スレッドから受け取る。
+
+# DB スレッドで呼べる db_manager の関数 (db.<名前>(...) で await する)
+ASYNC_FUNCTIONS = (
+    'add_food_item', 'add_food_items', 'update_food_item_quantity', 'update_food_item_details', 'apply_scan_counts',
+    'get_all_food_items', 'get_distinct_standard_names', 'get_food_items_columns', 'get_expiring_items',
+    'get_food_item_by_id', 'delete_food_item', 'mark_as_consumed_or_discarded', 'get_inventory_events',
+    'list_event_batches', 'get_inventory_at', 'undo_batch', 'create_checkpoint', 'get_scan_history',
+    'get_scan_variants', 'inventory_cache_stats', 'find_duplicate_receipt_image', 'register_receipt', 'list_receipts',
+)
+
+_STOP = object()
+_COMMIT = object()
+_ROLLBACK = object()
+
+_current_transaction = contextvars.ContextVar('inventory_async_transaction', default=None)
+
+
+class _Rollback(Exception):
+    """非同期トランザクションを DB スレッドの中でロールバックするための例外"""
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+
+def _run_request(fn, args, kwargs, future, loop):
+    """DB スレッドで要求を1つ実行し、結果をイベントループ側の Future に渡す"""
+    try:
+        result = fn(*args, **kwargs)
+    except BaseException as e:
+        loop.call_soon_threadsafe(_set_exception, future, e)
+    else:
+        loop.call_soon_threadsafe(_set_result, future, result)
+
+
+class AsyncTransaction:
+    """
+    AsyncInventoryDB.transaction() が返す非同期コンテキストマネージャ。
+    ブロックを例外なく抜けるとコミットし、例外で抜けるとロールバックする。
+    """
+
+    def __init__(self, db, household_id):
+        self.db = db
+        self.household_id = household_id
+        self.batch_id = None
+        self._requests = queue.Queue()
+        self._open = False
+        self._token = None
+        self._finished = None
+
+    def _serve(self, loop, started):
+        """DB スレッドで実行する: トランザクションを開き、コミットかロールバックの指示までブロック内の要求を処理する"""
+        try:
+            with db_manager.transaction(self.household_id):
+                loop.call_soon_threadsafe(_set_result, started, db_manager.current_batch_id())
+                while True:
+                    request = self._requests.get()
+                    if request is _COMMIT:
+                        return True
+                    if request is _ROLLBACK:
+                        raise _Rollback()
+                    _run_request(*request)
+        except _Rollback:
+            return False
+
+    def submit(self, fn, args, kwargs, future, loop):
+        self._requests.put((fn, args, kwargs, future, loop))
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+        self._finished = asyncio.ensure_future(self.db._call_direct(self._serve, loop, started))
+        # トランザクションを開けなかった場合は _finished が先に例外で終わる
+        await asyncio.wait({started, self._finished}, return_when=asyncio.FIRST_COMPLETED)
+        if not started.done():
+            started.cancel()
+            await self._finished
+        self.batch_id = started.result()
+        self._open = True
+        self._token = _current_transaction.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _current_transaction.reset(self._token)
+        self._open = False
+        self._requests.put(_COMMIT if exc_type is None else _ROLLBACK)
+        await self._finished
+        return False
+
+    async def execute(self, sql, params=()):
+        """トランザクションの中でSQLを実行し、結果の行を返す"""
+        return await self.db.execute(self.household_id, sql, params)
+
+
+class AsyncRowIterator:
+    """DB スレッドで作ったイテレータから batch_size 行ずつ受け取る非同期イテレータ"""
+
+    def __init__(self, db, fn, args, kwargs, batch_size=ASYNC_DB_ITER_BATCH_SIZE):
+        self._db = db
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._batch_size = batch_size
+        self._iterator = None
+        self._buffer = deque()
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    def _next_batch(self):
+        # DB スレッドで実行する (イテレータの生成も読み出しも接続を持つスレッドで行う)
+        if self._iterator is None:
+            self._iterator = iter(self._fn(*self._args, **self._kwargs))
+        rows = list(itertools.islice(self._iterator, self._batch_size))
+        if len(rows) < self._batch_size:
+            self._close_iterator()
+        return rows
+
+    def _close_iterator(self):
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+        self._exhausted = True
+
+    async def __anext__(self):
+        if not self._buffer:
+            if self._exhausted:
+                raise StopAsyncIteration
+            self._buffer.extend(await self._db.call(self._next_batch))
+            if not self._buffer:
+                raise StopAsyncIteration
+        return self._buffer.popleft()
+
+    async def aclose(self):
+        """途中で読むのをやめる場合に、DB スレッド側のカーソルを閉じる"""
+        if self._iterator is not None and not self._exhausted:
+            await self._db.call(self._close_iterator)
+        self._exhausted = True
+        self._buffer.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+        return False
+
+
+class AsyncInventoryDB:
+    """
+    在庫DBの非同期ファサード。
+
+        async with AsyncInventoryDB() as db:
+            item_id = await db.add_food_item('牛乳', 'milk', 1, 'manual', household_id='h1')
+            async with db.transaction('h1') as tx:
+                await db.update_food_item_quantity(item_id, 2, household_id='h1')
+                await db.add_food_item('卵', 'egg', 10, 'receipt', household_id='h1')
+            async for row in db.iter_food_items(['standard_name', 'quantity'], household_id='h1'):
+                ...
+
+    Args:
+        max_pending (int): DB スレッドに積める未処理の要求の数。
+    """
+
+    def __init__(self, max_pending=ASYNC_DB_MAX_PENDING):
+        self.max_pending = max_pending
+        self._requests = queue.Queue()
+        self._thread = None
+        self._slots = None
+
+    # --- 開始・終了 ---
+
+    async def start(self):
+        if self._thread is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._thread = threading.Thread(target=self._serve_forever, name='inventory-db', daemon=True)
+            self._thread.start()
+        return self
+
+    async def close(self):
+        """未処理の要求を処理し終えてから DB スレッドを止める"""
+        if self._thread is None:
+            return
+        self._requests.put(_STOP)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    def _serve_forever(self):
+        try:
+            while True:
+                request = self._requests.get()
+                if request is _STOP:
+                    break
+                _run_request(*request)
+        finally:
+            # DB スレッドでキャッシュした接続を閉じる
+            db_manager.get_router().close()
+
+    # --- 要求 ---
+
+    async def _call_direct(self, fn, *args, **kwargs):
+        """トランザクションの中かどうかに関係なく、DB スレッドのキューに要求を積む"""
+        await self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        async with self._slots:
+            self._requests.put((fn, args, kwargs, future, loop))
+            return await future
+
+    async def call(self, fn, *args, **kwargs):
+        """
+        fn(*args, **kwargs) を DB スレッドで実行し、その結果を返す。
+        このタスクが transaction() のブロック内にいれば、そのトランザクションの中で実行する。
+        """
+        transaction = _current_transaction.get()
+        if transaction is not None and transaction.db is self and transaction._open:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            transaction.submit(fn, args, kwargs, future, loop)
+            return await future
+        return await self._call_direct(fn, *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name not in ASYNC_FUNCTIONS:
+            raise AttributeError(name)
+        fn = getattr(db_manager, name)
+
+        async def wrapper(*args, **kwargs):
+            return await self.call(fn, *args, **kwargs)
+        wrapper.__name__ = name
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+
+    def transaction(self, household_id=DEFAULT_HOUSEHOLD_ID):
+        """世帯への書き込みを1つのトランザクション・1つの取り込みバッチにまとめる (db_manager.transaction と同じ)"""
+        return AsyncTransaction(self, household_id)
+
+    async def execute(self, household_id, sql, params=()):
+        """世帯のシャードでSQLを実行し、全ての行を返す (書き込みは transaction() の中で行うこと)"""
+        return await self.call(lambda: db_manager.get_db_connection(household_id).execute(sql, params).fetchall())
+
+    # --- 非同期イテレータ ---
+
+    def iterate(self, fn, *args, batch_size=ASYNC_DB_ITER_BATCH_SIZE, **kwargs):
+        """DB スレッドで fn(*args, **kwargs) が返すイテレータを、batch_size 行ずつ受け取る非同期イテレータ"""
+        return AsyncRowIterator(self, fn, args, kwargs, batch_size=batch_size)
+
+    def iter_food_items(self, columns=None, status='active', detected_by=None, batch_size=ASYNC_DB_ITER_BATCH_SIZE,
+                        household_id=DEFAULT_HOUSEHOLD_ID):
+        """db_manager.iter_food_items の非同期版"""
+        return self.iterate(db_manager.iter_food_items, columns=columns, status=status, detected_by=detected_by,
+                            batch_size=batch_size, household_id=household_id)
+
+    def iter_query(self, household_id, sql, params=(), batch_size=ASYNC_DB_ITER_BATCH_SIZE):
+        """世帯のシャードでSQLを実行し、結果の行を batch_size 行ずつ受け取る非同期イテレータ"""
+        return self.iterate(lambda: db_manager.get_db_connection(household_id).execute(sql, params),
+                            batch_size=batch_size)
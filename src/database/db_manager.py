@@ -2,24 +2,51 @@
 
 import sqlite3
 import os
-from datetime import datetime
+import logging
+import threading
+from contextlib import contextmanager
+from operator import itemgetter
+from datetime import date, datetime, timedelta
 from src.config import DATABASE_PATH
+from src.observability.instrumentation import traced, configure_logging
+from src.database.shard_router import ShardRouter, DEFAULT_HOUSEHOLD_ID
+from src.database import inventory_events, scan_history, receipt_fingerprints
+from src.database.inventory_events import event_batch, current_batch_id, UndoConflictError
+from src.database.inventory_cache import InventoryCache, CACHED_COLUMNS, row_class
 
-DB_FILE = DATABASE_PATH
+DB_FILE = DATABASE_PATH # シャーディング前の単一ファイルのDB (shard_router.py import-legacy で取り込む)
 
-def get_db_connection():
-    """データベースに接続し、コネクションオブジェクトを返す"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row # カラム名をキーとして値にアクセスできるようにする
-    return conn
+try:
+    from src.config import DATABASE_AUTO_IMPORT_LEGACY # シャードが空のとき、DB_FILE を既定の世帯に自動で取り込む
+except ImportError:
+    DATABASE_AUTO_IMPORT_LEGACY = True
 
-def create_table():
-    """food_itemsテーブルを作成する"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
+# DB_FILE を取り込んだ印 (シャードのディレクトリに置く。自動の取り込みは、このファイルを作れたプロセスだけが行う)
+LEGACY_IMPORT_MARKER = 'legacy_imported'
+
+logger = logging.getLogger(__name__)
+
+# household_id を持つテーブル。世帯をシャード間で移すときは、これらの行をIDごとそのままコピーする
+# (食材・イベント・チェックポイントのIDは household_sequences による世帯ごとの連番)
+HOUSEHOLD_TABLES = ['food_items', 'inventory_events', 'inventory_checkpoints', 'inventory_checkpoint_rows',
+                    'household_sequences', 'fridge_scans', 'scan_series', 'consumption_forecasts', 'expiry_alerts',
+                    'food_items_archive', 'receipt_fingerprints', 'receipt_dhash_bands']
+ITEM_SEQUENCE = 'food_item'
+
+# expiry_date として受け付ける書式。解釈できた日付は ISO 形式 (YYYY-MM-DD) で保存し、
+# 期限の範囲検索用に日番号 (date.toordinal()) を expiry_day 列に持つ。
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y%m%d', '%Y.%m.%d')
+
+_router = None
+_cache = None
+_pending = threading.local() # 書き込みトランザクション中の世帯 -> (item_id, 変更後の行) のリスト
+
+def _init_schema(conn):
+    """シャードに初めて接続したときにテーブルとインデックスを作る"""
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS food_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER NOT NULL,
+            household_id TEXT NOT NULL DEFAULT 'default',
             standard_name TEXT NOT NULL,
             yolo_class TEXT NOT NULL,
             quantity REAL NOT NULL,
@@ -29,131 +56,858 @@ def create_table():
             detected_by TEXT NOT NULL,
             last_seen_date TEXT NOT NULL,
             status TEXT NOT NULL DEFAULT 'active',
-            notes TEXT
+            notes TEXT,
+            expiry_day INTEGER,
+            PRIMARY KEY (household_id, id)
+        )
+    ''')
+    _migrate_expiry_day(conn)
+    # 消費済み・廃棄済みで保持期間を過ぎた行の移動先 (inventory_archive.py)。列は food_items と同じ
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS food_items_archive (
+            id INTEGER NOT NULL,
+            household_id TEXT NOT NULL,
+            standard_name TEXT NOT NULL,
+            yolo_class TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            unit TEXT,
+            purchase_date TEXT,
+            expiry_date TEXT,
+            detected_by TEXT NOT NULL,
+            last_seen_date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            notes TEXT,
+            expiry_day INTEGER,
+            archived_at TEXT NOT NULL,
+            PRIMARY KEY (household_id, id)
         )
     ''')
+    # 在庫中の行とアーカイブ済みの行をまとめた履歴のビュー (status が 'active' 以外の問い合わせはこちらを使う)
+    columns = ', '.join(('id', 'household_id') + FOOD_ITEM_COLUMNS[1:])
+    conn.execute(f'''
+        CREATE VIEW IF NOT EXISTS food_items_history AS
+        SELECT {columns}, NULL AS archived_at FROM food_items
+        UNION ALL
+        SELECT {columns}, archived_at FROM food_items_archive
+    ''')
+    # 全ての問い合わせは世帯で絞り込むので、インデックスは household_id を先頭にする
+    # status/detected_by での絞り込みと standard_name の DISTINCT をインデックスだけで完結させる
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_food_items_household_status_detected
+        ON food_items (household_id, status, detected_by, standard_name)
+    ''')
+    # スキャン結果の突き合わせ (YOLOクラス単位) 用
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_food_items_household_status_yolo_class
+        ON food_items (household_id, status, yolo_class)
+    ''')
+    # 期限の範囲検索用。在庫中で期限のある行だけを持つ部分インデックス
+    # (世帯ごとの get_expiring_items と、全世帯をまとめて走査する期限アラート用)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_food_items_household_active_expiry
+        ON food_items (household_id, expiry_day) WHERE status = 'active' AND expiry_day IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_food_items_active_expiry
+        ON food_items (expiry_day) WHERE status = 'active' AND expiry_day IS NOT NULL
+    ''')
+    # アーカイブの対象 (在庫中でない行) を全世帯から最終確認日の古い順に探す
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_food_items_inactive_last_seen
+        ON food_items (last_seen_date) WHERE status != 'active'
+    ''')
+    # 期限アラートの送信済み記録 (食材と期限の組ごとに1回だけ通知する)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS expiry_alerts (
+            household_id TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            expiry_day INTEGER NOT NULL,
+            alerted_at TEXT NOT NULL,
+            PRIMARY KEY (household_id, item_id, expiry_day)
+        ) WITHOUT ROWID
+    ''')
+    inventory_events.init_event_schema(conn)
+    scan_history.init_scan_schema(conn)
+    receipt_fingerprints.init_receipt_schema(conn)
     conn.commit()
-    conn.close()
-    print(f"Database table 'food_items' ensured at {DB_FILE}")
-
-def add_food_item(standard_name, yolo_class, quantity, detected_by, 
-                  unit=None, purchase_date=None, expiry_date=None, notes=None):
-    """新しい食材アイテムをデータベースに追加する"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+
+def _migrate_expiry_day(conn):
+    """expiry_day 列がない既存のシャードに列を追加し、expiry_date から埋める"""
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(food_items)')}
+    if 'expiry_day' in columns:
+        return
+    conn.execute('ALTER TABLE food_items ADD COLUMN expiry_day INTEGER')
+    rows = conn.execute('SELECT household_id, id, expiry_date FROM food_items WHERE expiry_date IS NOT NULL').fetchall()
+    updates = []
+    for row in rows:
+        expiry_date, expiry_day = normalize_date(row['expiry_date'])
+        updates.append((expiry_date, expiry_day, row['household_id'], row['id']))
+    conn.executemany('UPDATE food_items SET expiry_date = ?, expiry_day = ? WHERE household_id = ? AND id = ?', updates)
+    logger.info("Added expiry_day to food_items (%d rows backfilled).", len(updates))
+
+def parse_date(value):
+    """日付の文字列 (DATE_FORMATS) や date を date に変換する。解釈できない場合はNone"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def normalize_date(value):
+    """
+    expiry_date の値を (保存する文字列, 日番号) にする。
+    解釈できた日付は ISO 形式と date.toordinal() に、解釈できない文字列はそのまま残し日番号はNoneにする。
+    """
+    parsed = parse_date(value)
+    if parsed is None:
+        return value, None
+    return parsed.isoformat(), parsed.toordinal()
+
+def get_router():
+    """在庫DBのシャードルーター（初回に config の設定で作成する）"""
+    global _router
+    if _router is None:
+        router = ShardRouter(init_schema=_init_schema)
+        _import_legacy_on_first_open(router)
+        _router = router
+    return _router
+
+def use_router(router):
+    """
+    ルーターを差し替える（テストやベンチマークで一時ディレクトリのシャードを使う場合など）。
+    init_schema が未指定なら在庫のスキーマを設定する。直前のルーターを返す。
+    """
+    global _router
+    if router is not None and router.init_schema is None:
+        router.init_schema = _init_schema
+    previous, _router = _router, router
+    get_inventory_cache().invalidate()
+    return previous
+
+def get_inventory_cache():
+    """世帯ごとの在庫中の食材のキャッシュ (inventory_cache.py)"""
+    global _cache
+    if _cache is None:
+        _cache = InventoryCache()
+    return _cache
+
+def inventory_cache_stats():
+    """在庫キャッシュのヒット・ミス・追い出しの回数と、保持している世帯数・行数"""
+    return get_inventory_cache().stats()
+
+def get_db_connection(household_id=DEFAULT_HOUSEHOLD_ID):
+    """
+    世帯のシャードへの接続を返す。接続はスレッドごとにキャッシュされるため、呼び出し側で close しないこと。
+    書き込みは `with conn:` でトランザクションにする。
+    """
+    return get_router().connection(household_id)
+
+def _open_transactions():
+    transactions = getattr(_pending, 'transactions', None)
+    if transactions is None:
+        transactions = _pending.transactions = {}
+    return transactions
+
+@contextmanager
+def _write_transaction(household_id):
+    """
+    世帯のシャードへの書き込みトランザクション (`with conn:` と同じ)。
+    コミットした後に、トランザクション中に変更した行で在庫キャッシュを更新する (ロールバックした場合は何もしない)。
+    このスレッドで同じ世帯のトランザクションが既に開いていれば、その中で書き込む (コミットは外側で行う)。
+    """
+    transactions = _open_transactions()
+    if household_id in transactions:
+        yield get_db_connection(household_id)
+        return
+    # ロックを取ってから世帯が他のシャードへ移行済みでないかを確かめる (移行元への書き込みが失われないように)
+    conn = get_router().begin_write(household_id)
+    transactions[household_id] = changes = []
+    try:
+        with conn:
+            yield conn
+    finally:
+        del transactions[household_id]
+    get_inventory_cache().apply(household_id, changes)
+
+@contextmanager
+def transaction(household_id=DEFAULT_HOUSEHOLD_ID):
+    """
+    複数の書き込みを1つのトランザクション・1つの取り込みバッチにまとめる。
+    中で呼んだ add_food_item などの書き込み関数は、このトランザクションに加わる (例外で全体がロールバックされる)。
+    在庫の読み出しはキャッシュを使わず、トランザクション中の変更を含めてDBから読む。
+
+    Yields:
+        sqlite3.Connection: 世帯のシャードへの接続 (同じシャードの他の世帯の書き込みは混ぜないこと)
+    """
+    with event_batch(), _write_transaction(household_id) as conn:
+        yield conn
+
+def _track_changes(household_id, changes):
+    """変更した行 (item_id, 変更後の行 or None) を、コミット後に在庫キャッシュへ反映するよう記録する"""
+    pending = _open_transactions().get(household_id)
+    if pending is None:
+        # _write_transaction の外での書き込みは、コミットを待てないので世帯ごとキャッシュから外す
+        get_inventory_cache().invalidate(household_id)
+    else:
+        pending.extend(changes)
+
+def _record_item_events(conn, household_id, events):
+    """イベントを記録し、変更後の行を在庫キャッシュへの反映用に控える"""
+    inventory_events.record_events(conn, household_id, events)
+    _track_changes(household_id, [(item_id, after) for item_id, _, _, after in events])
+
+def _insert_item(conn, household_id, values, event_type):
+    """
+    食材を1行追加し、イベントを記録する。書き込みトランザクションの中で呼ぶこと。
+    values は id / household_id 以外の列名 -> 値。戻り値は世帯内の食材ID。
+    """
+    if 'expiry_date' in values:
+        values = {**values}
+        values['expiry_date'], values['expiry_day'] = normalize_date(values['expiry_date'])
+    item_id = inventory_events.next_ids(conn, household_id, ITEM_SEQUENCE)
+    columns = ['id', 'household_id', *values]
+    conn.execute(f"INSERT INTO food_items ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                 (item_id, household_id, *values.values()))
+    _record_item_events(conn, household_id,
+                        [(item_id, event_type, None, inventory_events.row_image(conn, household_id, item_id))])
+    return item_id
+
+def _update_item(conn, household_id, item_id, event_type, set_sql, params):
+    """
+    食材の1行を更新 (set_sql が None なら削除) し、変更前後のイメージをイベントとして記録する。
+    書き込みトランザクションの中で呼ぶこと。行が存在しなければ何もしない。
+    """
+    before = inventory_events.row_image(conn, household_id, item_id)
+    if before is None:
+        return False
+    if set_sql is None:
+        conn.execute('DELETE FROM food_items WHERE household_id = ? AND id = ?', (household_id, item_id))
+    else:
+        conn.execute(f'UPDATE food_items SET {set_sql} WHERE household_id = ? AND id = ?',
+                     (*params, household_id, item_id))
+    after = inventory_events.row_image(conn, household_id, item_id)
+    _record_item_events(conn, household_id, [(item_id, event_type, before, after)])
+    return True
+
+@traced('db.create_table')
+def create_table(household_id=DEFAULT_HOUSEHOLD_ID):
+    """世帯のシャードに food_items テーブルを用意する（スキーマはシャードへの初回接続時に作成される）"""
+    get_db_connection(household_id)
+    router = get_router()
+    logger.info("Database table 'food_items' ensured at %s", router.shard_path(router.shard_for(household_id)))
+
+@traced('db.add_food_item')
+def add_food_item(standard_name, yolo_class, quantity, detected_by,
+                  unit=None, purchase_date=None, expiry_date=None, notes=None,
+                  household_id=DEFAULT_HOUSEHOLD_ID, event_type='added'):
+    """新しい食材アイテムをデータベースに追加する（イベントログにも記録する）"""
     last_seen = datetime.now().strftime('%Y-%m-%d') # 今日の日付
 
-    cursor.execute('''
-        INSERT INTO food_items (standard_name, yolo_class, quantity, unit, 
-                                purchase_date, expiry_date, detected_by, last_seen_date, notes)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (standard_name, yolo_class, quantity, unit, 
-          purchase_date, expiry_date, detected_by, last_seen, notes))
-    conn.commit()
-    item_id = cursor.lastrowid # 挿入されたアイテムのIDを取得
-    conn.close()
-    print(f"Added item: {standard_name} (ID: {item_id})")
+    with _write_transaction(household_id) as conn:
+        item_id = _insert_item(conn, household_id, {
+            'standard_name': standard_name, 'yolo_class': yolo_class, 'quantity': quantity, 'unit': unit,
+            'purchase_date': purchase_date, 'expiry_date': expiry_date, 'detected_by': detected_by,
+            'last_seen_date': last_seen, 'notes': notes,
+        }, event_type) # 挿入されたアイテムのIDを取得
+    logger.debug("Added item: %s (ID: %s)", standard_name, item_id)
     return item_id
 
-def update_food_item_quantity(item_id, new_quantity, detected_by=None):
+@traced('db.add_food_items')
+def add_food_items(rows, household_id=DEFAULT_HOUSEHOLD_ID, event_type='added'):
+    """
+    複数の食材を1トランザクションで追加する（executemany。イベントも同じトランザクションで記録する）。
+
+    Args:
+        rows (iterable): FOOD_ITEM_INPUT_COLUMNS の順の値のタプル (expiry_day は expiry_date から求める)。
+
+    Returns:
+        list: 追加した食材IDのリスト
+    """
+    expiry_index = FOOD_ITEM_INPUT_COLUMNS.index('expiry_date')
+    normalized = []
+    for row in rows:
+        expiry_date, expiry_day = normalize_date(row[expiry_index])
+        normalized.append((*row[:expiry_index], expiry_date, *row[expiry_index + 1:], expiry_day))
+    rows = normalized
+    if not rows:
+        return []
+    columns = FOOD_ITEM_INPUT_COLUMNS + ('expiry_day',)
+    with _write_transaction(household_id) as conn:
+        first_id = inventory_events.next_ids(conn, household_id, ITEM_SEQUENCE, len(rows))
+        item_ids = range(first_id, first_id + len(rows))
+        conn.executemany(f"INSERT INTO food_items (id, household_id, {', '.join(columns)}) "
+                         f"VALUES ({', '.join('?' * (len(columns) + 2))})",
+                         [(item_id, household_id, *row) for item_id, row in zip(item_ids, rows)])
+        _record_item_events(conn, household_id, [
+            (item_id, event_type, None, {'id': item_id, 'household_id': household_id, **dict(zip(columns, row))})
+            for item_id, row in zip(item_ids, rows)])
+    logger.debug("Added %d items.", len(rows))
+    return list(item_ids)
+
+@traced('db.update_food_item_quantity')
+def update_food_item_quantity(item_id, new_quantity, detected_by=None, household_id=DEFAULT_HOUSEHOLD_ID,
+                              event_type='quantity_changed'):
     """既存の食材アイテムの数量を更新する"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     last_seen = datetime.now().strftime('%Y-%m-%d')
 
-    update_sql = 'UPDATE food_items SET quantity = ?'
+    set_sql = 'quantity = ?'
     params = [new_quantity]
 
     if detected_by: # 検出方法が指定された場合のみ更新
-        update_sql += ', detected_by = ?'
+        set_sql += ', detected_by = ?'
         params.append(detected_by)
-    
-    update_sql += ', last_seen_date = ? WHERE id = ?'
-    params.extend([last_seen, item_id])
 
-    cursor.execute(update_sql, tuple(params))
-    conn.commit()
-    conn.close()
-    print(f"Updated item ID {item_id} to quantity {new_quantity}")
+    set_sql += ', last_seen_date = ?'
+    params.append(last_seen)
+
+    with _write_transaction(household_id) as conn:
+        _update_item(conn, household_id, item_id, event_type, set_sql, params)
+    logger.debug("Updated item ID %s to quantity %s", item_id, new_quantity)
 
-def update_food_item_details(item_id, **kwargs):
+@traced('db.update_food_item_details')
+def update_food_item_details(item_id, household_id=DEFAULT_HOUSEHOLD_ID, event_type='details_changed', **kwargs):
     """既存の食材アイテムの詳細を更新する（例: standard_name, expiry_date, notesなど）"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     set_clauses = []
     params = []
-    
-    allowed_fields = ['standard_name', 'yolo_class', 'quantity', 'unit', 
-                      'purchase_date', 'expiry_date', 'notes', 'status', 
+
+    allowed_fields = ['standard_name', 'yolo_class', 'quantity', 'unit',
+                      'purchase_date', 'expiry_date', 'notes', 'status',
                       'last_seen_date', 'detected_by']
 
     for key, value in kwargs.items():
         if key in ['standard_name', 'yolo_class', 'unit', 'purchase_date', 'expiry_date', 'notes', 'status', 'last_seen_date']:
+            if key == 'expiry_date':
+                value, expiry_day = normalize_date(value)
+                set_clauses.append('expiry_day = ?')
+                params.append(expiry_day)
             set_clauses.append(f"{key} = ?")
             params.append(value)
         else:
-            print(f"Warning: Invalid field '{key}' for update.")
+            logger.warning("Invalid field '%s' for update.", key)
 
     if not set_clauses:
-        conn.close()
         return
 
-    sql = f"UPDATE food_items SET {', '.join(set_clauses)} WHERE id = ?"
-    params.append(item_id)
+    with _write_transaction(household_id) as conn:
+        _update_item(conn, household_id, item_id, event_type, ', '.join(set_clauses), params)
+    logger.debug("Updated details for item ID %s", item_id)
 
-    cursor.execute(sql, tuple(params))
-    conn.commit()
-    conn.close()
-    print(f"Updated details for item ID {item_id}")
 
+SCAN_MISSING_POLICIES = ('keep', 'decrement', 'consumed')
+
+@traced('db.apply_scan_counts')
+def apply_scan_counts(class_counts, class_aliases=None, missing_policy='keep', missing_grace_days=0,
+                      detectable_classes=None, household_id=DEFAULT_HOUSEHOLD_ID, model_variant=None):
+    """
+    1回の冷蔵庫スキャンの検出数 (統合後のYOLOクラス -> 個数) を在庫に反映する。
+    検出1件ごとに行を追加するのではなく、クラスごとに1回だけ更新または追加するため、
+    food_items はスキャン回数ではなく品目数に応じてしか増えない。全体を1トランザクション・1バッチで行う。
+    検出数はスキャンの時系列 (scan_history) にも、推論に使ったモデルのバリアントとともに同じトランザクションで記録する。
+
+    クラスごとの処理:
+      - 該当するアクティブな行がない: 検出数を数量とする行を1つ追加する。
+      - YOLOのみで登録された汎用行 (standard_name == yolo_class) がある: その1行の数量を
+        「検出数 - レシート由来の行の数量」にする。以前のスキャンで重複して作られた汎用行はまとめる。
+      - レシート由来の行だけがある: 数量は減らさない（隠れて見えないことがあるため）。
+        検出数の方が多い場合のみ、最近見た行に差分を足す。
+      - 該当する行はすべて last_seen_date を今日にする。
+
+    Args:
+        class_counts (dict): 統合後のYOLOクラス -> 検出数。
+        class_aliases (dict): YOLOクラス -> 同じ物として扱う別名クラスのリスト (YOLO_CLASS_ALIASES)。
+        missing_policy (str): 今回見えなかった行の扱い。'keep' (何もしない)、'decrement' (数量を1減らし、
+                              0になったら消費済み)、'consumed' (消費済みにする)。
+        missing_grace_days (int): 最後に見てからこの日数が経つまでは、見えなくても missing_policy を適用しない。
+        detectable_classes (iterable): 検出器が検出できるクラス。これ以外のクラスの行は見えなくても扱わない。
+        household_id (str): 世帯ID。
+        model_variant (str): 検出に使ったモデルのバリアント (例: 'best@480')。スキャンとともに記録する。
+
+    Returns:
+        dict: {'inserted': [id], 'updated': [id], 'merged': [id], 'missing': [id], 'scan_id': int}
+    """
+    if missing_policy not in SCAN_MISSING_POLICIES:
+        raise ValueError(f"missing_policy must be one of {SCAN_MISSING_POLICIES}")
+    class_aliases = class_aliases or {}
+    today = datetime.now().strftime('%Y-%m-%d')
+    summary = {'inserted': [], 'updated': [], 'merged': [], 'missing': []}
+
+    with event_batch(), _write_transaction(household_id) as conn:
+        summary['scan_id'] = scan_history.record_scan(conn, household_id, class_counts,
+                                                      detectable_classes=detectable_classes,
+                                                      model_variant=model_variant)
+        seen_classes = set()
+        for yolo_class, count in class_counts.items():
+            candidates = sorted({yolo_class, *class_aliases.get(yolo_class, [])})
+            seen_classes.update(candidates)
+            placeholders = ', '.join('?' * len(candidates))
+            rows = conn.execute(f'''
+                SELECT id, standard_name, yolo_class, quantity, detected_by, last_seen_date
+                FROM food_items WHERE household_id = ? AND status = 'active' AND yolo_class IN ({placeholders})
+                ORDER BY last_seen_date DESC, id
+            ''', (household_id, *candidates)).fetchall()
+
+            if not rows:
+                summary['inserted'].append(_insert_item(conn, household_id, {
+                    'standard_name': yolo_class, 'yolo_class': yolo_class, 'quantity': count,
+                    'purchase_date': today, 'detected_by': 'yolo', 'last_seen_date': today,
+                }, 'detected'))
+                continue
 
-def get_all_food_items(status='active'):
-    """全ての食材アイテム（または指定されたステータスのアイテム）を取得する"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+            generic = [r for r in rows if r['detected_by'] == 'yolo' and r['standard_name'] == r['yolo_class']]
+            generic_ids = {r['id'] for r in generic}
+            specific = [r for r in rows if r['id'] not in generic_ids]
+            specific_quantity = sum(r['quantity'] for r in specific)
+            new_quantities = {} # 食材ID -> 新しい数量
+            merged = []
+
+            if generic:
+                keep, duplicates = generic[0], generic[1:]
+                remaining = count - specific_quantity if specific else count
+                if remaining <= 0:
+                    # レシート由来の行で説明がつくので、汎用行は不要
+                    duplicates = generic
+                else:
+                    new_quantities[keep['id']] = remaining
+                merged = [r['id'] for r in duplicates]
+            elif count > specific_quantity:
+                new_quantities[specific[0]['id']] = specific[0]['quantity'] + count - specific_quantity
+
+            for row in rows:
+                if row['id'] in merged:
+                    _update_item(conn, household_id, row['id'], 'merged', None, ())
+                elif row['id'] in new_quantities and new_quantities[row['id']] != row['quantity']:
+                    _update_item(conn, household_id, row['id'], 'quantity_changed', 'quantity = ?, last_seen_date = ?',
+                                 (new_quantities[row['id']], today))
+                elif row['last_seen_date'] != today:
+                    _update_item(conn, household_id, row['id'], 'seen', 'last_seen_date = ?', (today,))
+            summary['merged'].extend(merged)
+            summary['updated'].extend(r['id'] for r in rows if r['id'] not in merged)
+
+        if missing_policy != 'keep':
+            summary['missing'] = _apply_missing_policy(conn, household_id, seen_classes, missing_policy,
+                                                       missing_grace_days, detectable_classes, today)
+    logger.debug("Applied scan counts %s: %s", class_counts, summary)
+    return summary
+
+def _apply_missing_policy(conn, household_id, seen_classes, missing_policy, missing_grace_days,
+                          detectable_classes, today):
+    """YOLOで追跡している行のうち、今回のスキャンで見えなかったものに missing_policy を適用する"""
+    cutoff = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=missing_grace_days)).strftime('%Y-%m-%d')
+    sql = '''
+        SELECT id, yolo_class, quantity FROM food_items
+        WHERE household_id = ? AND status = 'active' AND detected_by IN ('yolo', 'both') AND last_seen_date <= ?
+    '''
+    missing = [r for r in conn.execute(sql, (household_id, cutoff)).fetchall()
+               if r['yolo_class'] not in seen_classes
+               and (detectable_classes is None or r['yolo_class'] in detectable_classes)]
+    for row in missing:
+        if missing_policy == 'decrement' and row['quantity'] > 1:
+            _update_item(conn, household_id, row['id'], 'missing', 'quantity = ?', (row['quantity'] - 1,))
+        else:
+            _update_item(conn, household_id, row['id'], 'consumed', "status = 'consumed'", ())
+    return [r['id'] for r in missing]
+
+@traced('db.get_all_food_items')
+def get_all_food_items(status='active', household_id=DEFAULT_HOUSEHOLD_ID):
+    """
+    全ての食材アイテム（または指定されたステータスのアイテム）を取得する。
+    'active' 以外ではアーカイブ済みの行も含める (履歴のビュー food_items_history を使う)。
+    'active' の行は在庫キャッシュ (inventory_cache.py) から返す (在庫の多い世帯を除く)。
+    """
+    if status == 'active':
+        inventory = _cached_inventory(household_id)
+        if inventory is not None:
+            return list(inventory.rows())
+    conn = get_db_connection(household_id)
     if status == 'all':
-        cursor.execute('SELECT * FROM food_items ORDER BY standard_name')
+        cursor = conn.execute('SELECT * FROM food_items_history WHERE household_id = ? ORDER BY standard_name',
+                              (household_id,))
     else:
-        cursor.execute('SELECT * FROM food_items WHERE status = ? ORDER BY standard_name', (status,))
-    items = cursor.fetchall() # 全ての行を取得
-    conn.close()
-    return items
-
-def get_food_item_by_id(item_id):
-    """IDで食材アイテムを取得する"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM food_items WHERE id = ?', (item_id,))
-    item = cursor.fetchone() # 1つの行を取得
-    conn.close()
-    return item
-
-def delete_food_item(item_id):
+        cursor = conn.execute(f'SELECT * FROM {_source_for(status)} WHERE household_id = ? AND status = ? '
+                              'ORDER BY standard_name', (household_id, status))
+    return cursor.fetchall() # 全ての行を取得
+
+FOOD_ITEM_COLUMNS = ('id', 'standard_name', 'yolo_class', 'quantity', 'unit', 'purchase_date',
+                     'expiry_date', 'detected_by', 'last_seen_date', 'status', 'notes', 'expiry_day')
+# add_food_items に渡す行の列 (id は連番、expiry_day は expiry_date から求める)
+FOOD_ITEM_INPUT_COLUMNS = FOOD_ITEM_COLUMNS[1:-1]
+EXPIRING_ITEM_COLUMNS = ('id', 'standard_name', 'yolo_class', 'quantity', 'unit', 'expiry_date', 'expiry_day',
+                         'detected_by')
+
+def _load_active_items(household_id, limit):
+    """在庫キャッシュに載せる世帯の在庫中の行 (CACHED_COLUMNS の順、最大 limit 行)"""
+    return get_db_connection(household_id).execute(
+        f"SELECT {', '.join(CACHED_COLUMNS)} FROM food_items WHERE household_id = ? AND status = 'active' LIMIT ?",
+        (household_id, limit)).fetchall()
+
+def _cached_inventory(household_id):
+    """
+    世帯の在庫中の行のキャッシュ (HouseholdInventory)。キャッシュしない世帯では None。
+    このスレッドで世帯のトランザクションが開いている間は、未コミットの変更を読めるよう None を返す。
+    """
+    if household_id in _open_transactions():
+        return None
+    return get_inventory_cache().get(household_id, lambda limit: _load_active_items(household_id, limit))
+
+def _project_rows(rows, columns):
+    """キャッシュの行を指定したカラムだけの行にする (並び順は _build_filtered_select と同じ)"""
+    cls = row_class(columns)
+    getter = itemgetter(*(CACHED_COLUMNS.index(c) for c in columns))
+    if len(columns) == 1:
+        projected = [cls((getter(row),)) for row in rows]
+    else:
+        projected = [cls(getter(row)) for row in rows]
+    if 'standard_name' not in columns:
+        projected.sort(key=lambda r: (r[0] is not None, r[0]))
+    return projected
+
+def _source_for(status):
+    """在庫中の行だけを見る問い合わせは food_items、それ以外はアーカイブを含む履歴のビュー"""
+    return 'food_items' if status == 'active' else 'food_items_history'
+
+def _build_filtered_select(columns, status, detected_by, household_id, distinct=False):
+    """カラムを絞り、世帯と status/detected_by で絞り込むSELECT文とパラメータを組み立てる"""
+    columns = list(columns) if columns else list(FOOD_ITEM_COLUMNS)
+    invalid = [c for c in columns if c not in FOOD_ITEM_COLUMNS]
+    if invalid:
+        raise ValueError(f"Invalid column(s) for food_items: {invalid}")
+
+    where_clauses = ['household_id = ?']
+    params = [household_id]
+    if status != 'all':
+        where_clauses.append('status = ?')
+        params.append(status)
+    if detected_by is not None:
+        where_clauses.append('detected_by = ?')
+        params.append(detected_by)
+
+    sql = f"SELECT {'DISTINCT ' if distinct else ''}{', '.join(columns)} FROM {_source_for(status)}"
+    sql += ' WHERE ' + ' AND '.join(where_clauses)
+    order_by = 'standard_name' if 'standard_name' in columns else columns[0]
+    sql += f' ORDER BY {order_by}'
+    return sql, tuple(params)
+
+@traced('db.get_distinct_standard_names')
+def get_distinct_standard_names(status='active', detected_by=None, household_id=DEFAULT_HOUSEHOLD_ID):
+    """指定条件に一致する食材の標準名を重複なしで取得する（例: detected_by='both' のアクティブな食材名）"""
+    if status == 'active':
+        inventory = _cached_inventory(household_id)
+        if inventory is not None:
+            return inventory.standard_names(detected_by)
+    sql, params = _build_filtered_select(['standard_name'], status, detected_by, household_id, distinct=True)
+    return [row[0] for row in get_db_connection(household_id).execute(sql, params).fetchall()]
+
+@traced('db.get_food_items_columns')
+def get_food_items_columns(columns, status='active', detected_by=None, household_id=DEFAULT_HOUSEHOLD_ID):
+    """必要なカラムだけを指定条件で取得する（SELECT * を避け、行のサイズを抑える）"""
+    sql, params = _build_filtered_select(columns, status, detected_by, household_id)
+    if status == 'active':
+        inventory = _cached_inventory(household_id)
+        if inventory is not None:
+            return _project_rows(inventory.rows(detected_by), list(columns) if columns else list(FOOD_ITEM_COLUMNS))
+    return get_db_connection(household_id).execute(sql, params).fetchall()
+
+@traced('db.iter_food_items')
+def iter_food_items(columns=None, status='active', detected_by=None, batch_size=500,
+                    household_id=DEFAULT_HOUSEHOLD_ID):
+    """
+    食材アイテムを batch_size 行ずつ fetchmany で読み出すジェネレータ。
+    在庫や履歴が大きくなっても、全行を一度にメモリへ載せずに処理できる。
+    在庫中の行は、在庫キャッシュに載っている世帯ならキャッシュから返す。
+    """
+    sql, params = _build_filtered_select(columns, status, detected_by, household_id)
+    if status == 'active':
+        inventory = _cached_inventory(household_id)
+        if inventory is not None:
+            yield from _project_rows(inventory.rows(detected_by), list(columns) if columns else list(FOOD_ITEM_COLUMNS))
+            return
+    cursor = get_db_connection(household_id).execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+@traced('db.get_expiring_items')
+def get_expiring_items(within_days=3, household_id=DEFAULT_HOUSEHOLD_ID, include_expired=False, columns=None,
+                       today=None):
+    """
+    在庫中の食材のうち、今日から within_days 日以内に期限が来るものを期限の早い順に返す。
+    部分インデックス (household_id, expiry_day) の範囲検索なので、在庫の行数によらず該当する行数分の時間で済む。
+
+    Args:
+        within_days (int): 今日から何日後までを対象にするか (0 なら今日が期限のもの)。
+        include_expired (bool): Trueの場合は期限切れのものも含める。
+        columns (list): 取得するカラム。Noneの場合は EXPIRING_ITEM_COLUMNS。
+        today (date): 基準日。Noneの場合は今日。
+
+    Returns:
+        list: sqlite3.Row のリスト
+    """
+    columns = list(columns) if columns else list(EXPIRING_ITEM_COLUMNS)
+    invalid = [c for c in columns if c not in FOOD_ITEM_COLUMNS]
+    if invalid:
+        raise ValueError(f"Invalid column(s) for food_items: {invalid}")
+    today_day = (today or date.today()).toordinal()
+    sql = f'''
+        SELECT {', '.join(columns)} FROM food_items
+        WHERE household_id = ? AND status = 'active' AND expiry_day IS NOT NULL AND expiry_day <= ?
+    '''
+    params = [household_id, today_day + within_days]
+    if not include_expired:
+        sql += ' AND expiry_day >= ?'
+        params.append(today_day)
+    sql += ' ORDER BY expiry_day'
+    return get_db_connection(household_id).execute(sql, params).fetchall()
+
+@traced('db.get_food_item_by_id')
+def get_food_item_by_id(item_id, household_id=DEFAULT_HOUSEHOLD_ID):
+    """IDで食材アイテムを取得する（アーカイブ済みの行も返す）"""
+    inventory = _cached_inventory(household_id)
+    row = inventory.get(item_id) if inventory is not None else None
+    if row is not None:
+        return row
+    conn = get_db_connection(household_id)
+    return conn.execute('SELECT * FROM food_items_history WHERE id = ? AND household_id = ?',
+                        (item_id, household_id)).fetchone() # 1つの行を取得
+
+@traced('db.delete_food_item')
+def delete_food_item(item_id, household_id=DEFAULT_HOUSEHOLD_ID):
     """食材アイテムをデータベースから削除する（論理削除も考慮可）"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # 物理削除
-    cursor.execute('DELETE FROM food_items WHERE id = ?', (item_id,))
-    # 論理削除にする場合（statusを'deleted'などに変更）
-    # cursor.execute("UPDATE food_items SET status = 'deleted' WHERE id = ?", (item_id,))
-    conn.commit()
-    conn.close()
-    print(f"Deleted item ID {item_id}")
+    with _write_transaction(household_id) as conn:
+        # 物理削除（変更前の行はイベントログに残るので undo_batch で戻せる）
+        _update_item(conn, household_id, item_id, 'deleted', None, ())
+    logger.info("Deleted item ID %s", item_id)
 
-def mark_as_consumed_or_discarded(item_id, status='consumed'):
+@traced('db.mark_as_consumed_or_discarded')
+def mark_as_consumed_or_discarded(item_id, status='consumed', household_id=DEFAULT_HOUSEHOLD_ID):
     """食材アイテムを消費済みまたは廃棄済みにマークする"""
     if status not in ['consumed', 'discarded']:
         raise ValueError("Status must be 'consumed' or 'discarded'")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE food_items SET status = ? WHERE id = ?', (status, item_id))
-    conn.commit()
-    conn.close()
-    print(f"Item ID {item_id} marked as {status}.")
+    with _write_transaction(household_id) as conn:
+        _update_item(conn, household_id, item_id, status, 'status = ?', (status,))
+    logger.info("Item ID %s marked as %s.", item_id, status)
+
+# --- イベントログ ---
+
+@traced('db.get_inventory_events')
+def get_inventory_events(household_id=DEFAULT_HOUSEHOLD_ID, batch_id=None, item_id=None, limit=100):
+    """イベントを新しい順に取得する（バッチや食材で絞り込める）"""
+    sql = 'SELECT * FROM inventory_events WHERE household_id = ?'
+    params = [household_id]
+    if batch_id is not None:
+        sql += ' AND batch_id = ?'
+        params.append(batch_id)
+    if item_id is not None:
+        sql += ' AND item_id = ?'
+        params.append(item_id)
+    sql += ' ORDER BY event_id DESC LIMIT ?'
+    params.append(limit)
+    return get_db_connection(household_id).execute(sql, params).fetchall()
+
+@traced('db.list_event_batches')
+def list_event_batches(household_id=DEFAULT_HOUSEHOLD_ID, limit=20):
+    """最近の取り込みバッチ（新しい順）"""
+    return inventory_events.list_batches(get_db_connection(household_id), household_id, limit=limit)
+
+@traced('db.get_inventory_at')
+def get_inventory_at(at, household_id=DEFAULT_HOUSEHOLD_ID, status='active'):
+    """
+    指定時点の在庫を、チェックポイントとイベントログから復元する。
+
+    Args:
+        at (datetime or str): 復元する時点。
+        status (str): 'all' 以外の場合はそのステータスの行だけを返す。
+
+    Returns:
+        list: 行の辞書のリスト
+    """
+    rows = inventory_events.reconstruct_inventory(get_db_connection(household_id), household_id, at)
+    return rows if status == 'all' else [row for row in rows if row['status'] == status]
+
+@traced('db.undo_batch')
+def undo_batch(batch_id, household_id=DEFAULT_HOUSEHOLD_ID, force=False):
+    """
+    取り込みバッチ（冷蔵庫スキャンやレシート1枚分）の変更をまとめて取り消す。
+    後続のバッチが同じ食材を変更している場合は UndoConflictError（force=True で強制）。
+    バッチで記録したスキャンの時系列とレシートの指紋も削除する (取り消したレシートは再び取り込める)。
+    """
+    with _write_transaction(household_id) as conn:
+        item_ids = inventory_events.undo_batch(conn, household_id, batch_id, force=force)
+        _track_changes(household_id, [(item_id, inventory_events.row_image(conn, household_id, item_id))
+                                      for item_id in item_ids])
+        # 取り消しで food_items に戻った行がアーカイブにもあれば、戻した方を正とする
+        conn.executemany('DELETE FROM food_items_archive WHERE household_id = ? AND id = ?',
+                         [(household_id, item_id) for item_id in item_ids])
+        scan_history.delete_batch_scans(conn, household_id, batch_id)
+        receipt_fingerprints.delete_batch_receipts(conn, household_id, batch_id)
+    logger.info("Undid batch %s (%d items).", batch_id, len(item_ids))
+    return item_ids
+
+@traced('db.create_checkpoint')
+def create_checkpoint(household_id=DEFAULT_HOUSEHOLD_ID):
+    """在庫のスナップショットを今すぐ保存する（通常は INVENTORY_CHECKPOINT_INTERVAL イベントごとに自動で作られる）"""
+    with _write_transaction(household_id) as conn:
+        return inventory_events.create_checkpoint(conn, household_id)
+
+# --- スキャンの時系列 ---
+
+@traced('db.get_scan_history')
+def get_scan_history(household_id=DEFAULT_HOUSEHOLD_ID, yolo_class=None, since=None):
+    """
+    冷蔵庫スキャンの検出数の時系列を返す。
+
+    Args:
+        yolo_class (str): 指定した場合はそのクラスだけ。
+        since (datetime or float): この時点以降のスキャンだけ (datetime または UNIX秒)。
+
+    Returns:
+        list: (yolo_class, scan_id, scanned_at (UNIX秒), count) のタプルのリスト (クラス・時刻順)
+    """
+    if isinstance(since, datetime):
+        since = since.timestamp()
+    return scan_history.get_series(get_db_connection(household_id), household_id, yolo_class=yolo_class, since=since)
+
+@traced('db.get_scan_variants')
+def get_scan_variants(household_id=DEFAULT_HOUSEHOLD_ID, since=None):
+    """
+    スキャンごとに検出に使ったモデルのバリアントを返す (get_scan_history の点をバリアントの精度で重み付けするため)。
+
+    Returns:
+        dict: scan_id -> model_variant (記録がないスキャンはNone)
+    """
+    if isinstance(since, datetime):
+        since = since.timestamp()
+    return scan_history.get_scan_variants(get_db_connection(household_id), household_id, since=since)
+
+# --- レシートの指紋 ---
+
+@traced('db.find_duplicate_receipt_image')
+def find_duplicate_receipt_image(fingerprint, household_id=DEFAULT_HOUSEHOLD_ID):
+    """
+    OCR の前に、画像の指紋 (SHA-1 と dHash) で既に取り込んだレシートと照合する。
+
+    Returns:
+        dict or None: {'receipt_id', 'reason' ('image_exact' | 'image_near'), 'distance'}
+    """
+    return receipt_fingerprints.find_image_duplicate(get_db_connection(household_id), household_id, fingerprint)
+
+@traced('db.register_receipt')
+def register_receipt(fingerprint, household_id=DEFAULT_HOUSEHOLD_ID, status='applied', duplicate_of=None,
+                     duplicate_reason=None, check_duplicates=True):
+    """
+    レシートの指紋を記録する。status='applied' で check_duplicates=True の場合は、記録してから既存のレシートと照合し、
+    重複していれば 'flagged' に変えてその相手を返す。
+    transaction() の中で呼ぶと取り込みと同じトランザクション・バッチになり、先に指紋を書き込むことで
+    同じレシートを同時に取り込もうとしても、後の方が必ず先の指紋を見る。
+
+    Returns:
+        tuple: (receipt_id, duplicate (dict or None))
+    """
+    with _write_transaction(household_id) as conn:
+        receipt_id = receipt_fingerprints.insert_receipt(conn, household_id, fingerprint, status, current_batch_id(),
+                                                         duplicate_of=duplicate_of, duplicate_reason=duplicate_reason)
+        duplicate = None
+        if status == 'applied' and check_duplicates:
+            duplicate = receipt_fingerprints.find_duplicate(conn, household_id, fingerprint,
+                                                            exclude_receipt_id=receipt_id)
+            if duplicate is not None:
+                receipt_fingerprints.set_receipt_status(conn, household_id, receipt_id, 'flagged',
+                                                        duplicate['receipt_id'], duplicate['reason'])
+    return receipt_id, duplicate
+
+def list_receipts(household_id=DEFAULT_HOUSEHOLD_ID, status=None, limit=50):
+    """記録したレシートの指紋を新しい順に返す (status='flagged' で重複の疑いで反映しなかったものだけ)"""
+    return receipt_fingerprints.list_receipts(get_db_connection(household_id), household_id, status=status, limit=limit)
+
+def import_legacy_database(db_path, household_id=DEFAULT_HOUSEHOLD_ID):
+    """
+    シャーディング前の単一ファイルのDBを世帯に取り込み、期限を正規化し、連番を進めてチェックポイントを作る
+    (取り込んだ行には 'imported' イベントを記録するので、チェックポイントが間引かれても過去の在庫を復元できる)。
+    """
+    router = get_router()
+    imported = _import_legacy_rows(router, db_path, household_id)
+    with open(os.path.join(router.shard_dir, LEGACY_IMPORT_MARKER), 'w') as f:
+        f.write(f"{os.path.abspath(db_path)}\t{household_id}\t{datetime.now().isoformat(timespec='seconds')}\n")
+    return imported
+
+def _import_legacy_rows(router, db_path, household_id):
+    """import_legacy_database の本体 (ルーターを指定できるので、get_router() の初期化中にも使える)"""
+    imported = router.import_database(db_path, household_id, ['food_items'])
+    conn = router.connection(household_id)
+    with conn:
+        rows = conn.execute('SELECT id, expiry_date FROM food_items WHERE household_id = ? AND expiry_date IS NOT NULL',
+                            (household_id,)).fetchall()
+        conn.executemany('UPDATE food_items SET expiry_date = ?, expiry_day = ? WHERE household_id = ? AND id = ?',
+                         [(*normalize_date(row['expiry_date']), household_id, row['id']) for row in rows])
+        inventory_events.sync_sequence(conn, household_id, ITEM_SEQUENCE, 'food_items', 'id')
+        # 取り込んだ行にも 'imported' イベントを記録する (チェックポイントが間引かれても最初から再生して復元できるように)
+        inventory_events.record_untracked_rows(conn, household_id)
+        inventory_events.create_checkpoint(conn, household_id)
+    get_inventory_cache().invalidate(household_id)
+    return imported
+
+def _legacy_row_count(db_path):
+    """シャーディング前のDBの food_items の行数 (ファイルやテーブルがなければ0)"""
+    if not os.path.exists(db_path):
+        return 0
+    try:
+        legacy = sqlite3.connect(f'file:{os.path.abspath(db_path)}?mode=ro', uri=True)
+        try:
+            return legacy.execute('SELECT COUNT(*) FROM food_items').fetchone()[0]
+        finally:
+            legacy.close()
+    except sqlite3.Error:
+        return 0
+
+def _import_legacy_on_first_open(router, db_path=None, household_id=DEFAULT_HOUSEHOLD_ID):
+    """
+    シャーディング前の DB_FILE に在庫が残っていれば、初めて開いた (まだ世帯のない) シャードに取り込む。
+    シャードに既に世帯がある場合は取り込まず、取り込み方を警告する (アップグレード後に在庫が空に見えないように)。
+    複数のプロセスが同時に起動しても、印のファイルを作れた1つのプロセスだけが取り込む。
+    """
+    db_path = db_path or DB_FILE
+    marker = os.path.join(router.shard_dir, LEGACY_IMPORT_MARKER)
+    if os.path.exists(marker):
+        return
+    legacy_rows = _legacy_row_count(db_path)
+    if not legacy_rows:
+        return
+    if router.households() or not DATABASE_AUTO_IMPORT_LEGACY:
+        logger.warning("Legacy inventory database %s (%d rows) has not been imported into the shards at %s. "
+                       "Run 'python src/database/shard_router.py import-legacy <household_id> --db %s' to import it.",
+                       db_path, legacy_rows, router.shard_dir, db_path)
+        return
+    try:
+        fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return # 別のプロセスが取り込んでいる
+    try:
+        imported = _import_legacy_rows(router, db_path, household_id)
+    except Exception:
+        os.close(fd)
+        os.remove(marker) # 次回の起動でやり直す
+        logger.exception("Failed to import legacy inventory database %s into household '%s'.", db_path, household_id)
+        raise
+    with os.fdopen(fd, 'w') as f:
+        f.write(f"{os.path.abspath(db_path)}\t{household_id}\t{datetime.now().isoformat(timespec='seconds')}\n")
+    logger.warning("Imported legacy inventory database %s into household '%s' (%s). The file is no longer used.",
+                   db_path, household_id, imported)
 
 
 if __name__ == '__main__':
+    configure_logging('DEBUG')
+
     # データベースとテーブルを作成
     create_table()
 
@@ -168,14 +922,14 @@ if __name__ == '__main__':
     items = get_all_food_items()
     for item in items:
         print(f"ID: {item['id']}, Name: {item['standard_name']}, Qty: {item['quantity']}, Detected By: {item['detected_by']}")
-    
+
     # アイテムの数量を更新
     print("\n--- Updating item quantity ---")
     # 例としてID:1のアイテムの数量を0.5にする
     # 実際のIDはadd_food_itemの戻り値やget_all_food_itemsで確認してください
     if items:
         update_food_item_quantity(items[0]['id'], 0.5, detected_by='yolo')
-    
+
     # 更新後のアイテムを再取得
     print("\n--- Items after update ---")
     items = get_all_food_items()
@@ -205,4 +959,19 @@ if __name__ == '__main__':
     print("\n--- All items after deletion ---")
     items = get_all_food_items(status='all')
     for item in items:
-        print(f"ID: {item['id']}, Name: {item['standard_name']}, Qty: {item['quantity']}, Status: {item['status']}")
\ No newline at end of file
+        print(f"ID: {item['id']}, Name: {item['standard_name']}, Qty: {item['quantity']}, Status: {item['status']}")
+
+    # 取り込みバッチの取り消し
+    print("\n--- Undoing a batch ---")
+    with event_batch() as batch_id:
+        add_food_item('豆腐', 'tofu', 2, 'receipt')
+        update_food_item_quantity(items[0]['id'], 5)
+    print(f"Batch {batch_id}: {[(e['event_type'], e['item_id']) for e in get_inventory_events(batch_id=batch_id)]}")
+    undo_batch(batch_id)
+    print(f"After undo: {[(item['standard_name'], item['quantity']) for item in get_all_food_items()]}")
+
+    # 別の世帯の在庫は独立している（別のシャードに置かれることもある）
+    print("\n--- Another household ---")
+    add_food_item('トマト', 'tomato', 3, 'receipt', household_id='household-2')
+    print(f"household-2 items: {[item['standard_name'] for item in get_all_food_items(household_id='household-2')]}")
+    print(f"default items: {[item['standard_name'] for item in get_all_food_items()]}")
@@ -0,0 +1,286 @@
+# src/database/inventory_archive.py
+
+import os
+import sys
+import time
+import json
+import sqlite3
+import logging
+import threading
+import statistics
+from datetime import date, datetime, timedelta
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import span, traced, inc, configure_logging
+from src.database import db_manager
+from src.database.shard_router import BUSY_TIMEOUT_MS
+
+try:
+    from src.config import ARCHIVE_RETENTION_DAYS # 消費済み・廃棄済みの行を food_items に残す日数 (在庫中でなくなってから)
+except ImportError:
+    ARCHIVE_RETENTION_DAYS = 30
+
+try:
+    from src.config import ARCHIVE_BATCH_SIZE # 1トランザクションで移す行数 (書き込みロックを短く保つ)
+except ImportError:
+    ARCHIVE_BATCH_SIZE = 5000
+
+try:
+    from src.config import ARCHIVE_VACUUM_PAGES # incremental_vacuum 1回で返すページ数
+except ImportError:
+    ARCHIVE_VACUUM_PAGES = 2000
+
+try:
+    from src.config import ARCHIVE_VACUUM_MAX_STEPS # 1回の実行でシャードごとに行う incremental_vacuum の上限回数
+except ImportError:
+    ARCHIVE_VACUUM_MAX_STEPS = 50
+
+try:
+    from src.config import ARCHIVE_VACUUM_MAX_SECONDS # シャードごとの incremental_vacuum を打ち切る秒数 (残りは次回)
+except ImportError:
+    ARCHIVE_VACUUM_MAX_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------
+# 消費済み・廃棄済みの行のアーカイブ
+# ----------------------------------------------------
+# mark_as_consumed_or_discarded は status を変えるだけなので、food_items は在庫中でない行で増え続け、
+# status = 'active' の問い合わせもインデックスとページキャッシュを死んだ行と分け合うことになる。
+# 在庫中でなくなってから ARCHIVE_RETENTION_DAYS 日を過ぎた行を、シャードごとに ARCHIVE_BATCH_SIZE 行ずつの
+# トランザクションで food_items_archive に移し、空いたページを PRAGMA incremental_vacuum でファイルから返す。
+#   - 在庫中でなくなった時刻は、イベントログで status が 'active' から変わった最後のイベントの occurred_at。
+#     イベントのない行 (シャーディング前のDBから取り込んだ行など) は最終確認日 (last_seen_date) を使う。
+#     在庫中でなくなるのは最後に確認された後なので、最終確認日が基準日より前の行だけを索引で探し、
+#     その中で在庫中でなくなった時刻も基準日より前の行を移す。
+#   - 履歴の問い合わせ (status='all' や 'consumed') は food_items_history ビューでアーカイブも含めて読む。
+#   - アーカイブはイベントとして記録しない (在庫の論理的な状態は変わらないため)。
+#   - incremental_vacuum は専用の (自動コミットの) 接続で行い、1回の実行でのステップ数と時間に上限を設ける。
+#   - auto_vacuum=INCREMENTAL は新しいシャードでのみ有効 (shard_router._connect で設定)。既存のシャードは --convert-vacuum で一度だけ
+#     VACUUM して変換する (シャード全体を書き直すため、書き込みの少ない時間に行うこと)。
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+# 行 f が在庫中でなくなった時刻 (status が 'active' から変わった最後のイベント)。
+# 'imported' (シャーディング前のDBからの取り込み) の時刻は在庫中でなくなった時刻ではないので数えず、最終確認日を使う
+INACTIVE_SINCE_SQL = '''
+    SELECT MAX(e.occurred_at) FROM inventory_events e
+    WHERE e.household_id = f.household_id AND e.item_id = f.id AND e.event_type != 'imported'
+      AND json_extract(e.after_image, '$.status') != 'active'
+      AND (e.before_image IS NULL OR json_extract(e.before_image, '$.status') = 'active')
+'''
+
+
+def _archive_batch(conn, cutoff, batch_size, archived_at, after=None):
+    """
+    最終確認日が cutoff より前の在庫中でない行を、(最終確認日, rowid) の順に after の次から最大 batch_size 行調べ、
+    在庫中でなくなった時刻も cutoff より前の行をアーカイブに移す。
+
+    Returns:
+        tuple: (移した行数, 調べた行数, 次に渡す after)。保持期間中で残した行は、次の呼び出しで調べ直さない。
+    """
+    columns = ', '.join(('id', 'household_id') + db_manager.FOOD_ITEM_COLUMNS[1:])
+    position = '' if after is None else 'AND (f.last_seen_date, f.rowid) > (?, ?)'
+    with conn:
+        candidates = conn.execute(f'''
+            SELECT f.rowid, f.last_seen_date, COALESCE(({INACTIVE_SINCE_SQL}), f.last_seen_date)
+            FROM food_items f INDEXED BY idx_food_items_inactive_last_seen
+            WHERE f.status != 'active' AND f.last_seen_date < ? {position}
+            ORDER BY f.last_seen_date, f.rowid LIMIT ?
+        ''', (cutoff, *(after or ()), batch_size)).fetchall()
+        if not candidates:
+            return 0, 0, after
+        after = (candidates[-1][1], candidates[-1][0])
+        # occurred_at は日時、cutoff は日付の ISO 文字列なので、文字列の比較で cutoff の日より前かが分かる
+        rowids = [rowid for rowid, _, inactive_since in candidates if inactive_since < cutoff]
+        if not rowids:
+            return 0, len(candidates), after
+        selected = json.dumps(rowids)
+        conn.execute(f'''
+            INSERT OR REPLACE INTO food_items_archive ({columns}, archived_at)
+            SELECT {columns}, ? FROM food_items WHERE rowid IN (SELECT value FROM json_each(?))
+        ''', (archived_at, selected))
+        conn.execute('DELETE FROM food_items WHERE rowid IN (SELECT value FROM json_each(?))', (selected,))
+    return len(rowids), len(candidates), after
+
+
+def incremental_vacuum(db_path, pages_per_step=ARCHIVE_VACUUM_PAGES, max_steps=ARCHIVE_VACUUM_MAX_STEPS,
+                       max_seconds=ARCHIVE_VACUUM_MAX_SECONDS):
+    """
+    シャードのファイルの空きページを pages_per_step ずつ返す (1回ごとにロックを手放す)。
+    executescript は開いているトランザクションをコミットしてしまうため、キャッシュした接続は使わず、
+    専用の自動コミットの接続で行う。max_steps 回か max_seconds 秒で打ち切り、残りは次回に回す
+    (書き込みの多いシャードで毎回ロックを待っても、アーカイバが抜けられるように)。
+    auto_vacuum=INCREMENTAL でないシャードでは何もしない。返したページ数を返す
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return 0
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        released = 0
+        for _ in range(max_steps):
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if free_pages == 0 or (deadline is not None and time.monotonic() >= deadline):
+                break
+            step = min(free_pages, pages_per_step)
+            # execute() は incremental_vacuum を1ステップ (1ページ) しか進めないため、最後まで実行する executescript を使う
+            conn.executescript(f'PRAGMA incremental_vacuum({step});')
+            released += step
+        return released
+    finally:
+        conn.close()
+
+
+def convert_to_incremental_vacuum(conn):
+    """既存のシャードを auto_vacuum=INCREMENTAL に変換する (VACUUM でファイル全体を書き直す)"""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return False
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
+
+
+def _timed_median(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def shard_report(conn):
+    """
+    シャードのファイルサイズ・行数と、在庫中の行を読む問い合わせの所要時間。
+    問い合わせは最も行数の多い世帯の在庫 (display_inventory / レシピ推薦と同じ形) で計測する。
+    """
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    report = {
+        'file_mb': conn.execute('PRAGMA page_count').fetchone()[0] * page_size / 1024 / 1024,
+        'free_mb': conn.execute('PRAGMA freelist_count').fetchone()[0] * page_size / 1024 / 1024,
+        'active_rows': conn.execute("SELECT COUNT(*) FROM food_items WHERE status = 'active'").fetchone()[0],
+        'inactive_rows': conn.execute("SELECT COUNT(*) FROM food_items WHERE status != 'active'").fetchone()[0],
+        'archived_rows': conn.execute('SELECT COUNT(*) FROM food_items_archive').fetchone()[0],
+        'active_query_ms': None,
+    }
+    largest = conn.execute('SELECT household_id, COUNT(*) AS n FROM food_items GROUP BY household_id '
+                           'ORDER BY n DESC LIMIT 1').fetchone()
+    if largest is not None:
+        sql, params = db_manager._build_filtered_select(['id', 'standard_name', 'quantity', 'detected_by'],
+                                                        'active', None, largest['household_id'])
+        report['active_query_ms'] = _timed_median(lambda: conn.execute(sql, params).fetchall(), repeat=3) * 1000
+    return report
+
+
+@traced('archive.run')
+def archive_inactive_items(retention_days=ARCHIVE_RETENTION_DAYS, batch_size=ARCHIVE_BATCH_SIZE, router=None,
+                           vacuum=True, convert_vacuum=False, report=True, today=None,
+                           vacuum_max_steps=ARCHIVE_VACUUM_MAX_STEPS, vacuum_max_seconds=ARCHIVE_VACUUM_MAX_SECONDS):
+    """
+    全シャードで、保持期間を過ぎた在庫中でない行をアーカイブに移し、空いたページを返す。
+
+    Args:
+        retention_days (int): 在庫中でなくなってからこの日数を過ぎた行を移す。
+        batch_size (int): 1トランザクションで移す行数。
+        router (ShardRouter): Noneの場合は db_manager のルーター。
+        vacuum (bool): 移した後に incremental_vacuum を行うか。
+        vacuum_max_steps (int), vacuum_max_seconds (float): シャードごとの incremental_vacuum の上限。
+        convert_vacuum (bool): auto_vacuum=INCREMENTAL でないシャードを VACUUM で変換するか。
+        report (bool): 前後のサイズと問い合わせ時間を計測するか。
+        today (date): 基準日。Noneの場合は今日。
+
+    Returns:
+        dict: shard_id -> {'archived': 行数, 'released_pages': ページ数, 'before': {...}, 'after': {...}}
+    """
+    router = router or db_manager.get_router()
+    cutoff = ((today or date.today()) - timedelta(days=retention_days)).isoformat()
+    archived_at = datetime.now().isoformat(timespec='seconds')
+    results = {}
+    for shard_id in router.existing_shards():
+        conn = router.shard_connection(shard_id)
+        result = {'archived': 0, 'released_pages': 0}
+        if report:
+            result['before'] = shard_report(conn)
+        with span('archive.shard', shard=shard_id):
+            after = None
+            while True:
+                moved, scanned, after = _archive_batch(conn, cutoff, batch_size, archived_at, after)
+                result['archived'] += moved
+                if scanned < batch_size:
+                    break
+            if convert_vacuum and convert_to_incremental_vacuum(conn):
+                logger.info("Shard %d converted to auto_vacuum=INCREMENTAL.", shard_id)
+            if vacuum:
+                result['released_pages'] = incremental_vacuum(router.shard_path(shard_id),
+                                                              max_steps=vacuum_max_steps,
+                                                              max_seconds=vacuum_max_seconds)
+        if report:
+            result['after'] = shard_report(conn)
+        inc('archive_rows_total', result['archived'], shard=shard_id)
+        logger.info("Shard %d: archived %d rows, released %d pages.", shard_id, result['archived'],
+                    result['released_pages'])
+        results[shard_id] = result
+    return results
+
+
+def start_background_archiver(interval_seconds=24 * 3600, **kwargs):
+    """
+    archive_inactive_items を interval_seconds ごとに実行するデーモンスレッドを開始する。
+    戻り値の Event を set すると停止する。kwargs は archive_inactive_items に渡す。
+    """
+    stop = threading.Event()
+    kwargs.setdefault('report', False)
+
+    def loop():
+        while not stop.is_set():
+            try:
+                archive_inactive_items(**kwargs)
+            except Exception as e:
+                logger.error("Archival failed: %s", e)
+            stop.wait(interval_seconds)
+        db_manager.get_router().close()
+
+    threading.Thread(target=loop, name='inventory-archiver', daemon=True).start()
+    return stop
+
+
+def print_archive_report(results):
+    print(f"{'Shard':<6} {'Archived':>9} {'File MB':>17} {'Inactive rows':>17} {'Active query ms':>19}")
+    print("-" * 74)
+    for shard_id, r in results.items():
+        before, after = r.get('before'), r.get('after')
+        if before is None:
+            print(f"{shard_id:<6} {r['archived']:>9}")
+            continue
+        fmt_ms = lambda v: f"{v:.2f}" if v is not None else '-'
+        print(f"{shard_id:<6} {r['archived']:>9} {before['file_mb']:>8.1f} -> {after['file_mb']:<6.1f} "
+              f"{before['inactive_rows']:>8} -> {after['inactive_rows']:<6} "
+              f"{fmt_ms(before['active_query_ms']):>8} -> {fmt_ms(after['active_query_ms']):<8}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Archive consumed/discarded inventory rows and compact the shards.')
+    parser.add_argument('--retention-days', type=int, default=ARCHIVE_RETENTION_DAYS)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--no-vacuum', action='store_true', help='incremental_vacuum を行わない')
+    parser.add_argument('--convert-vacuum', action='store_true',
+                        help='既存のシャードを auto_vacuum=INCREMENTAL に変換する (VACUUM を伴う)')
+    parser.add_argument('--interval', type=float, default=None, help='指定した秒数ごとに繰り返し実行する')
+    args = parser.parse_args()
+
+    configure_logging()
+    while True:
+        results = archive_inactive_items(retention_days=args.retention_days, batch_size=args.batch_size,
+                                         vacuum=not args.no_vacuum, convert_vacuum=args.convert_vacuum)
+        print_archive_report(results)
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
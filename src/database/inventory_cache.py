@@ -0,0 +1,302 @@
+# src/database/inventory_cache.py
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import inc
+
+try:
+    from src.config import INVENTORY_CACHE_MAX_HOUSEHOLDS # キャッシュする世帯数の上限 (LRUで追い出す。0で無効)
+except ImportError:
+    INVENTORY_CACHE_MAX_HOUSEHOLDS = 1024
+
+try:
+    from src.config import INVENTORY_CACHE_MAX_ROWS # これより多く在庫を持つ世帯はキャッシュせず毎回DBを読む
+except ImportError:
+    INVENTORY_CACHE_MAX_ROWS = 5000
+
+try:
+    from src.config import INVENTORY_CACHE_TTL_SECONDS # 他のプロセスの書き込みを取り込むまでの最大の秒数 (Noneで無期限)
+except ImportError:
+    INVENTORY_CACHE_TTL_SECONDS = 60
+
+# ----------------------------------------------------
+# 世帯ごとの在庫中の食材のキャッシュ (プロセス内)
+# ----------------------------------------------------
+# 在庫の表示・冷蔵庫スキャン・レシート取り込み・レシピ推薦は、同じ世帯の在庫中の行を何度も読むが、
+# 変わるのは取り込みのときだけ。世帯の status = 'active' の行を、ID・標準名・YOLOクラスの索引付きで保持する。
+#   - 行は列名でも位置でも引けるタプル (sqlite3.Row と同じ使い方ができる) で持ち、辞書より小さくする。
+#   - db_manager の書き込みは、コミットした後に変更後の行 (イベントログに記録するのと同じイメージ) で
+#     キャッシュを行単位で更新する。世帯を丸ごと読み直すことはしない。
+#   - 各世帯の在庫 (HouseholdInventory) は一度作ったら変更しない。書き込みは変更後の行で新しい在庫を作り、
+#     ロックの中で差し替える (copy-on-write)。読み出し側はロックの外で索引を使っても、途中の状態を見ない。
+#   - 読み込みと書き込みが競合した場合に古い在庫を載せないよう、読み込み中の世帯に印を置き、
+#     書き込みがあれば印を外す。読み終えたときに自分の印が残っていなければキャッシュに載せない。
+#   - 同じシャードに書き込む別のプロセスの変更は分からないため、INVENTORY_CACHE_TTL_SECONDS で読み直す。
+
+CACHED_COLUMNS = ('id', 'household_id', 'standard_name', 'yolo_class', 'quantity', 'unit', 'purchase_date',
+                  'expiry_date', 'detected_by', 'last_seen_date', 'status', 'notes', 'expiry_day')
+
+_row_classes = {}
+
+
+def row_class(columns):
+    """列名でも位置でも引ける、指定した列のタプルの型 (列の組ごとに1つ作って使い回す)"""
+    columns = tuple(columns)
+    cls = _row_classes.get(columns)
+    if cls is None:
+        index = {name: i for i, name in enumerate(columns)}
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                key = index[key]
+            return tuple.__getitem__(self, key)
+
+        cls = type('InventoryRow', (tuple,), {
+            '__slots__': (),
+            '__getitem__': __getitem__,
+            'keys': lambda self: list(columns),
+            '__repr__': lambda self: f"InventoryRow({', '.join(f'{c}={v!r}' for c, v in zip(columns, self))})",
+        })
+        _row_classes[columns] = cls
+    return cls
+
+
+InventoryRow = row_class(CACHED_COLUMNS)
+_STANDARD_NAME = CACHED_COLUMNS.index('standard_name')
+_YOLO_CLASS = CACHED_COLUMNS.index('yolo_class')
+_QUANTITY = CACHED_COLUMNS.index('quantity')
+_DETECTED_BY = CACHED_COLUMNS.index('detected_by')
+
+
+class HouseholdInventory:
+    """1世帯の在庫中の行と、標準名・YOLOクラスの索引 (作った後は変更しない。変更は with_changes で新しく作る)"""
+
+    __slots__ = ('by_id', 'by_name', 'by_class', 'loaded_at', '_ordered')
+    oversized = False
+
+    def __init__(self, rows, loaded_at=None):
+        self.by_id = {}
+        self.by_name = {}
+        self.by_class = {}
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+        self._ordered = None
+        for row in rows:
+            self._add(InventoryRow(row))
+
+    def __len__(self):
+        return len(self.by_id)
+
+    @staticmethod
+    def _own_ids(index, key, copied):
+        """索引の key の集合を、元の在庫と共有しないよう必要なら複製して返す"""
+        ids = index.get(key)
+        if copied is None:
+            if ids is None:
+                ids = index[key] = set()
+            return ids
+        if ids is None or id(ids) not in copied:
+            ids = index[key] = set(ids or ())
+            copied.add(id(ids))
+        return ids
+
+    def _add(self, row, copied=None):
+        self.by_id[row[0]] = row
+        self._own_ids(self.by_name, row[_STANDARD_NAME], copied).add(row[0])
+        self._own_ids(self.by_class, row[_YOLO_CLASS], copied).add(row[0])
+
+    def _remove(self, item_id, copied=None):
+        row = self.by_id.pop(item_id, None)
+        if row is None:
+            return
+        for index, key in ((self.by_name, row[_STANDARD_NAME]), (self.by_class, row[_YOLO_CLASS])):
+            ids = self._own_ids(index, key, copied)
+            ids.discard(item_id)
+            if not ids:
+                del index[key]
+
+    def with_changes(self, changes):
+        """
+        変更を反映した新しい在庫を返す (self は変更しない)。
+
+        Args:
+            changes (list): (item_id, 変更後の行の辞書 or None) のリスト。None は削除・在庫でなくなった場合。
+        """
+        new = HouseholdInventory((), self.loaded_at)
+        new.by_id = dict(self.by_id)
+        new.by_name = dict(self.by_name)
+        new.by_class = dict(self.by_class)
+        copied = set() # 新しい在庫用に複製済みの索引の集合 (id で見分ける)
+        for item_id, after in changes:
+            new._remove(item_id, copied)
+            if after is not None and after.get('status') == 'active':
+                row = [after.get(c) for c in CACHED_COLUMNS]
+                if row[_QUANTITY] is not None:
+                    row[_QUANTITY] = float(row[_QUANTITY]) # quantity は REAL 列 (DBから読んだ行と同じ型にする)
+                new._add(InventoryRow(row), copied)
+        return new
+
+    def rows(self, detected_by=None):
+        """在庫中の行を標準名順 (同名はID順) に返す"""
+        if self._ordered is None:
+            self._ordered = sorted(self.by_id.values(), key=lambda r: (r[_STANDARD_NAME], r[0]))
+        if detected_by is None:
+            return self._ordered
+        return [row for row in self._ordered if row[_DETECTED_BY] == detected_by]
+
+    def get(self, item_id):
+        return self.by_id.get(item_id)
+
+    def by_standard_name(self, standard_name):
+        return sorted((self.by_id[i] for i in self.by_name.get(standard_name, ())), key=lambda r: r[0])
+
+    def by_yolo_class(self, yolo_class):
+        return sorted((self.by_id[i] for i in self.by_class.get(yolo_class, ())), key=lambda r: r[0])
+
+    def standard_names(self, detected_by=None):
+        if detected_by is None:
+            return sorted(self.by_name)
+        return sorted({row[_STANDARD_NAME] for row in self.by_id.values() if row[_DETECTED_BY] == detected_by})
+
+
+class _Oversized:
+    """max_rows より多く在庫を持つ世帯の印 (TTLの間はDBを直接読むよう呼び出し側に伝える)"""
+
+    __slots__ = ('loaded_at',)
+    oversized = True
+
+    def __init__(self, loaded_at):
+        self.loaded_at = loaded_at
+
+    def __len__(self):
+        return 0
+
+    def with_changes(self, changes):
+        return self
+
+
+class InventoryCache:
+    """
+    世帯ID -> HouseholdInventory の LRU キャッシュ (スレッドセーフ)。
+
+    Args:
+        max_households (int): 保持する世帯数の上限。超えたら最も長く使われていない世帯を追い出す。0で無効。
+        max_rows (int): 在庫中の行がこれより多い世帯はキャッシュしない。
+        ttl_seconds (float): 読み込んでからこの秒数を過ぎた世帯は読み直す。Noneの場合は無期限。
+    """
+
+    def __init__(self, max_households=INVENTORY_CACHE_MAX_HOUSEHOLDS, max_rows=INVENTORY_CACHE_MAX_ROWS,
+                 ttl_seconds=INVENTORY_CACHE_TTL_SECONDS):
+        self.max_households = max_households
+        self.max_rows = max_rows
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._loads = {} # 読み込み中の世帯ID -> 読み込みの印 (読み込みの間に書き込みがあれば外す)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0, 'updates': 0, 'invalidations': 0}
+
+    @property
+    def enabled(self):
+        return self.max_households > 0
+
+    def _count(self, name, value=1):
+        self._counters[name] += value
+        inc(f'inventory_cache_{name}_total', value)
+
+    def get(self, household_id, loader):
+        """
+        世帯の在庫を返す。キャッシュになければ loader() (CACHED_COLUMNS の順の行のリスト) で読み込む。
+        在庫が max_rows より多い世帯やキャッシュが無効な場合は None を返す (呼び出し側がDBを直接読む)。
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(household_id)
+            if entry is not None and (self.ttl_seconds is None
+                                      or time.monotonic() - entry.loaded_at <= self.ttl_seconds):
+                self._entries.move_to_end(household_id)
+                if entry.oversized:
+                    self._count('bypassed')
+                    return None
+                self._count('hits')
+                return entry
+            self._entries.pop(household_id, None)
+            token = self._loads[household_id] = object()
+            self._count('misses')
+
+        loaded_at = time.monotonic()
+        try:
+            rows = loader(self.max_rows + 1)
+        except BaseException:
+            with self._lock:
+                if self._loads.get(household_id) is token:
+                    del self._loads[household_id]
+            raise
+        entry = _Oversized(loaded_at) if len(rows) > self.max_rows else HouseholdInventory(rows, loaded_at)
+        with self._lock:
+            # 読み込みの間に書き込みがあった (または別の読み込みが始まった) 場合は載せない
+            if self._loads.get(household_id) is token:
+                del self._loads[household_id]
+                self._entries[household_id] = entry
+                self._entries.move_to_end(household_id)
+                while len(self._entries) > self.max_households:
+                    self._entries.popitem(last=False)
+                    self._count('evictions')
+            if entry.oversized:
+                self._count('bypassed')
+                return None
+        return entry
+
+    def peek(self, household_id):
+        """LRUの順序やカウンタを変えずにキャッシュ済みの在庫を返す (なければ None)"""
+        with self._lock:
+            entry = self._entries.get(household_id)
+            return None if entry is None or entry.oversized else entry
+
+    def apply(self, household_id, changes):
+        """
+        コミット済みの変更をキャッシュに反映する。
+
+        Args:
+            changes (list): (item_id, 変更後の行の辞書 or None) のリスト。
+        """
+        with self._lock:
+            self._loads.pop(household_id, None)
+            entry = self._entries.get(household_id)
+            if entry is None:
+                return
+            entry = entry.with_changes(changes)
+            self._entries[household_id] = entry if len(entry) <= self.max_rows else _Oversized(entry.loaded_at)
+            self._count('updates', len(changes))
+
+    def invalidate(self, household_id=None):
+        """世帯 (Noneの場合は全世帯) をキャッシュから外す"""
+        with self._lock:
+            if household_id is None:
+                self._loads.clear()
+                self._entries.clear()
+            else:
+                self._loads.pop(household_id, None)
+                self._entries.pop(household_id, None)
+            self._count('invalidations')
+
+    def stats(self):
+        """ヒット・ミスなどのカウンタと、保持している世帯数・行数"""
+        with self._lock:
+            total = self._counters['hits'] + self._counters['misses']
+            return {**self._counters, 'households': len(self._entries),
+                    'rows': sum(len(entry) for entry in self._entries.values()),
+                    'hit_rate': self._counters['hits'] / total if total else 0.0}
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self._counters:
+                self._counters[name] = 0
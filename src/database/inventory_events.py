@@ -0,0 +1,376 @@
+# src/database/inventory_events.py
+
+import os
+import sys
+import json
+import uuid
+import threading
+import contextlib
+from datetime import datetime
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from src.config import INVENTORY_CHECKPOINT_INTERVAL # このイベント数ごとに在庫のスナップショットを取る
+except ImportError:
+    INVENTORY_CHECKPOINT_INTERVAL = 1000
+
+try:
+    from src.config import INVENTORY_CHECKPOINT_KEEP # 世帯ごとに残すチェックポイントの数
+except ImportError:
+    INVENTORY_CHECKPOINT_KEEP = 10
+
+# ----------------------------------------------------
+# 追記専用の在庫イベントログ
+# ----------------------------------------------------
+# food_items は「現在の状態」を実体化したテーブルで、行を書き換えるたびに
+# 変更前後の行イメージ (JSON) を inventory_events に同じトランザクションで追記する。
+#   - バッチID: 1回の取り込み (冷蔵庫スキャン、レシート1枚) で発生したイベントをまとめるID。
+#               undo_batch() で取り込み全体を取り消せる。
+#   - チェックポイント: INVENTORY_CHECKPOINT_INTERVAL イベントごとに在庫全体のスナップショットを保存する。
+#               過去の任意の時点の在庫は、直前のチェックポイントから変更後イメージを再生して復元する。
+#               スナップショットは food_items_history (在庫中の行 + アーカイブ済みの行) から取る。
+#               アーカイブはイベントを記録せずに行を移すので、food_items だけを写すと移した行が復元から消える。
+# イベントは削除しないので、古いチェックポイントを消しても最初から再生すれば復元できる。
+# そのため在庫の行は必ずイベントから始まる (イベントなしで入れた行は record_untracked_rows で 'imported' を記録する)。
+# イベントとチェックポイントのIDは世帯ごとの連番 (household_sequences) なので、
+# 世帯をシャード間で移してもIDは変わらない。
+
+EVENT_SEQUENCE = 'event'
+CHECKPOINT_SEQUENCE = 'checkpoint'
+UNDO_BATCH_PREFIX = 'undo:'
+
+_local = threading.local()
+
+
+class UndoConflictError(RuntimeError):
+    """取り消すバッチの後に、同じ食材が別のバッチで変更されている"""
+
+
+def init_event_schema(conn):
+    """イベントログ・チェックポイント・世帯ごとの連番のテーブルを作る"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS household_sequences (
+            household_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (household_id, name)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_events (
+            household_id TEXT NOT NULL,
+            event_id INTEGER NOT NULL,
+            batch_id TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            occurred_at TEXT NOT NULL,
+            before_image TEXT,
+            after_image TEXT,
+            PRIMARY KEY (household_id, event_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_inventory_events_batch ON inventory_events (household_id, batch_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_inventory_events_item ON inventory_events (household_id, item_id, event_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_checkpoints (
+            household_id TEXT NOT NULL,
+            checkpoint_id INTEGER NOT NULL,
+            last_event_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            item_count INTEGER NOT NULL,
+            PRIMARY KEY (household_id, checkpoint_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_checkpoint_rows (
+            household_id TEXT NOT NULL,
+            checkpoint_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            image TEXT NOT NULL,
+            PRIMARY KEY (household_id, checkpoint_id, item_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def next_ids(conn, household_id, name, count=1):
+    """
+    世帯ごとの連番を count 個確保し、最初の値を返す。書き込みトランザクションの中で呼ぶこと。
+    """
+    conn.execute('''
+        INSERT INTO household_sequences (household_id, name, value) VALUES (?, ?, ?)
+        ON CONFLICT (household_id, name) DO UPDATE SET value = value + excluded.value
+    ''', (household_id, name, count))
+    value = conn.execute('SELECT value FROM household_sequences WHERE household_id = ? AND name = ?',
+                         (household_id, name)).fetchone()[0]
+    return value - count + 1
+
+
+def sync_sequence(conn, household_id, name, table, column):
+    """連番を table.column の最大値まで進める（既存の行を取り込んだ後に使う）"""
+    max_value = conn.execute(f'SELECT MAX({column}) FROM {table} WHERE household_id = ?',
+                             (household_id,)).fetchone()[0] or 0
+    conn.execute('''
+        INSERT INTO household_sequences (household_id, name, value) VALUES (?, ?, ?)
+        ON CONFLICT (household_id, name) DO UPDATE SET value = MAX(value, excluded.value)
+    ''', (household_id, name, max_value))
+
+
+# --- バッチ ---
+
+def new_batch_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_batch_id():
+    """event_batch() の中であればそのバッチID、外であればNone"""
+    return getattr(_local, 'batch_id', None)
+
+
+@contextlib.contextmanager
+def event_batch(batch_id=None):
+    """
+    このブロック内の在庫の変更を1つのバッチにまとめる（入れ子の場合は外側のバッチを使う）。
+
+        with event_batch() as batch_id:
+            process_receipt_image(path)
+        undo_batch(batch_id)
+    """
+    outer = current_batch_id()
+    if outer is not None:
+        yield outer
+        return
+    _local.batch_id = batch_id or new_batch_id()
+    try:
+        yield _local.batch_id
+    finally:
+        _local.batch_id = None
+
+
+# --- 記録 ---
+
+def row_image(conn, household_id, item_id):
+    """food_items の1行を辞書で返す（存在しなければNone）"""
+    row = conn.execute('SELECT * FROM food_items WHERE household_id = ? AND id = ?', (household_id, item_id)).fetchone()
+    return dict(row) if row is not None else None
+
+
+def record_events(conn, household_id, events, batch_id=None):
+    """
+    イベントを追記する。在庫の書き込みと同じトランザクションの中で呼ぶこと。
+
+    Args:
+        events (list): (item_id, event_type, 変更前の行 or None, 変更後の行 or None) のリスト。
+        batch_id (str): Noneの場合は current_batch_id()、それもなければ新しいバッチID。
+
+    Returns:
+        str: 使用したバッチID
+    """
+    batch_id = batch_id or current_batch_id() or new_batch_id()
+    if not events:
+        return batch_id
+    first_id = next_ids(conn, household_id, EVENT_SEQUENCE, len(events))
+    occurred_at = datetime.now().isoformat(timespec='microseconds')
+    conn.executemany('''
+        INSERT INTO inventory_events (household_id, event_id, batch_id, item_id, event_type, occurred_at,
+                                      before_image, after_image)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(household_id, first_id + i, batch_id, item_id, event_type, occurred_at,
+           json.dumps(before, ensure_ascii=False) if before is not None else None,
+           json.dumps(after, ensure_ascii=False) if after is not None else None)
+          for i, (item_id, event_type, before, after) in enumerate(events)])
+    maybe_checkpoint(conn, household_id, first_id + len(events) - 1)
+    return batch_id
+
+
+def record_untracked_rows(conn, household_id, event_type='imported'):
+    """
+    イベントが1件もない food_items の行 (シャーディング前のDBから取り込んだ行など) に、
+    変更後イメージだけのイベントを記録する。書き込みトランザクションの中で呼ぶこと。
+
+    Returns:
+        int: イベントを記録した行数
+    """
+    rows = conn.execute('''
+        SELECT * FROM food_items f
+        WHERE f.household_id = ? AND NOT EXISTS (
+            SELECT 1 FROM inventory_events e WHERE e.household_id = f.household_id AND e.item_id = f.id)
+        ORDER BY f.id
+    ''', (household_id,)).fetchall()
+    record_events(conn, household_id, [(row['id'], event_type, None, dict(row)) for row in rows])
+    return len(rows)
+
+
+# --- チェックポイント ---
+
+def _last_checkpoint(conn, household_id, before=None):
+    sql = 'SELECT checkpoint_id, last_event_id, created_at, item_count FROM inventory_checkpoints WHERE household_id = ?'
+    params = [household_id]
+    if before is not None:
+        sql += ' AND created_at <= ?'
+        params.append(before)
+    return conn.execute(sql + ' ORDER BY checkpoint_id DESC LIMIT 1', params).fetchone()
+
+
+def maybe_checkpoint(conn, household_id, last_event_id, interval=INVENTORY_CHECKPOINT_INTERVAL):
+    """
+    前回のチェックポイントから interval イベント以上たまっていればチェックポイントを作る。
+    在庫が大きい世帯では、前回のスナップショットの行数以上のイベントがたまるまで待つ
+    (スナップショットのコストをイベント1件あたり定数に抑えるため)。
+    """
+    last = _last_checkpoint(conn, household_id)
+    threshold = max(interval, last['item_count'] if last else 0)
+    if last_event_id - (last['last_event_id'] if last else 0) >= threshold:
+        create_checkpoint(conn, household_id)
+
+
+def create_checkpoint(conn, household_id, keep=INVENTORY_CHECKPOINT_KEEP):
+    """
+    現在の food_items_history (アーカイブ済みの行を含む) をスナップショットとして保存し、
+    古いチェックポイントを keep 個まで削除する。
+    書き込みトランザクションの中で呼ぶこと。
+
+    Returns:
+        int: チェックポイントID
+    """
+    last_event_id = conn.execute('SELECT value FROM household_sequences WHERE household_id = ? AND name = ?',
+                                 (household_id, EVENT_SEQUENCE)).fetchone()
+    last_event_id = last_event_id[0] if last_event_id else 0
+    checkpoint_id = next_ids(conn, household_id, CHECKPOINT_SEQUENCE)
+    rows = conn.execute('SELECT * FROM food_items_history WHERE household_id = ?', (household_id,)).fetchall()
+    images = []
+    for row in rows:
+        image = dict(row)
+        del image['archived_at'] # 行イメージは food_items と同じ列にそろえる
+        images.append((household_id, checkpoint_id, row['id'], json.dumps(image, ensure_ascii=False)))
+    conn.executemany('''
+        INSERT INTO inventory_checkpoint_rows (household_id, checkpoint_id, item_id, image) VALUES (?, ?, ?, ?)
+    ''', images)
+    conn.execute('''
+        INSERT INTO inventory_checkpoints (household_id, checkpoint_id, last_event_id, created_at, item_count)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (household_id, checkpoint_id, last_event_id, datetime.now().isoformat(timespec='microseconds'), len(rows)))
+
+    # 古いチェックポイントを削除する（イベントは残るので、それより前の時点も最初から再生すれば復元できる）
+    stale = conn.execute('''
+        SELECT checkpoint_id FROM inventory_checkpoints WHERE household_id = ?
+        ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?
+    ''', (household_id, keep)).fetchall()
+    for row in stale:
+        conn.execute('DELETE FROM inventory_checkpoint_rows WHERE household_id = ? AND checkpoint_id = ?',
+                     (household_id, row['checkpoint_id']))
+        conn.execute('DELETE FROM inventory_checkpoints WHERE household_id = ? AND checkpoint_id = ?',
+                     (household_id, row['checkpoint_id']))
+    return checkpoint_id
+
+
+# --- 復元・取り消し ---
+
+def reconstruct_inventory(conn, household_id, at):
+    """
+    指定時点の在庫 (全ステータスの行) を復元する。
+    at 以前の最新のチェックポイントから、それ以降 at までのイベントの変更後イメージを再生する。
+
+    Args:
+        at (datetime or str): 復元する時点 (ISO形式の文字列も可)。
+
+    Returns:
+        list: 行の辞書のリスト (id 順)
+    """
+    at = at.isoformat(timespec='microseconds') if isinstance(at, datetime) else at
+    checkpoint = _last_checkpoint(conn, household_id, before=at)
+    state = {}
+    last_event_id = 0
+    if checkpoint is not None:
+        last_event_id = checkpoint['last_event_id']
+        for row in conn.execute('SELECT item_id, image FROM inventory_checkpoint_rows '
+                                'WHERE household_id = ? AND checkpoint_id = ?',
+                                (household_id, checkpoint['checkpoint_id'])):
+            state[row['item_id']] = json.loads(row['image'])
+
+    events = conn.execute('''
+        SELECT item_id, after_image FROM inventory_events
+        WHERE household_id = ? AND event_id > ? AND occurred_at <= ?
+        ORDER BY event_id
+    ''', (household_id, last_event_id, at))
+    for row in events:
+        if row['after_image'] is None:
+            state.pop(row['item_id'], None)
+        else:
+            state[row['item_id']] = json.loads(row['after_image'])
+    return [state[item_id] for item_id in sorted(state)]
+
+
+def _restore_image(conn, household_id, item_id, image):
+    if image is None:
+        conn.execute('DELETE FROM food_items WHERE household_id = ? AND id = ?', (household_id, item_id))
+        return
+    columns = list(image)
+    conn.execute(f"INSERT OR REPLACE INTO food_items ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                 [image[c] for c in columns])
+
+
+def undo_batch(conn, household_id, batch_id, force=False):
+    """
+    バッチの変更を、変更前イメージを逆順に書き戻して取り消す。取り消し自体もイベントとして記録する
+    (バッチIDは 'undo:<batch_id>')。書き込みトランザクションの中で呼ぶこと。
+
+    Args:
+        force (bool): バッチの後に同じ食材が別のバッチで変更されていても取り消す（その変更は失われる）。
+
+    Returns:
+        list: 元に戻した食材IDのリスト
+
+    Raises:
+        ValueError: バッチが存在しない、または取り消し済みの場合。
+        UndoConflictError: force=False で、後続のバッチが同じ食材を変更している場合。
+    """
+    events = conn.execute('''
+        SELECT event_id, item_id, before_image FROM inventory_events
+        WHERE household_id = ? AND batch_id = ? ORDER BY event_id DESC
+    ''', (household_id, batch_id)).fetchall()
+    if not events:
+        raise ValueError(f"No inventory events for batch '{batch_id}'.")
+    if conn.execute('SELECT 1 FROM inventory_events WHERE household_id = ? AND batch_id = ? LIMIT 1',
+                    (household_id, UNDO_BATCH_PREFIX + batch_id)).fetchone():
+        raise ValueError(f"Batch '{batch_id}' has already been undone.")
+
+    item_ids = sorted({row['item_id'] for row in events})
+    if not force:
+        last_event_id = events[0]['event_id']
+        placeholders = ', '.join('?' * len(item_ids))
+        later = conn.execute(f'''
+            SELECT item_id, batch_id FROM inventory_events
+            WHERE household_id = ? AND event_id > ? AND item_id IN ({placeholders})
+        ''', (household_id, last_event_id, *item_ids)).fetchall()
+        # 後続のバッチでも、取り消し済みのもの (とその取り消しイベント) は打ち消し合うので無視する
+        later_batches = {row['batch_id'] for row in later}
+        conflicts = sorted({row['item_id'] for row in later
+                            if not row['batch_id'].startswith(UNDO_BATCH_PREFIX)
+                            and UNDO_BATCH_PREFIX + row['batch_id'] not in later_batches})
+        if conflicts:
+            raise UndoConflictError(f"Items {conflicts} were changed after batch "
+                                    f"'{batch_id}'. Use force=True to undo anyway.")
+
+    current = {item_id: row_image(conn, household_id, item_id) for item_id in item_ids}
+    for row in events:
+        _restore_image(conn, household_id, row['item_id'],
+                       json.loads(row['before_image']) if row['before_image'] is not None else None)
+    record_events(conn, household_id,
+                  [(item_id, 'undone', current[item_id], row_image(conn, household_id, item_id)) for item_id in item_ids],
+                  batch_id=UNDO_BATCH_PREFIX + batch_id)
+    return item_ids
+
+
+def list_batches(conn, household_id, limit=20):
+    """最近のバッチ (新しい順): batch_id, 開始時刻, イベント数, イベント種別"""
+    rows = conn.execute('''
+        SELECT batch_id, MIN(occurred_at) AS started_at, COUNT(*) AS events,
+               GROUP_CONCAT(DISTINCT event_type) AS event_types
+        FROM inventory_events WHERE household_id = ?
+        GROUP BY batch_id ORDER BY MAX(event_id) DESC LIMIT ?
+    ''', (household_id, limit)).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,406 @@
+# src/database/inventory_export.py
+
+import os
+import sys
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import span, traced, inc, configure_logging
+from src.database import db_manager, scan_history
+from src.database.shard_router import DEFAULT_HOUSEHOLD_ID
+
+try:
+    from src.config import EXPORT_CHUNK_ROWS # エクスポートで1回に読み出して書き込む行数 (メモリ使用量の上限になる)
+except ImportError:
+    EXPORT_CHUNK_ROWS = 100_000
+
+try:
+    from src.config import IMPORT_BATCH_ROWS # インポートで1トランザクションに書き込む行数
+except ImportError:
+    IMPORT_BATCH_ROWS = 50_000
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------
+# 在庫と履歴の列指向フォーマット (Parquet / Arrow IPC) での一括エクスポート・インポート
+# ----------------------------------------------------
+# export_tables: 全シャード (または指定した世帯) のテーブルを、シャードごとに EXPORT_CHUNK_ROWS 行ずつ fetchmany で読み、
+#                RecordBatch にして1テーブル1ファイルに追記していく。メモリに載るのは1チャンク分だけ。
+#                'scan_points' は scan_series のバイト列を (世帯, クラス, scan_id, count, scanned_at) の行に展開したもの。
+#                出力は pandas.read_parquet / polars.read_parquet / pyarrow.ipc.open_file でそのまま読める。
+# import_food_items: ファイルの食材を1つの世帯に新しい行として取り込む (シード用)。IMPORT_BATCH_ROWS 行ずつ
+#                add_food_items (executemany + イベントの記録を1トランザクション) で書き込む。
+# restore_households: export_tables で HOUSEHOLD_TABLES を書き出したディレクトリから、世帯の行をIDごとそのまま
+#                書き戻す (別の環境への世帯の移行用)。連番 (household_sequences) も一緒に戻るので、以降のIDは衝突しない。
+# pyarrow は任意の依存パッケージ。ない環境ではこのモジュールの関数を呼んだときに ImportError になる。
+
+FORMATS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+FORMAT_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+# 既定で書き出すテーブル (分析用)。'all' を指定すると HOUSEHOLD_TABLES をすべて書き出す (restore_households 用)
+ANALYTICS_TABLES = ('food_items', 'food_items_archive', 'inventory_events', 'scan_points', 'consumption_forecasts')
+SCAN_POINTS = 'scan_points'
+PARQUET_COMPRESSION = 'zstd'
+
+# import_food_items で、ファイルにない列に使う値 (standard_name / yolo_class / quantity は必須)
+IMPORT_REQUIRED_COLUMNS = ('standard_name', 'yolo_class', 'quantity')
+IMPORT_DEFAULTS = {'detected_by': 'manual', 'status': 'active'}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+        import pyarrow.compute
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet/Arrow export and import (pip install pyarrow)") from e
+    return pyarrow
+
+
+def _arrow_type(pa, declared_type):
+    """SQLite の宣言型 (型アフィニティの規則) から Arrow の型を決める"""
+    declared_type = (declared_type or '').upper()
+    if 'INT' in declared_type:
+        return pa.int64()
+    if any(t in declared_type for t in ('CHAR', 'CLOB', 'TEXT')):
+        return pa.string()
+    if 'BLOB' in declared_type or not declared_type:
+        return pa.binary()
+    return pa.float64()
+
+
+def table_schema(conn, table):
+    """テーブルの列から Arrow のスキーマを作る ('scan_points' は展開後の列)"""
+    pa = _require_pyarrow()
+    if table == SCAN_POINTS:
+        return pa.schema([('household_id', pa.string()), ('yolo_class', pa.string()), ('scan_id', pa.int32()),
+                          ('count', pa.int32()), ('scanned_at', pa.int64())])
+    columns = conn.execute(f'PRAGMA table_info({table})').fetchall()
+    if not columns:
+        raise ValueError(f"Unknown table: {table}")
+    return pa.schema([(row['name'], _arrow_type(pa, row['type'])) for row in columns])
+
+
+def _record_batch(pa, schema, rows):
+    """行のタプルのリストを列ごとの配列にして RecordBatch にする"""
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                      schema=schema)
+
+
+def _scan_points_batch(pa, schema, rows):
+    """scan_series の行 (household_id, yolo_class, points) を点ごとの行に展開する"""
+    points = [scan_history.decode_points(blob) for _, _, blob in rows]
+    lengths = [len(p) for p in points]
+    merged = np.concatenate(points) if points else np.empty(0, dtype=scan_history.POINT_DTYPE)
+    return pa.RecordBatch.from_arrays([
+        pa.array(np.repeat(np.array([row[0] for row in rows], dtype=object), lengths), type=pa.string()),
+        pa.array(np.repeat(np.array([row[1] for row in rows], dtype=object), lengths), type=pa.string()),
+        pa.array(merged['scan_id']), pa.array(merged['count']), pa.array(merged['scanned_at']),
+    ], schema=schema)
+
+
+def iter_table_batches(table, household_ids=None, chunk_rows=EXPORT_CHUNK_ROWS, router=None):
+    """
+    全シャードからテーブルの行を chunk_rows 行ずつ RecordBatch として読み出すジェネレータ。
+    ディレクトリ上そのシャードに属する世帯の行だけを返す (移行の途中で残った行は含めない)。
+
+    Args:
+        table (str): HOUSEHOLD_TABLES のいずれか、または 'scan_points'。
+        household_ids (iterable): 指定した場合はその世帯だけ。
+    """
+    pa = _require_pyarrow()
+    router = router or db_manager.get_router()
+    assignments = router.households()
+    wanted = set(household_ids) if household_ids is not None else None
+    source = 'scan_series' if table == SCAN_POINTS else table
+    if source not in db_manager.HOUSEHOLD_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    schema = None
+    yielded = False
+    for shard_id in router.existing_shards():
+        conn = router.shard_connection(shard_id)
+        schema = schema or table_schema(conn, table)
+        households = [h for h, s in assignments.items() if s == shard_id and (wanted is None or h in wanted)]
+        if not households:
+            continue
+        columns = 'household_id, yolo_class, points' if table == SCAN_POINTS else ', '.join(schema.names)
+        cursor = conn.cursor()
+        cursor.row_factory = None # 列に並べ替えるだけなので sqlite3.Row を作らない
+        cursor.execute(f'SELECT {columns} FROM {source} WHERE household_id IN (SELECT value FROM json_each(?))',
+                       (json.dumps(households),))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                if table == SCAN_POINTS:
+                    yield _scan_points_batch(pa, schema, rows)
+                else:
+                    yield _record_batch(pa, schema, rows)
+                yielded = True
+        finally:
+            cursor.close()
+    if not yielded:
+        # 該当する行がない場合も空のファイルを書けるよう、列だけの空のバッチを返す
+        schema = schema or table_schema(router.shard_connection(0), table)
+        yield pa.RecordBatch.from_pylist([], schema=schema)
+
+
+class _BatchWriter:
+    """Parquet / Arrow IPC ファイルへの RecordBatch の追記"""
+
+    def __init__(self, path, schema, fmt):
+        pa = _require_pyarrow()
+        self.tmp_path = path + '.tmp'
+        self.path = path
+        if fmt == 'parquet':
+            self._writer = pa.parquet.ParquetWriter(self.tmp_path, schema, compression=PARQUET_COMPRESSION)
+        else:
+            self._writer = pa.ipc.new_file(self.tmp_path, schema)
+        self.rows = 0
+
+    def write(self, batch):
+        if batch.num_rows:
+            self._writer.write_batch(batch)
+            self.rows += batch.num_rows
+
+    def close(self):
+        self._writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def _format_for(path, fmt=None):
+    if fmt is not None:
+        if fmt not in FORMAT_EXTENSIONS:
+            raise ValueError(f"fmt must be one of {tuple(FORMAT_EXTENSIONS)}")
+        return fmt
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Cannot infer the format from {path} (use .parquet or .arrow)")
+    return fmt
+
+
+@traced('export.table')
+def export_table(table, path, household_ids=None, fmt=None, chunk_rows=EXPORT_CHUNK_ROWS, router=None):
+    """
+    1つのテーブルをファイルに書き出し、行数を返す。書き終えるまでは path + '.tmp' に書く。
+
+    Args:
+        fmt (str): 'parquet' または 'arrow'。Noneの場合は拡張子から決める。
+    """
+    fmt = _format_for(path, fmt)
+    writer = None
+    try:
+        for batch in iter_table_batches(table, household_ids=household_ids, chunk_rows=chunk_rows, router=router):
+            if writer is None:
+                writer = _BatchWriter(path, batch.schema, fmt)
+            writer.write(batch)
+    except BaseException:
+        if writer is not None:
+            writer._writer.close()
+            os.remove(writer.tmp_path)
+        raise
+    writer.close()
+    inc('export_rows', writer.rows, table=table)
+    return writer.rows
+
+
+@traced('export.tables')
+def export_tables(output_dir, tables=ANALYTICS_TABLES, household_ids=None, fmt='parquet',
+                  chunk_rows=EXPORT_CHUNK_ROWS, router=None):
+    """
+    テーブルを output_dir/<テーブル名>.parquet (または .arrow) に書き出す。
+
+    Args:
+        tables (iterable or str): 書き出すテーブル。'all' の場合は HOUSEHOLD_TABLES (restore_households で戻せる形)。
+        household_ids (iterable): 指定した場合はその世帯だけ。
+        fmt (str): 'parquet' または 'arrow'。
+
+    Returns:
+        dict: テーブル名 -> 行数
+    """
+    if tables == 'all':
+        tables = db_manager.HOUSEHOLD_TABLES
+    os.makedirs(output_dir, exist_ok=True)
+    counts = {}
+    for table in tables:
+        path = os.path.join(output_dir, table + FORMAT_EXTENSIONS[_format_for('', fmt)])
+        with span('export.write', table=table):
+            counts[table] = export_table(table, path, household_ids=household_ids, fmt=fmt, chunk_rows=chunk_rows,
+                                         router=router)
+        logger.info("Exported %d rows of %s to %s", counts[table], table, path)
+    return counts
+
+
+def iter_file_batches(path, batch_rows=IMPORT_BATCH_ROWS):
+    """Parquet / Arrow IPC ファイルを batch_rows 行以下の RecordBatch ずつ読み出す"""
+    pa = _require_pyarrow()
+    if _format_for(path) == 'parquet':
+        yield from pa.parquet.ParquetFile(path).iter_batches(batch_size=batch_rows)
+        return
+    with pa.memory_map(path) as source:
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            source.seek(0)
+            batches = pa.ipc.open_stream(source)
+        for batch in batches:
+            for offset in range(0, batch.num_rows, batch_rows):
+                yield batch.slice(offset, batch_rows)
+
+
+def _batch_rows(batch, columns):
+    """RecordBatch の指定した列を、行のタプルのリストにする"""
+    return list(zip(*(batch.column(name).to_pylist() for name in columns)))
+
+
+@traced('import.food_items')
+def import_food_items(path, household_id=DEFAULT_HOUSEHOLD_ID, event_type='imported',
+                      batch_rows=IMPORT_BATCH_ROWS, status=None):
+    """
+    ファイルの食材を世帯の新しい行として取り込む (IDは世帯の連番で振り直す)。
+    batch_rows 行ずつ add_food_items で書き込むので、各バッチはイベントの記録と合わせて1トランザクションになる。
+
+    Args:
+        path (str): export_tables の food_items ファイル、または FOOD_ITEM_INPUT_COLUMNS の一部の列を持つファイル。
+        event_type (str): 記録するイベントの種類。
+        status (str): 指定した場合はこの status の行だけを取り込む (例: 'active')。
+
+    Returns:
+        int: 取り込んだ行数
+    """
+    pa = _require_pyarrow()
+    today = datetime.now().strftime('%Y-%m-%d')
+    defaults = {**IMPORT_DEFAULTS, 'last_seen_date': today}
+    imported = 0
+    for batch in iter_file_batches(path, batch_rows=batch_rows):
+        missing = [c for c in IMPORT_REQUIRED_COLUMNS if c not in batch.schema.names]
+        if missing:
+            raise ValueError(f"{path} is missing required column(s): {missing}")
+        if status is not None and 'status' in batch.schema.names:
+            batch = batch.filter(pa.compute.equal(batch.column('status'), status))
+        values = [batch.column(c).to_pylist() if c in batch.schema.names else None
+                  for c in db_manager.FOOD_ITEM_INPUT_COLUMNS]
+        values = [column if column is not None else [defaults.get(name)] * batch.num_rows
+                  for name, column in zip(db_manager.FOOD_ITEM_INPUT_COLUMNS, values)]
+        rows = list(zip(*values))
+        if rows:
+            db_manager.add_food_items(rows, household_id=household_id, event_type=event_type)
+            imported += len(rows)
+    inc('import_rows', imported, table='food_items')
+    logger.info("Imported %d items from %s into household '%s'.", imported, path, household_id)
+    return imported
+
+
+def _prepare_household(conn, household_id, replace):
+    """世帯を書き戻す前に、移行先に既存の行がないか確かめる (replace=True なら削除する)"""
+    if replace:
+        for table in db_manager.HOUSEHOLD_TABLES:
+            conn.execute(f'DELETE FROM {table} WHERE household_id = ?', (household_id,))
+        return
+    if conn.execute('SELECT 1 FROM household_sequences WHERE household_id = ? LIMIT 1', (household_id,)).fetchone() \
+            or conn.execute('SELECT 1 FROM food_items WHERE household_id = ? LIMIT 1', (household_id,)).fetchone():
+        raise ValueError(f"Household '{household_id}' already has data (use replace=True to overwrite it)")
+
+
+@traced('import.restore_households')
+def restore_households(input_dir, household_ids=None, replace=False, batch_rows=IMPORT_BATCH_ROWS, router=None):
+    """
+    export_tables(tables='all') で書き出したディレクトリから、世帯の行をIDごとそのまま書き戻す。
+    テーブルは HOUSEHOLD_TABLES の順に、世帯のシャードごとに batch_rows 行ずつ executemany で書き込む。
+    世帯の書き込みを止めてから実行すること (途中で失敗した場合は replace=True でやり直す)。
+
+    Args:
+        household_ids (iterable): 指定した場合はその世帯だけ。
+        replace (bool): 移行先に既にデータがある世帯を上書きするか (False なら ValueError)。
+
+    Returns:
+        dict: テーブル名 -> 書き戻した行数
+    """
+    pa = _require_pyarrow()
+    router = router or db_manager.get_router()
+    wanted = pa.array(sorted(set(household_ids)), type=pa.string()) if household_ids is not None else None
+    prepared = set()
+    counts = {}
+    for table in db_manager.HOUSEHOLD_TABLES:
+        paths = [os.path.join(input_dir, table + ext) for ext in FORMATS if os.path.exists(
+            os.path.join(input_dir, table + ext))]
+        if not paths:
+            continue
+        counts[table] = 0
+        for batch in iter_file_batches(paths[0], batch_rows=batch_rows):
+            if wanted is not None:
+                batch = batch.filter(pa.compute.is_in(batch.column('household_id'), value_set=wanted))
+            by_shard = {}
+            for household_id in batch.column('household_id').unique().to_pylist():
+                by_shard.setdefault(router.shard_for(household_id), []).append(household_id)
+            for shard_id, households in by_shard.items():
+                shard_batch = batch if len(by_shard) == 1 else batch.filter(
+                    pa.compute.is_in(batch.column('household_id'), value_set=pa.array(households, type=pa.string())))
+                conn = router.shard_connection(shard_id)
+                columns = [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')
+                           if row['name'] in shard_batch.schema.names]
+                with conn:
+                    for household_id in households:
+                        if household_id not in prepared:
+                            _prepare_household(conn, household_id, replace)
+                            prepared.add(household_id)
+                    conn.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                                     f"VALUES ({', '.join('?' * len(columns))})", _batch_rows(shard_batch, columns))
+                counts[table] += shard_batch.num_rows
+        inc('import_rows', counts[table], table=table)
+    for household_id in prepared:
+        db_manager.get_inventory_cache().invalidate(household_id)
+    logger.info("Restored %d households from %s: %s", len(prepared), input_dir, counts)
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Bulk export/import of inventory and history as Parquet or Arrow.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='テーブルを Parquet / Arrow に書き出す')
+    export_parser.add_argument('output_dir')
+    export_parser.add_argument('--tables', nargs='+', default=list(ANALYTICS_TABLES),
+                               help="書き出すテーブル ('all' で世帯の全テーブル)")
+    export_parser.add_argument('--households', nargs='+', default=None)
+    export_parser.add_argument('--format', choices=tuple(FORMAT_EXTENSIONS), default='parquet')
+    export_parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS)
+    import_parser = subparsers.add_parser('import', help='食材のファイルを世帯の新しい行として取り込む')
+    import_parser.add_argument('path')
+    import_parser.add_argument('household_id')
+    import_parser.add_argument('--status', default=None, help="指定した status の行だけ取り込む (例: active)")
+    import_parser.add_argument('--batch-rows', type=int, default=IMPORT_BATCH_ROWS)
+    restore_parser = subparsers.add_parser('restore', help="export --tables all の出力から世帯をIDごと書き戻す")
+    restore_parser.add_argument('input_dir')
+    restore_parser.add_argument('--households', nargs='+', default=None)
+    restore_parser.add_argument('--replace', action='store_true', help='既にデータがある世帯を上書きする')
+    restore_parser.add_argument('--batch-rows', type=int, default=IMPORT_BATCH_ROWS)
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.command == 'export':
+        tables = 'all' if args.tables == ['all'] else args.tables
+        counts = export_tables(args.output_dir, tables=tables, household_ids=args.households, fmt=args.format,
+                               chunk_rows=args.chunk_rows)
+        for table, rows in counts.items():
+            print(f"{table:<28} {rows:>10} rows")
+    elif args.command == 'import':
+        rows = import_food_items(args.path, args.household_id, status=args.status, batch_rows=args.batch_rows)
+        print(f"Imported {rows} items into household '{args.household_id}'.")
+    elif args.command == 'restore':
+        counts = restore_households(args.input_dir, household_ids=args.households, replace=args.replace,
+                                    batch_rows=args.batch_rows)
+        for table, rows in counts.items():
+            print(f"{table:<28} {rows:>10} rows")
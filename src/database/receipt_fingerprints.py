@@ -0,0 +1,270 @@
+# src/database/receipt_fingerprints.py
+
+import os
+import sys
+import json
+from datetime import datetime
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.database import inventory_events
+
+try:
+    from src.config import RECEIPT_DHASH_NEAR_DISTANCE # dHash (64ビット) のハミング距離がこれ以下なら同じレシートの別の写真の候補
+except ImportError:
+    RECEIPT_DHASH_NEAR_DISTANCE = 3
+
+# ----------------------------------------------------
+# レシートの指紋 (二重取り込みの検出)
+# ----------------------------------------------------
+# 同じレシートを2回撮影・送信すると、process_receipt_image は品目の数量をもう一度足してしまう。
+# 取り込んだレシートごとに指紋を記録し、新しいレシートを既存のものと照合する。
+#   - 画像: ファイルの SHA-1、64ビットの dHash (近い写真の検索用)、256ビットの dHash (候補の並べ替え用)。
+#           同じ画像とみなすのは SHA-1 の一致だけ。同じ店のレシートは行数や見出しが同じだと別の買い物でも
+#           dHash が近くなる (細かい dHash でも数ビットの差) ので、dHash の一致は候補にとどめ、
+#           必ず OCR してテキストの指紋 (日時・合計) で確かめる。
+#           64ビットの dHash を 16 ビットずつ DHASH_BANDS 個の帯に分けて receipt_dhash_bands に索引する。
+#           ハミング距離が DHASH_BANDS - 1 以下の2つのハッシュは、少なくとも1つの帯が完全に一致するので、
+#           帯の完全一致で候補を引いてから距離を計算すれば全件を比べずに済む
+#           (RECEIPT_DHASH_NEAR_DISTANCE を DHASH_BANDS - 1 より大きくすると、それ以上離れた写真は見落としうる)。
+#   - テキスト: OCR 後の店名・日時・合計・品目を正規化したハッシュ (text_hash) と、品目を除いたハッシュ (header_hash)。
+# status は 'applied' (在庫に反映した)、'flagged' (重複の疑いで反映しなかった)、'skipped' (SHA-1 が同じなので OCR もしなかった)。
+# 照合の相手は 'applied' のレシートだけ。レシートIDは世帯ごとの連番で、取り込みバッチを undo_batch すると指紋も消える。
+
+RECEIPT_SEQUENCE = 'receipt'
+DHASH_BANDS = 4
+DHASH_BAND_BITS = 64 // DHASH_BANDS
+RECEIPT_STATUSES = ('applied', 'flagged', 'skipped')
+FINGERPRINT_COLUMNS = ('image_sha1', 'dhash', 'dhash_fine', 'text_hash', 'header_hash', 'store', 'receipt_date',
+                       'total', 'items')
+
+
+def init_receipt_schema(conn):
+    """レシートの指紋と dHash の帯の索引のテーブルを作る"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS receipt_fingerprints (
+            household_id TEXT NOT NULL,
+            receipt_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            batch_id TEXT,
+            status TEXT NOT NULL,
+            duplicate_of INTEGER,
+            duplicate_reason TEXT,
+            image_sha1 TEXT,
+            dhash INTEGER,
+            dhash_fine TEXT,
+            text_hash TEXT,
+            header_hash TEXT,
+            store TEXT,
+            receipt_date TEXT,
+            total INTEGER,
+            items TEXT,
+            PRIMARY KEY (household_id, receipt_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receipt_fingerprints_sha1 ON receipt_fingerprints (household_id, image_sha1)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receipt_fingerprints_text ON receipt_fingerprints (household_id, text_hash)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receipt_fingerprints_header '
+                 'ON receipt_fingerprints (household_id, header_hash)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receipt_fingerprints_batch ON receipt_fingerprints (household_id, batch_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS receipt_dhash_bands (
+            household_id TEXT NOT NULL,
+            band INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            receipt_id INTEGER NOT NULL,
+            PRIMARY KEY (household_id, band, value, receipt_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def to_signed64(value):
+    """64ビットの符号なし整数を SQLite の INTEGER (符号付き) に収める"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def dhash_bands(dhash):
+    """64ビットの dHash を (帯の番号, 値) のリストにする"""
+    dhash = to_unsigned64(dhash)
+    mask = (1 << DHASH_BAND_BITS) - 1
+    return [(band, (dhash >> (band * DHASH_BAND_BITS)) & mask) for band in range(DHASH_BANDS)]
+
+
+def hamming_distance(a, b):
+    return (to_unsigned64(a) ^ to_unsigned64(b)).bit_count()
+
+
+def hex_hamming_distance(a, b):
+    """16進文字列で表したハッシュ同士のハミング距離 (長さが違えば None)"""
+    if not a or not b or len(a) != len(b):
+        return None
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def _set_bands(conn, household_id, receipt_id, dhash, indexed):
+    """dHash の帯の索引を付ける (indexed=False なら外す)。行は主キーで指定するので、帯の表を走査しない"""
+    if dhash is None:
+        return
+    rows = [(household_id, band, value, receipt_id) for band, value in dhash_bands(dhash)]
+    if indexed:
+        conn.executemany('INSERT OR IGNORE INTO receipt_dhash_bands (household_id, band, value, receipt_id) '
+                         'VALUES (?, ?, ?, ?)', rows)
+    else:
+        conn.executemany('DELETE FROM receipt_dhash_bands WHERE household_id = ? AND band = ? AND value = ? '
+                         'AND receipt_id = ?', rows)
+
+
+def insert_receipt(conn, household_id, fingerprint, status, batch_id=None, duplicate_of=None, duplicate_reason=None):
+    """
+    レシートの指紋を記録し、レシートIDを返す。書き込みトランザクションの中で呼ぶこと。
+
+    Args:
+        fingerprint (dict): FINGERPRINT_COLUMNS のうち分かっているもの (items は品目のリスト)。
+        status (str): RECEIPT_STATUSES のいずれか。'applied' のものだけ dHash の帯を索引する。
+    """
+    if status not in RECEIPT_STATUSES:
+        raise ValueError(f"status must be one of {RECEIPT_STATUSES}")
+    receipt_id = inventory_events.next_ids(conn, household_id, RECEIPT_SEQUENCE)
+    values = {c: fingerprint.get(c) for c in FINGERPRINT_COLUMNS}
+    if values['dhash'] is not None:
+        values['dhash'] = to_signed64(values['dhash'])
+    if values['items'] is not None:
+        values['items'] = json.dumps(values['items'], ensure_ascii=False)
+    columns = ('household_id', 'receipt_id', 'created_at', 'batch_id', 'status', 'duplicate_of', 'duplicate_reason',
+               *FINGERPRINT_COLUMNS)
+    conn.execute(f"INSERT INTO receipt_fingerprints ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                 (household_id, receipt_id, datetime.now().isoformat(timespec='seconds'), batch_id, status,
+                  duplicate_of, duplicate_reason, *values.values()))
+    if status == 'applied':
+        _set_bands(conn, household_id, receipt_id, values['dhash'], True)
+    return receipt_id
+
+
+def set_receipt_status(conn, household_id, receipt_id, status, duplicate_of=None, duplicate_reason=None):
+    """レシートの status を変える (dHash の帯の索引も合わせて付け外しする)"""
+    if status not in RECEIPT_STATUSES:
+        raise ValueError(f"status must be one of {RECEIPT_STATUSES}")
+    conn.execute('UPDATE receipt_fingerprints SET status = ?, duplicate_of = ?, duplicate_reason = ? '
+                 'WHERE household_id = ? AND receipt_id = ?',
+                 (status, duplicate_of, duplicate_reason, household_id, receipt_id))
+    row = conn.execute('SELECT dhash FROM receipt_fingerprints WHERE household_id = ? AND receipt_id = ?',
+                       (household_id, receipt_id)).fetchone()
+    if row is not None:
+        _set_bands(conn, household_id, receipt_id, row['dhash'], status == 'applied')
+
+
+def _image_candidates(conn, household_id, image_sha1, dhash, exclude_receipt_id):
+    """SHA-1 が同じか、dHash の帯が1つでも一致する 'applied' のレシート"""
+    candidates = {}
+    if image_sha1 is not None:
+        for row in conn.execute('''
+            SELECT * FROM receipt_fingerprints
+            WHERE household_id = ? AND image_sha1 = ? AND status = 'applied'
+        ''', (household_id, image_sha1)):
+            candidates[row['receipt_id']] = row
+    if dhash is not None:
+        bands = dhash_bands(dhash)
+        # 帯ごとに主キーで引く (OR でまとめると世帯の帯をすべて走査する)
+        band_query = ' UNION '.join(['SELECT receipt_id FROM receipt_dhash_bands '
+                                     'WHERE household_id = ? AND band = ? AND value = ?'] * len(bands))
+        for row in conn.execute(f'''
+            SELECT f.* FROM receipt_fingerprints f
+            WHERE f.household_id = ? AND f.status = 'applied' AND f.receipt_id IN ({band_query})
+        ''', (household_id, *(v for band, value in bands for v in (household_id, band, value)))):
+            candidates[row['receipt_id']] = row
+    candidates.pop(exclude_receipt_id, None)
+    return candidates.values()
+
+
+def _match_image(conn, household_id, fingerprint, exclude_receipt_id, near_distance):
+    """(照合結果, 相手の header_hash) を返す。dHash の候補は (64ビットの距離, 256ビットの距離) が小さい順に選ぶ"""
+    best = best_header = best_key = None
+    for row in _image_candidates(conn, household_id, fingerprint.get('image_sha1'), fingerprint.get('dhash'),
+                                 exclude_receipt_id):
+        if fingerprint.get('image_sha1') is not None and row['image_sha1'] == fingerprint['image_sha1']:
+            return {'receipt_id': row['receipt_id'], 'reason': 'image_exact', 'distance': 0}, row['header_hash']
+        distance = hamming_distance(row['dhash'], fingerprint['dhash'])
+        if distance > near_distance:
+            continue
+        fine = hex_hamming_distance(row['dhash_fine'], fingerprint.get('dhash_fine'))
+        key = (distance, fine if fine is not None else 256)
+        if best is None or key < best_key:
+            best = {'receipt_id': row['receipt_id'], 'reason': 'image_near', 'distance': distance}
+            best_header, best_key = row['header_hash'], key
+    return best, best_header
+
+
+def find_image_duplicate(conn, household_id, fingerprint, exclude_receipt_id=None,
+                         near_distance=RECEIPT_DHASH_NEAR_DISTANCE):
+    """
+    画像の指紋だけで既に取り込んだレシートと照合する (OCR の前に使う)。
+    'image_exact' (SHA-1 が同じファイル) だけが OCR を省いてよい結果で、'image_near' は候補にすぎない。
+
+    Returns:
+        dict or None: {'receipt_id', 'reason' ('image_exact' | 'image_near'), 'distance'}。
+                      同じファイルがあればそれを、なければ最も近い写真を返す。
+    """
+    return _match_image(conn, household_id, fingerprint, exclude_receipt_id, near_distance)[0]
+
+
+def find_duplicate(conn, household_id, fingerprint, exclude_receipt_id=None,
+                   near_distance=RECEIPT_DHASH_NEAR_DISTANCE):
+    """
+    OCR 後の指紋 (画像とテキスト) で、既に取り込んだレシートと重複していないか調べる。
+
+        - 'image_exact': 同じファイル (SHA-1 が同じ)
+        - 'text':        店名・日時・合計・品目が同じ (別の写真)
+        - 'header':      店名・日時・合計が同じで品目の読み取りだけが違う
+        - 'image_near':  写真が近く、日時と合計からは別のレシートと言い切れない
+
+    Returns:
+        dict or None: {'receipt_id', 'reason', 'distance'}
+    """
+    image_match, image_header = _match_image(conn, household_id, fingerprint, exclude_receipt_id, near_distance)
+    if image_match is not None and image_match['reason'] == 'image_exact':
+        return image_match
+    for column, reason in (('text_hash', 'text'), ('header_hash', 'header')):
+        if fingerprint.get(column) is None:
+            continue
+        row = conn.execute(f'''
+            SELECT receipt_id FROM receipt_fingerprints
+            WHERE household_id = ? AND {column} = ? AND status = 'applied' AND receipt_id != ?
+            ORDER BY receipt_id LIMIT 1
+        ''', (household_id, fingerprint[column], exclude_receipt_id or 0)).fetchone()
+        if row is not None:
+            return {'receipt_id': row['receipt_id'], 'reason': reason, 'distance': None}
+    if image_match is not None:
+        # 両方のレシートで日時と合計が読めて、それが違うなら、同じ店の別のレシート
+        if image_header is not None and fingerprint.get('header_hash') is not None:
+            return None
+        return image_match
+    return None
+
+
+def delete_batch_receipts(conn, household_id, batch_id):
+    """取り込みバッチで記録したレシートの指紋を削除する (undo_batch と同じトランザクションで呼ぶ)"""
+    rows = conn.execute('SELECT receipt_id, dhash FROM receipt_fingerprints WHERE household_id = ? AND batch_id = ?',
+                        (household_id, batch_id)).fetchall()
+    for receipt_id, dhash in rows:
+        _set_bands(conn, household_id, receipt_id, dhash, False)
+    conn.execute('DELETE FROM receipt_fingerprints WHERE household_id = ? AND batch_id = ?', (household_id, batch_id))
+    return [row[0] for row in rows]
+
+
+def list_receipts(conn, household_id, status=None, limit=50):
+    """レシートの指紋を新しい順に返す"""
+    sql = 'SELECT * FROM receipt_fingerprints WHERE household_id = ?'
+    params = [household_id]
+    if status is not None:
+        sql += ' AND status = ?'
+        params.append(status)
+    sql += ' ORDER BY receipt_id DESC LIMIT ?'
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
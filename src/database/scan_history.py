@@ -0,0 +1,199 @@
+# src/database/scan_history.py
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.database import inventory_events
+
+try:
+    from src.config import SCAN_HISTORY_MAX_POINTS # (世帯, クラス) ごとに残す直近のスキャン数
+except ImportError:
+    SCAN_HISTORY_MAX_POINTS = 365
+
+# ----------------------------------------------------
+# 冷蔵庫スキャンの検出数の時系列
+# ----------------------------------------------------
+# food_items は last_seen_date しか持たないため、どれくらいの速さで減っているかが分からない。
+# analyze_fridge_image の1回のスキャンごとに、統合後のYOLOクラス -> 検出数を記録する。
+#   - fridge_scans: スキャン1回につき1行 (時刻は UNIX 秒の整数、取り込みバッチID、推論に使ったモデルのバリアント)。
+#                   バリアント (例: 'best@480') は後段の照合で、精度の低いモデルのスキャンを軽く扱うために残す
+#   - scan_series:  (世帯, クラス) ごとに1行。点 (scan_id, count, scanned_at) を POINT_DTYPE の
+#                   バイト列として古い順に連結して持つ。スキャンごとに行を増やすより小さく、
+#                   全世帯の系列を np.frombuffer でまとめて読める。直近 SCAN_HISTORY_MAX_POINTS 点だけを残す。
+#                   以前に見えていたクラスが今回見えなかった場合は 0 を記録する (在庫切れを系列で表すため)。
+#   - consumption_forecasts: 時系列から計算した消費ペースと在庫切れ予測のキャッシュ
+#                   (src/analytics/consumption_forecast.py が書き込む)。scan_id はどのスキャンまでを
+#                   反映した結果かを表し、世帯の最新のスキャンと一致しなければ再計算する。
+# スキャンIDは世帯ごとの連番なので、世帯をシャード間で移してもそのままコピーできる。
+
+SCAN_SEQUENCE = 'fridge_scan'
+POINT_DTYPE = np.dtype([('scan_id', '<i4'), ('count', '<i4'), ('scanned_at', '<i8')])
+
+
+def init_scan_schema(conn):
+    """スキャンの時系列と消費予測のキャッシュのテーブルを作る"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fridge_scans (
+            household_id TEXT NOT NULL,
+            scan_id INTEGER NOT NULL,
+            scanned_at INTEGER NOT NULL,
+            batch_id TEXT,
+            model_variant TEXT,
+            PRIMARY KEY (household_id, scan_id)
+        ) WITHOUT ROWID
+    ''')
+    if 'model_variant' not in {row[1] for row in conn.execute('PRAGMA table_info(fridge_scans)')}:
+        conn.execute('ALTER TABLE fridge_scans ADD COLUMN model_variant TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fridge_scans_batch ON fridge_scans (household_id, batch_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_series (
+            household_id TEXT NOT NULL,
+            yolo_class TEXT NOT NULL,
+            points BLOB NOT NULL,
+            PRIMARY KEY (household_id, yolo_class)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS consumption_forecasts (
+            household_id TEXT NOT NULL,
+            yolo_class TEXT NOT NULL,
+            scan_id INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            last_count INTEGER NOT NULL,
+            last_scanned_at INTEGER NOT NULL,
+            rate_per_day REAL,
+            runout_at INTEGER,
+            PRIMARY KEY (household_id, yolo_class)
+        ) WITHOUT ROWID
+    ''')
+
+
+def decode_points(blob):
+    """scan_series.points を POINT_DTYPE の配列にする"""
+    return np.frombuffer(blob, dtype=POINT_DTYPE)
+
+
+def _load_series(conn, household_id):
+    rows = conn.execute('SELECT yolo_class, points FROM scan_series WHERE household_id = ?', (household_id,))
+    return {row[0]: row[1] for row in rows}
+
+
+def tracked_classes(conn, household_id):
+    """世帯の時系列に一度でも現れたクラス"""
+    rows = conn.execute('SELECT yolo_class FROM scan_series WHERE household_id = ?', (household_id,))
+    return {row[0] for row in rows}
+
+
+def record_scans(conn, household_id, scans, detectable_classes=None, batch_id=None,
+                 max_points=SCAN_HISTORY_MAX_POINTS, model_variant=None):
+    """
+    スキャンをまとめて記録する。書き込みトランザクションの中で呼ぶこと。
+
+    Args:
+        scans (list): (scanned_at (UNIX秒), {クラス: 個数}) のリスト (古い順)。
+        detectable_classes (iterable): 検出器が検出できるクラス。以前に記録したクラスのうち、
+                                       今回見えなかったものは (検出できるクラスであれば) 0 として記録する。
+        batch_id (str): 取り込みバッチID。Noneの場合は current_batch_id()。
+        max_points (int): 系列ごとに残す直近の点の数。
+        model_variant (str): 推論に使ったモデルのバリアント (例: 'best@480')。不明ならNone。
+
+    Returns:
+        int: 最初のスキャンID
+    """
+    if not scans:
+        return None
+    batch_id = batch_id or inventory_events.current_batch_id()
+    first_id = inventory_events.next_ids(conn, household_id, SCAN_SEQUENCE, len(scans))
+    existing = _load_series(conn, household_id)
+    detectable = set(detectable_classes) if detectable_classes is not None else None
+    known = {c for c in existing if detectable is None or c in detectable}
+    scan_rows = []
+    new_points = {} # クラス -> [(scan_id, count, scanned_at)]
+    for offset, (scanned_at, class_counts) in enumerate(scans):
+        scan_id = first_id + offset
+        scan_rows.append((household_id, scan_id, int(scanned_at), batch_id, model_variant))
+        known.update(class_counts)
+        for yolo_class in known:
+            new_points.setdefault(yolo_class, []).append((scan_id, int(class_counts.get(yolo_class, 0)),
+                                                          int(scanned_at)))
+    conn.executemany('INSERT INTO fridge_scans (household_id, scan_id, scanned_at, batch_id, model_variant) '
+                     'VALUES (?, ?, ?, ?, ?)', scan_rows)
+
+    series_rows = []
+    for yolo_class, points in new_points.items():
+        blob = existing.get(yolo_class, b'') + np.array(points, dtype=POINT_DTYPE).tobytes()
+        series_rows.append((household_id, yolo_class, blob[-max_points * POINT_DTYPE.itemsize:]))
+    conn.executemany('INSERT OR REPLACE INTO scan_series (household_id, yolo_class, points) VALUES (?, ?, ?)',
+                     series_rows)
+    return first_id
+
+
+def record_scan(conn, household_id, class_counts, detectable_classes=None, scanned_at=None, batch_id=None,
+                model_variant=None):
+    """1回のスキャンの検出数を記録し、スキャンIDを返す。書き込みトランザクションの中で呼ぶこと"""
+    scanned_at = time.time() if scanned_at is None else scanned_at
+    return record_scans(conn, household_id, [(scanned_at, class_counts)],
+                        detectable_classes=detectable_classes, batch_id=batch_id, model_variant=model_variant)
+
+
+def get_scan_variants(conn, household_id, since=None):
+    """
+    スキャンごとに推論に使ったモデルのバリアントを返す (時系列の点を精度で重み付けするため)。
+
+    Returns:
+        dict: scan_id -> model_variant (記録がないスキャンはNone)
+    """
+    query = 'SELECT scan_id, model_variant FROM fridge_scans WHERE household_id = ?'
+    params = [household_id]
+    if since is not None:
+        query += ' AND scanned_at >= ?'
+        params.append(int(since))
+    return {row[0]: row[1] for row in conn.execute(query, params)}
+
+
+def delete_batch_scans(conn, household_id, batch_id):
+    """取り込みバッチで記録したスキャンを時系列から削除する (undo_batch と同じトランザクションで呼ぶ)"""
+    scan_ids = [row[0] for row in conn.execute(
+        'SELECT scan_id FROM fridge_scans WHERE household_id = ? AND batch_id = ?', (household_id, batch_id))]
+    if not scan_ids:
+        return []
+    for yolo_class, blob in _load_series(conn, household_id).items():
+        points = decode_points(blob)
+        keep = points[~np.isin(points['scan_id'], scan_ids)]
+        if len(keep) == len(points):
+            continue
+        if len(keep):
+            conn.execute('UPDATE scan_series SET points = ? WHERE household_id = ? AND yolo_class = ?',
+                         (keep.tobytes(), household_id, yolo_class))
+        else:
+            conn.execute('DELETE FROM scan_series WHERE household_id = ? AND yolo_class = ?',
+                         (household_id, yolo_class))
+    conn.executemany('DELETE FROM fridge_scans WHERE household_id = ? AND scan_id = ?',
+                     [(household_id, scan_id) for scan_id in scan_ids])
+    return scan_ids
+
+
+def get_series(conn, household_id, yolo_class=None, since=None):
+    """
+    世帯の時系列を (yolo_class, scanned_at) の順に返す。
+
+    Returns:
+        list: (yolo_class, scan_id, scanned_at, count) のタプルのリスト
+    """
+    result = []
+    for name, blob in sorted(_load_series(conn, household_id).items()):
+        if yolo_class is not None and name != yolo_class:
+            continue
+        points = decode_points(blob)
+        if since is not None:
+            points = points[points['scanned_at'] >= int(since)]
+        result.extend((name, int(p['scan_id']), int(p['scanned_at']), int(p['count'])) for p in points)
+    return result
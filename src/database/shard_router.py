@@ -0,0 +1,401 @@
+# src/database/shard_router.py
+
+import os
+import re
+import sys
+import time
+import zlib
+import sqlite3
+import threading
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.config import DATABASE_PATH
+
+try:
+    from src.config import DATABASE_SHARD_DIR # 世帯ごとのシャード (SQLiteファイル) を置くディレクトリ
+except ImportError:
+    DATABASE_SHARD_DIR = os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), 'inventory_shards')
+
+try:
+    from src.config import DATABASE_NUM_SHARDS # 新しい世帯を割り当てるシャード数 (同じシャードの世帯同士は書き込みロックを共有する)
+except ImportError:
+    DATABASE_NUM_SHARDS = 4
+
+try:
+    from src.config import DATABASE_DEDICATED_SHARDS # True: 新しい世帯ごとに専用のシャードを作る (DATABASE_NUM_SHARDS は使わない)
+except ImportError:
+    DATABASE_DEDICATED_SHARDS = False
+
+try:
+    from src.config import DEFAULT_HOUSEHOLD_ID
+except ImportError:
+    DEFAULT_HOUSEHOLD_ID = 'default'
+
+# ----------------------------------------------------
+# 世帯 (household) 単位のシャーディング
+# ----------------------------------------------------
+# 在庫を1つのSQLiteファイルに集めると、全世帯の書き込みが1つのライターロックを取り合う。
+# 世帯をハッシュで複数のシャード (shard_000.db, shard_001.db, ...) に振り分け、
+# 別のシャードにいる世帯同士の書き込みが競合しないようにする。
+#   - 既定 (DATABASE_NUM_SHARDS 個のシャードにハッシュで振り分ける) では、同じシャードに入った世帯同士は
+#     SQLite の書き込みロックを共有するため、書き込みは互いに待つ (WAL なので読み取りは待たない)。
+#     世帯ごとに書き込みを完全に分けたい場合は DATABASE_DEDICATED_SHARDS = True にすると、新しい世帯ごとに
+#     専用のシャードを作る。ファイル数と、スレッドごとにキャッシュする接続の数は世帯数に比例して増える。
+#   - 割り当ては shard_directory.db に記録するため、シャード数や方式を変えても既存の世帯は移動しない。
+#   - 接続はスレッド (とプロセス) ごとにシャード単位でキャッシュする (WAL + busy_timeout)。
+#   - 書き込みの多い世帯は migrate_household() で専用のシャードに移せる。
+#     移行元のシャードには移行済みの印 (migrated_households) を残す。書き込みは begin_write() で
+#     ロックを取ってから印を確かめるので、古い割り当てをキャッシュしている他のプロセスの書き込みも
+#     移行元に書かれて失われることはなく、新しいシャードでやり直される。
+
+DIRECTORY_FILENAME = 'shard_directory.db'
+SHARD_FILENAME_PATTERN = re.compile(r'^shard_(\d+)\.db$')
+BUSY_TIMEOUT_MS = 30_000
+ASSIGNMENT_CACHE_SECONDS = 5.0 # 他のプロセスで行われた移行を読み取りに反映するまでの時間 (書き込みは begin_write で即座に反映)
+MAX_WRITE_REDIRECTS = 3 # begin_write が移行済みの印を見てシャードを引き直す回数の上限
+
+
+def default_shard_for(household_id, num_shards):
+    """ハッシュによる既定のシャード番号 (プロセスをまたいで安定するよう crc32 を使う)"""
+    return zlib.crc32(str(household_id).encode('utf-8')) % num_shards
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    # 新しいファイルでは、削除で空いたページを PRAGMA incremental_vacuum で返せるようにする
+    # (ファイルの作成前にしか設定できないため、journal_mode より先に行う。既存のファイルでは何も起きない)
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('PRAGMA journal_mode=WAL') # 読み取りが書き込みを待たないようにする
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _init_migration_schema(conn):
+    """移行元のシャードに残す移行済みの印のテーブル"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS migrated_households (
+            household_id TEXT PRIMARY KEY,
+            shard_id INTEGER NOT NULL,
+            migrated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+class ShardRouter:
+    """世帯IDからシャードのSQLite接続を返すルーター"""
+
+    def __init__(self, shard_dir=DATABASE_SHARD_DIR, num_shards=DATABASE_NUM_SHARDS, init_schema=None,
+                 dedicated=DATABASE_DEDICATED_SHARDS):
+        """
+        Args:
+            shard_dir (str): シャードとディレクトリ (割り当て表) を置くディレクトリ。
+            num_shards (int): 新しい世帯を割り当てるシャード数。
+            init_schema (callable): シャードに初めて接続したときに呼ぶ関数 (引数は接続)。
+            dedicated (bool): True の場合、新しい世帯には割り当て済みのどのシャードとも違う専用のシャードを割り当てる。
+        """
+        self.shard_dir = shard_dir
+        self.num_shards = num_shards
+        self.init_schema = init_schema
+        self.dedicated = dedicated
+        os.makedirs(shard_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._assignments = {} # household_id -> (shard_id, キャッシュの期限)
+        self._initialized_shards = set()
+
+        with self._directory() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS households (
+                    household_id TEXT PRIMARY KEY,
+                    shard_id INTEGER NOT NULL,
+                    assigned_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+
+    # --- 接続 ---
+
+    def _connections(self):
+        """このスレッドの接続キャッシュ。fork後の子プロセスでは親の接続を使わない"""
+        cache = getattr(self._local, 'cache', None)
+        if cache is None or cache[0] != os.getpid():
+            cache = self._local.cache = (os.getpid(), {})
+        return cache[1]
+
+    def _directory(self):
+        connections = self._connections()
+        conn = connections.get('directory')
+        if conn is None:
+            conn = connections['directory'] = _connect(os.path.join(self.shard_dir, DIRECTORY_FILENAME))
+        return conn
+
+    def shard_path(self, shard_id):
+        return os.path.join(self.shard_dir, f'shard_{shard_id:03d}.db')
+
+    def shard_connection(self, shard_id):
+        """シャードへの接続 (スレッドごとにキャッシュ)。呼び出し側で close しないこと"""
+        connections = self._connections()
+        conn = connections.get(shard_id)
+        if conn is None:
+            conn = connections[shard_id] = _connect(self.shard_path(shard_id))
+            _init_migration_schema(conn)
+            with self._lock:
+                needs_schema = shard_id not in self._initialized_shards
+                self._initialized_shards.add(shard_id)
+            if needs_schema and self.init_schema is not None:
+                self.init_schema(conn)
+        return conn
+
+    def connection(self, household_id=DEFAULT_HOUSEHOLD_ID):
+        """世帯のシャードへの接続"""
+        return self.shard_connection(self.shard_for(household_id))
+
+    def begin_write(self, household_id):
+        """
+        世帯のシャードで書き込みトランザクションを始め (BEGIN IMMEDIATE)、その接続を返す。
+        ロックを取った後に世帯がこのシャードから移行済みでないかを確かめ、移行済みなら割り当てを引き直して
+        移行先で始め直す。コミット・ロールバックは呼び出し側で行う (`with conn:`)。
+
+        Raises:
+            RuntimeError: 割り当てを引き直しても移行済みのシャードを指し続ける場合。
+        """
+        for _ in range(MAX_WRITE_REDIRECTS):
+            conn = self.connection(household_id)
+            conn.execute('BEGIN IMMEDIATE')
+            moved = conn.execute('SELECT shard_id FROM migrated_households WHERE household_id = ?',
+                                 (household_id,)).fetchone()
+            if moved is None:
+                return conn
+            conn.rollback()
+            # 他のプロセスで移行された。キャッシュした割り当てを捨ててディレクトリから読み直す
+            self._assignments.pop(household_id, None)
+        raise RuntimeError(f"Household {household_id} keeps resolving to a shard it was migrated from.")
+
+    def close(self):
+        """このスレッドでキャッシュしている接続を閉じる"""
+        connections = self._connections()
+        for conn in connections.values():
+            conn.close()
+        connections.clear()
+
+    # --- 割り当て ---
+
+    def shard_for(self, household_id):
+        """世帯のシャード番号。未割り当ての世帯はハッシュで割り当ててディレクトリに記録する"""
+        cached = self._assignments.get(household_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        conn = self._directory()
+        row = conn.execute('SELECT shard_id FROM households WHERE household_id = ?', (household_id,)).fetchone()
+        if row is None:
+            with conn:
+                # 他のプロセスが同時に割り当てた場合はそちらを使う
+                if self.dedicated:
+                    # 次の番号を1つの文で決めて記録するため、同時に割り当てても同じシャードにならない
+                    conn.execute('INSERT OR IGNORE INTO households (household_id, shard_id, assigned_at) '
+                                 'SELECT ?, COALESCE(MAX(shard_id) + 1, 0), ? FROM households',
+                                 (household_id, time.time()))
+                else:
+                    conn.execute('INSERT OR IGNORE INTO households (household_id, shard_id, assigned_at) '
+                                 'VALUES (?, ?, ?)',
+                                 (household_id, default_shard_for(household_id, self.num_shards), time.time()))
+            row = conn.execute('SELECT shard_id FROM households WHERE household_id = ?', (household_id,)).fetchone()
+        self._assignments[household_id] = (row['shard_id'], time.monotonic() + ASSIGNMENT_CACHE_SECONDS)
+        return row['shard_id']
+
+    def households(self):
+        """household_id -> shard_id"""
+        rows = self._directory().execute('SELECT household_id, shard_id FROM households').fetchall()
+        return {row['household_id']: row['shard_id'] for row in rows}
+
+    def _set_shard(self, household_id, shard_id):
+        conn = self._directory()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO households (household_id, shard_id, assigned_at) VALUES (?, ?, ?)',
+                         (household_id, shard_id, time.time()))
+        self._assignments[household_id] = (shard_id, time.monotonic() + ASSIGNMENT_CACHE_SECONDS)
+
+    def existing_shards(self):
+        """ファイルが存在するシャード番号のリスト"""
+        shard_ids = set() if self.dedicated else set(range(self.num_shards))
+        for filename in os.listdir(self.shard_dir):
+            match = SHARD_FILENAME_PATTERN.match(filename)
+            if match:
+                shard_ids.add(int(match.group(1)))
+        return sorted(shard_ids)
+
+    # --- 移行・再配置 ---
+
+    def migrate_household(self, household_id, target_shard, tables):
+        """
+        世帯の行を別のシャードに移す。
+
+        移行先へのコピーとコミット -> ディレクトリの更新 -> 移行元からの削除と移行済みの印、の順に行う。
+        途中で失敗しても、ディレクトリが指すシャードには常に完全なデータがある
+        (移行先に残ったコピーは次回の実行時に削除してからコピーし直す)。
+        移行元のシャードは移行中は書き込みロックを保持するため、この世帯への書き込みは待たされる。
+        待っていた書き込みや、古い割り当てをキャッシュしている他のプロセスの書き込みは、begin_write が
+        移行済みの印を見て移行先でやり直すので、移行元に書かれて失われることはない。
+
+        Args:
+            household_id (str): 移す世帯。
+            target_shard (int): 移行先のシャード番号 (num_shards 以上の専用シャードも可)。
+            tables (list): household_id 列を持つテーブル名のリスト。行はIDも含めてそのままコピーする
+                           (IDは世帯ごとの連番なので、移行先の他の世帯と衝突しない)。
+
+        Returns:
+            dict: テーブル名 -> 移した行数
+        """
+        source_shard = self.shard_for(household_id)
+        if source_shard == target_shard:
+            return {}
+        source = self.shard_connection(source_shard)
+        target = self.shard_connection(target_shard)
+        moved = {}
+        source.execute('BEGIN IMMEDIATE')
+        try:
+            with target:
+                target.execute('DELETE FROM migrated_households WHERE household_id = ?', (household_id,))
+                for table in tables:
+                    target.execute(f'DELETE FROM {table} WHERE household_id = ?', (household_id,))
+                    columns = [row['name'] for row in source.execute(f'PRAGMA table_info({table})')]
+                    rows = source.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE household_id = ?",
+                                          (household_id,))
+                    cursor = target.executemany(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                                f"VALUES ({', '.join('?' * len(columns))})", rows)
+                    moved[table] = cursor.rowcount
+            self._set_shard(household_id, target_shard)
+            for table in tables:
+                source.execute(f'DELETE FROM {table} WHERE household_id = ?', (household_id,))
+            source.execute('INSERT OR REPLACE INTO migrated_households (household_id, shard_id, migrated_at) '
+                           'VALUES (?, ?, ?)', (household_id, target_shard, time.time()))
+            source.commit()
+        except Exception:
+            source.rollback()
+            raise
+        return moved
+
+    def shard_loads(self, table='food_items'):
+        """シャードごとの {household_id: 行数} (ディレクトリ上そのシャードに属する世帯のみ)"""
+        assignments = self.households()
+        loads = {}
+        for shard_id in self.existing_shards():
+            rows = self.shard_connection(shard_id).execute(
+                f'SELECT household_id, COUNT(*) AS n FROM {table} GROUP BY household_id').fetchall()
+            loads[shard_id] = {row['household_id']: row['n'] for row in rows
+                               if assignments.get(row['household_id']) == shard_id}
+        return loads
+
+    def plan_rebalance(self, table='food_items', max_moves=10):
+        """
+        行数の最も多いシャードから最も少ないシャードへ、差を縮める世帯を移す計画を立てる。
+
+        Returns:
+            list: (household_id, 移行元, 移行先, 行数) のリスト
+        """
+        loads = self.shard_loads(table)
+        totals = {shard_id: sum(households.values()) for shard_id, households in loads.items()}
+        plan = []
+        while len(plan) < max_moves and len(totals) > 1:
+            heaviest = max(totals, key=totals.get)
+            lightest = min(totals, key=totals.get)
+            gap = totals[heaviest] - totals[lightest]
+            # 移すと差が縮まる (行数が差より小さい) 世帯のうち最大のもの
+            movable = [(n, hh) for hh, n in loads[heaviest].items() if 0 < n < gap]
+            if not movable:
+                break
+            n, household_id = max(movable)
+            del loads[heaviest][household_id]
+            loads[lightest][household_id] = n
+            totals[heaviest] -= n
+            totals[lightest] += n
+            plan.append((household_id, heaviest, lightest, n))
+        return plan
+
+    def rebalance(self, tables, max_moves=10, dry_run=True):
+        """plan_rebalance() の計画を (dry_run=False なら) 実行し、計画を返す。行数は tables の先頭のテーブルで数える"""
+        plan = self.plan_rebalance(tables[0], max_moves=max_moves)
+        if not dry_run:
+            for household_id, _, target_shard, _ in plan:
+                self.migrate_household(household_id, target_shard, tables)
+        return plan
+
+    def import_database(self, db_path, household_id, tables):
+        """
+        シャーディング前の単一ファイルのDB (household_id 列なし) の行を、世帯のシャードに取り込む。
+        共通する列だけをコピーし、IDはそのまま使う。
+        元のDBは読み取り専用で開く (_connect で開くと WAL や auto_vacuum の設定がファイルに残ってしまう)。
+
+        Returns:
+            dict: テーブル名 -> 取り込んだ行数
+        """
+        legacy = sqlite3.connect(f'file:{os.path.abspath(db_path)}?mode=ro', uri=True, timeout=BUSY_TIMEOUT_MS / 1000)
+        legacy.row_factory = sqlite3.Row
+        target = self.connection(household_id)
+        imported = {}
+        try:
+            with target:
+                for table in tables:
+                    if legacy.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (table,)).fetchone() is None:
+                        continue
+                    legacy_columns = {row['name'] for row in legacy.execute(f'PRAGMA table_info({table})')}
+                    columns = [row['name'] for row in target.execute(f'PRAGMA table_info({table})')
+                               if row['name'] in legacy_columns and row['name'] != 'household_id']
+                    rows = ((household_id, *row) for row in legacy.execute(f"SELECT {', '.join(columns)} FROM {table}"))
+                    cursor = target.executemany(f"INSERT INTO {table} (household_id, {', '.join(columns)}) "
+                                                f"VALUES (?, {', '.join('?' * len(columns))})", rows)
+                    imported[table] = cursor.rowcount
+        finally:
+            legacy.close()
+        return imported
+
+
+def print_shard_stats(router, table='food_items'):
+    loads = router.shard_loads(table)
+    print(f"{'Shard':<8} {'Households':>10} {'Rows':>10} {'Size (MB)':>10}")
+    print("-" * 42)
+    for shard_id, households in loads.items():
+        path = router.shard_path(shard_id)
+        size_mb = os.path.getsize(path) / 1024 / 1024 if os.path.exists(path) else 0.0
+        print(f"{shard_id:<8} {len(households):>10} {sum(households.values()):>10} {size_mb:>10.2f}")
+
+
+if __name__ == '__main__':
+    import argparse
+    from src.database.db_manager import get_router, import_legacy_database, HOUSEHOLD_TABLES
+
+    parser = argparse.ArgumentParser(description='Inspect, migrate and rebalance household inventory shards.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='シャードごとの世帯数・行数を表示')
+    migrate_parser = subparsers.add_parser('migrate', help='世帯を別のシャードに移す')
+    migrate_parser.add_argument('household_id')
+    migrate_parser.add_argument('shard', type=int)
+    rebalance_parser = subparsers.add_parser('rebalance', help='行数が均等になるよう世帯を移す')
+    rebalance_parser.add_argument('--max-moves', type=int, default=10)
+    rebalance_parser.add_argument('--apply', action='store_true', help='指定しない場合は計画の表示のみ')
+    import_parser = subparsers.add_parser('import-legacy', help='シャーディング前のDBを世帯に取り込む')
+    import_parser.add_argument('household_id')
+    import_parser.add_argument('--db', default=DATABASE_PATH)
+    args = parser.parse_args()
+
+    router = get_router()
+    if args.command == 'stats':
+        print_shard_stats(router)
+    elif args.command == 'migrate':
+        moved = router.migrate_household(args.household_id, args.shard, HOUSEHOLD_TABLES)
+        print(f"Moved household '{args.household_id}' to shard {args.shard}: {moved}")
+    elif args.command == 'rebalance':
+        plan = router.rebalance(HOUSEHOLD_TABLES, max_moves=args.max_moves, dry_run=not args.apply)
+        for household_id, source, target, rows in plan:
+            print(f"{'moved' if args.apply else 'would move'} {household_id}: shard {source} -> {target} ({rows} rows)")
+        if not plan:
+            print("Shards are already balanced.")
+    elif args.command == 'import-legacy':
+        imported = import_legacy_database(args.db, args.household_id)
+        print(f"Imported {args.db} into household '{args.household_id}': {imported}")
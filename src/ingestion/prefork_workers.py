@@ -0,0 +1,389 @@
+# src/ingestion/prefork_workers.py
+
+import os
+import sys
+import gc
+import time
+import queue
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import span
+
+try:
+    from src.config import PREFORK_RESULT_POLL_SECONDS # 結果を待つ間にワーカーの生存を確認する間隔 (秒)
+except ImportError:
+    PREFORK_RESULT_POLL_SECONDS = 1.0
+try:
+    from src.config import PREFORK_JOB_TIMEOUT_SECONDS # 1枚の推論の上限 (秒)。超えたジョブは失敗にしてワーカーを作り直す
+except ImportError:
+    PREFORK_JOB_TIMEOUT_SECONDS = 300.0
+
+
+# ----------------------------------------------------
+# プリフォーク型ワーカープール
+# ----------------------------------------------------
+# 親プロセスでYOLOv8モデルとEasyOCRリーダーを一度だけロードし、その後forkで
+# ワーカーを生成する。ワーカーは親のメモリ（モデルの重み）をcopy-on-writeで共有するため、
+# ワーカー数を増やしてもRSSが重みのコピー分だけ増えることはない。
+# 画像は親でデコードし、共有メモリ上のバッファとしてワーカーに渡す（配列のpickleは行わない）。
+#
+# 注意: forkを前提とするためLinux/macOS専用。CUDA初期化後のforkは動作しないため、
+#       GPU利用時は run_ocr.py の reader を gpu=False にしてCPUで運用すること。
+#
+# ワーカーは処理中のジョブIDと開始時刻を共有配列に書く。親は結果を待つ間に定期的に確認し、
+# 停止した (OOM Killer など) ワーカーや PREFORK_JOB_TIMEOUT_SECONDS を超えたワーカーのジョブを
+# 失敗 (結果 None) にして、同じスロットに新しいワーカーをforkし直す。
+
+TASK_YOLO = 'yolo'
+TASK_OCR = 'ocr'
+
+_STOP = None # ワーカー停止用のセンチネル
+_IDLE = -1 # 処理中のジョブがないスロットの値
+
+
+def _load_models(load_yolo=True, load_ocr=True):
+    """
+    親プロセスでモデルをロードする（モジュールのインポート時にロードされる）。
+    戻り値はタスク名 -> 推論関数 の辞書。
+    """
+    handlers = {}
+    if load_yolo:
+        from src.yolo_detection.predict_yolo import predict_on_array
+        handlers[TASK_YOLO] = predict_on_array
+    if load_ocr:
+        from src.ocr_processing.run_ocr import perform_ocr_on_array
+        handlers[TASK_OCR] = perform_ocr_on_array
+    return handlers
+
+
+def _read_private_memory_kb(pid):
+    """/proc/<pid>/smaps_rollup からプライベートページ (USS相当) をkB単位で読み取る"""
+    total_kb = 0
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            if line.startswith('Private_Clean:') or line.startswith('Private_Dirty:'):
+                total_kb += int(line.split()[1])
+    return total_kb
+
+
+def get_process_memory(pid):
+    """
+    指定プロセスのメモリ使用量をMB単位で返す。
+    USS (そのプロセスだけが持つページ) がcopy-on-write共有の効果を示す指標になる。
+
+    Returns:
+        dict: {'rss_mb': float, 'uss_mb': float}
+    """
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_full_info()
+        return {'rss_mb': info.rss / 1024 / 1024, 'uss_mb': info.uss / 1024 / 1024}
+    except ImportError:
+        pass
+
+    # psutilがない場合はLinuxの/procから直接読む
+    rss_kb = 0
+    with open(f'/proc/{pid}/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss_kb = int(line.split()[1])
+                break
+    return {'rss_mb': rss_kb / 1024, 'uss_mb': _read_private_memory_kb(pid) / 1024}
+
+
+def _worker_loop(handlers, task_queue, result_queue, task_kwargs, slot, current_jobs, started_at):
+    """
+    ワーカープロセスのメインループ。共有メモリ上の画像を受け取り、推論結果を返す。
+    処理中は current_jobs[slot] / started_at[slot] にジョブIDと開始時刻を書き、親が停止やタイムアウトを検出できるようにする。
+    """
+    # 各ワーカーが全コアを奪い合わないように、PyTorchのスレッド数を1に制限する
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    pid = os.getpid()
+    while True:
+        job = task_queue.get()
+        if job is _STOP:
+            break
+
+        job_id, task, shm_name, shape, dtype = job
+        started_at[slot] = time.monotonic()
+        current_jobs[slot] = job_id
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                # コピーせずに共有メモリ上のバッファをそのまま配列として参照する
+                image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+                result = handlers[task](image, **task_kwargs.get(task, {}))
+                del image
+            finally:
+                shm.close()
+            result_queue.put((job_id, pid, result, None))
+        except Exception as e:
+            result_queue.put((job_id, pid, None, f"{type(e).__name__}: {e}"))
+        current_jobs[slot] = _IDLE
+
+
+class PreforkWorkerPool:
+    """
+    モデルを親プロセスで一度だけロードし、forkしたワーカーでcopy-on-write共有する推論プール。
+
+    使用例:
+        with PreforkWorkerPool(num_workers=4) as pool:
+            detections = pool.map_images(image_paths, task='yolo')
+            print(pool.memory_report())
+    """
+
+    def __init__(self, num_workers=None, load_yolo=True, load_ocr=True, max_inflight=None, task_kwargs=None,
+                 job_timeout=PREFORK_JOB_TIMEOUT_SECONDS):
+        """
+        Args:
+            num_workers (int): ワーカープロセス数。Noneの場合はCPUコア数。
+            load_yolo (bool): YOLOv8モデルをロードして 'yolo' タスクを有効にするか。
+            load_ocr (bool): EasyOCRリーダーをロードして 'ocr' タスクを有効にするか。
+            max_inflight (int): 同時に共有メモリへ展開しておく画像の最大数。Noneの場合はワーカー数の2倍。
+            task_kwargs (dict): タスク名 -> 推論関数に渡す追加引数 (例: {'ocr': {'detail': 1}})。
+            job_timeout (float): 1枚の推論の上限 (秒)。超えたジョブは失敗にし、ワーカーを作り直す。
+        """
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_inflight = max_inflight or self.num_workers * 2
+        self.task_kwargs = task_kwargs or {}
+        self.job_timeout = job_timeout
+        self.handlers = _load_models(load_yolo=load_yolo, load_ocr=load_ocr)
+        self._ctx = mp.get_context('fork')
+        self._workers = []
+        self._task_queue = None
+        self._result_queue = None
+        self._current_jobs = None # スロット -> 処理中のジョブID (_IDLE は待機中)
+        self._started_at = None # スロット -> ジョブの開始時刻 (time.monotonic)
+
+    def _fork_worker(self, slot):
+        p = self._ctx.Process(
+            target=_worker_loop,
+            args=(self.handlers, self._task_queue, self._result_queue, self.task_kwargs,
+                  slot, self._current_jobs, self._started_at),
+            daemon=True,
+        )
+        p.start()
+        return p
+
+    def start(self):
+        """ワーカーをforkする。モデルはこの時点で親プロセスにロード済みである必要がある。"""
+        if self._workers:
+            return
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._current_jobs = self._ctx.RawArray('q', [_IDLE] * self.num_workers)
+        self._started_at = self._ctx.RawArray('d', self.num_workers)
+        # ワーカーが共有メモリを開くと resource_tracker に登録される。fork前に親で起動しておかないと
+        # ワーカーごとに tracker が起動し、ワーカーが停止したときに処理中の共有メモリを unlink してしまう
+        resource_tracker.ensure_running()
+
+        # fork前にGCで追跡中のオブジェクトを永続世代へ移し、
+        # ワーカー側のGCが参照カウント領域に書き込んでページがコピーされるのを防ぐ
+        gc.collect()
+        gc.freeze()
+        for slot in range(self.num_workers):
+            self._workers.append(self._fork_worker(slot))
+        gc.unfreeze()
+        print(f"Prefork worker pool started with {self.num_workers} workers (tasks: {list(self.handlers)}).")
+
+    def _recover_workers(self, inflight, submitted_at):
+        """
+        停止したワーカーと、job_timeout を超えて処理中のワーカーを同じスロットにforkし直す。
+
+        Args:
+            inflight (dict): 結果待ちのジョブID -> SharedMemory。
+            submitted_at (dict): ジョブID -> キューに入れた時刻 (time.monotonic)。
+
+        Returns:
+            list: 失敗として扱うジョブの (ジョブID, 理由) のリスト
+        """
+        now = time.monotonic()
+        failed = []
+        for slot, p in enumerate(self._workers):
+            job_id = self._current_jobs[slot]
+            if p.is_alive():
+                if job_id == _IDLE or now - self._started_at[slot] < self.job_timeout:
+                    continue
+                p.terminate()
+                p.join()
+                reason = f"timed out after {self.job_timeout:.0f}s"
+            else:
+                reason = f"exited with code {p.exitcode}"
+            print(f"Worker {p.pid} {reason}; starting a replacement.")
+            if job_id in inflight:
+                failed.append((job_id, f"worker {p.pid} {reason}"))
+            self._current_jobs[slot] = _IDLE
+            gc.collect()
+            gc.freeze()
+            self._workers[slot] = self._fork_worker(slot)
+            gc.unfreeze()
+
+        # キューから取り出した直後 (ジョブIDを書く前) にワーカーが停止すると、どのスロットにも
+        # 記録されないジョブが残る。待機中のワーカーがいるのに job_timeout を過ぎても誰も処理していなければ失われたとみなす
+        claimed = set(self._current_jobs)
+        if _IDLE in claimed:
+            failed_ids = {job_id for job_id, _ in failed}
+            for job_id in inflight:
+                if (job_id not in claimed and job_id not in failed_ids
+                        and now - submitted_at[job_id] >= self.job_timeout):
+                    failed.append((job_id, "job was lost by a stopped worker"))
+        return failed
+
+    def shutdown(self):
+        """全ワーカーを停止する"""
+        if not self._workers:
+            return
+        for _ in self._workers:
+            self._task_queue.put(_STOP)
+        for p in self._workers:
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()
+        self._workers = []
+        print("Prefork worker pool stopped.")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    @staticmethod
+    def _to_shared_memory(image):
+        """画像配列を新しい共有メモリセグメントにコピーし、セグメントを返す"""
+        shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+        return shm
+
+    def map_images(self, image_paths, task=TASK_YOLO):
+        """
+        画像を親プロセスでデコードし、共有メモリ経由でワーカーに配布して推論する。
+
+        Args:
+            image_paths (list): 画像パスのリスト。
+            task (str): 'yolo' または 'ocr'。
+
+        Returns:
+            list: 入力と同じ順序の推論結果。読み込みや推論に失敗した画像、処理中にワーカーが停止したり
+                  job_timeout を超えたりした画像はNone。
+        """
+        if task not in self.handlers:
+            raise ValueError(f"Task '{task}' is not loaded in this pool. Available: {list(self.handlers)}")
+        if not self._workers:
+            self.start()
+
+        results = [None] * len(image_paths)
+        inflight = {} # job_id -> SharedMemory
+        submitted_at = {} # job_id -> キューに入れた時刻
+        next_index = 0
+        last_check = time.monotonic()
+
+        def release(job_id):
+            shm = inflight.pop(job_id, None)
+            submitted_at.pop(job_id, None)
+            if shm is None:
+                return False
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+            return True
+
+        def collect_one():
+            # ワーカーが停止しても待ち続けないよう、一定間隔でワーカーの生存とタイムアウトを確認する
+            nonlocal last_check
+            try:
+                job_id, pid, result, error = self._result_queue.get(timeout=PREFORK_RESULT_POLL_SECONDS)
+            except queue.Empty:
+                job_id = None
+            # inflight にないジョブは失敗として処理済み (作り直したワーカーの遅れて届いた結果) なので捨てる
+            if job_id is not None and release(job_id):
+                if error:
+                    print(f"Worker {pid} failed on {image_paths[job_id]}: {error}")
+                else:
+                    results[job_id] = result
+            if job_id is None or time.monotonic() - last_check >= PREFORK_RESULT_POLL_SECONDS:
+                last_check = time.monotonic()
+                for failed_id, reason in self._recover_workers(inflight, submitted_at):
+                    release(failed_id)
+                    print(f"Error: {image_paths[failed_id]} failed: {reason}")
+
+        while next_index < len(image_paths) or inflight:
+            # 共有メモリの使用量を抑えるため、同時展開数を max_inflight までに制限する
+            while next_index < len(image_paths) and len(inflight) < self.max_inflight:
+                image_path = image_paths[next_index]
+                with span('image.decode'):
+                    image = cv2.imread(image_path)
+                if image is None:
+                    print(f"Error: Could not load image from {image_path}")
+                else:
+                    shm = self._to_shared_memory(image)
+                    inflight[next_index] = shm
+                    submitted_at[next_index] = time.monotonic()
+                    self._task_queue.put((next_index, task, shm.name, image.shape, image.dtype.str))
+                next_index += 1
+            if inflight:
+                collect_one()
+
+        return results
+
+    def memory_report(self):
+        """
+        親プロセスと各ワーカーのRSS/USSを返す。
+        ワーカーのUSSが重みのサイズより十分小さければ、copy-on-write共有が効いている。
+        """
+        report = {'parent': {'pid': os.getpid(), **get_process_memory(os.getpid())}, 'workers': []}
+        for p in self._workers:
+            if p.is_alive():
+                report['workers'].append({'pid': p.pid, **get_process_memory(p.pid)})
+        report['total_worker_uss_mb'] = sum(w['uss_mb'] for w in report['workers'])
+        return report
+
+
+def print_memory_report(report):
+    """memory_report() の結果を整形して表示する"""
+    parent = report['parent']
+    print(f"{'Process':<10} {'PID':<8} {'RSS (MB)':>10} {'USS (MB)':>10}")
+    print("-" * 42)
+    print(f"{'parent':<10} {parent['pid']:<8} {parent['rss_mb']:>10.1f} {parent['uss_mb']:>10.1f}")
+    for i, w in enumerate(report['workers']):
+        print(f"{f'worker{i}':<10} {w['pid']:<8} {w['rss_mb']:>10.1f} {w['uss_mb']:>10.1f}")
+    print("-" * 42)
+    print(f"Total worker USS: {report['total_worker_uss_mb']:.1f} MB")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run YOLO/OCR inference with a prefork worker pool.')
+    parser.add_argument('images', nargs='+', help='推論対象の画像パス')
+    parser.add_argument('--task', choices=[TASK_YOLO, TASK_OCR], default=TASK_YOLO)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    with PreforkWorkerPool(num_workers=args.workers,
+                           load_yolo=(args.task == TASK_YOLO),
+                           load_ocr=(args.task == TASK_OCR)) as pool:
+        start = time.perf_counter()
+        outputs = pool.map_images(args.images, task=args.task)
+        elapsed = time.perf_counter() - start
+        for path, output in zip(args.images, outputs):
+            print(f"{path}: {output}")
+        print(f"\nProcessed {len(args.images)} images in {elapsed:.2f}s")
+        print_memory_report(pool.memory_report())
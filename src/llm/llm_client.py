@@ -0,0 +1,129 @@
+# src/llm/llm_client.py
+
+import os
+import sys
+import json
+import time
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.config import GEMINI_API_KEY, GEMINI_MODEL_NAME
+from src.observability.instrumentation import span, inc
+
+try:
+    from src.config import LLM_BACKEND # 'gemini' または 'stub'
+except ImportError:
+    LLM_BACKEND = 'gemini'
+
+
+# ----------------------------------------------------
+# LLMクライアントの共通インターフェース
+# ----------------------------------------------------
+class LLMClient:
+    """
+    LLMバックエンドの共通インターフェース。
+    generate() はプロンプトを受け取り、応答テキスト（JSON指定時はJSON文字列）を返す。
+    バックエンドは _generate() を実装する（呼び出し回数と計装は generate() が共通で行う）。
+    """
+    backend = 'base'
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.call_count = 0 # 実際にバックエンドへ送ったリクエスト数
+
+    def generate(self, prompt, json_output=True):
+        self.call_count += 1
+        inc('llm_calls_total', backend=self.backend)
+        with span('llm.generate', backend=self.backend, model=self.model_name, prompt_chars=len(prompt)):
+            return self._generate(prompt, json_output)
+
+    def _generate(self, prompt, json_output):
+        raise NotImplementedError
+
+
+class GeminiClient(LLMClient):
+    """Google Gemini API クライアント。genai.configure とモデル生成はインスタンスごとに一度だけ行う。"""
+    backend = 'gemini'
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME, api_key=GEMINI_API_KEY):
+        super().__init__(model_name)
+        import google.generativeai as genai # オフライン環境でもstubを使えるよう遅延インポート
+        self._genai = genai
+        genai.configure(api_key=api_key)
+        self._model = genai.GenerativeModel(model_name)
+
+    def _generate(self, prompt, json_output):
+        generation_config = None
+        if json_output:
+            # response_mime_type を application/json に指定することで、Geminiがより厳密にJSONを返そうとします
+            generation_config = self._genai.types.GenerationConfig(response_mime_type="application/json")
+        response = self._model.generate_content(prompt, generation_config=generation_config)
+        return response.text
+
+
+class StubLLMClient(LLMClient):
+    """
+    ネットワークを使わないローカルスタブ。テストやベンチマークでLLM呼び出し経路をオフラインで動かす。
+
+    responder にプロンプト -> 応答テキストの関数を渡すと、その結果を返す。
+    省略時は固定のレシピJSONを返す。
+    """
+    backend = 'stub'
+
+    DEFAULT_RESPONSE = json.dumps({
+        "recipes": [
+            {"meal_type": "朝食", "name": "スクランブルエッグ", "description": "卵で手軽に作れる朝食です。",
+             "ingredients": ["卵", "牛乳", "塩"]},
+            {"meal_type": "昼食", "name": "野菜うどん", "description": "冷蔵庫の野菜を使った温かいうどんです。",
+             "ingredients": ["うどん", "キャベツ", "にんじん"]},
+            {"meal_type": "夕食", "name": "鶏肉のトマト煮込み", "description": "トマトで煮込んだ一品です。",
+             "ingredients": ["鶏むね肉", "トマト", "玉ねぎ"]},
+        ]
+    }, ensure_ascii=False)
+
+    def __init__(self, model_name='stub', responder=None, latency=0.0):
+        """
+        Args:
+            model_name (str): キャッシュキーなどに使われるモデル名。
+            responder (callable): プロンプトを受け取り応答テキストを返す関数。
+            latency (float): ネットワーク遅延を模擬する待ち時間（秒）。ベンチマーク用。
+        """
+        super().__init__(model_name)
+        self.responder = responder
+        self.latency = latency
+        self.prompts = [] # 受け取ったプロンプトの履歴（テスト用）
+
+    def _generate(self, prompt, json_output):
+        self.prompts.append(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.responder is not None:
+            return self.responder(prompt)
+        return self.DEFAULT_RESPONSE
+
+
+_client_instances = {} # (backend, model_name) -> LLMClient
+
+
+def get_llm_client(backend=None, model_name=None):
+    """
+    バックエンド名に応じたLLMクライアントを返す。同じ (backend, model_name) のクライアントは再利用する。
+
+    Args:
+        backend (str): 'gemini' または 'stub'。Noneの場合は config の LLM_BACKEND。
+        model_name (str): モデル名。Noneの場合は config の GEMINI_MODEL_NAME。
+    """
+    backend = backend or LLM_BACKEND
+    model_name = model_name or GEMINI_MODEL_NAME
+    key = (backend, model_name)
+    if key not in _client_instances:
+        if backend == 'gemini':
+            _client_instances[key] = GeminiClient(model_name=model_name)
+        elif backend == 'stub':
+            _client_instances[key] = StubLLMClient(model_name=model_name)
+        else:
+            raise ValueError(f"Unknown LLM backend: {backend}")
+    return _client_instances[key]
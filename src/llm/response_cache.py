@@ -0,0 +1,197 @@
+# src/llm/response_cache.py
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from src.config import LLM_CACHE_PATH
+except ImportError:
+    LLM_CACHE_PATH = os.path.join(project_root, 'data', 'llm_cache.db')
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60 # 1週間
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024 # 応答テキストの合計サイズ上限
+
+
+def normalize_ingredients(ingredients):
+    """食材名のリストを正規化（NFKC・空白除去・小文字化）し、重複を除いてソートする"""
+    normalized = set()
+    for name in ingredients:
+        name = unicodedata.normalize('NFKC', str(name)).strip().lower()
+        if name:
+            normalized.add(name)
+    return sorted(normalized)
+
+
+def make_cache_key(ingredients, model_name, prompt_version):
+    """正規化した食材セット・モデル名・プロンプトバージョンからキャッシュキーを作る"""
+    payload = json.dumps([normalize_ingredients(ingredients), model_name, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLiteに保存する永続的なLLM応答キャッシュ。
+    TTLを過ぎたエントリは無効になり、件数または合計サイズが上限を超えると
+    最終アクセスが古いものから削除される (LRU)。
+    1つの接続を複数のスレッド (イベントループのスレッドや to_thread のワーカー) から使えるよう、
+    接続は check_same_thread=False で開き、操作はロックで直列化する。
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # キャッシュヒットをミリ秒以内で返すため、接続は開いたまま保持する
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                cache_key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_response_cache (last_access)')
+        self._conn.commit()
+
+    def get(self, cache_key):
+        """キャッシュを引く。存在しないかTTL切れの場合はNone"""
+        with self._lock:
+            now = time.time()
+            row = self._conn.execute(
+                'SELECT response, created_at FROM llm_response_cache WHERE cache_key = ?', (cache_key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute('DELETE FROM llm_response_cache WHERE cache_key = ?', (cache_key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE llm_response_cache SET last_access = ? WHERE cache_key = ?', (now, cache_key))
+            self._conn.commit()
+            self.hits += 1
+            return response
+
+    def put(self, cache_key, response, namespace='default'):
+        """応答を保存し、上限を超えた分を削除する"""
+        with self._lock:
+            now = time.time()
+            self._conn.execute('''
+                INSERT OR REPLACE INTO llm_response_cache
+                    (cache_key, namespace, response, size_bytes, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (cache_key, namespace, response, len(response.encode('utf-8')), now, now))
+            self._evict()
+            self._conn.commit()
+
+    def get_many(self, cache_keys):
+        """
+        複数のキーをまとめて引く（1トランザクション）。
+
+        Returns:
+            dict: ヒットしたキー -> 応答
+        """
+        with self._lock:
+            now = time.time()
+            found = {}
+            expired = []
+            cache_keys = list(dict.fromkeys(cache_keys))
+            # SQLiteのパラメータ数上限を超えないように分割して問い合わせる
+            for i in range(0, len(cache_keys), 500):
+                chunk = cache_keys[i:i + 500]
+                placeholders = ', '.join(['?'] * len(chunk))
+                for cache_key, response, created_at in self._conn.execute(
+                        f'SELECT cache_key, response, created_at FROM llm_response_cache WHERE cache_key IN ({placeholders})',
+                        chunk):
+                    if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                        expired.append((cache_key,))
+                    else:
+                        found[cache_key] = response
+            with self._conn:
+                self._conn.executemany('DELETE FROM llm_response_cache WHERE cache_key = ?', expired)
+                self._conn.executemany('UPDATE llm_response_cache SET last_access = ? WHERE cache_key = ?',
+                                       [(now, k) for k in found])
+            self.hits += len(found)
+            self.misses += len(cache_keys) - len(found)
+            return found
+
+    def put_many(self, items, namespace='default'):
+        """キー -> 応答 の辞書をまとめて保存する（1トランザクション）"""
+        with self._lock:
+            now = time.time()
+            with self._conn:
+                self._conn.executemany('''
+                    INSERT OR REPLACE INTO llm_response_cache
+                        (cache_key, namespace, response, size_bytes, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [(k, namespace, v, len(v.encode('utf-8')), now, now) for k, v in items.items()])
+                self._evict()
+
+    def _evict(self):
+        """TTL切れのエントリを削除し、件数・サイズ上限を超えた分を古い順に削除する"""
+        if self.ttl_seconds is not None:
+            self._conn.execute('DELETE FROM llm_response_cache WHERE created_at < ?',
+                               (time.time() - self.ttl_seconds,))
+
+        count, total_bytes = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_response_cache'
+        ).fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # 最終アクセスが新しい順に走査し、上限内に収まらないエントリを削除対象とする
+        keep_count = 0
+        keep_bytes = 0
+        evict_keys = []
+        for cache_key, size_bytes in self._conn.execute(
+                'SELECT cache_key, size_bytes FROM llm_response_cache ORDER BY last_access DESC'):
+            if keep_count < self.max_entries and keep_bytes + size_bytes <= self.max_bytes:
+                keep_count += 1
+                keep_bytes += size_bytes
+            else:
+                evict_keys.append((cache_key,))
+        self._conn.executemany('DELETE FROM llm_response_cache WHERE cache_key = ?', evict_keys)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_response_cache')
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """プロセス内で共有するデフォルトのキャッシュを返す"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = LLMResponseCache()
+    return _default_cache
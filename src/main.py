@@ -4,7 +4,8 @@ import os
 import sys
 from datetime import datetime
 import json
-import google.generativeai as genai
+import time
+import logging
 
 # === 1. プロジェクトルートをsys.pathに追加 (全モジュールのインポートのために必須) ===
 # このスクリプトがどこから実行されても、常にプロジェクトのルートディレクトリ (re2_yolo/) をsys.pathに追加する
@@ -21,30 +22,81 @@ if _project_root not in sys.path:
 # これが、コード全体で使用するPROJECT_ROOTになります。
 from src.config import PROJECT_ROOT, YOLO_MODEL_PATH, OCR_CONFIDENCE_THRESHOLD, \
                        TARGET_FOOD_YOLO_CLASSES, STANDARD_TO_YOLO_CLASS_MAP, \
-                       DATABASE_PATH, GEMINI_API_KEY, GEMINI_MODEL_NAME, \
+                       DATABASE_PATH, GEMINI_MODEL_NAME, \
                        YOLO_CLASS_CONSOLIDATION_MAP, YOLO_CLASS_ALIASES
 
+# ログと計装 (print の代わりにレベル付きのログを使い、本番では LOG_LEVEL で抑制できる)
+from src.observability.instrumentation import span, traced, inc, configure_logging, configure as configure_instrumentation, \
+                                             summary as instrumentation_summary, is_enabled as instrumentation_enabled
+
 # YOLOv8関連 - predict_on_imageがモデルロードと推論をラップ
 from src.yolo_detection.predict_yolo import predict_on_image  
 
 # OCR関連
-from src.ocr_processing.run_ocr import perform_ocr  
-from src.ocr_processing.receipt_parser import parse_receipt_text_simple 
+from src.ocr_processing.run_ocr import perform_ocr_on_array  
+from src.ocr_processing.receipt_fingerprint import load_receipt_image, text_fingerprint 
+from src.ocr_processing.receipt_parser import parse_receipt_text_simple, HybridReceiptParser 
+
+try:
+    from src.config import RECEIPT_PARSER_MODE # 'simple' (キーワードのみ) または 'hybrid' (キーワード + LLM)
+except ImportError:
+    RECEIPT_PARSER_MODE = 'simple'
+
+try:
+    from src.config import RECEIPT_DUPLICATE_CHECK # 同じレシートの二重取り込みを検出する (重複は在庫に反映しない)
+except ImportError:
+    RECEIPT_DUPLICATE_CHECK = True
 
 # データベース関連
 from src.database.db_manager import create_table, add_food_item, update_food_item_quantity, \
                                    update_food_item_details, get_all_food_items, \
                                    mark_as_consumed_or_discarded, delete_food_item, \
-                                   get_db_connection, get_food_item_by_id 
+                                   get_db_connection, get_food_item_by_id, \
+                                   get_distinct_standard_names, get_food_items_columns, iter_food_items, \
+                                   apply_scan_counts, event_batch, get_expiring_items, \
+                                   transaction, current_batch_id, find_duplicate_receipt_image, register_receipt 
+from src.database.shard_router import DEFAULT_HOUSEHOLD_ID 
+
+try:
+    from src.config import YOLO_MISSING_ITEM_POLICY # 前回まで見えていて今回見えない食材の扱い: 'keep', 'decrement', 'consumed'
+except ImportError:
+    YOLO_MISSING_ITEM_POLICY = 'keep'
+
+try:
+    from src.config import YOLO_MISSING_GRACE_DAYS # 最後に見てからこの日数は、見えなくても在庫に残す
+except ImportError:
+    YOLO_MISSING_GRACE_DAYS = 2
+
+# LLM関連 (クライアントはバックエンドを差し替え可能。応答はキャッシュする)
+from src.llm.llm_client import get_llm_client
+from src.llm.response_cache import get_default_cache, make_cache_key
+
+# ローカルレシピ検索
+from src.recipes.recipe_store import get_default_store, build_ingredient_weights, EXPIRY_BOOST_DAYS
+
+try:
+    from src.config import RECIPE_RECOMMENDATION_MODE # 'llm', 'local', 'hybrid'
+except ImportError:
+    RECIPE_RECOMMENDATION_MODE = 'llm'
+
+# レシピ推薦プロンプトのバージョン。プロンプトを変更したら更新し、古いキャッシュを無効にする
+RECIPE_PROMPT_VERSION = 'v1'
+RECIPE_RERANK_CANDIDATES = 10 # hybridモードでLLMに渡す候補数
+
+logger = logging.getLogger(__name__)
 
 
 # === 4. 各処理フロー関数 === 
-def analyze_fridge_image(image_path): 
-    """冷蔵庫画像をYOLOv8で解析し、DBを更新する""" 
-    print(f"\n--- Analyzing fridge image: {image_path} ---") 
+@traced('flow.analyze_fridge')
+def analyze_fridge_image(image_path, latency_budget_ms=None, queue_depth=0, household_id=DEFAULT_HOUSEHOLD_ID): 
+    """
+    冷蔵庫画像をYOLOv8で解析し、世帯の在庫DBを更新する。
+    latency_budget_ms / queue_depth を指定すると、モデルラダーから予算内のモデル・画像サイズで推論する。
+    """ 
+    logger.info("--- Analyzing fridge image: %s ---", image_path) 
      
     # YOLO検出 
-    detected_yolo_items = predict_on_image(image_path) 
+    detected_yolo_items = predict_on_image(image_path, latency_budget_ms=latency_budget_ms, queue_depth=queue_depth) 
 
     # YOLO検出結果を標準化するロジックをここに組み込む 
     standardized_yolo_items = [] 
@@ -55,167 +107,196 @@ def analyze_fridge_image(image_path):
         standardized_yolo_items.append({ 
             'yolo_class': consolidated_yolo_class, 
             'confidence': item['confidence'], 
-            'bbox': item['bbox'] 
+            'bbox': item['bbox'], 
+            'model_variant': item.get('model_variant'), 
         }) 
 
-    print("YOLO Detected Items (standardized by YOLO_CLASS_CONSOLIDATION_MAP):") 
+    logger.info("YOLO Detected Items (standardized by YOLO_CLASS_CONSOLIDATION_MAP):") 
     if not standardized_yolo_items: 
-        print(" - No target food items detected by YOLO.") 
+        logger.info(" - No target food items detected by YOLO.") 
     else: 
         for item in standardized_yolo_items: 
-            print(f" - {item['yolo_class']} (Conf: {item['confidence']:.2f})") 
+            logger.debug(" - %s (Conf: %.2f, Model: %s)", item['yolo_class'], item['confidence'], item['model_variant']) 
 
-    # データベース更新ロジック: YOLO検出されたアイテムを既存DBと比較し、更新/追加などを判断 
-    current_active_items = get_all_food_items(status='active') 
-     
+    # データベース更新ロジック: 検出をクラスごとに集計し、クラスごとに1回だけ更新/追加する 
+    # (検出1件ごとに行を追加すると、スキャンのたびに在庫の行が増え続けるため) 
     yolo_counts = {} 
     for item in standardized_yolo_items: 
         yolo_counts[item['yolo_class']] = yolo_counts.get(item['yolo_class'], 0) + 1 
      
-    print("YOLO Detected Counts:", yolo_counts) 
-
-    for yolo_detected_item in standardized_yolo_items: 
-        yolo_class = yolo_detected_item['yolo_class'] 
-         
-        found_in_db_for_yolo_update = False 
-        for db_item in current_active_items: 
-            if db_item['id'] in processed_db_item_ids: # ここは analyze_fridge_image には不要 (receipt_processing用)
-                continue # Safety check, but processed_db_item_ids is for receipt processing
-
-            # 1. 完全に同じ標準名（かつアクティブ）のアイテムがDBに既に存在する場合 
-            #    YOLO検出で更新する対象として、最も具体的なアイテムを優先 
-            if db_item['standard_name'] == yolo_class and db_item['status'] == 'active': 
-                # 同じYOLOクラス名を持つアイテムがDBに存在する場合、そのlast_seen_dateを更新 
-                update_food_item_details(db_item['id'], last_seen_date=datetime.now().strftime('%Y-%m-%d')) 
-                print(f"Updated last seen date for existing '{db_item['standard_name']}' (ID: {db_item['id']}).") 
-                found_in_db_for_yolo_update = True 
-                break 
-         
-        if not found_in_db_for_yolo_update: 
-            # YOLOで検出されたがDBにないアイテムは、新規追加として扱う 
-            # 標準名はYOLOクラス名そのまま（後でレシート情報で具体化されることを期待） 
-            print(f"Adding new item '{yolo_class}' from YOLO detection.") 
-            add_food_item( 
-                standard_name=yolo_class, 
-                yolo_class=yolo_class, 
-                quantity=1, # YOLO検出では一旦1個と仮定（個体識別は困難なため） 
-                purchase_date=datetime.now().strftime('%Y-%m-%d'), # YOLOで検出された日を購入日とする
-                detected_by='yolo' 
-            ) 
-    print("Fridge analysis complete.") 
+    logger.info("YOLO Detected Counts: %s", yolo_counts) 
+    # 1回の推論は1つのバリアントで行うので、検出に付いているバリアントをスキャンとともに記録する
+    # (検出がない場合は分からないので None) 
+    model_variant = next((item['model_variant'] for item in standardized_yolo_items if item['model_variant']), None) 
+
+    detectable_classes = {YOLO_CLASS_CONSOLIDATION_MAP.get(c, c) for c in TARGET_FOOD_YOLO_CLASSES} 
+    with event_batch() as batch_id: 
+        result = apply_scan_counts(yolo_counts, class_aliases=YOLO_CLASS_ALIASES, 
+                                   missing_policy=YOLO_MISSING_ITEM_POLICY, 
+                                   missing_grace_days=YOLO_MISSING_GRACE_DAYS, 
+                                   detectable_classes=detectable_classes, household_id=household_id, 
+                                   model_variant=model_variant) 
+    logger.info("Scan reconciled: %d added, %d updated, %d merged duplicates, %d missing (%s). Batch: %s, scan: %s (%s)", 
+                len(result['inserted']), len(result['updated']), len(result['merged']), 
+                len(result['missing']), YOLO_MISSING_ITEM_POLICY, batch_id, result['scan_id'], model_variant) 
+    logger.info("Fridge analysis complete.") 
     return detected_yolo_items 
 
 
-def process_receipt_image(receipt_image_path): 
-    """レシート画像をOCRで解析し、DBを更新する""" 
-    print(f"\n--- Processing receipt image: {receipt_image_path} ---") 
+@traced('flow.process_receipt')
+def process_receipt_image(receipt_image_path, household_id=DEFAULT_HOUSEHOLD_ID, force=False): 
+    """
+    レシート画像をOCRで解析し、世帯の在庫DBを更新する。
+    既に取り込んだレシートと同じファイル (SHA-1 が一致) ならOCRをせずに終わる。写真が似ているだけのレシートは
+    OCRして日時・合計などで照合し、内容が重複していれば在庫に反映せず
+    'flagged' として記録する (db_manager.list_receipts で確認できる)。force=True で重複の確認をしない。
+    """ 
+    logger.info("--- Processing receipt image: %s ---", receipt_image_path) 
+
+    # 画像を1回だけ読み込み、OCRの前に同じファイルかどうかを調べる (dHash が近いだけの写真は OCR 後に照合する) 
+    img, image_fp = load_receipt_image(receipt_image_path) 
+    if img is None: 
+        logger.warning("Could not load receipt image: %s", receipt_image_path) 
+        return [] 
+    check_duplicates = RECEIPT_DUPLICATE_CHECK and not force 
+    if check_duplicates: 
+        duplicate = find_duplicate_receipt_image(image_fp, household_id=household_id) 
+        if duplicate is not None and duplicate['reason'] == 'image_exact': 
+            register_receipt(image_fp, household_id=household_id, status='skipped', 
+                             duplicate_of=duplicate['receipt_id'], duplicate_reason=duplicate['reason']) 
+            inc('receipt_duplicates_total', kind='skipped') 
+            logger.warning("Receipt image is identical to receipt %s; skipping OCR.", duplicate['receipt_id']) 
+            return [] 
 
     # OCRによるテキスト抽出 
-    ocr_results_detail = perform_ocr(receipt_image_path, detail=1) 
+    ocr_results_detail = perform_ocr_on_array(img, detail=1) 
 
     if not ocr_results_detail: 
-        print("No text extracted from receipt.") 
+        logger.warning("No text extracted from receipt.") 
         return [] 
 
     # 信頼度でフィルタリング 
     filtered_text_list = [item[1] for item in ocr_results_detail if item[2] >= OCR_CONFIDENCE_THRESHOLD] 
      
     # レシートテキストの解析 
-    parsed_items_from_receipt = parse_receipt_text_simple(filtered_text_list) 
+    if RECEIPT_PARSER_MODE == 'hybrid': 
+        # キーワードで特定できなかった行だけをLLMに送る 
+        parsed_items_from_receipt = HybridReceiptParser().parse(filtered_text_list) 
+    else: 
+        parsed_items_from_receipt = parse_receipt_text_simple(filtered_text_list) 
 
     if not parsed_items_from_receipt: 
-        print("No valid food items parsed from receipt.") 
+        logger.warning("No valid food items parsed from receipt.") 
         return [] 
 
-    print("Parsed items from receipt:", parsed_items_from_receipt) 
+    logger.info("Parsed items from receipt: %s", parsed_items_from_receipt) 
 
-    current_active_items_in_db = get_all_food_items(status='active') 
+    # このレシートによる変更と指紋を1つのトランザクション・バッチにまとめる (undo_batch で取り込み全体を取り消せる) 
+    with transaction(household_id): 
+        batch_id = current_batch_id() 
+        receipt_id, duplicate = register_receipt({**image_fp, **text_fingerprint(filtered_text_list, 
+                                                                                 parsed_items_from_receipt)}, 
+                                                 household_id=household_id, check_duplicates=check_duplicates) 
+        if duplicate is not None: 
+            inc('receipt_duplicates_total', kind='flagged') 
+            logger.warning("Receipt %s looks like a duplicate of receipt %s (%s); not applied to the inventory.", 
+                           receipt_id, duplicate['receipt_id'], duplicate['reason']) 
+            return [] 
 
-    processed_db_item_ids = set() # 既にこのレシート処理で使われたDBアイテムIDを追跡
+        current_active_items_in_db = get_all_food_items(status='active', household_id=household_id) 
+
+        processed_db_item_ids = set() # 既にこのレシート処理で使われたDBアイテムIDを追跡
     
-    for item_from_receipt in parsed_items_from_receipt: 
-        standard_name_receipt = item_from_receipt['item_name'] 
-        quantity_receipt = item_from_receipt['quantity'] 
+        for item_from_receipt in parsed_items_from_receipt: 
+            standard_name_receipt = item_from_receipt['item_name'] 
+            quantity_receipt = item_from_receipt['quantity'] 
          
-        corresponding_yolo_class = STANDARD_TO_YOLO_CLASS_MAP.get(standard_name_receipt, 'unknown_yolo_class') 
-
-        candidate_yolo_classes_for_match = [corresponding_yolo_class] 
-        if corresponding_yolo_class in YOLO_CLASS_ALIASES: # configからインポートした YOLO_CLASS_ALIASES を使う
-            candidate_yolo_classes_for_match.extend(YOLO_CLASS_ALIASES[corresponding_yolo_class]) 
-        candidate_yolo_classes_for_match = list(set(candidate_yolo_classes_for_match)) # 重複を削除
-
-
-        # 最適なマッチングアイテムをここで探す 
-        best_match_db_item = None 
-        is_exact_standard_name_match = False # 最も強いマッチタイプを追跡 
-
-        # 優先順位1: 完全に同じ「標準名」を持つアクティブなアイテムを探す 
-        for db_item in current_active_items_in_db: 
-            if db_item['id'] in processed_db_item_ids: 
-                continue 
-            if db_item['standard_name'] == standard_name_receipt and db_item['status'] == 'active': 
-                best_match_db_item = db_item 
-                is_exact_standard_name_match = True 
-                break # 最優先マッチが見つかったら即終了 
-
-        # 優先順位1で見つからなかった場合のみ、優先順位2を探す 
-        if best_match_db_item is None: 
-            # 優先順位2: YOLOクラスがマッチング候補にあり、かつ標準名が汎用的なアイテムを探す 
+            corresponding_yolo_class = STANDARD_TO_YOLO_CLASS_MAP.get(standard_name_receipt, 'unknown_yolo_class') 
+
+            candidate_yolo_classes_for_match = [corresponding_yolo_class] 
+            if corresponding_yolo_class in YOLO_CLASS_ALIASES: # configからインポートした YOLO_CLASS_ALIASES を使う
+                candidate_yolo_classes_for_match.extend(YOLO_CLASS_ALIASES[corresponding_yolo_class]) 
+            candidate_yolo_classes_for_match = list(set(candidate_yolo_classes_for_match)) # 重複を削除
+
+
+            # 最適なマッチングアイテムをここで探す 
+            best_match_db_item = None 
+            is_exact_standard_name_match = False # 最も強いマッチタイプを追跡 
+
+            # 優先順位1: 完全に同じ「標準名」を持つアクティブなアイテムを探す 
             for db_item in current_active_items_in_db: 
                 if db_item['id'] in processed_db_item_ids: 
                     continue 
-                # YOLOクラスが候補にあり、かつDBのstandard_nameがそのyolo_class名そのまま（汎用名）の場合 
-                if (db_item['yolo_class'] in candidate_yolo_classes_for_match and  
-                    db_item['standard_name'] == db_item['yolo_class'] and  
-                    db_item['status'] == 'active'): 
+                if db_item['standard_name'] == standard_name_receipt and db_item['status'] == 'active': 
+                    best_match_db_item = db_item 
+                    is_exact_standard_name_match = True 
+                    break # 最優先マッチが見つかったら即終了 
+
+            # 優先順位1で見つからなかった場合のみ、優先順位2を探す 
+            if best_match_db_item is None: 
+                # 優先順位2: YOLOクラスがマッチング候補にあり、かつ標準名が汎用的なアイテムを探す 
+                for db_item in current_active_items_in_db: 
+                    if db_item['id'] in processed_db_item_ids: 
+                        continue 
+                    # YOLOクラスが候補にあり、かつDBのstandard_nameがそのyolo_class名そのまま（汎用名）の場合 
+                    if (db_item['yolo_class'] in candidate_yolo_classes_for_match and  
+                        db_item['standard_name'] == db_item['yolo_class'] and  
+                        db_item['status'] == 'active'): 
                       
-                     # 念のため、レシートの品目名がYOLOクラス名と異なり、より具体的であることも確認 
-                     # （標準名が既に具体的な場合、汎用マッチで上書きしないように） 
-                    if standard_name_receipt != db_item['yolo_class']:  
-                        best_match_db_item = db_item 
-                        break # 最初に見つかった汎用マッチを優先
-         # === マッチング結果に基づいて更新または新規追加 === 
-        if best_match_db_item: 
-            # データベースアイテムを更新 (standard_nameをレシートの具体的な名前に更新) 
-            # Quantityも合算 
-            update_food_item_details(best_match_db_item['id'],  
-                                    standard_name=standard_name_receipt,  
-                                    detected_by='both') 
-            update_food_item_quantity(best_match_db_item['id'],  
-                                    best_match_db_item['quantity'] + quantity_receipt,  
-                                    detected_by='both') 
+                         # 念のため、レシートの品目名がYOLOクラス名と異なり、より具体的であることも確認 
+                         # （標準名が既に具体的な場合、汎用マッチで上書きしないように） 
+                        if standard_name_receipt != db_item['yolo_class']:  
+                            best_match_db_item = db_item 
+                            break # 最初に見つかった汎用マッチを優先
+             # === マッチング結果に基づいて更新または新規追加 === 
+            if best_match_db_item: 
+                # データベースアイテムを更新 (standard_nameをレシートの具体的な名前に更新) 
+                # Quantityも合算 
+                update_food_item_details(best_match_db_item['id'],  
+                                        household_id=household_id, 
+                                        standard_name=standard_name_receipt,  
+                                        detected_by='both', event_type='receipt_matched') 
+                update_food_item_quantity(best_match_db_item['id'],  
+                                        best_match_db_item['quantity'] + quantity_receipt,  
+                                        detected_by='both', household_id=household_id, 
+                                        event_type='receipt_matched') 
               
-            # ログメッセージを状況に合わせて調整 
-            if best_match_db_item['standard_name'] == best_match_db_item['yolo_class']: # 具体化された場合 
-                print(f"Refined and updated item: '{standard_name_receipt}' (ID: {best_match_db_item['id']}) from receipt (was '{best_match_db_item['yolo_class']}').") 
-            else: # 数量更新のみの場合 
-                print(f"Updated quantity for existing item: '{standard_name_receipt}' (ID: {best_match_db_item['id']}) from receipt. (Already specific)") 
+                # ログメッセージを状況に合わせて調整 
+                if best_match_db_item['standard_name'] == best_match_db_item['yolo_class']: # 具体化された場合 
+                    logger.info("Refined and updated item: '%s' (ID: %s) from receipt (was '%s').", 
+                                standard_name_receipt, best_match_db_item['id'], best_match_db_item['yolo_class']) 
+                else: # 数量更新のみの場合 
+                    logger.info("Updated quantity for existing item: '%s' (ID: %s) from receipt. (Already specific)", 
+                                standard_name_receipt, best_match_db_item['id']) 
               
-            processed_db_item_ids.add(best_match_db_item['id']) # このアイテムは処理済み 
-
-        else: # DBにマッチするアイテムがない場合 (完全に新規の品目) 
-            print(f"Adding new item '{standard_name_receipt}' from receipt.") 
-            add_food_item( 
-                standard_name=standard_name_receipt, 
-                yolo_class=corresponding_yolo_class,  
-                quantity=quantity_receipt, 
-                purchase_date=datetime.now().strftime('%Y-%m-%d'), 
-                detected_by='receipt' 
-            ) 
-    print("Receipt processing complete.")    
-
-def display_inventory(): 
-    """現在の冷蔵庫在庫を表示する""" 
+                processed_db_item_ids.add(best_match_db_item['id']) # このアイテムは処理済み 
+
+            else: # DBにマッチするアイテムがない場合 (完全に新規の品目) 
+                logger.info("Adding new item '%s' from receipt.", standard_name_receipt) 
+                add_food_item( 
+                    standard_name=standard_name_receipt, 
+                    yolo_class=corresponding_yolo_class,  
+                    quantity=quantity_receipt, 
+                    purchase_date=datetime.now().strftime('%Y-%m-%d'), 
+                    detected_by='receipt', 
+                    household_id=household_id, 
+                    event_type='receipt_added' 
+                ) 
+    logger.info("Receipt processing complete. Receipt: %s, Batch: %s", receipt_id, batch_id)    
+
+def display_inventory(household_id=DEFAULT_HOUSEHOLD_ID): 
+    """世帯の現在の冷蔵庫在庫を表示する""" 
     print("\n--- Current Refrigerator Inventory ---") 
-    items = get_all_food_items(status='active') 
-    if not items: 
-        print("Your refrigerator is empty!") 
-        return 
-
-    # 見やすいように整形して表示 
-    print(f"{'ID':<4} {'Name':<20} {'YOLO Class':<15} {'Qty':<5} {'Unit':<5} {'Purchase Date':<15} {'Detected By':<12}") 
-    print("-" * 80) 
+    # 表示に必要なカラムだけを fetchmany で少しずつ読み出す 
+    items = iter_food_items(columns=['id', 'standard_name', 'yolo_class', 'quantity', 'unit', 
+                                     'purchase_date', 'detected_by'], status='active', household_id=household_id) 
+    header_printed = False 
     for item in items: 
+        if not header_printed: 
+            # 見やすいように整形して表示 
+            print(f"{'ID':<4} {'Name':<20} {'YOLO Class':<15} {'Qty':<5} {'Unit':<5} {'Purchase Date':<15} {'Detected By':<12}") 
+            print("-" * 80) 
+            header_printed = True 
          # SQLite.Rowオブジェクトは辞書のようにアクセスできる 
         qty_display = item['quantity'] if item['quantity'] is not None else 0 
         unit_display = item['unit'] if item['unit'] is not None else '-' 
@@ -223,39 +304,15 @@ def display_inventory():
         detected_by_display = item['detected_by'] if item['detected_by'] is not None else '-' 
 
         print(f"{item['id']:<4} {item['standard_name']:<20} {item['yolo_class']:<15} {qty_display:<5.1f} {unit_display:<5} {purchase_date_display:<15} {detected_by_display:<12}") 
-    print("-" * 80) 
-
-def recommend_recipes_with_llm(): 
-    """ 
-    YOLOとレシートの両方で検出された食材を使って、LLMにレシピを推薦させる。 
-    """ 
-    print("\n---レシピ推薦(LLM活用)---") 
-
-     # 1. データベースから 'both' で検出された食材を取得 
-    all_items = get_all_food_items()  
-    both_detected_items = [] 
-    for item in all_items: 
-        if item['detected_by'] == 'both': 
-            both_detected_items.append(item['standard_name'])  
 
-    if not both_detected_items: 
-        print("YOLOとレシートの両方で検出された食材がありません。") 
-        print("まず冷蔵庫画像を解析し、その後レシートを処理して食材を紐付けてください。") 
+    if not header_printed: 
+        print("Your refrigerator is empty!") 
         return 
+    print("-" * 80) 
 
-    unique_ingredients = list(set(both_detected_items)) 
-    ingredients_str = ", ".join(unique_ingredients) 
-
-    print(f"冷蔵庫にある食材（両方で検出）: {ingredients_str}") 
-
-     # Gemini APIの初期設定 
-    genai.configure(api_key=GEMINI_API_KEY) 
-    model = genai.GenerativeModel(GEMINI_MODEL_NAME) # config.pyで定義したモデル名を使用 
-
-
-     # 2. LLMへのプロンプト生成 
-     # LLMがJSONを生成しやすくするために、プロンプトを調整 
-    prompt = f"""あなたは料理の専門家であり、レシピの提案者です。 
+def build_recipe_prompt(ingredients_str):
+    """レシピ推薦用のプロンプトを生成する（LLMがJSONを生成しやすくするために調整済み）"""
+    return f"""あなたは料理の専門家であり、レシピの提案者です。 
     冷蔵庫に以下の食材があります。これらの食材をメインに使える、おすすめのレシピを3つ提案してください。 
 
     # 前提条件 
@@ -296,41 +353,189 @@ def recommend_recipes_with_llm():
      出力: 
      """ 
 
-    print("\n--- LLMにレシピをリクエスト中 ---") 
 
+def print_recipes(parsed_recipes): 
+    """LLMが返したレシピを食事タイプ順に表示する""" 
+    print("\n--- 🍳 おすすめの献立 🍴 ---") 
+     # meal_typeでソート（朝→昼→夜の順番で表示するため） 
+    meal_order = {"朝食": 0, "昼食": 1, "夕食": 2} 
+    sorted_recipes = sorted(parsed_recipes["recipes"], key=lambda r: meal_order.get(r.get("meal_type"), 99)) 
+
+    for recipe in sorted_recipes: 
+        meal_type = recipe.get('meal_type') or '食事' 
+        print(f"\n--- {meal_type} ---") 
+        print(f"🍽️ 料理名: {recipe.get('name', '不明なレシピ')}") 
+        print(f"📝 説明: {recipe.get('description') or '説明なし'}") 
+        print(f"🥕 材料: {', '.join(recipe.get('ingredients', []))}") 
+
+
+def build_rerank_prompt(ingredients_str, candidates, top_k):
+    """ローカル検索で得たレシピ候補をLLMに並べ替えさせるためのプロンプトを生成する"""
+    candidate_lines = "\n".join(
+        f"    - id={c['id']}: {c['name']} (材料: {', '.join(c['ingredients'])})" for c in candidates)
+    return f"""あなたは料理の専門家です。冷蔵庫にある食材と、レシピ候補の一覧があります。 
+    候補の中から、冷蔵庫の食材を最も活用できるレシピを{top_k}つ選び、おすすめ順に並べてください。 
+    候補にないレシピを追加してはいけません。 
+
+    冷蔵庫の食材: {ingredients_str} 
+
+    レシピ候補: 
+{candidate_lines} 
+
+    出力は必ずJSON形式で、選んだレシピのidをおすすめ順に並べてください。 
+    出力例: {{"ranking": [12, 5, 33]}} 
+    出力: 
+    """ 
+
+
+def _generate_json_with_cache(client, cache, cache_key, prompt, required_key, namespace): 
+    """ 
+    キャッシュを確認し、なければLLMに問い合わせてJSONをパースして返す。 
+    required_key を含む応答のみキャッシュする。期待通りでない応答の場合はNoneを返す。 
+    """ 
+    llm_response_text = cache.get(cache_key) if cache is not None else None 
+    from_cache = llm_response_text is not None 
+
+    if from_cache: 
+        logger.info("--- キャッシュ済みの応答を使用します ---") 
+    else: 
+        logger.info("--- LLMにリクエスト中 ---") 
+        start = time.perf_counter() 
+        llm_response_text = client.generate(prompt, json_output=True) 
+        logger.info("LLM応答時間: %.2fs", time.perf_counter() - start) 
+
+     # JSON文字列をPythonの辞書にパース 
+    parsed = json.loads(llm_response_text) 
+    if not parsed or required_key not in parsed: 
+        logger.warning("LLMが期待通りの情報を生成しませんでした。") 
+        logger.debug("LLM Raw Response: %s", llm_response_text) # デバッグ用に生の応答を表示 
+        return None 
+
+    # 期待通りの応答のみキャッシュする 
+    if cache is not None and not from_cache: 
+        cache.put(cache_key, llm_response_text, namespace=namespace) 
+    return parsed 
+
+
+def _recommend_recipes_local(active_items, client, cache, mode, top_k, expiring_items=None): 
+    """ 
+    ローカルのレシピストアから候補を検索する。mode='hybrid' の場合はLLMで並べ替える 
+    (client が None ならここで作り、作れなければローカルの順位を使う)。 
+    expiring_items (get_expiring_items の結果) の食材は期限が近いほど優先する。 
+    候補が見つからない場合はNoneを返し、呼び出し元でLLMにフォールバックする。 
+    """ 
+    store = get_default_store() 
+    weights = build_ingredient_weights(active_items, expiring_items=expiring_items) 
+    unique_ingredients = sorted(weights) 
+
+    start = time.perf_counter() 
+    num_candidates = top_k if mode == 'local' else RECIPE_RERANK_CANDIDATES 
+    with span('recipes.local_top_k', candidates=num_candidates): 
+        candidates = store.top_k(weights, k=num_candidates) 
+    logger.info("ローカル検索: %d 件の候補 (%.1f ms)", len(candidates), (time.perf_counter() - start) * 1000) 
+    if not candidates: 
+        return None 
+
+    recipes = candidates[:top_k] 
+    if mode == 'hybrid': 
+        # LLMは候補の並べ替えのみ担当する。失敗した場合はローカルの順位をそのまま使う 
+        try: 
+            if client is None: 
+                client = get_llm_client() 
+            candidate_ids = [f"#{c['id']}" for c in candidates] 
+            cache_key = make_cache_key(unique_ingredients + candidate_ids, client.model_name, 
+                                       f"rerank-{RECIPE_PROMPT_VERSION}") 
+            parsed = _generate_json_with_cache( 
+                client, cache, cache_key, 
+                build_rerank_prompt(", ".join(unique_ingredients), candidates, top_k), 
+                required_key="ranking", namespace='recipe_rerank') 
+            if parsed: 
+                by_id = {c['id']: c for c in candidates} 
+                reranked = [by_id[i] for i in parsed["ranking"] if i in by_id] 
+                if reranked: 
+                    recipes = reranked[:top_k] 
+        except Exception as e: 
+            logger.warning("LLMによる並べ替えに失敗したため、ローカルの順位を使用します: %s", e) 
+
+    result = {"recipes": recipes} 
+    print_recipes(result) 
+    return result 
+
+
+def recommend_recipes_with_llm(client=None, cache=None, use_cache=True, mode=None, top_k=3, 
+                               household_id=DEFAULT_HOUSEHOLD_ID): 
+    """ 
+    冷蔵庫の食材からレシピを推薦する。 
+
+    Args:
+        client (LLMClient): 使用するLLMクライアント。Noneの場合は config の LLM_BACKEND に従う。
+                            オフラインでのテストやベンチマークには StubLLMClient を渡す。
+        cache (LLMResponseCache): 応答キャッシュ。Noneの場合はデフォルトの永続キャッシュ。
+        use_cache (bool): Falseの場合はキャッシュを使わず毎回LLMを呼び出す。
+        mode (str): 'llm'   - YOLOとレシートの両方で検出された食材をLLMに渡して推薦させる（従来の動作）
+                    'local' - ローカルのレシピストアから検索する。候補がない場合のみLLMを使う
+                    'hybrid'- ローカル検索の候補をLLMで並べ替える。LLMが失敗したらローカルの順位を使う
+                    Noneの場合は config の RECIPE_RECOMMENDATION_MODE。
+        top_k (int): ローカル検索で返すレシピ数。
+        household_id (str): 在庫を参照する世帯。
+
+    Returns:
+        dict or None: パースされたレシピ ({"recipes": [...]})。失敗時はNone。
+    """ 
+    mode = mode or RECIPE_RECOMMENDATION_MODE 
+    logger.info("---レシピ推薦(%s)---", mode) 
+
+     # 1. 'both' で検出されたアクティブな食材名を、SQL側で絞り込み・重複除去して取得 
+    both_detected_items = get_distinct_standard_names(status='active', detected_by='both', household_id=household_id) 
+
+    if not use_cache: 
+        cache = None 
+    elif cache is None: 
+        cache = get_default_cache() 
+
+    if mode in ('local', 'hybrid'): 
+        # スコアリングに必要なカラムだけをストリーミングで読み出す。期限による優先度は、 
+        # 期限の近い食材だけをインデックスで取り出して付ける 
+        active_items = iter_food_items(columns=['standard_name', 'detected_by'], status='active', 
+                                       household_id=household_id) 
+        expiring_items = get_expiring_items(EXPIRY_BOOST_DAYS, household_id=household_id, include_expired=True, 
+                                            columns=['standard_name', 'detected_by', 'expiry_day']) 
+        if expiring_items: 
+            logger.info("期限が近い食材: %s", ", ".join(item['standard_name'] for item in expiring_items)) 
+        result = _recommend_recipes_local(active_items, client, cache, mode, top_k, expiring_items=expiring_items) 
+        if result is not None: 
+            return result 
+        logger.info("ローカルのレシピストアに候補がないため、LLMで推薦します。") 
+
+    if not both_detected_items: 
+        logger.warning("YOLOとレシートの両方で検出された食材がありません。") 
+        logger.warning("まず冷蔵庫画像を解析し、その後レシートを処理して食材を紐付けてください。") 
+        return None 
+
+    # LLMクライアントはLLMを呼ぶ経路でだけ作る ('local' ではバックエンドの設定やAPIキーがなくても動く) 
+    if client is None: 
+        client = get_llm_client() 
+
+    # 並び順が変わってもプロンプト（とキャッシュキー）が変わらないようにソート済み 
+    unique_ingredients = both_detected_items 
+    ingredients_str = ", ".join(unique_ingredients) 
+
+    logger.info("冷蔵庫にある食材（両方で検出）: %s", ingredients_str) 
+
+     # 2. キャッシュを確認（同じ食材セット・モデル・プロンプトなら前回の応答を再利用）し、なければLLMを呼び出す 
+    cache_key = make_cache_key(unique_ingredients, client.model_name, RECIPE_PROMPT_VERSION) 
     try: 
-         # LLMを呼び出し、応答を受け取る 
-         # response_mime_type を application/json に指定することで、Geminiがより厳密にJSONを返そうとします 
-        response = model.generate_content( 
-            prompt, 
-            generation_config=genai.types.GenerationConfig(response_mime_type="application/json") 
-        ) 
-
-         # 応答からテキストを抽出（response_mime_type指定により、result.textはJSON文字列になる） 
-        llm_response_text = response.text 
-          
-         # JSON文字列をPythonの辞書にパース 
-        parsed_recipes = json.loads(llm_response_text) 
-    
-         # 4. レシピの表示 
-        print("\n--- 🍳 おすすめの献立 🍴 ---") # タイトルを変更 
-        if parsed_recipes and "recipes" in parsed_recipes: 
-             # meal_typeでソート（朝→昼→夜の順番で表示するため） 
-            meal_order = {"朝食": 0, "昼食": 1, "夕食": 2} 
-            sorted_recipes = sorted(parsed_recipes["recipes"], key=lambda r: meal_order.get(r.get("meal_type"), 99)) 
-
-            for recipe in sorted_recipes: 
-                meal_type = recipe.get('meal_type', '食事') 
-                print(f"\n--- {meal_type} ---") 
-                print(f"🍽️ 料理名: {recipe.get('name', '不明なレシピ')}") 
-                print(f"📝 説明: {recipe.get('description', '説明なし')}") 
-                print(f"🥕 材料: {', '.join(recipe.get('ingredients', []))}") 
-        else: 
-            print("LLMが期待通りのレシピ情報を生成しませんでした。") 
-            print("LLM Raw Response:", llm_response_text) # デバッグ用に生の応答を表示 
+        parsed_recipes = _generate_json_with_cache( 
+            client, cache, cache_key, build_recipe_prompt(ingredients_str), 
+            required_key="recipes", namespace='recipes') 
+         # 3. レシピの表示 
+        if parsed_recipes: 
+            print_recipes(parsed_recipes) 
+            return parsed_recipes 
     except Exception as e: 
-        print(f"LLMによるレシピ推薦中にエラーが発生しました: {e}") 
-        print("ネットワーク接続やAPIキー、またはLLMの応答形式を確認してください。") 
+        logger.error("LLMによるレシピ推薦中にエラーが発生しました: %s", e) 
+        logger.error("ネットワーク接続やAPIキー、またはLLMの応答形式を確認してください。") 
+    return None 
 
  # def main(): # <- この行は削除します
      # create_table() はdb_manager.pyでDATABASE_PATHを使用するように修正済みであることを前提 
@@ -399,7 +604,16 @@ def recommend_recipes_with_llm():
      #     print("Invalid choice. Please try again.") 
 
 if __name__ == '__main__': 
-    print("Refrigerator Inventory Management System started.") 
+    import argparse 
+
+    parser = argparse.ArgumentParser(description='Refrigerator Inventory Management System') 
+    parser.add_argument('--household', default=DEFAULT_HOUSEHOLD_ID, help='操作する世帯のID') 
+    args = parser.parse_args() 
+    household_id = args.household 
+
+    configure_logging() 
+    configure_instrumentation() 
+    print(f"Refrigerator Inventory Management System started (household: {household_id}).") 
 
     while True: 
         print("\n--- Menu ---") 
@@ -416,7 +630,7 @@ if __name__ == '__main__':
             fridge_img_path = input("Enter path to fridge image (e.g., data/annotated_images/IMG_XXXX.jpg): ") 
             fridge_img_path_abs = os.path.join(PROJECT_ROOT, fridge_img_path) 
             if os.path.exists(fridge_img_path_abs): 
-                analyze_fridge_image(fridge_img_path_abs) 
+                analyze_fridge_image(fridge_img_path_abs, household_id=household_id) 
             else: 
                 print(f"Error: Image not found at {fridge_img_path_abs}") 
 
@@ -424,29 +638,29 @@ if __name__ == '__main__':
             receipt_img_path = input("Enter path to receipt image (e.g., data/receipt_images/receipt_001.jpg): ") 
             receipt_img_path_abs = os.path.join(PROJECT_ROOT, receipt_img_path) 
             if os.path.exists(receipt_img_path_abs): 
-                process_receipt_image(receipt_img_path_abs) 
+                process_receipt_image(receipt_img_path_abs, household_id=household_id) 
             else: 
                 print(f"Error: Image not found at {receipt_img_path_abs}") 
 
         elif choice == '3': 
-            display_inventory() 
+            display_inventory(household_id) 
 
         elif choice == '4': # ★このブロックを追加 ★ 
-            recommend_recipes_with_llm() # 新しく追加したレシピ推薦関数を呼び出す 
+            recommend_recipes_with_llm(household_id=household_id) # 新しく追加したレシピ推薦関数を呼び出す 
 
         elif choice == '5': 
              # 手動でのアイテム消費/廃棄 
-            display_inventory() # 選択しやすくするために現在の在庫を表示 
+            display_inventory(household_id) # 選択しやすくするために現在の在庫を表示 
             item_id = input("Enter item ID to mark as consumed/discarded: ") 
             try: 
                 item_id = int(item_id) 
-                db_item = get_food_item_by_id(item_id) 
+                db_item = get_food_item_by_id(item_id, household_id=household_id) 
                 if db_item and db_item['status'] == 'active': 
                     status_choice = input("Mark as 'consumed' or 'discarded'? (c/d): ").lower() 
                     if status_choice == 'c': 
-                        mark_as_consumed_or_discarded(item_id, 'consumed') 
+                        mark_as_consumed_or_discarded(item_id, 'consumed', household_id=household_id) 
                     elif status_choice == 'd': 
-                        mark_as_consumed_or_discarded(item_id, 'discarded') 
+                        mark_as_consumed_or_discarded(item_id, 'discarded', household_id=household_id) 
                     else: 
                         print("Invalid status choice. Please enter 'c' or 'd'.") 
                 elif db_item and db_item['status'] != 'active': 
@@ -457,6 +671,10 @@ if __name__ == '__main__':
                 print("Invalid ID. Please enter a number.") 
 
         elif choice == '6': 
+            if instrumentation_enabled(): 
+                # ステージ別の所要時間を表示する 
+                for row in instrumentation_summary(): 
+                    print(f"{row['span']:<30} {row['count']:>6} calls {row['mean_ms']:>10.1f} ms avg") 
             print("Exiting system. Goodbye!") 
             break 
 
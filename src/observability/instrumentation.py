@@ -0,0 +1,348 @@
+# src/observability/instrumentation.py
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import inspect
+import itertools
+import threading
+import functools
+from collections import defaultdict
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from src.config import INSTRUMENTATION_ENABLED
+except ImportError:
+    INSTRUMENTATION_ENABLED = False
+
+try:
+    from src.config import INSTRUMENTATION_TRACE_PATH # スパンをJSON Linesで書き出すファイル (Noneなら書き出さない)
+except ImportError:
+    INSTRUMENTATION_TRACE_PATH = None
+
+try:
+    from src.config import LOG_LEVEL # 本番では 'WARNING' にすると進捗ログを抑制できる
+except ImportError:
+    LOG_LEVEL = 'INFO'
+
+# ----------------------------------------------------
+# 軽量な計装 (スパン・カウンタ・ヒストグラム)
+# ----------------------------------------------------
+# 画像デコード・YOLO推論・OCR・解析・DB呼び出し・LLM呼び出しの各ステージを span() / @traced で囲む。
+# 無効時は span() が共有の何もしないオブジェクトを返し、@traced はフラグを1回見て元の関数を呼ぶだけなので、
+# ホットループに入れてもほぼコストがかからない。
+# 有効時はスパンの所要時間をステージ別のヒストグラムに集計し、JSON Lines のトレース、
+# または Prometheus のテキスト形式で書き出せる。
+#   環境変数 RE2_YOLO_INSTRUMENT=1 でも有効にできる。
+
+METRIC_PREFIX = 're2_yolo'
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TRACE_FLUSH_EVENTS = 256 # この件数たまったらトレースファイルに書き出す
+
+
+class _NoopSpan:
+    """計装が無効なときに返す、何もしないスパン"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Histogram:
+    """累積バケットのヒストグラム（Prometheus互換）"""
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative_counts(self):
+        return list(itertools.accumulate(self.counts))
+
+
+class _Registry:
+    """カウンタ・ヒストグラム・トレースのバッファを保持する（スレッドセーフ）"""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_path = None
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)      # (name, labels) -> 値
+        self._histograms = {}                    # (name, labels) -> Histogram
+        self._trace_buffer = []
+        self._span_ids = itertools.count(1)
+        self._local = threading.local()
+
+    def inc(self, name, value, labels):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def record_span(self, event):
+        if self.trace_path is None:
+            return
+        with self._lock:
+            self._trace_buffer.append(event)
+            if len(self._trace_buffer) < TRACE_FLUSH_EVENTS:
+                return
+            events, self._trace_buffer = self._trace_buffer, []
+        self._write_events(events)
+
+    def flush(self):
+        with self._lock:
+            events, self._trace_buffer = self._trace_buffer, []
+        self._write_events(events)
+
+    def _write_events(self, events):
+        if not events or self.trace_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+        with open(self.trace_path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(e, ensure_ascii=False, default=str) + '\n' for e in events)
+
+    def span_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.buckets, h.cumulative_counts(), h.total, h.count)
+                          for key, h in self._histograms.items()}
+        return counters, histograms
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._trace_buffer = []
+
+
+_registry = _Registry()
+
+
+class Span:
+    """計装が有効なときのスパン。終了時に所要時間をヒストグラムとトレースに記録する"""
+    __slots__ = ('name', 'attrs', 'span_id', 'parent_id', '_start', '_wall_start')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """スパンに属性を追加する（例: 検出数、選ばれたモデル）"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _registry.span_stack()
+        self.parent_id = stack[-1].span_id if stack else None
+        self.span_id = next(_registry._span_ids)
+        stack.append(self)
+        self._wall_start = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        stack = _registry.span_stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        labels = (('span', self.name),)
+        _registry.observe('span_seconds', duration, labels)
+        if exc_type is not None:
+            _registry.inc('span_errors_total', 1, labels)
+        _registry.record_span({
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            'start': self._wall_start,
+            'duration_ms': duration * 1000,
+            'error': exc_type.__name__ if exc_type is not None else None,
+            'attrs': self.attrs,
+        })
+        return False
+
+
+def configure(enabled=None, trace_path=None):
+    """
+    計装を有効/無効にする。
+
+    Args:
+        enabled (bool): Noneの場合は config の INSTRUMENTATION_ENABLED か環境変数 RE2_YOLO_INSTRUMENT。
+        trace_path (str): スパンを追記するJSON Linesファイル。Noneの場合は config の INSTRUMENTATION_TRACE_PATH。
+    """
+    if enabled is None:
+        enabled = INSTRUMENTATION_ENABLED or os.environ.get('RE2_YOLO_INSTRUMENT', '') not in ('', '0')
+    _registry.flush()
+    _registry.enabled = bool(enabled)
+    _registry.trace_path = trace_path or INSTRUMENTATION_TRACE_PATH
+    return _registry.enabled
+
+
+def is_enabled():
+    return _registry.enabled
+
+
+def span(name, **attrs):
+    """
+    ステージの所要時間を計測するコンテキストマネージャ。
+
+        with span('yolo.inference', variant='best@640') as s:
+            ...
+            s.set(detections=len(items))
+    """
+    if not _registry.enabled:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def traced(name=None):
+    """関数（ジェネレータ関数も可）の呼び出しをスパンで囲むデコレータ。name の省略時は 'モジュール.関数名'"""
+    def decorator(fn):
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                if not _registry.enabled:
+                    yield from fn(*args, **kwargs)
+                    return
+                # ジェネレータは消費し終わるまでをスパンとする
+                with Span(span_name, {}) as s:
+                    count = 0
+                    for item in fn(*args, **kwargs):
+                        count += 1
+                        yield item
+                    s.set(rows=count)
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _registry.enabled:
+                return fn(*args, **kwargs)
+            with Span(span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inc(name, value=1, **labels):
+    """カウンタを増やす（例: inc('llm_cache_hits_total', namespace='recipes')）"""
+    if _registry.enabled:
+        _registry.inc(name, value, tuple(sorted(labels.items())))
+
+
+def observe(name, value, **labels):
+    """ヒストグラムに値を記録する（例: observe('yolo_detections', 6)）"""
+    if _registry.enabled:
+        _registry.observe(name, value, tuple(sorted(labels.items())))
+
+
+def flush():
+    """バッファ中のスパンをトレースファイルに書き出す"""
+    _registry.flush()
+
+
+def reset():
+    _registry.reset()
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def export_prometheus():
+    """集計したカウンタとヒストグラムを Prometheus のテキスト形式で返す"""
+    counters, histograms = _registry.snapshot()
+    lines = []
+    for name in sorted({n for n, _ in counters}):
+        metric = f'{METRIC_PREFIX}_{name}'
+        lines.append(f'# TYPE {metric} counter')
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f'{metric}{_format_labels(labels)} {value:g}')
+    for name in sorted({n for n, _ in histograms}):
+        metric = f'{METRIC_PREFIX}_{name}'
+        lines.append(f'# TYPE {metric} histogram')
+        for (n, labels), (buckets, cumulative, total, count) in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, value in zip(buckets, cumulative):
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {value}')
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {total:g}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """Prometheus のテキスト形式でファイルに書き出す（node_exporter の textfile collector 向け）"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(export_prometheus())
+    os.replace(tmp_path, path)
+
+
+def summary():
+    """スパン別の呼び出し回数・合計・平均秒数を返す（CLIでの表示用）"""
+    _, histograms = _registry.snapshot()
+    rows = []
+    for (name, labels), (_, _, total, count) in histograms.items():
+        if name == 'span_seconds':
+            rows.append({'span': dict(labels)['span'], 'count': count, 'total_s': total,
+                         'mean_ms': total / count * 1000 if count else 0.0})
+    return sorted(rows, key=lambda r: r['total_s'], reverse=True)
+
+
+def configure_logging(level=None):
+    """
+    print の代わりに使うロガーの出力先を設定する。
+    level は 'DEBUG' / 'INFO' / 'WARNING' など。Noneの場合は config の LOG_LEVEL。
+    """
+    logging.basicConfig(level=getattr(logging, str(level or LOG_LEVEL).upper(), logging.INFO),
+                        format='%(message)s', stream=sys.stdout)
+
+
+configure()
+atexit.register(flush)
@@ -0,0 +1,168 @@
+# src/ocr_processing/receipt_fingerprint.py
+import os
+import sys
+import re
+import json
+import hashlib
+import unicodedata
+
+import cv2
+import numpy as np
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import span
+from src.ocr_processing.receipt_parser import normalize_receipt_line
+
+# ----------------------------------------------------
+# レシートの指紋の計算
+# ----------------------------------------------------
+# 同じレシートの二重取り込みを見つけるための指紋を作る (照合と保存は src/database/receipt_fingerprints.py)。
+#   - image_fingerprint: OCR の前に、ファイルの SHA-1 と dHash を計算する。
+#       dHash はグレースケールを (size+1) x size に縮小し、横に隣り合う画素の明暗を1ビットずつ並べたもの。
+#       64ビット (8x8) は近い写真の検索に、256ビット (16x16) は候補の中で最も近い写真を選ぶのに使う。
+#       同じ店のレシートは別の買い物でも dHash が近いので、dHash だけで重複とは判定しない。
+#   - text_fingerprint: OCR の後に、店名・日時・合計・品目を正規化してハッシュにする。
+#       品目は解析済みの (標準名, 数量) を使うので、読み取りの細かい揺れには影響されない。
+
+# 合計の行 (小計・お預り・お釣りは対象外)
+TOTAL_KEYWORDS = ('合計', '合計金額', 'お買上計', 'total')
+DATE_PATTERN = re.compile(r'(20\d{2}|\d{2})\s*[/\-.年]\s*(\d{1,2})\s*[/\-.月]\s*(\d{1,2})')
+TIME_PATTERN = re.compile(r'(\d{1,2})\s*[:時]\s*(\d{2})')
+AMOUNT_PATTERN = re.compile(r'[¥\\]?\s*(\d{1,3}(?:,\d{3})+|\d+)\s*円?')
+STORE_SEARCH_LINES = 5
+
+
+def dhash(gray, size=8):
+    """グレースケール画像の dHash を size*size ビットの整数で返す"""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def load_receipt_image(image_path):
+    """
+    レシート画像を読み込み、画像配列と画像の指紋を返す (ファイルは1回だけ読み、同じバイト列をハッシュとデコードに使う)。
+
+    Returns:
+        tuple: (img (BGR の numpy.ndarray), fingerprint (dict))。読み込めなければ (None, None)。
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None, None
+    with span('image.decode'):
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None, None
+    fingerprint = image_fingerprint(img)
+    fingerprint['image_sha1'] = hashlib.sha1(data).hexdigest()
+    return img, fingerprint
+
+
+def image_fingerprint(img):
+    """
+    画像配列 (BGR またはグレースケール) の dHash を計算する。
+
+    Returns:
+        dict: {'dhash': 64ビットの整数, 'dhash_fine': 256ビットの16進文字列}
+    """
+    with span('receipt.image_fingerprint'):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        return {'dhash': dhash(gray, 8), 'dhash_fine': f'{dhash(gray, 16):064x}'}
+
+
+def _normalize(line_text):
+    # 全角の数字・記号を半角にそろえてから、receipt_parser と同じ正規化をする
+    return normalize_receipt_line(unicodedata.normalize('NFKC', line_text))
+
+
+def _parse_amount(text):
+    amounts = [int(m.group(1).replace(',', '')) for m in AMOUNT_PATTERN.finditer(text)]
+    return amounts[-1] if amounts else None
+
+
+def _find_store(lines):
+    """先頭の数行のうち、数字を含まない最初の行を店名とみなす"""
+    for line in lines[:STORE_SEARCH_LINES]:
+        if len(line) >= 2 and not re.search(r'\d', line):
+            return line
+    return None
+
+
+def _find_date(lines):
+    """最初に現れる日付 (YYYY-MM-DD) と時刻 (HH:MM) を返す"""
+    receipt_date = receipt_time = None
+    for line in lines:
+        if receipt_date is None:
+            m = DATE_PATTERN.search(line)
+            if m:
+                year, month, day = (int(g) for g in m.groups())
+                if year < 100:
+                    year += 2000
+                if 1 <= month <= 12 and 1 <= day <= 31:
+                    receipt_date = f'{year:04d}-{month:02d}-{day:02d}'
+                    line = line[m.end():]
+        if receipt_date is not None and receipt_time is None:
+            m = TIME_PATTERN.search(line)
+            if m and int(m.group(1)) < 24 and int(m.group(2)) < 60:
+                receipt_time = f'{int(m.group(1)):02d}:{int(m.group(2)):02d}'
+        if receipt_date is not None and receipt_time is not None:
+            break
+    return receipt_date, receipt_time
+
+
+def _find_total(lines):
+    """合計の行 (金額が次の行に分かれている場合も) から金額を返す"""
+    for index, line in enumerate(lines):
+        if '小計' in line or 'subtotal' in line:
+            continue
+        for keyword in TOTAL_KEYWORDS:
+            position = line.find(keyword)
+            if position < 0:
+                continue
+            amount = _parse_amount(line[position + len(keyword):])
+            if amount is None and index + 1 < len(lines):
+                amount = _parse_amount(lines[index + 1])
+            if amount is not None:
+                return amount
+    return None
+
+
+def _hash(values):
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def text_fingerprint(text_lines, parsed_items):
+    """
+    OCR のテキストと解析済みの品目から、レシートの内容の指紋を作る。
+
+    Args:
+        text_lines (list): 信頼度でフィルタリングした OCR のテキスト行。
+        parsed_items (list): parse_receipt_text_simple などの結果 ({'item_name', 'quantity'} のリスト)。
+
+    Returns:
+        dict: store, receipt_date (日付と時刻), total, items (並べ替えた [標準名, 数量]),
+              text_hash (全て。日付も合計も読めなければ品目だけでは別のレシートと区別できないので None)、
+              header_hash (店名・日時・合計。日付か合計が読めなければ None)。
+    """
+    lines = [_normalize(line) for line in text_lines if line and line.strip()]
+    store = _find_store(lines)
+    receipt_date, receipt_time = _find_date(lines)
+    if receipt_date is not None and receipt_time is not None:
+        receipt_date = f'{receipt_date} {receipt_time}'
+    total = _find_total(lines)
+    items = sorted([item['item_name'], float(item['quantity'])] for item in parsed_items)
+    header = [store, receipt_date, total]
+    return {
+        'store': store,
+        'receipt_date': receipt_date,
+        'total': total,
+        'items': items,
+        'text_hash': _hash(header + [items]) if receipt_date is not None or total is not None else None,
+        'header_hash': _hash(header) if receipt_date is not None and total is not None else None,
+    }
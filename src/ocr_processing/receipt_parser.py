@@ -1,216 +1,544 @@
 # src/ocr_processing/receipt_parser.py
+import os
+import sys
 import re
-import json # LLMを使用する場合に備えてインポート
+import json
+import asyncio
+import logging
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.observability.instrumentation import span, traced, inc
+
+logger = logging.getLogger(__name__)
+
+try:
+    from src.config import RECEIPT_LINE_CACHE_PATH
+except ImportError:
+    RECEIPT_LINE_CACHE_PATH = os.path.join(project_root, 'data', 'receipt_line_cache.db')
 
 # ----------------------------------------------------
 # 簡易的な正規表現とキーワードマッチングによる解析関数
 # ----------------------------------------------------
-def parse_receipt_text_simple(extracted_text_list):
-    """
-    EasyOCRから抽出されたテキストリストから、品目と数量を簡易的に解析する。
-    """
-    parsed_items = []
-    
-    # 仮のキーワードリスト (あなたのプロジェクトの食材に合わせてカスタマイズしてください)
-    # レシートに現れる可能性のある表記ゆれも考慮に入れると良い
-    food_keywords_map = {
-        '牛乳': ['牛乳', 'ぎゅうにゅう', 'ミルク', '特濃'], 
-        '卵': ['たまご', '卵', '玉子', 'タマゴ', 'たまごL10コ', '鶏卵', '白M10個'], # '白M10個'のような具体的な表記もキーワードに
-        '豚ロース肉': ['豚肉ローススライス', '豚肉', '豚ロース', 'ロース'], # レシートから抽出したい具体的名称
-        '鶏むね肉': ['鶏むね肉', '東北産若どりむね肉', 'むね肉', '若どり'], # レシートから抽出したい具体的名称
-        '肉（その他）': ['肉', '牛肉', 'もも肉', 'バラ肉'], # 汎用的な肉は「肉（その他）」のような標準名に
-        '鮭': ['鮭', 'サケ', 'しゃけ'], # 具体的な魚名
-        '魚（その他）': ['魚', 'マグロ', '鯛', 'ブリ'], # 汎用的な魚名
-        '味噌': ['みそ', '味噌'],                             
-        '豆腐': ['豆腐', 'とうふ'],                             
-        'トマト': ['トマト', 'トマト袋'], # 'トマト袋'もキーワードに
-        'きゅうり': ['きゅうり', '胡瓜', 'きゅうり袋'], # 'きゅうり袋'もキーワードに                       
-        'なす': ['なす', 'ナス', '茄子', '長なす'],           
-        'にんじん': ['にんじん', '人参'],                         
-        '玉ねぎ': ['たまねぎ', '玉ねぎ', '玉葱'],                 
-        'キャベツ': ['キャベツ'],                            
-        'ピーマン': ['ピーマン'],                          
-        'ほうれん草': ['ほうれん草', 'ホウレン草'],
-        '小松菜': ['小松菜'],
-        'レタス': ['レタス'], # leafy_greenとは別にレタス自体を標準名に
-        'きのこ': ['きのこ', 'キノコ', 'しめじ', 'エノキ', '椎茸', 'まいたけ'],
-        'もやし': ['もやし'],                           
-        'ビール': ['ビール', 'BEER', 'びーる'],                    
-        'チーズ': ['チーズ'],                               
-        '納豆': ['納豆', 'なっとう'],                         
-        'ヨーグルト': ['ヨーグルト', 'プレーンソ', 'プレーン'],      
-        'ボトル飲料': ['ボトル', '水', 'お茶', 'ドリンク', 'PET'], 
-
-        # Roboflowのクラスに対応する日本語名
-        'りんご': ['りんご', 'リンゴ'],
-        'バナナ': ['バナナ'],
-        'ブロッコリー': ['ブロッコリー'],
-        'コーン': ['コーン', 'とうもろこし'],
-        'ぶどう': ['ぶどう', 'ブドウ'],
-        'キウイ': ['キウイ'],
-        'レモン': ['レモン'],
-        'オレンジ': ['オレンジ'],
-        'マンゴー': ['マンゴー'],
-        'スイカ': ['スイカ'],
-
-        # その他、YOLO学習クラスではないが、レシートから抽出したい具体的品目
-        'ロイヤルブレッド': ['ロイヤルブレッド'],
-        'プルーン': ['プルーン', 'TVプルーン種ぬき'], # 具体的な表記
-        'おにぎり': ['おにぎり', '0尺おにぎり'], # 具体的な表記
-
-        # 汎用的なYOLOクラス名が直接抽出された場合も考慮
-        'apple': ['apple'], 'banana': ['banana'], 'broccoli': ['broccoli'], 'corn': ['corn'],
-        'cucumber': ['cucumber'], 'eggplant': ['eggplant'], 'grape': ['grape'], 'kiwi': ['kiwi'],
-        'lemon': ['lemon'], 'lettuce': ['lettuce'], 'mango': ['mango'], 'orange': ['orange'],
-        'watermelon': ['watermelon'], 'milk': ['milk'], 'egg': ['egg'], 'meat': ['meat'],
-        'fish': ['fish'], 'miso': ['miso'], 'tofu': ['tofu'], 'tomato': ['tomato'],
-        'carrot': ['carrot'], 'onion': ['onion'], 'cabbage': ['cabbage'], 'bell_pepper': ['bell_pepper'],
-        'leafy_green': ['leafy_green'], 'mushroom': ['mushroom'], 'bean_sprout': ['bean_sprout'],
-        'beer': ['beer'], 'cheese': ['cheese'], 'natto': ['natto'], 'yogurt': ['yogurt'], 'bottle': ['bottle'],
-
-        'meatballs': ['ミートボール'],
-        'marinara sauce': ['マリナーラ'],
-        'tomato soup': ['トマトスープ'],
-        'chicken noodle soup': ['チキンヌードルスープ'],
-        'french onion soup': ['フレンチオニオンスープ'],
-        'ribs': ['リブ', 'スペアリブ'],
-        'pulled pork': ['プルドポーク'],
-        'hamburger': ['ハンバーガー'],
-        'ロイヤルブレッド': ['ロイヤルブレッド'],
-        'プルーン': ['プルーン'], 
-        'おにぎり': ['おにぎり'],
+# 仮のキーワードリスト (あなたのプロジェクトの食材に合わせてカスタマイズしてください)
+# レシートに現れる可能性のある表記ゆれも考慮に入れると良い
+FOOD_KEYWORDS_MAP = {
+    '牛乳': ['牛乳', 'ぎゅうにゅう', 'ミルク', '特濃'], 
+    '卵': ['たまご', '卵', '玉子', 'タマゴ', 'たまごL10コ', '鶏卵', '白M10個'], # '白M10個'のような具体的な表記もキーワードに
+    '豚ロース肉': ['豚肉ローススライス', '豚肉', '豚ロース', 'ロース'], # レシートから抽出したい具体的名称
+    '鶏むね肉': ['鶏むね肉', '東北産若どりむね肉', 'むね肉', '若どり'], # レシートから抽出したい具体的名称
+    '肉（その他）': ['肉', '牛肉', 'もも肉', 'バラ肉'], # 汎用的な肉は「肉（その他）」のような標準名に
+    '鮭': ['鮭', 'サケ', 'しゃけ'], # 具体的な魚名
+    '魚（その他）': ['魚', 'マグロ', '鯛', 'ブリ'], # 汎用的な魚名
+    '味噌': ['みそ', '味噌'],                             
+    '豆腐': ['豆腐', 'とうふ'],                             
+    'トマト': ['トマト', 'トマト袋'], # 'トマト袋'もキーワードに
+    'きゅうり': ['きゅうり', '胡瓜', 'きゅうり袋'], # 'きゅうり袋'もキーワードに                       
+    'なす': ['なす', 'ナス', '茄子', '長なす'],           
+    'にんじん': ['にんじん', '人参'],                         
+    '玉ねぎ': ['たまねぎ', '玉ねぎ', '玉葱'],                 
+    'キャベツ': ['キャベツ'],                            
+    'ピーマン': ['ピーマン'],                          
+    'ほうれん草': ['ほうれん草', 'ホウレン草'],
+    '小松菜': ['小松菜'],
+    'レタス': ['レタス'], # leafy_greenとは別にレタス自体を標準名に
+    'きのこ': ['きのこ', 'キノコ', 'しめじ', 'エノキ', '椎茸', 'まいたけ'],
+    'もやし': ['もやし'],                           
+    'ビール': ['ビール', 'BEER', 'びーる'],                    
+    'チーズ': ['チーズ'],                               
+    '納豆': ['納豆', 'なっとう'],                         
+    'ヨーグルト': ['ヨーグルト', 'プレーンソ', 'プレーン'],      
+    'ボトル飲料': ['ボトル', '水', 'お茶', 'ドリンク', 'PET'], 
 
-    }
+    # Roboflowのクラスに対応する日本語名
+    'りんご': ['りんご', 'リンゴ'],
+    'バナナ': ['バナナ'],
+    'ブロッコリー': ['ブロッコリー'],
+    'コーン': ['コーン', 'とうもろこし'],
+    'ぶどう': ['ぶどう', 'ブドウ'],
+    'キウイ': ['キウイ'],
+    'レモン': ['レモン'],
+    'オレンジ': ['オレンジ'],
+    'マンゴー': ['マンゴー'],
+    'スイカ': ['スイカ'],
 
-    reverse_keyword_map = {}
-    for standard_name, keywords in food_keywords_map.items():
-        for kw in keywords:
-            reverse_keyword_map[kw.lower()] = standard_name
+    # その他、YOLO学習クラスではないが、レシートから抽出したい具体的品目
+    'ロイヤルブレッド': ['ロイヤルブレッド'],
+    'プルーン': ['プルーン', 'TVプルーン種ぬき'], # 具体的な表記
+    'おにぎり': ['おにぎり', '0尺おにぎり'], # 具体的な表記
 
-    for line_text in extracted_text_list:
-        line_text_norm = line_text.lower().replace(' ', '').replace('　', '').replace('※', '')
+    # 汎用的なYOLOクラス名が直接抽出された場合も考慮
+    'apple': ['apple'], 'banana': ['banana'], 'broccoli': ['broccoli'], 'corn': ['corn'],
+    'cucumber': ['cucumber'], 'eggplant': ['eggplant'], 'grape': ['grape'], 'kiwi': ['kiwi'],
+    'lemon': ['lemon'], 'lettuce': ['lettuce'], 'mango': ['mango'], 'orange': ['orange'],
+    'watermelon': ['watermelon'], 'milk': ['milk'], 'egg': ['egg'], 'meat': ['meat'],
+    'fish': ['fish'], 'miso': ['miso'], 'tofu': ['tofu'], 'tomato': ['tomato'],
+    'carrot': ['carrot'], 'onion': ['onion'], 'cabbage': ['cabbage'], 'bell_pepper': ['bell_pepper'],
+    'leafy_green': ['leafy_green'], 'mushroom': ['mushroom'], 'bean_sprout': ['bean_sprout'],
+    'beer': ['beer'], 'cheese': ['cheese'], 'natto': ['natto'], 'yogurt': ['yogurt'], 'bottle': ['bottle'],
 
-        if re.fullmatch(r'\d+(\.\d+)?(円|※)?$|[-+]\d+%?$', line_text_norm): # 123円, 123.00, 123※, -40, 20% など
-             continue
+    'meatballs': ['ミートボール'],
+    'marinara sauce': ['マリナーラ'],
+    'tomato soup': ['トマトスープ'],
+    'chicken noodle soup': ['チキンヌードルスープ'],
+    'french onion soup': ['フレンチオニオンスープ'],
+    'ribs': ['リブ', 'スペアリブ'],
+    'pulled pork': ['プルドポーク'],
+    'hamburger': ['ハンバーガー'],
+    'ロイヤルブレッド': ['ロイヤルブレッド'],
+    'プルーン': ['プルーン'], 
+    'おにぎり': ['おにぎり'],
 
-        found_standard_name = None
+}
 
-        sorted_keywords = sorted(reverse_keyword_map.keys(), key=len, reverse=True)
-        for keyword in sorted_keywords:
-            if keyword in line_text_norm: 
-                found_standard_name = reverse_keyword_map[keyword]
-                break
-        
-        if found_standard_name:
-            quantity = 1
-            # 1. 数字+単位 (例: 10個, 1袋)
-            qty_match = re.search(r'(\d+)\s*([個袋本入組k])', line_text_norm) # 'k'はキログラムのkなどの誤認識対策
-            if qty_match:
-                quantity = int(qty_match.group(1))
+# キーワード -> 標準名 の逆引きと、長いキーワードから優先して照合するためのソート済みリスト
+# (行ごと・呼び出しごとに作り直さないよう、モジュール読み込み時に一度だけ構築する)
+REVERSE_KEYWORD_MAP = {}
+for _standard_name, _keywords in FOOD_KEYWORDS_MAP.items():
+    for _kw in _keywords:
+        REVERSE_KEYWORD_MAP[_kw.lower()] = _standard_name
+SORTED_KEYWORDS = sorted(REVERSE_KEYWORD_MAP.keys(), key=len, reverse=True)
+
+# 価格として扱う文字列（品目名として誤認識された場合に除外する）
+_PRICE_AS_ITEM_NAMES = set(str(x) for x in range(1, 1000)) | {'-40', '20%'}
+
+LINE_PRICE = 'price'         # 価格などの数値だけの行
+LINE_MATCHED = 'matched'     # キーワードで品目を特定できた行
+LINE_UNMATCHED = 'unmatched' # キーワードで特定できなかった行
+
+
+def normalize_receipt_line(line_text):
+    """レシートの1行を照合用に正規化する（小文字化・空白と※の除去）"""
+    return line_text.lower().replace(' ', '').replace('　', '').replace('※', '')
+
+
+def _extract_quantity(line_text_norm, found_standard_name):
+    """正規化済みの行から数量を推定する"""
+    quantity = 1
+    # 1. 数字+単位 (例: 10個, 1袋)
+    qty_match = re.search(r'(\d+)\s*([個袋本入組k])', line_text_norm) # 'k'はキログラムのkなどの誤認識対策
+    if qty_match:
+        quantity = int(qty_match.group(1))
+    else:
+        # 2. サイズ+数量 (例: L10コ -> 10)
+        qty_match = re.search(r'([lLsSＭM])?(\d+)[コ個]', line_text_norm)
+        if qty_match:
+            quantity = int(qty_match.group(2))
+        else:
+            # 3. 行内の数字を数量とみなす場合 (価格ではないことを前提)
+            # ただし、「400g」のようなグラム表示は数量1とすべき
+            if re.search(r'\d+g$', line_text_norm): # '400g'のようにグラム表記で終わる場合
+                quantity = 1
             else:
-                # 2. サイズ+数量 (例: L10コ -> 10)
-                qty_match = re.search(r'([lLsSＭM])?(\d+)[コ個]', line_text_norm)
+                # 行の先頭にある数字を数量とみなす（価格ではないと判断できる場合）
+                qty_match = re.search(r'^(\d+)', line_text_norm)
                 if qty_match:
-                    quantity = int(qty_match.group(2))
-                else:
-                    # 3. 行内の数字を数量とみなす場合 (価格ではないことを前提)
-                    # ただし、「400g」のようなグラム表示は数量1とすべき
-                    if re.search(r'\d+g$', line_text_norm): # '400g'のようにグラム表記で終わる場合
-                        quantity = 1
+                    # ただし、その数字が単独で価格として認識される可能性がないか確認
+                    # 例えば '230' だけの行は数量ではない
+                    if not re.fullmatch(r'\d+', line_text_norm): # 行全体が数字だけなら数量ではない
+                        quantity = int(qty_match.group(1))
                     else:
-                        # 行の先頭にある数字を数量とみなす（価格ではないと判断できる場合）
-                        qty_match = re.search(r'^(\d+)', line_text_norm)
-                        if qty_match:
-                            # ただし、その数字が単独で価格として認識される可能性がないか確認
-                            # 例えば '230' だけの行は数量ではない
-                            if not re.fullmatch(r'\d+', line_text_norm): # 行全体が数字だけなら数量ではない
-                                quantity = int(qty_match.group(1))
-                            else:
-                                quantity = 1 # 数字だけの行はデフォルト1 (ただし価格の可能性が高いので注意)
-                        else:
-                            quantity = 1 # デフォルト
-
-            if quantity == 0 and "おにぎり" in found_standard_name: 
-                quantity = 1
+                        quantity = 1 # 数字だけの行はデフォルト1 (ただし価格の可能性が高いので注意)
+                else:
+                    quantity = 1 # デフォルト
 
-                        
+    if quantity == 0 and "おにぎり" in found_standard_name: 
+        quantity = 1
+    return quantity
 
-            price_as_item_names = [str(x) for x in range(1, 1000)]
-            price_as_item_names.extend(['-40', '20%'])
 
-            if found_standard_name in price_as_item_names:
-                continue
+def classify_receipt_line(line_text):
+    """
+    レシートの1行をキーワードで解析する。
+
+    Returns:
+        tuple: (LINE_PRICE | LINE_MATCHED | LINE_UNMATCHED, 解析結果の辞書またはNone)
+    """
+    line_text_norm = normalize_receipt_line(line_text)
+
+    if re.fullmatch(r'\d+(\.\d+)?(円|※)?$|[-+]\d+%?$', line_text_norm): # 123円, 123.00, 123※, -40, 20% など
+        return LINE_PRICE, None
+
+    found_standard_name = None
+    for keyword in SORTED_KEYWORDS:
+        if keyword in line_text_norm: 
+            found_standard_name = REVERSE_KEYWORD_MAP[keyword]
+            break
+
+    if not found_standard_name:
+        return LINE_UNMATCHED, None
+
+    if found_standard_name in _PRICE_AS_ITEM_NAMES:
+        return LINE_PRICE, None
+
+    return LINE_MATCHED, {
+        'item_name': found_standard_name,
+        'quantity': _extract_quantity(line_text_norm, found_standard_name),
+        'raw_line': line_text # デバッグ用に元の行を残す
+    }
 
-            parsed_items.append({
-                'item_name': found_standard_name,
-                'quantity': quantity,
-                'raw_line': line_text # デバッグ用に元の行を残す
-            })
 
+@traced('receipt.parse_simple')
+def parse_receipt_text_simple(extracted_text_list):
+    """
+    EasyOCRから抽出されたテキストリストから、品目と数量を簡易的に解析する。
+    """
+    parsed_items = []
+    for line_text in extracted_text_list:
+        status, item = classify_receipt_line(line_text)
+        if status == LINE_MATCHED:
+            parsed_items.append(item)
     return parsed_items
 
 # ----------------------------------------------------
 # LLM（大規模言語モデル）を用いた解析関数（推奨）
 # ----------------------------------------------------
-def parse_receipt_text_with_llm(ocr_raw_text):
+# キーワードで特定できなかった行のうち、明らかに品目ではない行（合計・日付・支払いなど）
+_NON_ITEM_LINE_PATTERN = re.compile(
+    r'(合計|小計|税|お釣|おつり|釣銭|現金|預り|預かり|領収|レジ|ポイント|tel|電話|^\d{2,4}[/年.-]\d{1,2}|\d{1,2}:\d{2})')
+
+# 行末の価格（空白区切りの数字、または¥/円の付いた数字）
+_TRAILING_PRICE_PATTERN = re.compile(r'(\s+[¥￥]?[\d,]+(\.\d+)?(円|※)?|[¥￥][\d,]+|[\d,]+円)\s*$')
+
+RECEIPT_LINE_PROMPT_VERSION = 'receipt-line-v1'
+
+
+def build_receipt_lines_prompt(lines):
     """
-    LLM (Gemmaなど) を用いて、レシートの生テキストから品目と数量を抽出する。
+    キーワードで特定できなかった行をまとめてLLMに解析させるプロンプトを生成する。
+    複数のレシートの行を1つのプロンプトに詰めて送るため、各行にidを振る。
     """
-    # LLM API呼び出しの擬似コード
-    # 実際には、Google AI StudioのGemini APIなどを利用します。
-    # APIキーの管理、リクエスト形式、レスポンスのパースなどが必要です。
-
-    # プロンプトの例（LLMへの指示文）
-    prompt = f"""以下のレシートのテキストから、購入された食材の品目名と数量を抽出し、JSON配列の形式で出力してください。
+    standard_names = ", ".join(dict.fromkeys(name for name in FOOD_KEYWORDS_MAP if not name.isascii()))
+    lines_json = json.dumps([{"id": i, "text": text} for i, text in enumerate(lines)], ensure_ascii=False)
+    return f"""以下はレシートから読み取った行の一覧です。各行が食材であれば品目名と数量を、食材でなければnameをnullにしてください。
     品目名は、以下のリストにある一般的な名称に正規化してください。もしリストにない場合は、テキストから最も近い一般的な名称を推測してください。
     数量が不明な場合は1としてください。
 
     一般的な食材の名称リスト:
-    牛乳, 卵, 肉, 魚, 味噌, 豆腐, トマト, きゅうり, なす, もやし, レタス, ほうれん草, 小松菜, きのこ, しめじ, えのき, ビール, チーズ, 納豆, ヨーグルト, ボトル飲料, (その他あなたのYOLOクラスに対応する具体的な野菜名など)
+    {standard_names}
 
-    レシートテキスト:
-    ```
-    {ocr_raw_text}
+    行の一覧:
+    ```json
+    {lines_json}
     ```
 
+    出力は必ずJSON形式で、すべての行のidについて結果を返してください。
     出力例:
     ```json
     {{
       "items": [
-        {{"name": "牛乳", "quantity": 1}},
-        {{"name": "卵", "quantity": 10}},
-        {{"name": "ほうれん草", "quantity": 1}}
+        {{"id": 0, "name": "牛乳", "quantity": 1}},
+        {{"id": 1, "name": null, "quantity": 0}}
       ]
     }}
     ```
     出力:
     """
 
-    print("\n--- LLMを活用してレシートを解析します（これはシミュレーションです）---")
-    print(f"プロンプトをLLMに送信中...")
-    
-    # 実際にはここでLLM APIを叩く
-    # 例: response = client.generate_content(prompt)
-    #     json_output = response.text
-    #     parsed_data = json.loads(json_output)
-
-    # 仮のリターン値（実際のLLMの出力をシミュレート）
-    simulated_llm_output = """
-    {
-      "items": [
-        {"name": "牛乳", "quantity": 1},
-        {"name": "ほうれん草", "quantity": 1},
-        {"name": "卵", "quantity": 10},
-        {"name": "肉", "quantity": 1}
-      ]
-    }
+
+class HybridReceiptParser:
+    """
+    キーワード解析とLLMを組み合わせたレシート解析器。
+
+    1. まず高速なキーワード解析 (classify_receipt_line) を全行に適用する。
+    2. キーワードで特定できなかった行だけを、正規化した行テキスト単位のキャッシュで引く。
+    3. キャッシュにない行は、複数のレシートにまたがってまとめて1つのプロンプトにし、
+       asyncioで同時実行数を制限しながら、タイムアウトとリトライ付きでLLMに送る。
+    4. LLMの結果は行テキストごとにキャッシュし、店舗固有の商品名が二度LLMに送られないようにする。
+
+    イベントループの中 (非同期のサーバーなど) からは parse_many_async / parse_async を await する。
+    parse_many / parse は内部で asyncio.run を呼ぶ同期版で、ループの外 (スクリプト・CLI・同期の処理) 専用。
+    """
+
+    def __init__(self, client=None, cache=None, batch_size=40, max_concurrency=4,
+                 timeout=30.0, max_retries=3, retry_backoff=0.5):
+        """
+        Args:
+            client (LLMClient): LLMクライアント。Noneの場合は config の LLM_BACKEND に従う。
+            cache (LLMResponseCache): 行単位のキャッシュ。Noneの場合はデフォルトの行キャッシュ。
+            batch_size (int): 1つのプロンプトに含める最大行数。
+            max_concurrency (int): 同時に実行するLLMリクエスト数の上限 (タイムアウト後もスレッドで実行中のリクエストを含む)。
+            timeout (float): 1リクエストあたりのタイムアウト（秒）。
+            max_retries (int): 失敗時のリトライ回数。
+            retry_backoff (float): リトライ間隔の初期値（秒）。リトライごとに倍になる。
+        """
+        if client is None:
+            from src.llm.llm_client import get_llm_client
+            client = get_llm_client()
+        if cache is None:
+            cache = get_receipt_line_cache()
+        self.client = client
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        # llm_attempts: 送ったリクエスト (リトライを含む)、llm_calls: 応答が返ったリクエスト、llm_timeouts: 待つのをやめたリクエスト
+        self.stats = {'receipts': 0, 'keyword_lines': 0, 'unmatched_lines': 0, 'cache_hits': 0,
+                      'llm_lines': 0, 'llm_attempts': 0, 'llm_calls': 0, 'llm_timeouts': 0, 'failed_batches': 0}
+
+    def _line_cache_key(self, line_norm):
+        from src.llm.response_cache import make_cache_key
+        return make_cache_key([line_norm], self.client.model_name, RECEIPT_LINE_PROMPT_VERSION)
+
+    def _start_llm_request(self, semaphore, prompt):
+        """
+        LLMへのリクエストを1件始める (呼び出し前に semaphore を取得しておくこと)。
+        スロットは待つのをやめた時点ではなく、リクエストが実際に終わった時点で返す。
+        asyncio.to_thread のスレッドはタイムアウトしても止められないため、スロットを先に返すと
+        タイムアウトとリトライのたびに実行中のリクエストが増え、max_concurrency を超えてしまう。
+        """
+        if hasattr(self.client, 'generate_async'):
+            task = asyncio.ensure_future(self.client.generate_async(prompt, json_output=True))
+        else:
+            task = asyncio.ensure_future(asyncio.to_thread(self.client.generate, prompt, True))
+
+        def finished(task):
+            semaphore.release()
+            # 待つのをやめたリクエストの例外も取り出しておく (未取得の警告を出さないため)
+            if not task.cancelled() and task.exception() is None:
+                self.stats['llm_calls'] += 1
+        task.add_done_callback(finished)
+        return task
+
+    async def _call_llm(self, semaphore, lines):
+        """1バッチ分の行をLLMに送り、行インデックス -> 結果 の辞書を返す。失敗時は空の辞書。"""
+        prompt = build_receipt_lines_prompt(lines)
+        for attempt in range(self.max_retries + 1):
+            await semaphore.acquire()
+            self.stats['llm_attempts'] += 1
+            task = self._start_llm_request(semaphore, prompt)
+            try:
+                # shield: タイムアウトで to_thread のタスクを取り消すと、スレッドが動いたままスロットが返ってしまう
+                response_text = await asyncio.wait_for(asyncio.shield(task), timeout=self.timeout)
+                parsed = json.loads(response_text)
+                return {int(entry['id']): entry for entry in parsed.get('items', [])
+                        if isinstance(entry, dict) and 'id' in entry and 0 <= int(entry['id']) < len(lines)}
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats['llm_timeouts'] += 1
+                    if hasattr(self.client, 'generate_async'):
+                        task.cancel() # コルーチンのリクエストは取り消せる (スロットは取り消しの完了時に返る)
+                if attempt == self.max_retries:
+                    logger.warning("LLMによるレシート行解析に失敗しました (%d 行): %s: %s", len(lines), type(e).__name__, e)
+                    self.stats['failed_batches'] += 1
+                    return {}
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+
+    @staticmethod
+    def _to_item(entry, raw_line):
+        """LLMの結果1件を parse_receipt_text_simple と同じ形式に変換する。食材でなければNone"""
+        name = entry.get('name')
+        if not name:
+            return None
+        # LLMが表記ゆれのまま返した場合もキーワード表で標準名に寄せる
+        name = REVERSE_KEYWORD_MAP.get(str(name).lower(), name)
+        try:
+            quantity = max(int(entry.get('quantity') or 1), 1)
+        except (TypeError, ValueError):
+            quantity = 1
+        return {'item_name': name, 'quantity': quantity, 'raw_line': raw_line, 'source': 'llm'}
+
+    async def parse_many_async(self, receipts):
+        """
+        複数のレシートをまとめて解析する。
+
+        Args:
+            receipts (list): レシートごとのOCR行テキストのリスト。
+
+        Returns:
+            list: レシートごとの解析結果のリスト（各要素は parse_receipt_text_simple と同じ形式）。
+                  キーワードで解析した品目は 'source': 'keyword'、LLMで解析した品目は 'source': 'llm'。
+        """
+        results = []
+        pending = {} # 正規化済みの行 -> [(レシート番号, 元の行テキスト), ...]
+        for receipt_index, lines in enumerate(receipts):
+            self.stats['receipts'] += 1
+            items = []
+            for line_text in lines:
+                status, item = classify_receipt_line(line_text)
+                if status == LINE_MATCHED:
+                    item['source'] = 'keyword'
+                    items.append(item)
+                    self.stats['keyword_lines'] += 1
+                elif status == LINE_UNMATCHED:
+                    # 末尾の価格は除いてキーにする（同じ商品が価格違いでもキャッシュに当たるように）
+                    line_norm = normalize_receipt_line(_TRAILING_PRICE_PATTERN.sub('', line_text.strip()))
+                    if line_norm and not _NON_ITEM_LINE_PATTERN.search(line_norm) and not line_norm.isdigit():
+                        pending.setdefault(line_norm, []).append((receipt_index, line_text))
+                        self.stats['unmatched_lines'] += 1
+            results.append(items)
+
+        if not pending:
+            return results
+
+        # 行テキスト単位のキャッシュを一括で引く
+        key_by_line = {line_norm: self._line_cache_key(line_norm) for line_norm in pending}
+        cached = self.cache.get_many(list(key_by_line.values()))
+        resolved = {} # 正規化済みの行 -> LLMの結果 (dict)
+        for line_norm, key in key_by_line.items():
+            if key in cached:
+                resolved[line_norm] = json.loads(cached[key])
+                self.stats['cache_hits'] += len(pending[line_norm])
+        inc('receipt_line_cache_hits_total', len(cached))
+        inc('receipt_line_cache_misses_total', len(key_by_line) - len(cached))
+
+        # キャッシュにない行を重複なしでバッチにまとめ、同時実行数を制限してLLMに送る
+        misses = [line_norm for line_norm in pending if line_norm not in resolved]
+        if misses:
+            self.stats['llm_lines'] += len(misses)
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            batches = [misses[i:i + self.batch_size] for i in range(0, len(misses), self.batch_size)]
+            # LLMには正規化前の行テキスト（最初に現れたもの）を渡す
+            outputs = await asyncio.gather(*[
+                self._call_llm(semaphore, [pending[line_norm][0][1] for line_norm in batch]) for batch in batches])
+
+            new_entries = {}
+            for batch, output in zip(batches, outputs):
+                for i, line_norm in enumerate(batch):
+                    if i in output:
+                        entry = {'name': output[i].get('name'), 'quantity': output[i].get('quantity')}
+                        resolved[line_norm] = entry
+                        new_entries[key_by_line[line_norm]] = json.dumps(entry, ensure_ascii=False)
+            # 失敗したバッチの行はキャッシュせず、次回の解析で再度LLMに送る
+            if new_entries:
+                self.cache.put_many(new_entries, namespace='receipt_line')
+
+        for line_norm, occurrences in pending.items():
+            entry = resolved.get(line_norm)
+            if entry is None:
+                continue
+            for receipt_index, raw_line in occurrences:
+                item = self._to_item(entry, raw_line)
+                if item is not None:
+                    results[receipt_index].append(item)
+        return results
+
+    async def parse_async(self, extracted_text_list):
+        """1枚のレシートを解析する (parse の非同期版)"""
+        return (await self.parse_many_async([extracted_text_list]))[0]
+
+    def parse_many(self, receipts):
+        """
+        parse_many_async の同期版。イベントループの外からだけ呼べる。
+
+        Raises:
+            RuntimeError: 実行中のイベントループの中から呼ばれた場合 (parse_many_async を await すること)。
+        """
+        _ensure_no_running_loop('parse_many', 'parse_many_async')
+        with span('receipt.parse_hybrid', receipts=len(receipts)):
+            return asyncio.run(self.parse_many_async(receipts))
+
+    def parse(self, extracted_text_list):
+        """1枚のレシートを解析する (parse_async の同期版。イベントループの外からだけ呼べる)"""
+        _ensure_no_running_loop('parse', 'parse_async')
+        return self.parse_many([extracted_text_list])[0]
+
+
+def _ensure_no_running_loop(sync_name, async_name):
+    """
+    実行中のイベントループの中で同期版が呼ばれたら、非同期版を案内する RuntimeError を送出する。
+    (asyncio.run の例外より前に検出し、作ったコルーチンが await されずに残るのも防ぐ)
     """
     try:
-        parsed_data = json.loads(simulated_llm_output)
-        return parsed_data.get("items", [])
-    except json.JSONDecodeError:
-        print("LLMからのJSON解析に失敗しました。")
-        return []
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    raise RuntimeError(f"{sync_name}() cannot be called from a running event loop; await {async_name}() instead.")
+
+
+_receipt_line_cache = None
+
+
+def get_receipt_line_cache():
+    """レシート行の解析結果を保存する永続キャッシュを返す（商品名は変わりにくいためTTLなし）"""
+    global _receipt_line_cache
+    if _receipt_line_cache is None:
+        from src.llm.response_cache import LLMResponseCache
+        _receipt_line_cache = LLMResponseCache(path=RECEIPT_LINE_CACHE_PATH, ttl_seconds=None,
+                                               max_entries=200_000, max_bytes=64 * 1024 * 1024)
+    return _receipt_line_cache
+
+
+def parse_receipt_text_with_llm(ocr_raw_text, client=None, cache=None):
+    """
+    キーワード解析とLLMを組み合わせて、レシートの生テキストから品目と数量を抽出する。
+    キーワードで特定できなかった行だけをLLMに送る。
+    イベントループの中からは parse_receipt_text_with_llm_async を await すること。
+
+    Returns:
+        list: [{"name": "牛乳", "quantity": 1}, ...]
+    """
+    lines = [line.strip() for line in ocr_raw_text.split('\n') if line.strip()]
+    parser = HybridReceiptParser(client=client, cache=cache)
+    return [{'name': item['item_name'], 'quantity': item['quantity']} for item in parser.parse(lines)]
+
+
+async def parse_receipt_text_with_llm_async(ocr_raw_text, client=None, cache=None):
+    """parse_receipt_text_with_llm の非同期版 (イベントループの中から await する)"""
+    lines = [line.strip() for line in ocr_raw_text.split('\n') if line.strip()]
+    parser = HybridReceiptParser(client=client, cache=cache)
+    return [{'name': item['item_name'], 'quantity': item['quantity']} for item in await parser.parse_async(lines)]
+
+
+# ----------------------------------------------------
+# ベンチマーク: 1,000枚あたりのLLM呼び出し回数
+# ----------------------------------------------------
+def _stub_receipt_responder(prompt):
+    """ベンチマーク・テスト用のスタブ応答。カタカナを含む行を食材とみなす"""
+    lines = json.loads(re.search(r'```json\s*(\[.*?\])\s*```', prompt, re.S).group(1))
+    items = []
+    for line in lines:
+        is_food = re.search(r'[ァ-ヶｦ-ﾟ]', line['text']) is not None
+        items.append({'id': line['id'], 'name': line['text'].split()[0] if is_food else None, 'quantity': 1})
+    return json.dumps({'items': items}, ensure_ascii=False)
+
+
+def generate_synthetic_receipts(num_receipts, seed=0):
+    """既知のキーワード行と、店舗固有の商品名（キーワード表にない行）を混ぜた合成レシートを作る"""
+    import random
+    rng = random.Random(seed)
+    known_lines = ['牛乳 230円', 'たまごL10コ 250円', '豚肉ローススライス 498円', 'きゅうり3本 158円', 'トマト袋 298円']
+    store_specific = [f'PB特選ﾎﾟｰｸ{i} {rng.randint(100, 900)}円' for i in range(150)] + \
+                     [f'ｵｰｶﾞﾆｯｸﾍﾞｼﾞ{i}' for i in range(100)]
+    receipts = []
+    for _ in range(num_receipts):
+        lines = ['〇〇スーパー', '2025/07/15 10:30']
+        lines += rng.sample(known_lines, rng.randint(1, 3))
+        lines += rng.sample(store_specific, rng.randint(1, 4))
+        lines += [f'合計 {rng.randint(500, 5000)}円']
+        receipts.append(lines)
+    return receipts
+
+
+def benchmark_llm_calls(num_receipts=1000, batch_size=40, max_concurrency=4, latency=0.05):
+    """
+    スタブLLMを使って、1,000枚あたりのLLM呼び出し回数と処理時間を計測する。
+    1回目（キャッシュなし）と2回目（行キャッシュが温まった状態）を比較する。
+    """
+    import time
+    from src.llm.llm_client import StubLLMClient
+    from src.llm.response_cache import LLMResponseCache
+
+    receipts = generate_synthetic_receipts(num_receipts)
+    client = StubLLMClient(model_name='stub', responder=_stub_receipt_responder, latency=latency)
+    cache = LLMResponseCache(':memory:', ttl_seconds=None, max_entries=200_000)
+
+    for label in ('cold cache', 'warm cache'):
+        parser = HybridReceiptParser(client=client, cache=cache, batch_size=batch_size,
+                                     max_concurrency=max_concurrency)
+        start = time.perf_counter()
+        parser.parse_many(receipts)
+        elapsed = time.perf_counter() - start
+        calls_per_1000 = parser.stats['llm_calls'] / num_receipts * 1000
+        print(f"[{label}] {num_receipts} receipts in {elapsed:.2f}s, "
+              f"LLM calls: {parser.stats['llm_calls']} ({calls_per_1000:.1f} per 1,000 receipts; "
+              f"naive per-receipt parsing would be 1,000), stats: {parser.stats}")
+
 
 if __name__ == '__main__':
     sample_ocr_text = """
@@ -228,7 +556,10 @@ if __name__ == '__main__':
     for item in parsed_items_simple:
         print(f"Parsed Simple: {item['item_name']}, Quantity: {item['quantity']}")
 
-    print("\n--- LLM Parser Test ---")
+    print("\n--- Hybrid (Keyword + LLM) Parser Test ---")
     parsed_items_llm = parse_receipt_text_with_llm(sample_ocr_text)
     for item in parsed_items_llm:
-        print(f"Parsed LLM: {item['name']}, Quantity: {item['quantity']}")
\ No newline at end of file
+        print(f"Parsed LLM: {item['name']}, Quantity: {item['quantity']}")
+
+    print("\n--- LLM Calls Benchmark (stub client) ---")
+    benchmark_llm_calls(num_receipts=1000)
\ No newline at end of file
@@ -13,6 +13,7 @@ from PIL import Image
 
 
 from src.ocr_processing.image_preprocess import preprocess_receipt_image
+from src.observability.instrumentation import span
 
 reader = easyocr.Reader(['ja', 'en'], gpu=True) # gpu=False if no GPU or issues
 
@@ -25,12 +26,24 @@ def perform_ocr(image_path, detail=0):
     """
 
     # OpenCVで直接読み込み、そのままEasyOCRに渡す
-    img = cv2.imread(image_path)
+    with span('image.decode'):
+        img = cv2.imread(image_path)
     if img is None:
         print(f"Error: Could not load image from {image_path}")
         return None
 
-    result = reader.readtext(img, detail=detail)
+    return perform_ocr_on_array(img, detail=detail)
+
+def perform_ocr_on_array(img, detail=0):
+    """
+    デコード済みの画像配列 (BGR) からテキストを抽出する。
+    共有メモリ経由で画像を受け取るワーカープロセスからも利用する。
+    :param img: 画像配列 (numpy.ndarray)
+    :param detail: 0 (テキストのみ), 1 (ボックス、テキスト、信頼度)
+    :return: 抽出されたテキストのリスト
+    """
+    with span('ocr.readtext'):
+        result = reader.readtext(img, detail=detail)
     
     # detail=0 の場合、テキストのリストを返す
     if detail == 0:
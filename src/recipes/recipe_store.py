@@ -0,0 +1,260 @@
+# src/recipes/recipe_store.py
+
+import os
+import sys
+import json
+import itertools
+import time
+import sqlite3
+from datetime import datetime, date
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.llm.response_cache import normalize_ingredients
+
+try:
+    from src.config import RECIPE_DB_PATH
+except ImportError:
+    RECIPE_DB_PATH = os.path.join(project_root, 'data', 'recipes.db')
+
+# スコアリングの重み
+BOTH_DETECTED_WEIGHT = 1.0   # YOLOとレシートの両方で確認された食材
+ACTIVE_ITEM_WEIGHT = 0.5     # それ以外の在庫中 (active) の食材
+EXPIRY_BOOST_DAYS = 3        # 賞味期限がこの日数以内の食材は重みを上げる
+EXPIRY_BOOST_FACTOR = 1.0    # 期限当日の食材は重みが (1 + EXPIRY_BOOST_FACTOR) 倍になる
+COVERAGE_WEIGHT = 0.5        # レシピの材料のうち在庫でまかなえる割合に対するボーナス
+
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y%m%d')
+
+
+def _parse_date(value):
+    """expiry_date の文字列を date に変換する。解釈できない場合はNone"""
+    if not value:
+        return None
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _days_left(item, today):
+    """期限までの日数。expiry_day (日番号) があればそれを使い、なければ expiry_date を解釈する。期限がなければNone"""
+    keys = item.keys()
+    if 'expiry_day' in keys and item['expiry_day'] is not None:
+        return item['expiry_day'] - today.toordinal()
+    if 'expiry_date' in keys:
+        expiry = _parse_date(item['expiry_date'])
+        if expiry is not None:
+            return (expiry - today).days
+    return None
+
+
+def build_ingredient_weights(items, today=None, expiring_items=None):
+    """
+    在庫アイテムから「食材名 -> 重み」の辞書を作る。
+    'both' で検出された食材を優先し、賞味期限が近い食材ほど重みを上げる。
+
+    Args:
+        items (list): standard_name, detected_by と、expiry_day か expiry_date (任意) を持つ行 (sqlite3.Row や dict)。
+        today (date): 基準日。Noneの場合は今日。
+        expiring_items (list): db_manager.get_expiring_items() の結果。期限の列を items から読まずに、
+                               インデックスで絞り込んだ期限の近い食材だけでブーストする場合に渡す。
+
+    Returns:
+        dict: 正規化された食材名 -> 重み
+    """
+    today = today or date.today()
+    weights = {}
+    for item in itertools.chain(items, expiring_items or ()):
+        names = normalize_ingredients([item['standard_name']])
+        if not names:
+            continue
+        weight = BOTH_DETECTED_WEIGHT if item['detected_by'] == 'both' else ACTIVE_ITEM_WEIGHT
+
+        days_left = _days_left(item, today)
+        if days_left is not None:
+            if days_left <= EXPIRY_BOOST_DAYS:
+                # 期限が近いほど大きく、期限切れ（days_left <= 0）は最大のブースト
+                urgency = 1.0 - max(days_left, 0) / (EXPIRY_BOOST_DAYS + 1)
+                weight *= 1.0 + EXPIRY_BOOST_FACTOR * urgency
+
+        # 同じ食材が複数行ある場合は最も大きい重みを採用する
+        weights[names[0]] = max(weights.get(names[0], 0.0), weight)
+    return weights
+
+
+class RecipeStore:
+    """
+    ローカルのレシピストア。食材 -> レシピ の転置インデックスを持ち、
+    在庫食材との重なりでレシピをスコアリングして上位k件を返す。
+    """
+
+    def __init__(self, path=RECIPE_DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS recipes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                meal_type TEXT,
+                description TEXT,
+                ingredients_json TEXT NOT NULL,
+                ingredient_count INTEGER NOT NULL
+            );
+            -- 転置インデックス: 食材名でクラスタリングし、食材ごとのレシピ一覧を連続領域から読む
+            CREATE TABLE IF NOT EXISTS recipe_ingredients (
+                ingredient TEXT NOT NULL,
+                recipe_id INTEGER NOT NULL,
+                PRIMARY KEY (ingredient, recipe_id)
+            ) WITHOUT ROWID;
+        ''')
+        self._conn.commit()
+
+    def add_recipes(self, recipes, batch_size=5000):
+        """
+        レシピをまとめて登録する。
+
+        Args:
+            recipes (iterable): {"name", "meal_type", "description", "ingredients"} を持つ辞書。
+            batch_size (int): 1トランザクションあたりのレシピ数。
+
+        Returns:
+            int: 登録したレシピ数
+        """
+        count = 0
+        batch = []
+
+        def flush():
+            with self._conn: # 1バッチを1トランザクションで書き込む
+                for recipe in batch:
+                    ingredients = normalize_ingredients(recipe.get('ingredients', []))
+                    cursor = self._conn.execute('''
+                        INSERT INTO recipes (name, meal_type, description, ingredients_json, ingredient_count)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (recipe['name'], recipe.get('meal_type'), recipe.get('description'),
+                          json.dumps(recipe.get('ingredients', []), ensure_ascii=False), max(len(ingredients), 1)))
+                    self._conn.executemany(
+                        'INSERT OR IGNORE INTO recipe_ingredients (ingredient, recipe_id) VALUES (?, ?)',
+                        [(name, cursor.lastrowid) for name in ingredients])
+            batch.clear()
+
+        for recipe in recipes:
+            batch.append(recipe)
+            count += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return count
+
+    def import_json(self, json_path):
+        """{"recipes": [...]} 形式、またはレシピ配列のJSONファイルを取り込む"""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        recipes = data.get('recipes', []) if isinstance(data, dict) else data
+        count = self.add_recipes(recipes)
+        print(f"Imported {count} recipes into {self.path}")
+        return count
+
+    def count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM recipes').fetchone()[0]
+
+    def top_k(self, ingredient_weights, k=3):
+        """
+        食材の重みに基づいてレシピをスコアリングし、上位k件を返す。
+        スコア = 一致した食材の重みの合計 + COVERAGE_WEIGHT * (一致数 / レシピの材料数)
+
+        Args:
+            ingredient_weights (dict): build_ingredient_weights() の戻り値。
+            k (int): 返すレシピ数。
+
+        Returns:
+            list: スコア順のレシピ辞書のリスト（'score' と 'matched_count' を含む）
+        """
+        if not ingredient_weights:
+            return []
+
+        # 問い合わせ食材を VALUES の一時表にし、転置インデックスとJOINして集計する
+        values_sql = ', '.join(['(?, ?)'] * len(ingredient_weights))
+        params = []
+        for name, weight in ingredient_weights.items():
+            params.extend([name, weight])
+        params.extend([COVERAGE_WEIGHT, k])
+
+        rows = self._conn.execute(f'''
+            WITH query(ingredient, weight) AS (VALUES {values_sql}),
+            scored AS (
+                SELECT ri.recipe_id, SUM(query.weight) AS matched_weight, COUNT(*) AS matched_count
+                FROM query JOIN recipe_ingredients ri ON ri.ingredient = query.ingredient
+                GROUP BY ri.recipe_id
+            )
+            SELECT r.id, r.name, r.meal_type, r.description, r.ingredients_json,
+                   scored.matched_count,
+                   scored.matched_weight + ? * scored.matched_count * 1.0 / r.ingredient_count AS score
+            FROM scored JOIN recipes r ON r.id = scored.recipe_id
+            ORDER BY score DESC, r.id
+            LIMIT ?
+        ''', params).fetchall()
+
+        return [{
+            'id': row['id'],
+            'name': row['name'],
+            'meal_type': row['meal_type'],
+            'description': row['description'],
+            'ingredients': json.loads(row['ingredients_json']),
+            'matched_count': row['matched_count'],
+            'score': row['score'],
+        } for row in rows]
+
+    def close(self):
+        self._conn.close()
+
+
+_default_store = None
+
+
+def get_default_store():
+    """プロセス内で共有するデフォルトのレシピストアを返す"""
+    global _default_store
+    if _default_store is None:
+        _default_store = RecipeStore()
+    return _default_store
+
+
+if __name__ == '__main__':
+    import random
+
+    # 10万件の合成レシピでtop-kの応答時間を確認する
+    ingredient_pool = ['卵', '牛乳', 'トマト', 'きゅうり', 'なす', 'にんじん', '玉ねぎ', 'キャベツ', 'ピーマン',
+                       'ほうれん草', '豆腐', '納豆', '鶏むね肉', '豚ロース肉', '鮭', 'チーズ', 'ヨーグルト',
+                       'もやし', 'きのこ', 'レタス', '味噌', 'ブロッコリー', 'りんご', 'バナナ'] + \
+                      [f'食材{i}' for i in range(500)]
+    rng = random.Random(0)
+    store = RecipeStore(':memory:')
+    start = time.perf_counter()
+    store.add_recipes({'name': f'レシピ{i}', 'meal_type': rng.choice(['朝食', '昼食', '夕食']),
+                       'ingredients': rng.sample(ingredient_pool, rng.randint(3, 10))}
+                      for i in range(100_000))
+    print(f"Indexed {store.count()} recipes in {time.perf_counter() - start:.2f}s")
+
+    inventory = [
+        {'standard_name': '卵', 'detected_by': 'both', 'expiry_date': None},
+        {'standard_name': 'トマト', 'detected_by': 'both', 'expiry_date': date.today().isoformat()},
+        {'standard_name': '玉ねぎ', 'detected_by': 'yolo', 'expiry_date': None},
+        {'standard_name': '豚ロース肉', 'detected_by': 'receipt', 'expiry_date': None},
+    ]
+    weights = build_ingredient_weights(inventory)
+    start = time.perf_counter()
+    for _ in range(20):
+        results = store.top_k(weights, k=5)
+    print(f"top_k: {(time.perf_counter() - start) / 20 * 1000:.2f} ms/query")
+    for r in results:
+        print(f"{r['score']:.2f} {r['name']} {r['ingredients']}")
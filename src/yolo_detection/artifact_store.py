@@ -0,0 +1,396 @@
+# src/yolo_detection/artifact_store.py
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+import yaml
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from src.config import ARTIFACT_STORE_DIR
+except ImportError:
+    ARTIFACT_STORE_DIR = os.path.join(project_root, 'data', 'artifacts')
+
+# ----------------------------------------------------
+# 学習ランの成果物ストア (内容アドレス方式)
+# ----------------------------------------------------
+# ラン出力のファイルは SHA-256 ごとに1つだけ保存する。
+#   objects/<sha[:2]>/<sha> : ファイル本体（読み取り専用）
+#   runs/<run_id>.json      : ランのマニフェスト（args・メトリクス・重みのハッシュ・ファイル一覧）
+# 同じ train_batch*.jpg やプロットが複数のランにあっても、実体は1つになる。
+# ランの一覧・比較はマニフェストだけを読み、画像ファイルは走査しない。
+# ラン内のファイルは取り込み後に読み取り専用のオブジェクトへのハードリンクに置き換えるが、
+# 重みと results.csv は学習の再開 (resume=True) やエクスポートなどでその場で書き換えられるため、
+# ストアにコピーするだけでラン内は通常のファイルのまま残す。
+
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+WEIGHT_EXTENSIONS = ('.pt', '.onnx', '.engine', '.torchscript')
+IN_PLACE_FILES = ('results.csv',) # 学習の再開で追記されるため、ハードリンクに置き換えないファイル
+
+# GCの保持ポリシー: 新しい順に KEEP_LAST 件 + mAP50-95 上位 KEEP_BEST 件 + pin されたランを残す
+DEFAULT_KEEP_LAST = 5
+DEFAULT_KEEP_BEST = 3
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def read_results_csv(path):
+    """ultralyticsの results.csv を読み、エポックごとの辞書のリストを返す（列名の前後の空白は除く）"""
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        return [{name: _to_number(value.strip()) for name, value in zip(header, row)} for row in reader if row]
+
+
+def summarize_results(rows):
+    """
+    results.csv の行からランの要約メトリクスを作る。
+    best は mAP50-95 が最大のエポック、final は最後のエポック。
+    """
+    if not rows:
+        return {}
+    map_key = 'metrics/mAP50-95(B)'
+    best = max(rows, key=lambda r: (r.get(map_key, 0.0), -r.get('epoch', 0)))
+    final = rows[-1]
+    return {
+        'epochs': len(rows),
+        'best_epoch': int(best.get('epoch', 0)),
+        'best_map50_95': best.get(map_key),
+        'best_map50': best.get('metrics/mAP50(B)'),
+        'best_precision': best.get('metrics/precision(B)'),
+        'best_recall': best.get('metrics/recall(B)'),
+        'final_map50_95': final.get(map_key),
+        'final_map50': final.get('metrics/mAP50(B)'),
+        'train_time': final.get('time'), # ultralyticsの time 列は累積秒数
+    }
+
+
+class ArtifactStore:
+    """学習ランの出力を内容ハッシュで重複排除して保存するストア"""
+
+    def __init__(self, root=ARTIFACT_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.runs_dir = os.path.join(root, 'runs')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.runs_dir, exist_ok=True)
+
+    # --- オブジェクト ---
+
+    def object_path(self, sha):
+        return os.path.join(self.objects_dir, sha[:2], sha)
+
+    def has_object(self, sha):
+        return os.path.exists(self.object_path(sha))
+
+    def put_file(self, path):
+        """
+        ファイルをストアに登録し、(sha, 新規に保存したか) を返す。
+        同じ内容がすでにあればコピーしない。
+        """
+        sha = file_sha256(path)
+        dest = self.object_path(sha)
+        if os.path.exists(dest):
+            return sha, False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.tmp_')
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.chmod(tmp_path, 0o444) # ハードリンク経由で書き換えられないよう読み取り専用にする
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return sha, True
+
+    def _link_back(self, sha, path):
+        """ラン内のファイルをストアのオブジェクトへのハードリンクに置き換える（同じファイルシステムの場合のみ）"""
+        obj = self.object_path(sha)
+        if os.path.samefile(obj, path):
+            return True
+        tmp_path = path + '.artifact_link'
+        try:
+            os.link(obj, tmp_path)
+        except OSError:
+            return False
+        os.replace(tmp_path, path)
+        return True
+
+    # --- ラン ---
+
+    def manifest_path(self, run_id):
+        return os.path.join(self.runs_dir, f'{run_id}.json')
+
+    def ingest_run(self, run_dir, run_id=None, link_back=True, extra=None):
+        """
+        学習ランのディレクトリを取り込み、マニフェストを書く。
+
+        Args:
+            run_dir (str): ultralyticsの出力ディレクトリ (args.yaml, results.csv, weights/ など)。
+            run_id (str): ランID。Noneの場合はディレクトリ名 + ディレクトリパスのハッシュ。
+            link_back (bool): Trueの場合、ラン内のファイル (重みと IN_PLACE_FILES を除く) を
+                              ストアへのハードリンクに置き換え、ディスク上の重複をなくす。
+            extra (dict): マニフェストに追加で記録する情報。
+
+        Returns:
+            dict: マニフェスト
+        """
+        run_dir = os.path.abspath(run_dir)
+        if run_id is None:
+            path_hash = hashlib.sha1(run_dir.encode('utf-8')).hexdigest()[:8]
+            run_id = f'{os.path.basename(run_dir)}-{path_hash}'
+
+        files = {}
+        weights = {}
+        new_bytes = total_bytes = 0
+        for root, dirs, filenames in os.walk(run_dir):
+            dirs.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                if os.path.islink(path) or filename.endswith('.artifact_link'):
+                    continue
+                rel_path = os.path.relpath(path, run_dir).replace(os.sep, '/')
+                sha, is_new = self.put_file(path)
+                size = os.path.getsize(path)
+                files[rel_path] = {'sha256': sha, 'size': size}
+                total_bytes += size
+                if is_new:
+                    new_bytes += size
+                if filename.endswith(WEIGHT_EXTENSIONS):
+                    weights[rel_path] = sha
+                if link_back and not filename.endswith(WEIGHT_EXTENSIONS) and filename not in IN_PLACE_FILES:
+                    self._link_back(sha, path)
+
+        args = {}
+        if os.path.exists(os.path.join(run_dir, 'args.yaml')):
+            with open(os.path.join(run_dir, 'args.yaml'), 'r') as f:
+                args = yaml.safe_load(f) or {}
+        metrics = {}
+        if os.path.exists(os.path.join(run_dir, 'results.csv')):
+            metrics = summarize_results(read_results_csv(os.path.join(run_dir, 'results.csv')))
+
+        previous = self.load_manifest(run_id) if os.path.exists(self.manifest_path(run_id)) else {}
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'run_id': run_id,
+            'source_dir': run_dir,
+            'created_at': previous.get('created_at', time.time()),
+            'ingested_at': time.time(),
+            'pinned': previous.get('pinned', False),
+            'args': args,
+            'metrics': metrics,
+            'weights': weights,
+            'files': files,
+            'total_bytes': total_bytes,
+        }
+        if extra:
+            manifest['extra'] = extra
+        tmp_path = self.manifest_path(run_id) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, default=str)
+        os.replace(tmp_path, self.manifest_path(run_id))
+
+        print(f"Stored run '{run_id}': {len(files)} files, {total_bytes / 1e6:.1f} MB "
+              f"({new_bytes / 1e6:.1f} MB new, {(total_bytes - new_bytes) / 1e6:.1f} MB deduplicated)")
+        return manifest
+
+    def load_manifest(self, run_id):
+        with open(self.manifest_path(run_id), 'r') as f:
+            return json.load(f)
+
+    def list_runs(self):
+        """全ランのマニフェストを作成日時順に返す"""
+        manifests = []
+        for filename in os.listdir(self.runs_dir):
+            if filename.endswith('.json'):
+                manifests.append(self.load_manifest(filename[:-len('.json')]))
+        return sorted(manifests, key=lambda m: (m['created_at'], m['run_id']))
+
+    def compare_runs(self, run_ids=None):
+        """
+        ランの主要な設定とメトリクスを1行ずつの辞書で返す（マニフェストのみを読む）。
+        run_ids を省略すると全ラン。
+        """
+        manifests = self.list_runs() if run_ids is None else [self.load_manifest(r) for r in run_ids]
+        rows = []
+        for m in manifests:
+            args = m.get('args', {})
+            metrics = m.get('metrics', {})
+            rows.append({
+                'run_id': m['run_id'],
+                'model': args.get('model'),
+                'epochs': args.get('epochs'),
+                'imgsz': args.get('imgsz'),
+                'batch': args.get('batch'),
+                'best_epoch': metrics.get('best_epoch'),
+                'best_map50_95': metrics.get('best_map50_95'),
+                'best_map50': metrics.get('best_map50'),
+                'train_time': metrics.get('train_time'),
+                'best_weights': m.get('weights', {}).get('weights/best.pt'),
+                'pinned': m.get('pinned', False),
+            })
+        return rows
+
+    def restore_run(self, run_id, dest_dir, pattern=None):
+        """ランのファイルをストアから dest_dir に復元する（pattern は含まれるべき部分文字列、例: 'weights/'）"""
+        manifest = self.load_manifest(run_id)
+        for rel_path, info in manifest['files'].items():
+            if pattern and pattern not in rel_path:
+                continue
+            dest = os.path.join(dest_dir, rel_path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(self.object_path(info['sha256']), dest)
+        return dest_dir
+
+    def set_pinned(self, run_id, pinned=True):
+        """GCで削除されないようにランを固定する（本番で使っている重みなど）"""
+        manifest = self.load_manifest(run_id)
+        manifest['pinned'] = pinned
+        with open(self.manifest_path(run_id), 'w') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, default=str)
+
+    def gc(self, keep_last=DEFAULT_KEEP_LAST, keep_best=DEFAULT_KEEP_BEST, dry_run=False):
+        """
+        保持ポリシーに従ってランのマニフェストを削除し、どのマニフェストからも参照されない
+        オブジェクトを削除する。
+
+        保持するラン: pin されたラン、新しい順に keep_last 件、best mAP50-95 の上位 keep_best 件。
+
+        Returns:
+            dict: 削除したランID・オブジェクト数・実際に解放したバイト数・
+                  ラン出力ディレクトリのハードリンクが残っているため解放されないバイト数
+        """
+        manifests = self.list_runs()
+        keep = {m['run_id'] for m in manifests if m.get('pinned')}
+        keep.update(m['run_id'] for m in manifests[::-1][:keep_last])
+        ranked = sorted((m for m in manifests if m.get('metrics', {}).get('best_map50_95') is not None),
+                        key=lambda m: m['metrics']['best_map50_95'], reverse=True)
+        keep.update(m['run_id'] for m in ranked[:keep_best])
+
+        removed_runs = [m['run_id'] for m in manifests if m['run_id'] not in keep]
+        referenced = set()
+        for m in manifests:
+            if m['run_id'] in keep:
+                referenced.update(info['sha256'] for info in m['files'].values())
+
+        removed_objects = 0
+        freed_bytes = 0
+        linked_bytes = 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for sha in os.listdir(prefix_dir):
+                if sha in referenced or sha.startswith('.'):
+                    continue
+                path = os.path.join(prefix_dir, sha)
+                st = os.stat(path)
+                removed_objects += 1
+                # ラン出力ディレクトリにハードリンクが残っている場合、ストア側を消しても容量は解放されない
+                if st.st_nlink > 1:
+                    linked_bytes += st.st_size
+                else:
+                    freed_bytes += st.st_size
+                if not dry_run:
+                    os.remove(path)
+        if not dry_run:
+            for run_id in removed_runs:
+                os.remove(self.manifest_path(run_id))
+
+        action = 'Would remove' if dry_run else 'Removed'
+        print(f"{action} {len(removed_runs)} runs and {removed_objects} objects ({freed_bytes / 1e6:.1f} MB freed).")
+        if linked_bytes:
+            print(f"{linked_bytes / 1e6:.1f} MB is still hard-linked from run directories and is freed only when they are deleted.")
+        return {'removed_runs': removed_runs, 'removed_objects': removed_objects, 'freed_bytes': freed_bytes,
+                'linked_bytes': linked_bytes}
+
+
+def detach_run_dir(run_dir):
+    """
+    ストアへのハードリンクになっているファイルを通常のコピーに戻す。
+    同じディレクトリに再学習 (exist_ok=True) したり学習を再開 (resume=True) したりする前に呼ぶ。
+    ハードリンクのままだとプロットなどの上書きが読み取り専用のオブジェクトへの書き込みになり失敗する。
+    """
+    if not os.path.isdir(run_dir):
+        return
+    for root, _, filenames in os.walk(run_dir):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if not os.path.islink(path) and os.stat(path).st_nlink > 1:
+                tmp_path = path + '.detach'
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, path)
+
+
+def print_run_comparison(rows):
+    print(f"{'Run':<32} {'Model':<12} {'Ep':>4} {'Img':>5} {'Best@':>6} {'mAP50-95':>9} {'mAP50':>7} {'Time(s)':>9}")
+    print("-" * 92)
+    for r in rows:
+        def fmt(value, spec):
+            return format(value, spec) if isinstance(value, (int, float)) else '-'
+        name = r['run_id'] + (' *' if r['pinned'] else '')
+        print(f"{name:<32} {str(r['model'] or '-'):<12} {fmt(r['epochs'], '>4')} {fmt(r['imgsz'], '>5')} "
+              f"{fmt(r['best_epoch'], '>6')} {fmt(r['best_map50_95'], '>9.4f')} {fmt(r['best_map50'], '>7.4f')} "
+              f"{fmt(r['train_time'], '>9.1f')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Content-addressed store for YOLO training runs.')
+    parser.add_argument('--store', default=ARTIFACT_STORE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_ingest = sub.add_parser('ingest', help='ラン出力ディレクトリを取り込む')
+    p_ingest.add_argument('run_dirs', nargs='+')
+    p_ingest.add_argument('--no-link-back', action='store_true', help='ラン内のファイルをハードリンクに置き換えない')
+    sub.add_parser('list', help='ランを一覧表示する')
+    p_compare = sub.add_parser('compare', help='ランのメトリクスを比較する')
+    p_compare.add_argument('run_ids', nargs='*')
+    p_pin = sub.add_parser('pin', help='ランをGCの対象外にする')
+    p_pin.add_argument('run_id')
+    p_pin.add_argument('--unpin', action='store_true')
+    p_restore = sub.add_parser('restore', help='ランのファイルを復元する')
+    p_restore.add_argument('run_id')
+    p_restore.add_argument('dest_dir')
+    p_restore.add_argument('--only', default=None, help="パスに含まれる文字列で絞り込む (例: 'weights/')")
+    p_gc = sub.add_parser('gc', help='保持ポリシーに従って古い成果物を削除する')
+    p_gc.add_argument('--keep-last', type=int, default=DEFAULT_KEEP_LAST)
+    p_gc.add_argument('--keep-best', type=int, default=DEFAULT_KEEP_BEST)
+    p_gc.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.store)
+    if args.command == 'ingest':
+        for run_dir in args.run_dirs:
+            store.ingest_run(run_dir, link_back=not args.no_link_back)
+    elif args.command in ('list', 'compare'):
+        print_run_comparison(store.compare_runs(getattr(args, 'run_ids', None) or None))
+    elif args.command == 'pin':
+        store.set_pinned(args.run_id, not args.unpin)
+    elif args.command == 'restore':
+        store.restore_run(args.run_id, args.dest_dir, pattern=args.only)
+    elif args.command == 'gc':
+        store.gc(keep_last=args.keep_last, keep_best=args.keep_best, dry_run=args.dry_run)
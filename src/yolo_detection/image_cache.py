@@ -0,0 +1,363 @@
+# src/yolo_detection/image_cache.py
+
+import os
+import sys
+import json
+import math
+import time
+import hashlib
+
+import cv2
+import numpy as np
+import yaml
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+# ----------------------------------------------------
+# 学習用のデコード済み画像キャッシュ
+# ----------------------------------------------------
+# CPUでの学習では、毎エポックのJPEGデコードとリサイズがステップ時間の大半を占める。
+# 画像を imgsz ごとに一度だけデコード・リサイズし、(N, imgsz, imgsz, 3) の uint8 memmap に格納する。
+# 各スロットには長辺を imgsz に合わせた画像を左上詰めで置き（残りは0埋め）、実サイズを index.json に記録する。
+# リサイズ規則は ultralytics の BaseDataset.load_image (rect_mode=True) と同じなので、ラベル座標はそのまま使える。
+# 画像の内容ハッシュと imgsz が一致する限り、実行をまたいで再利用する。
+
+CACHE_VERSION = 1
+IMAGE_CACHE_DIR = os.path.join(project_root, 'data', 'cache', 'images')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def _sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def resize_long_side(im, imgsz):
+    """長辺が imgsz になるようにアスペクト比を保ってリサイズする（ultralyticsの load_image と同じ規則）"""
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR if r > 1 else cv2.INTER_AREA)
+    return im
+
+
+class ImageCacheStore:
+    """imgsz ごとのデコード済み画像ストア"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'index.json'), 'r') as f:
+            index = json.load(f)
+        self.imgsz = index['imgsz']
+        self.entries = index['entries']
+        self.content_key = index['content_key']
+        shape = (len(self.entries), self.imgsz, self.imgsz, 3)
+        if self.entries:
+            self.images = np.memmap(os.path.join(store_dir, index['data_file']), dtype=np.uint8, mode='r', shape=shape)
+        else:
+            self.images = np.zeros(shape, dtype=np.uint8)
+        self._slot_by_path = {e['path']: i for i, e in enumerate(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def slot_for(self, image_path):
+        return self._slot_by_path.get(os.path.abspath(image_path))
+
+    def get(self, slot):
+        """スロットの画像 (h, w, 3) のビューと、元画像のサイズ (h0, w0) を返す"""
+        e = self.entries[slot]
+        return self.images[slot, :e['h'], :e['w']], (e['h0'], e['w0'])
+
+
+def build_image_cache(image_paths, imgsz, cache_dir=IMAGE_CACHE_DIR, verbose=True):
+    """
+    画像をデコード・リサイズしてストアを作る。既存のストアと内容ハッシュが一致する画像は再デコードしない。
+
+    Args:
+        image_paths (list): 画像パスのリスト。
+        imgsz (int): 学習時の imgsz。
+        cache_dir (str): ストアを置くディレクトリ（imgsz ごとにサブディレクトリを作る）。
+
+    Returns:
+        ImageCacheStore
+    """
+    start = time.perf_counter()
+    store_dir = os.path.join(cache_dir, f'imgsz{imgsz}')
+    os.makedirs(store_dir, exist_ok=True)
+
+    previous = None
+    try:
+        previous = ImageCacheStore(store_dir)
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+    previous_by_path = {e['path']: (i, e) for i, e in enumerate(previous.entries)} if previous else {}
+
+    # 内容ハッシュはサイズとmtimeが同じなら前回の値を使い、読み直しを避ける
+    entries = []
+    for path in sorted(set(os.path.abspath(p) for p in image_paths)):
+        stat = os.stat(path)
+        old = previous_by_path.get(path)
+        if old and old[1]['size'] == stat.st_size and old[1]['mtime_ns'] == stat.st_mtime_ns:
+            sha1 = old[1]['sha1']
+        else:
+            sha1 = _sha1_file(path)
+        entries.append({'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1})
+
+    content_key = hashlib.sha1(json.dumps([imgsz, CACHE_VERSION] + [(e['path'], e['sha1']) for e in entries])
+                               .encode('utf-8')).hexdigest()
+    if previous is not None and previous.content_key == content_key:
+        if verbose:
+            print(f"Image cache is up to date: {store_dir} ({len(entries)} images, imgsz={imgsz})")
+        return previous
+
+    data_file = f'images_{content_key[:12]}.u8'
+    data = np.memmap(os.path.join(store_dir, data_file + '.tmp'), dtype=np.uint8, mode='w+',
+                     shape=(max(len(entries), 1), imgsz, imgsz, 3))
+    decoded = reused = 0
+    kept_entries = []
+    for e in entries:
+        slot = len(kept_entries)
+        old = previous_by_path.get(e['path'])
+        if old and old[1]['sha1'] == e['sha1']:
+            # 内容が同じ画像は前回のストアからコピーする
+            data[slot] = previous.images[old[0]]
+            for key in ('h0', 'w0', 'h', 'w'):
+                e[key] = old[1][key]
+            reused += 1
+        else:
+            im = cv2.imread(e['path'])
+            if im is None:
+                print(f"Warning: Could not load image for cache: {e['path']}")
+                continue
+            e['h0'], e['w0'] = im.shape[:2]
+            im = resize_long_side(im, imgsz)
+            e['h'], e['w'] = im.shape[:2]
+            data[slot, :e['h'], :e['w']] = im
+            data[slot, e['h']:, :] = 0
+            data[slot, :e['h'], e['w']:] = 0
+            decoded += 1
+        kept_entries.append(e)
+    data.flush()
+    del data
+
+    os.replace(os.path.join(store_dir, data_file + '.tmp'), os.path.join(store_dir, data_file))
+    index = {'version': CACHE_VERSION, 'imgsz': imgsz, 'content_key': content_key,
+             'data_file': data_file, 'entries': kept_entries}
+    tmp_index = os.path.join(store_dir, 'index.json.tmp')
+    with open(tmp_index, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_index, os.path.join(store_dir, 'index.json'))
+
+    # 古いデータファイルを削除する
+    for filename in os.listdir(store_dir):
+        if filename.startswith('images_') and filename != data_file:
+            os.remove(os.path.join(store_dir, filename))
+
+    if verbose:
+        print(f"Image cache built at {store_dir}: {len(kept_entries)} images (decoded {decoded}, reused {reused}) "
+              f"in {time.perf_counter() - start:.1f}s")
+    return ImageCacheStore(store_dir)
+
+
+def _resolve_split_paths(data_yaml_path, splits=('train', 'val')):
+    """data.yaml の train/val から画像パスを列挙する（ディレクトリ・画像リストtxtの両方に対応）"""
+    with open(data_yaml_path, 'r') as f:
+        data = yaml.safe_load(f)
+    yaml_dir = os.path.dirname(os.path.abspath(data_yaml_path))
+    base = data.get('path') or yaml_dir
+    if not os.path.isabs(base):
+        base = os.path.join(yaml_dir, base)
+
+    image_paths = []
+    for split in splits:
+        values = data.get(split)
+        if not values:
+            continue
+        for value in (values if isinstance(values, list) else [values]):
+            path = os.path.normpath(os.path.join(base, value))
+            # Roboflowの data.yaml は '../train/images' 形式のため、ultralyticsと同様に '../' を外して再試行する
+            if not os.path.exists(path) and value.startswith('../'):
+                path = os.path.normpath(os.path.join(base, value[3:]))
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    image_paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+            elif os.path.isfile(path):
+                with open(path, 'r') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            image_paths.append(line if os.path.isabs(line) else os.path.join(os.path.dirname(path), line))
+    return image_paths
+
+
+def build_image_cache_for_dataset(data_yaml_path, imgsz, cache_dir=IMAGE_CACHE_DIR):
+    """data.yaml の train/val 画像をまとめてキャッシュする"""
+    return build_image_cache(_resolve_split_paths(data_yaml_path), imgsz, cache_dir=cache_dir)
+
+
+def attach_image_cache(dataset, store):
+    """
+    ultralyticsのデータセットの load_image を、ストアから読む実装に差し替える。
+    ストアにない画像や imgsz が異なる場合は元の実装を使う。
+    """
+    if getattr(dataset, 'imgsz', None) != store.imgsz:
+        print(f"Image cache imgsz ({store.imgsz}) does not match dataset imgsz ({dataset.imgsz}). Cache disabled.")
+        return dataset
+    original_load_image = dataset.load_image
+
+    def load_image(i, rect_mode=True):
+        # バッファ (モザイク拡張用) やRAMキャッシュに載っている画像はそのまま返す（元の実装と同じ）
+        if dataset.ims[i] is not None:
+            return dataset.ims[i], dataset.im_hw0[i], dataset.im_hw[i]
+        slot = store.slot_for(dataset.im_files[i])
+        if slot is None:
+            return original_load_image(i, rect_mode)
+        im, (h0, w0) = store.get(slot)
+        im = np.ascontiguousarray(im) # 拡張処理が配列を書き換えても、キャッシュに影響しないようにコピーする
+        if not rect_mode:
+            # 非rectモードでは正方形に引き伸ばす（ultralyticsと同じ挙動）。小さい画像からのリサイズなので安価
+            im = cv2.resize(im, (store.imgsz, store.imgsz), interpolation=cv2.INTER_LINEAR)
+        if dataset.augment:
+            # 元の load_image と同じく、拡張ありの学習では読んだ画像をバッファに積む。
+            # モザイク拡張は random.choices(dataset.buffer, ...) で相手の画像を選ぶため、空のままだと IndexError になる
+            dataset.ims[i], dataset.im_hw0[i], dataset.im_hw[i] = im, (h0, w0), im.shape[:2]
+            dataset.buffer.append(i)
+            if 1 < len(dataset.buffer) >= dataset.max_buffer_length:
+                j = dataset.buffer.pop(0)
+                if getattr(dataset, 'cache', None) != 'ram':
+                    dataset.ims[j], dataset.im_hw0[j], dataset.im_hw[j] = None, None, None
+        return im, (h0, w0), im.shape[:2]
+
+    dataset.load_image = load_image
+    return dataset
+
+
+def make_cached_trainer(store):
+    """ストアを使うデータセットを構築する DetectionTrainer のサブクラスを返す"""
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    class CachedDetectionTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode='train', batch=None):
+            dataset = super().build_dataset(img_path, mode=mode, batch=batch)
+            return attach_image_cache(dataset, store)
+
+    return CachedDetectionTrainer
+
+
+def _write_smoke_dataset(work_dir, num_images, image_size=160, seed=0):
+    """合成画像と、1画像に1つの箱のラベルを持つ最小のデータセット (data.yaml) を作る"""
+    rng = np.random.default_rng(seed)
+    for split in ('train', 'val'):
+        image_dir = os.path.join(work_dir, split, 'images')
+        label_dir = os.path.join(work_dir, split, 'labels')
+        os.makedirs(image_dir, exist_ok=True)
+        os.makedirs(label_dir, exist_ok=True)
+        for index in range(num_images):
+            im = np.full((image_size, image_size, 3), int(rng.integers(180, 240)), dtype=np.uint8)
+            w, h = (int(v) for v in rng.integers(image_size // 6, image_size // 2, 2))
+            x, y = int(rng.integers(0, image_size - w)), int(rng.integers(0, image_size - h))
+            cv2.rectangle(im, (x, y), (x + w, y + h), tuple(int(c) for c in rng.integers(0, 150, 3)), -1)
+            cv2.imwrite(os.path.join(image_dir, f'{index:03d}.jpg'), im)
+            with open(os.path.join(label_dir, f'{index:03d}.txt'), 'w') as f:
+                f.write(f"0 {(x + w / 2) / image_size:.6f} {(y + h / 2) / image_size:.6f} "
+                        f"{w / image_size:.6f} {h / image_size:.6f}\n")
+    data_yaml_path = os.path.join(work_dir, 'data.yaml')
+    with open(data_yaml_path, 'w') as f:
+        yaml.safe_dump({'path': work_dir, 'train': 'train/images', 'val': 'val/images', 'nc': 1, 'names': ['item']}, f)
+    return data_yaml_path
+
+
+def smoke_train_cached(work_dir=None, imgsz=64, num_images=8, batch=4):
+    """
+    合成データセットで、キャッシュを使う学習を1エポックだけ実行する（既定の mosaic=1.0 を含む拡張あり）。
+    attach_image_cache の load_image が ultralytics のデータセットの前提（バッファなど）を壊していないかを確かめる。
+
+    Returns:
+        str: 学習結果の保存先 (work_dir を指定しなかった場合は、一時ディレクトリごと削除済み)
+    """
+    import shutil
+    import tempfile
+    from ultralytics import YOLO
+
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='re2_yolo_cache_smoke_')
+    try:
+        data_yaml_path = _write_smoke_dataset(work_dir, num_images)
+        store = build_image_cache_for_dataset(data_yaml_path, imgsz, cache_dir=os.path.join(work_dir, 'cache'))
+        # 重みのダウンロードを避けるため、モデル定義 (yaml) から初期化する
+        results = YOLO('yolov8n.yaml').train(data=data_yaml_path, epochs=1, imgsz=imgsz, batch=batch, workers=0,
+                                             device='cpu', mosaic=1.0, plots=False, val=False,
+                                             project=os.path.join(work_dir, 'runs'), name='smoke',
+                                             trainer=make_cached_trainer(store))
+        print(f"Cached smoke training finished: {results.save_dir if results else work_dir}")
+        return str(results.save_dir) if results else work_dir
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_image_loading(data_yaml_path, imgsz=640, limit=200):
+    """JPEGデコード+リサイズと、キャッシュからの読み出しにかかる時間を比較する"""
+    image_paths = _resolve_split_paths(data_yaml_path, splits=('train',))[:limit]
+    store = build_image_cache(image_paths, imgsz)
+
+    start = time.perf_counter()
+    for path in image_paths:
+        resize_long_side(cv2.imread(path), imgsz)
+    decode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in image_paths:
+        im, _ = store.get(store.slot_for(path))
+        np.ascontiguousarray(im)
+    cache_time = time.perf_counter() - start
+
+    n = max(len(image_paths), 1)
+    print(f"Decode + resize: {decode_time / n * 1000:.2f} ms/image, "
+          f"cache read: {cache_time / n * 1000:.2f} ms/image ({decode_time / max(cache_time, 1e-9):.1f}x)")
+
+
+def benchmark_epoch_time(epochs=1, imgsz=640, batch=16, model_name='yolov8n.pt'):
+    """同じ設定で、キャッシュなし/ありの学習を実行し、1エポックあたりの時間を比較する"""
+    from src.yolo_detection.train_yolo import train_yolov8_model
+
+    timings = {}
+    for image_cache in (False, True):
+        label = 'with cache' if image_cache else 'without cache'
+        start = time.perf_counter()
+        train_yolov8_model(epochs=epochs, imgsz=imgsz, batch=batch, model_name=model_name,
+                           run_name=f"bench_image_cache_{'on' if image_cache else 'off'}",
+                           image_cache=image_cache, exist_ok=True)
+        timings[label] = (time.perf_counter() - start) / epochs
+    for label, seconds in timings.items():
+        print(f"Epoch time {label}: {seconds:.1f}s")
+    return timings
+
+
+if __name__ == '__main__':
+    import argparse
+    from src.config import DATA_DIR
+
+    parser = argparse.ArgumentParser(description='Build the decoded image cache or run the cache benchmarks.')
+    parser.add_argument('command', choices=['build', 'bench-load', 'bench-epoch', 'smoke'])
+    parser.add_argument('--data', default=os.path.join(DATA_DIR, 'datasets', 'data.yaml'))
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--epochs', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_image_cache_for_dataset(args.data, args.imgsz)
+    elif args.command == 'smoke':
+        smoke_train_cached()
+    elif args.command == 'bench-load':
+        benchmark_image_loading(args.data, imgsz=args.imgsz)
+    else:
+        benchmark_epoch_time(epochs=args.epochs, imgsz=args.imgsz)
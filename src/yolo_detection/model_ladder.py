@@ -0,0 +1,158 @@
+# src/yolo_detection/model_ladder.py
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from src.config import YOLO_MODEL_LADDER_PATH
+except ImportError:
+    YOLO_MODEL_LADDER_PATH = os.path.join(project_root, 'data', 'model_ladder.json')
+
+try:
+    from src.config import YOLO_DEFAULT_LATENCY_BUDGET_MS # キュー深さだけが指定された場合の1リクエストあたりの予算
+except ImportError:
+    YOLO_DEFAULT_LATENCY_BUDGET_MS = 1000.0
+
+# ----------------------------------------------------
+# レイテンシ予算に応じたモデル・画像サイズの選択 (モデルラダー)
+# ----------------------------------------------------
+# 複数のモデル (例: yolov8n/s のエクスポート) と imgsz (320/480/640) の組み合わせを
+# インストール時にローカルCPUでプロファイルし、model_ladder.json に保存する。
+# 推論時は「予算内に収まる (p95 レイテンシ <= 予算) 中で最も精度の高い」バリアントを選ぶ。
+# キューに待ちがある場合は、待っているリクエストも同じ予算内で処理できるよう予算を分け合う。
+
+LADDER_VERSION = 1
+DEFAULT_IMAGE_SIZES = (320, 480, 640)
+
+
+def variant_name(weights_path, imgsz):
+    """バリアント名 (例: 'best@480', 'yolov8s_int8_openvino_model@320')"""
+    return f"{os.path.splitext(os.path.basename(os.path.normpath(weights_path)))[0]}@{imgsz}"
+
+
+def profile_ladder(weights_paths, image_sizes=DEFAULT_IMAGE_SIZES, data_yaml_path=None,
+                   output_path=YOLO_MODEL_LADDER_PATH, latency_runs=20):
+    """
+    各重み x 画像サイズのCPUレイテンシ（と data_yaml_path 指定時は検証分割の mAP）を計測し、
+    ラダーのプロファイルをJSONに保存する。
+
+    Returns:
+        list: バリアントの辞書のリスト
+    """
+    from src.yolo_detection.quantize_yolo import evaluate_model
+    from src.yolo_detection.run_metrics import measure_cpu_latency
+
+    variants = []
+    for weights_path in weights_paths:
+        for imgsz in image_sizes:
+            name = variant_name(weights_path, imgsz)
+            print(f"Profiling {name} ...")
+            if data_yaml_path:
+                result = evaluate_model(weights_path, data_yaml_path, imgsz=imgsz, latency_runs=latency_runs)
+            else:
+                latency_ms, latency_p95_ms = measure_cpu_latency(weights_path, imgsz=imgsz, runs=latency_runs)
+                result = {'map50_95': None, 'map50': None, 'latency_ms': latency_ms, 'latency_p95_ms': latency_p95_ms}
+            variants.append({
+                'name': name,
+                'weights': os.path.abspath(weights_path),
+                'imgsz': imgsz,
+                'map50_95': result['map50_95'],
+                'map50': result['map50'],
+                'latency_ms': result['latency_ms'],
+                'latency_p95_ms': result['latency_p95_ms'],
+            })
+            print(f"  {result['latency_ms']:.1f} ms (p95 {result['latency_p95_ms']:.1f} ms), "
+                  f"mAP50-95 {result['map50_95'] if result['map50_95'] is not None else '-'}")
+
+    profile = {'version': LADDER_VERSION, 'profiled_at': time.time(), 'cpu_count': os.cpu_count(),
+               'variants': variants}
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, output_path)
+    print(f"Model ladder profile saved to {output_path}")
+    return variants
+
+
+class ModelLadder:
+    """プロファイル済みのバリアントから、レイテンシ予算に合うものを選んでロードする"""
+
+    def __init__(self, profile_path=YOLO_MODEL_LADDER_PATH):
+        with open(profile_path, 'r') as f:
+            profile = json.load(f)
+        # 精度の高い順（mAPが未計測のものはレイテンシが大きい＝大きいモデル・画像ほど精度が高いとみなす）
+        self.variants = sorted(profile['variants'],
+                               key=lambda v: (v['map50_95'] if v['map50_95'] is not None else -1.0, v['latency_ms']),
+                               reverse=True)
+        if not self.variants:
+            raise ValueError(f"Model ladder profile {profile_path} has no variants.")
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def effective_budget(latency_budget_ms=None, queue_depth=0):
+        """
+        このリクエストに使えるレイテンシ予算 (ms)。
+        キューに queue_depth 件待っている場合、それらも同じ予算内に処理できるよう (queue_depth + 1) で割る。
+        予算も待ちもない場合は None（制約なし）。
+        """
+        if latency_budget_ms is None:
+            if not queue_depth:
+                return None
+            latency_budget_ms = YOLO_DEFAULT_LATENCY_BUDGET_MS
+        return latency_budget_ms / (max(queue_depth, 0) + 1)
+
+    def select(self, latency_budget_ms=None, queue_depth=0):
+        """予算内 (p95) で最も精度の高いバリアントを返す。どれも収まらない場合は最速のバリアント"""
+        budget = self.effective_budget(latency_budget_ms, queue_depth)
+        if budget is None:
+            return self.variants[0]
+        for variant in self.variants:
+            if variant['latency_p95_ms'] <= budget:
+                return variant
+        return min(self.variants, key=lambda v: v['latency_ms'])
+
+    def get_model(self, variant):
+        """バリアントのモデルを返す（初回のみロード。同じ重みは画像サイズが違っても共有する）"""
+        weights = variant['weights']
+        with self._lock:
+            if weights not in self._models:
+                from ultralytics import YOLO
+                self._models[weights] = YOLO(weights, task='detect')
+            return self._models[weights]
+
+
+def print_ladder(ladder, budgets=(50, 100, 200, 400)):
+    print(f"{'Variant':<40} {'mAP50-95':>9} {'ms':>8} {'p95 ms':>8}")
+    print("-" * 68)
+    for v in ladder.variants:
+        map_text = f"{v['map50_95']:.4f}" if v['map50_95'] is not None else '-'
+        print(f"{v['name']:<40} {map_text:>9} {v['latency_ms']:>8.1f} {v['latency_p95_ms']:>8.1f}")
+    print()
+    for budget in budgets:
+        print(f"budget {budget:>4} ms -> {ladder.select(budget)['name']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile exported YOLO variants on this CPU and build a model ladder.')
+    parser.add_argument('weights', nargs='*', help='プロファイルする重み (.pt / OpenVINOのディレクトリなど)')
+    parser.add_argument('--imgsz', type=int, nargs='+', default=list(DEFAULT_IMAGE_SIZES))
+    parser.add_argument('--data', default=None, help='指定すると検証分割の mAP も計測する')
+    parser.add_argument('--output', default=YOLO_MODEL_LADDER_PATH)
+    parser.add_argument('--latency-runs', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.weights:
+        profile_ladder(args.weights, args.imgsz, data_yaml_path=args.data, output_path=args.output,
+                       latency_runs=args.latency_runs)
+    print_ladder(ModelLadder(args.output))
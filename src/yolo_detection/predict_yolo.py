@@ -1,7 +1,9 @@
 # src/yolo_detection/predict_yolo.py
 
 import os
+import json
 import sys
+import logging
 from ultralytics import YOLO
 
 # プロジェクトルートをsys.pathに追加
@@ -10,20 +12,72 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from src.config import YOLO_MODEL_PATH, YOLO_CONFIDENCE_THRESHOLD, TARGET_FOOD_YOLO_CLASSES
+from src.yolo_detection.model_ladder import ModelLadder, YOLO_MODEL_LADDER_PATH, variant_name
+from src.observability.instrumentation import span, configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    # quantize_yolo.py で作成したINT8モデル (OpenVINO) を使う場合の設定
+    from src.config import YOLO_USE_INT8, YOLO_INT8_MODEL_PATH
+except ImportError:
+    YOLO_USE_INT8 = False
+    YOLO_INT8_MODEL_PATH = None
+
+
+def _load_int8_model():
+    """INT8モデルをロードする。精度チェックに合格していない・ロードできない場合はNone（FP32を使う）"""
+    if not (YOLO_USE_INT8 and YOLO_INT8_MODEL_PATH):
+        return None
+    report_path = os.path.join(YOLO_INT8_MODEL_PATH, 'quantization_report.json')
+    try:
+        with open(report_path, 'r') as f:
+            if not json.load(f).get('accepted'):
+                logger.warning("INT8 model at %s failed the accuracy check. Falling back to FP32.", YOLO_INT8_MODEL_PATH)
+                return None
+        model = YOLO(YOLO_INT8_MODEL_PATH, task='detect')
+        logger.info("YOLOv8 INT8 prediction model loaded from %s", YOLO_INT8_MODEL_PATH)
+        return model
+    except Exception as e:
+        logger.error("Error loading INT8 model from %s: %s. Falling back to FP32.", YOLO_INT8_MODEL_PATH, e)
+        return None
 
 
 # YOLOv8モデルのロード（一度だけ行う）
 # train.pyで学習したbest.ptモデルをロード
-try:
-    yolo_model = YOLO(YOLO_MODEL_PATH)
-    print(f"YOLOv8 prediction model loaded from {YOLO_MODEL_PATH}")
-except Exception as e:
-    print(f"Error loading YOLOv8 model from {YOLO_MODEL_PATH}: {e}")
-    print("Please ensure your YOLO_MODEL_PATH in src/config.py is correct and the model exists.")
-    yolo_model = None
+yolo_model = _load_int8_model()
+DEFAULT_MODEL_VARIANT = variant_name(YOLO_INT8_MODEL_PATH, 'default') if yolo_model is not None else None
+if yolo_model is None:
+    try:
+        yolo_model = YOLO(YOLO_MODEL_PATH)
+        DEFAULT_MODEL_VARIANT = variant_name(YOLO_MODEL_PATH, 'default')
+        logger.info("YOLOv8 prediction model loaded from %s", YOLO_MODEL_PATH)
+    except Exception as e:
+        logger.error("Error loading YOLOv8 model from %s: %s", YOLO_MODEL_PATH, e)
+        logger.error("Please ensure your YOLO_MODEL_PATH in src/config.py is correct and the model exists.")
+        yolo_model = None
+
+_model_ladder = None
+_model_ladder_loaded = False
 
 
-def predict_on_image(image_path, conf_threshold=YOLO_CONFIDENCE_THRESHOLD, target_classes=TARGET_FOOD_YOLO_CLASSES):
+def get_model_ladder():
+    """model_ladder.py でプロファイルしたラダーを返す（初回のみロード）。プロファイルがない場合はNone"""
+    global _model_ladder, _model_ladder_loaded
+    if not _model_ladder_loaded:
+        _model_ladder_loaded = True
+        if os.path.exists(YOLO_MODEL_LADDER_PATH):
+            try:
+                _model_ladder = ModelLadder(YOLO_MODEL_LADDER_PATH)
+                logger.info("YOLO model ladder loaded from %s (%d variants)", YOLO_MODEL_LADDER_PATH, len(_model_ladder.variants))
+            except Exception as e:
+                logger.error("Error loading model ladder from %s: %s. Using the default model.", YOLO_MODEL_LADDER_PATH, e)
+    return _model_ladder
+
+
+def predict_on_image(image_path, conf_threshold=YOLO_CONFIDENCE_THRESHOLD, target_classes=TARGET_FOOD_YOLO_CLASSES,
+                     latency_budget_ms=None, queue_depth=0):
     """
     指定された画像パスの食材をYOLOv8モデルで検出し、結果を返す。
 
@@ -31,36 +85,80 @@ def predict_on_image(image_path, conf_threshold=YOLO_CONFIDENCE_THRESHOLD, targe
         image_path (str): 推論対象の画像パス。
         conf_threshold (float): 検出の信頼度閾値。
         target_classes (list): 検出結果をフィルタリングするターゲット食材のYOLOクラス名リスト。
+        latency_budget_ms (float): このリクエストのレイテンシ予算。指定するとモデルラダーから
+                                   予算内で最も精度の高いモデル・画像サイズを選ぶ。
+        queue_depth (int): 推論待ちのリクエスト数。多いほど軽いバリアントを選ぶ。
 
     Returns:
-        list: 検出された各アイテムの辞書のリスト
-              例: [{'yolo_class': 'milk', 'confidence': 0.95, 'bbox': [x1, y1, x2, y2]}, ...]
+        list: 検出された各アイテムの辞書のリスト。'model_variant' は推論に使ったバリアント名
+              例: [{'yolo_class': 'milk', 'confidence': 0.95, 'bbox': [x1, y1, x2, y2], 'model_variant': 'best@640'}, ...]
     """
     if yolo_model is None:
-        print("YOLO model not loaded. Cannot perform prediction.")
+        logger.error("YOLO model not loaded. Cannot perform prediction.")
         return []
 
     if not os.path.exists(image_path):
-        print(f"Error: Image file not found at {image_path}")
+        logger.error("Image file not found at %s", image_path)
         return []
 
-    print(f"Performing YOLO prediction on: {image_path}")
-    
+    logger.debug("Performing YOLO prediction on: %s", image_path)
+    detected_items = _run_yolo_prediction(image_path, conf_threshold, target_classes, latency_budget_ms, queue_depth)
+    logger.info("YOLO prediction completed. Detected %d target items.", len(detected_items))
+    return detected_items
+
+def predict_on_array(image, conf_threshold=YOLO_CONFIDENCE_THRESHOLD, target_classes=TARGET_FOOD_YOLO_CLASSES,
+                     latency_budget_ms=None, queue_depth=0):
+    """
+    デコード済みの画像配列 (BGR, HxWx3のuint8) に対してYOLOv8推論を行う。
+    共有メモリ経由で画像を受け取るワーカープロセスなど、ファイルパスを持たない呼び出し元向け。
+
+    Args:
+        image (numpy.ndarray): 推論対象の画像配列。
+        conf_threshold (float): 検出の信頼度閾値。
+        target_classes (list): 検出結果をフィルタリングするターゲット食材のYOLOクラス名リスト。
+        latency_budget_ms (float), queue_depth (int): predict_on_image と同じ。
+
+    Returns:
+        list: predict_on_image と同じ形式の検出結果リスト。
+    """
+    if yolo_model is None:
+        logger.error("YOLO model not loaded. Cannot perform prediction.")
+        return []
+
+    return _run_yolo_prediction(image, conf_threshold, target_classes, latency_budget_ms, queue_depth)
+
+
+def _select_model(latency_budget_ms, queue_depth):
+    """(モデル, imgsz, バリアント名) を返す。予算の指定がない・ラダーがない場合はデフォルトのモデル"""
+    if latency_budget_ms is not None or queue_depth:
+        ladder = get_model_ladder()
+        if ladder is not None:
+            variant = ladder.select(latency_budget_ms, queue_depth)
+            return ladder.get_model(variant), variant['imgsz'], variant['name']
+    return yolo_model, None, DEFAULT_MODEL_VARIANT
+
+
+def _run_yolo_prediction(source, conf_threshold, target_classes, latency_budget_ms=None, queue_depth=0):
+    """画像パスまたは画像配列を受け取り、推論結果をターゲットクラスでフィルタリングして返す"""
+    model, imgsz, model_variant = _select_model(latency_budget_ms, queue_depth)
+    predict_kwargs = {'imgsz': imgsz} if imgsz else {}
+
     # YOLOv8で推論を実行
     # save=False: 結果画像を保存しない (main.pyで制御)
     # verbose=False: 詳細なログを出力しない
-    results = yolo_model.predict(source=image_path, conf=conf_threshold, save=False, verbose=False, iou=0.7)
-    
+    with span('yolo.inference', variant=model_variant):
+        results = model.predict(source=source, conf=conf_threshold, save=False, verbose=False, iou=0.7, **predict_kwargs)
+
     detected_items = []
     # YOLOv8モデルの .names 属性からクラス名マップを取得
-    class_names_map = yolo_model.names
+    class_names_map = model.names
 
     for r in results: # 各画像の結果
         for box in r.boxes: # 各検出されたオブジェクト
             class_id = int(box.cls[0])
             confidence = float(box.conf[0])
             bbox = box.xyxy[0].tolist() # バウンディングボックス座標 [x1, y1, x2, y2]
-            
+
             yolo_class_name = class_names_map.get(class_id, "unknown")
 
             # ターゲット食材クラスでフィルタリング
@@ -69,12 +167,13 @@ def predict_on_image(image_path, conf_threshold=YOLO_CONFIDENCE_THRESHOLD, targe
                     'yolo_class': yolo_class_name,
                     'confidence': confidence,
                     'bbox': bbox,
+                    'model_variant': model_variant, # 後段の照合で信頼度を重み付けするために記録する
                 })
-    
-    print(f"YOLO prediction completed. Detected {len(detected_items)} target items.")
     return detected_items
 
 if __name__ == '__main__':
+    configure_logging()
+
     # ターミナルから直接推論をテストする場合の例
     # 適当な冷蔵庫の画像パスを指定
     test_image_path = os.path.join(PROJECT_ROOT, 'data', 'annotated_images', 'IMG_XXXX.jpg') # XXXXを実際のファイル名に
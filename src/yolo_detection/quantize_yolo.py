@@ -0,0 +1,174 @@
+# src/yolo_detection/quantize_yolo.py
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import yaml
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.config import DATA_DIR
+from src.yolo_detection.image_cache import _resolve_split_paths
+from src.yolo_detection.run_metrics import measure_cpu_latency
+
+try:
+    from src.config import QUANT_MAP_TOLERANCE
+except ImportError:
+    QUANT_MAP_TOLERANCE = 0.01 # 許容する mAP50-95 の低下幅（絶対値）
+
+# ----------------------------------------------------
+# 学習後INT8量子化 (静的量子化 + キャリブレーション)
+# ----------------------------------------------------
+# train_yolov8_model が出力した best.pt を OpenVINO の INT8 モデルに変換する。
+# ultralyticsのエクスポート (NNCFによる静的量子化) は data.yaml の val 分割をキャリブレーションに使うため、
+# 学習画像から抽出したサンプルを val に指定した一時的な data.yaml を渡す。
+# 変換後は検証分割で FP32 と mAP・CPUレイテンシ・モデルサイズを比較し、
+# mAP50-95 の低下が許容幅を超えた場合は QuantizationAccuracyError を送出する。
+
+DEFAULT_DATA_YAML = os.path.join(DATA_DIR, 'datasets', 'data.yaml')
+CALIBRATION_IMAGES = 300
+REPORT_FILENAME = 'quantization_report.json'
+
+
+class QuantizationAccuracyError(RuntimeError):
+    """INT8モデルの精度低下が許容幅を超えた"""
+
+
+def _path_size(path):
+    """ファイルまたはディレクトリ (OpenVINOのエクスポート) の合計バイト数"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def write_calibration_yaml(data_yaml_path, output_dir, num_images=CALIBRATION_IMAGES, seed=0):
+    """
+    学習分割からキャリブレーション用の画像を抽出し、それを val に指定した data.yaml を書き出す。
+    ラベルは元の画像と同じ場所から読まれる。
+    """
+    images = sorted(_resolve_split_paths(data_yaml_path, splits=('train',)))
+    if not images:
+        raise FileNotFoundError(f"No training images found via {data_yaml_path}")
+    sample = random.Random(seed).sample(images, min(num_images, len(images)))
+
+    os.makedirs(output_dir, exist_ok=True)
+    list_path = os.path.join(output_dir, 'calibration.txt')
+    with open(list_path, 'w') as f:
+        f.writelines(path + '\n' for path in sample)
+
+    with open(data_yaml_path, 'r') as f:
+        data = yaml.safe_load(f) or {}
+    calib_data = {'path': output_dir, 'train': list_path, 'val': list_path}
+    for key in ('nc', 'names'):
+        if key in data:
+            calib_data[key] = data[key]
+    calib_yaml_path = os.path.join(output_dir, 'calibration.yaml')
+    with open(calib_yaml_path, 'w') as f:
+        yaml.safe_dump(calib_data, f, allow_unicode=True, sort_keys=False)
+    return calib_yaml_path, len(sample)
+
+
+def evaluate_model(model_path, data_yaml_path, imgsz=640, latency_runs=20):
+    """検証分割の mAP と、CPUレイテンシ・モデルサイズを計測する"""
+    from ultralytics import YOLO
+
+    model = YOLO(model_path, task='detect')
+    metrics = model.val(data=data_yaml_path, split='val', imgsz=imgsz, batch=1, device='cpu',
+                        plots=False, verbose=False)
+    latency_ms, latency_p95_ms = measure_cpu_latency(model_path, imgsz=imgsz, runs=latency_runs)
+    return {
+        'model_path': model_path,
+        'map50_95': float(metrics.box.map),
+        'map50': float(metrics.box.map50),
+        'latency_ms': latency_ms,
+        'latency_p95_ms': latency_p95_ms,
+        'size_bytes': _path_size(model_path),
+    }
+
+
+def quantize_model(weights_path, data_yaml_path=DEFAULT_DATA_YAML, imgsz=640, tolerance=QUANT_MAP_TOLERANCE,
+                   calibration_images=CALIBRATION_IMAGES, latency_runs=20):
+    """
+    best.pt をキャリブレーション付きで静的INT8量子化し、FP32と比較する。
+
+    Args:
+        weights_path (str): train_yolov8_model が出力した重み (weights/best.pt)。
+        data_yaml_path (str): データセットの data.yaml（キャリブレーションは train、評価は val を使う）。
+        imgsz (int): エクスポート・評価の画像サイズ。
+        tolerance (float): 許容する mAP50-95 の低下幅（絶対値）。
+        calibration_images (int): キャリブレーションに使う学習画像の枚数。
+
+    Returns:
+        dict: FP32/INT8の比較レポート（'int8_model_path' を含む）
+
+    Raises:
+        QuantizationAccuracyError: mAP50-95 の低下が tolerance を超えた場合。
+    """
+    from ultralytics import YOLO
+
+    weights_path = os.path.abspath(weights_path)
+    work_dir = os.path.join(os.path.dirname(weights_path), 'int8_calibration')
+    calib_yaml_path, num_calib = write_calibration_yaml(data_yaml_path, work_dir, calibration_images)
+
+    print(f"--- INT8 quantization of {weights_path} ({num_calib} calibration images) ---")
+    start = time.perf_counter()
+    int8_model_path = YOLO(weights_path).export(format='openvino', int8=True, data=calib_yaml_path,
+                                                imgsz=imgsz, fraction=1.0, device='cpu')
+    export_seconds = time.perf_counter() - start
+
+    fp32 = evaluate_model(weights_path, data_yaml_path, imgsz=imgsz, latency_runs=latency_runs)
+    int8 = evaluate_model(int8_model_path, data_yaml_path, imgsz=imgsz, latency_runs=latency_runs)
+    map_drop = fp32['map50_95'] - int8['map50_95']
+    report = {
+        'weights_path': weights_path,
+        'int8_model_path': int8_model_path,
+        'imgsz': imgsz,
+        'calibration_images': num_calib,
+        'export_seconds': export_seconds,
+        'tolerance': tolerance,
+        'map50_95_drop': map_drop,
+        'accepted': map_drop <= tolerance,
+        'fp32': fp32,
+        'int8': int8,
+        'created_at': time.time(),
+    }
+    with open(os.path.join(int8_model_path, REPORT_FILENAME), 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print_quantization_report(report)
+
+    if not report['accepted']:
+        raise QuantizationAccuracyError(
+            f"INT8 mAP50-95 dropped by {map_drop:.4f} ({fp32['map50_95']:.4f} -> {int8['map50_95']:.4f}), "
+            f"exceeding the tolerance of {tolerance:.4f}. Do not deploy {int8_model_path}.")
+    return report
+
+
+def print_quantization_report(report):
+    fp32, int8 = report['fp32'], report['int8']
+    print(f"{'':<6} {'mAP50-95':>9} {'mAP50':>7} {'CPU ms':>8} {'p95 ms':>8} {'Size MB':>8}")
+    for name, r in (('FP32', fp32), ('INT8', int8)):
+        print(f"{name:<6} {r['map50_95']:>9.4f} {r['map50']:>7.4f} {r['latency_ms']:>8.1f} "
+              f"{r['latency_p95_ms']:>8.1f} {r['size_bytes'] / 1e6:>8.2f}")
+    print(f"mAP50-95 drop: {report['map50_95_drop']:.4f} (tolerance {report['tolerance']:.4f}), "
+          f"speedup: {fp32['latency_ms'] / int8['latency_ms']:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Post-training static INT8 quantization for the fridge detector.')
+    parser.add_argument('weights', help='学習済みの重み (weights/best.pt)')
+    parser.add_argument('--data', default=DEFAULT_DATA_YAML)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--tolerance', type=float, default=QUANT_MAP_TOLERANCE, help='許容する mAP50-95 の低下幅')
+    parser.add_argument('--calibration-images', type=int, default=CALIBRATION_IMAGES)
+    args = parser.parse_args()
+
+    result = quantize_model(args.weights, args.data, imgsz=args.imgsz, tolerance=args.tolerance,
+                            calibration_images=args.calibration_images)
+    print(f"Set YOLO_INT8_MODEL_PATH = '{result['int8_model_path']}' and YOLO_USE_INT8 = True in src/config.py")
@@ -0,0 +1,329 @@
+# src/yolo_detection/run_metrics.py
+
+import os
+import sys
+import glob
+import time
+import sqlite3
+import argparse
+
+import yaml
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.yolo_detection.artifact_store import read_results_csv, file_sha256
+
+try:
+    from src.config import RUN_METRICS_DB_PATH
+except ImportError:
+    RUN_METRICS_DB_PATH = os.path.join(project_root, 'data', 'run_metrics.db')
+
+# ----------------------------------------------------
+# 学習ランのメトリクス索引とリーダーボード
+# ----------------------------------------------------
+# detect/* や runs/detect/* に散らばった results.csv と args.yaml を1つのSQLiteに取り込み、
+# ラン同士を比較できるようにする。
+#   run_epochs     : ラン x エポック の列指向テーブル（results.csv の各列）
+#   runs           : ランごとの要約（best mAP50-95 のエポック、エポックあたり時間、収束速度）
+#   weight_latency : 重みファイル (SHA-256) ごとのCPU推論レイテンシ
+# 重みのレイテンシはファイルの内容ハッシュで引くため、同じ重みを持つランは一度だけ計測する。
+
+DEFAULT_RUN_ROOTS = [
+    os.path.join(project_root, 'src', 'yolo_detection', 'detect'),
+    os.path.join(project_root, 'runs', 'detect'),
+]
+CONVERGENCE_FRACTION = 0.9 # best mAP50-95 のこの割合に最初に到達したエポックを「収束エポック」とする
+LATENCY_WARMUP_RUNS = 3
+LATENCY_MEASURE_RUNS = 20
+
+# results.csv の列名 -> run_epochs の列名
+EPOCH_COLUMNS = {
+    'train/box_loss': 'train_box_loss',
+    'train/cls_loss': 'train_cls_loss',
+    'train/dfl_loss': 'train_dfl_loss',
+    'metrics/precision(B)': 'precision',
+    'metrics/recall(B)': 'recall',
+    'metrics/mAP50(B)': 'map50',
+    'metrics/mAP50-95(B)': 'map50_95',
+    'val/box_loss': 'val_box_loss',
+    'val/cls_loss': 'val_cls_loss',
+    'val/dfl_loss': 'val_dfl_loss',
+}
+
+
+def _epoch_times(rows):
+    """
+    各エポックの所要秒数を返す。
+    ultralyticsの time 列は累積秒数だが、古いバージョンではエポックごとの値のため、単調増加かどうかで判定する。
+    """
+    times = [r.get('time') for r in rows]
+    if not times or any(not isinstance(t, float) for t in times):
+        return [None] * len(rows)
+    if all(b >= a for a, b in zip(times, times[1:])):
+        return [times[0]] + [b - a for a, b in zip(times, times[1:])]
+    return times
+
+
+def summarize_run(epochs):
+    """
+    run_epochs の行（辞書のリスト）からランの要約を計算する。
+
+    Returns:
+        dict: best_epoch, best_map50_95, best_map50, epochs_run, total_time, time_per_epoch,
+              convergence_epoch (best の CONVERGENCE_FRACTION に最初に到達したエポック)
+    """
+    if not epochs:
+        return {}
+    best = max(epochs, key=lambda r: (r['map50_95'] or 0.0, -r['epoch']))
+    best_map = best['map50_95'] or 0.0
+    convergence_epoch = next((r['epoch'] for r in epochs if (r['map50_95'] or 0.0) >= CONVERGENCE_FRACTION * best_map),
+                             best['epoch'])
+    epoch_times = [r['epoch_time'] for r in epochs if r['epoch_time'] is not None]
+    total_time = sum(epoch_times) if epoch_times else None
+    return {
+        'best_epoch': best['epoch'],
+        'best_map50_95': best['map50_95'],
+        'best_map50': best['map50'],
+        'epochs_run': len(epochs),
+        'total_time': total_time,
+        'time_per_epoch': total_time / len(epoch_times) if epoch_times else None,
+        'convergence_epoch': convergence_epoch,
+    }
+
+
+def find_run_dirs(roots=None):
+    """results.csv を持つランディレクトリを列挙する"""
+    run_dirs = []
+    for root in roots or DEFAULT_RUN_ROOTS:
+        for path in sorted(glob.glob(os.path.join(root, '**', 'results.csv'), recursive=True)):
+            run_dirs.append(os.path.dirname(os.path.abspath(path)))
+    return run_dirs
+
+
+def measure_cpu_latency(weights_path, imgsz=640, runs=LATENCY_MEASURE_RUNS, warmup=LATENCY_WARMUP_RUNS):
+    """
+    重みファイルのCPU推論レイテンシ (ms) を合成画像で計測する。
+
+    Returns:
+        tuple: (中央値 ms, p95 ms)
+    """
+    import numpy as np
+    from ultralytics import YOLO
+
+    model = YOLO(weights_path)
+    image = np.random.default_rng(0).integers(0, 256, (imgsz, imgsz, 3), dtype=np.uint8)
+    for _ in range(warmup):
+        model.predict(image, imgsz=imgsz, device='cpu', verbose=False)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(image, imgsz=imgsz, device='cpu', verbose=False)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+class RunMetricsIndex:
+    """学習ランのメトリクスを集約するSQLiteの索引"""
+
+    def __init__(self, path=RUN_METRICS_DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        epoch_columns = ',\n'.join(f'                {name} REAL' for name in EPOCH_COLUMNS.values())
+        self._conn.executescript(f'''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                run_dir TEXT NOT NULL,
+                model TEXT,
+                imgsz INTEGER,
+                batch INTEGER,
+                epochs_planned INTEGER,
+                epochs_run INTEGER,
+                best_epoch INTEGER,
+                best_map50_95 REAL,
+                best_map50 REAL,
+                total_time REAL,
+                time_per_epoch REAL,
+                convergence_epoch INTEGER,
+                weights_path TEXT,
+                weights_sha256 TEXT,
+                results_mtime_ns INTEGER,
+                results_size INTEGER,
+                ingested_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS run_epochs (
+                run_id TEXT NOT NULL,
+                epoch INTEGER NOT NULL,
+                time REAL,
+                epoch_time REAL,
+{epoch_columns},
+                PRIMARY KEY (run_id, epoch)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS weight_latency (
+                weights_sha256 TEXT NOT NULL,
+                imgsz INTEGER NOT NULL,
+                latency_ms REAL NOT NULL,
+                latency_p95_ms REAL NOT NULL,
+                measured_at REAL NOT NULL,
+                PRIMARY KEY (weights_sha256, imgsz)
+            );
+        ''')
+        self._conn.commit()
+
+    @staticmethod
+    def run_id_for(run_dir):
+        """プロジェクトルートからの相対パスをランIDにする (例: src/yolo_detection/detect/train_initial)"""
+        run_dir = os.path.abspath(run_dir)
+        if run_dir.startswith(project_root + os.sep):
+            return os.path.relpath(run_dir, project_root).replace(os.sep, '/')
+        return run_dir.replace(os.sep, '/')
+
+    def ingest_run(self, run_dir, force=False):
+        """
+        ランディレクトリの results.csv と args.yaml を取り込む。
+        results.csv のサイズとmtimeが前回と同じならスキップする。
+
+        Returns:
+            bool: 取り込んだ場合True
+        """
+        run_id = self.run_id_for(run_dir)
+        results_path = os.path.join(run_dir, 'results.csv')
+        stat = os.stat(results_path)
+        row = self._conn.execute('SELECT results_mtime_ns, results_size FROM runs WHERE run_id = ?',
+                                 (run_id,)).fetchone()
+        if not force and row and row['results_mtime_ns'] == stat.st_mtime_ns and row['results_size'] == stat.st_size:
+            return False
+
+        rows = read_results_csv(results_path)
+        epoch_times = _epoch_times(rows)
+        epochs = []
+        for r, epoch_time in zip(rows, epoch_times):
+            epoch = {'epoch': int(r.get('epoch', len(epochs) + 1)), 'time': r.get('time'), 'epoch_time': epoch_time}
+            for csv_name, column in EPOCH_COLUMNS.items():
+                value = r.get(csv_name)
+                epoch[column] = value if isinstance(value, float) else None
+            epochs.append(epoch)
+
+        args = {}
+        if os.path.exists(os.path.join(run_dir, 'args.yaml')):
+            with open(os.path.join(run_dir, 'args.yaml'), 'r') as f:
+                args = yaml.safe_load(f) or {}
+        weights_path = os.path.join(run_dir, 'weights', 'best.pt')
+        weights_sha = file_sha256(weights_path) if os.path.exists(weights_path) else None
+        summary = summarize_run(epochs)
+
+        columns = ['run_id', 'epoch', 'time', 'epoch_time'] + list(EPOCH_COLUMNS.values())
+        with self._conn:
+            self._conn.execute('DELETE FROM run_epochs WHERE run_id = ?', (run_id,))
+            self._conn.executemany(
+                f'INSERT INTO run_epochs ({", ".join(columns)}) VALUES ({", ".join(["?"] * len(columns))})',
+                [[run_id] + [e[c] for c in columns[1:]] for e in epochs])
+            self._conn.execute('''
+                INSERT OR REPLACE INTO runs (run_id, run_dir, model, imgsz, batch, epochs_planned, epochs_run,
+                    best_epoch, best_map50_95, best_map50, total_time, time_per_epoch, convergence_epoch,
+                    weights_path, weights_sha256, results_mtime_ns, results_size, ingested_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (run_id, os.path.abspath(run_dir), args.get('model'), args.get('imgsz'), args.get('batch'),
+                  args.get('epochs'), summary.get('epochs_run'), summary.get('best_epoch'),
+                  summary.get('best_map50_95'), summary.get('best_map50'), summary.get('total_time'),
+                  summary.get('time_per_epoch'), summary.get('convergence_epoch'),
+                  weights_path if weights_sha else None, weights_sha, stat.st_mtime_ns, stat.st_size, time.time()))
+        return True
+
+    def ingest_all(self, roots=None, force=False):
+        """ルート以下のすべてのランを取り込み、(取り込んだ数, スキップした数) を返す"""
+        ingested = skipped = 0
+        for run_dir in find_run_dirs(roots):
+            if self.ingest_run(run_dir, force=force):
+                ingested += 1
+            else:
+                skipped += 1
+        print(f"Run metrics index: {ingested} runs ingested, {skipped} unchanged.")
+        return ingested, skipped
+
+    def measure_latencies(self, runs=LATENCY_MEASURE_RUNS, force=False):
+        """重みを持つランのCPUレイテンシを計測する。同じ重み・imgszの計測結果は再利用する"""
+        targets = self._conn.execute('''
+            SELECT r.weights_sha256, r.weights_path, COALESCE(r.imgsz, 640) AS imgsz
+            FROM runs r
+            LEFT JOIN weight_latency w ON w.weights_sha256 = r.weights_sha256 AND w.imgsz = COALESCE(r.imgsz, 640)
+            WHERE r.weights_sha256 IS NOT NULL AND (w.weights_sha256 IS NULL OR ?)
+            GROUP BY r.weights_sha256, COALESCE(r.imgsz, 640)
+        ''', (int(force),)).fetchall()
+        for row in targets:
+            median_ms, p95_ms = measure_cpu_latency(row['weights_path'], imgsz=row['imgsz'], runs=runs)
+            with self._conn:
+                self._conn.execute('INSERT OR REPLACE INTO weight_latency VALUES (?, ?, ?, ?, ?)',
+                                   (row['weights_sha256'], row['imgsz'], median_ms, p95_ms, time.time()))
+            print(f"Measured {row['weights_path']}: {median_ms:.1f} ms (p95 {p95_ms:.1f} ms)")
+        return len(targets)
+
+    def leaderboard(self, latency_budget_ms=None, limit=20):
+        """
+        best mAP50-95 順のリーダーボードを返す。
+        latency_budget_ms を指定すると、計測済みのCPUレイテンシ（中央値）が予算内のランだけに絞る。
+        """
+        params = []
+        where = ''
+        if latency_budget_ms is not None:
+            where = 'WHERE w.latency_ms <= ?'
+            params.append(latency_budget_ms)
+        params.append(limit)
+        rows = self._conn.execute(f'''
+            SELECT r.run_id, r.model, r.imgsz, r.epochs_run, r.best_epoch, r.best_map50_95, r.best_map50,
+                   r.time_per_epoch, r.convergence_epoch, r.weights_path, w.latency_ms, w.latency_p95_ms
+            FROM runs r
+            LEFT JOIN weight_latency w ON w.weights_sha256 = r.weights_sha256 AND w.imgsz = COALESCE(r.imgsz, 640)
+            {where}
+            ORDER BY r.best_map50_95 DESC, w.latency_ms, r.run_id
+            LIMIT ?
+        ''', params).fetchall()
+        return [dict(row) for row in rows]
+
+    def epochs(self, run_id):
+        """ランのエポックごとのメトリクス"""
+        return [dict(row) for row in self._conn.execute(
+            'SELECT * FROM run_epochs WHERE run_id = ? ORDER BY epoch', (run_id,))]
+
+    def close(self):
+        self._conn.close()
+
+
+def print_leaderboard(rows, latency_budget_ms=None):
+    budget = f" (CPU latency <= {latency_budget_ms:g} ms)" if latency_budget_ms is not None else ''
+    print(f"--- Training Run Leaderboard{budget} ---")
+    print(f"{'#':>2} {'Run':<44} {'mAP50-95':>9} {'mAP50':>7} {'Best@':>6} {'Conv@':>6} {'s/ep':>7} {'CPU ms':>8}")
+    print("-" * 96)
+    for rank, r in enumerate(rows, 1):
+        def fmt(value, spec):
+            return format(value, spec) if value is not None else '-'
+        print(f"{rank:>2} {r['run_id'][-44:]:<44} {fmt(r['best_map50_95'], '>9.4f')} {fmt(r['best_map50'], '>7.4f')} "
+              f"{fmt(r['best_epoch'], '>6')} {fmt(r['convergence_epoch'], '>6')} {fmt(r['time_per_epoch'], '>7.2f')} "
+              f"{fmt(r['latency_ms'], '>8.1f')}")
+    with_weights = [r for r in rows if r['weights_path']]
+    if with_weights:
+        print(f"\nSuggested YOLO_MODEL_PATH: {with_weights[0]['weights_path']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index training runs and rank them by accuracy under a latency budget.')
+    parser.add_argument('--db', default=RUN_METRICS_DB_PATH)
+    parser.add_argument('--roots', nargs='*', default=None, help='results.csv を探すディレクトリ')
+    parser.add_argument('--force', action='store_true', help='変更がなくても取り込み・計測し直す')
+    parser.add_argument('--measure-latency', action='store_true', help='未計測の重みのCPUレイテンシを計測する')
+    parser.add_argument('--latency-runs', type=int, default=LATENCY_MEASURE_RUNS)
+    parser.add_argument('--budget-ms', type=float, default=None, help='CPUレイテンシの予算 (ms)')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    index = RunMetricsIndex(args.db)
+    index.ingest_all(args.roots, force=args.force)
+    if args.measure_latency:
+        index.measure_latencies(runs=args.latency_runs, force=args.force)
+    print_leaderboard(index.leaderboard(args.budget_ms, limit=args.limit), args.budget_ms)
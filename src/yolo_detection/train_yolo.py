@@ -11,17 +11,39 @@ if project_root not in sys.path:
 
 from src.config import PROJECT_ROOT, YOLO_MODEL_PATH # YOLO_MODEL_PATHはpre-trained model用
 from src.config import DATA_DIR # data.yamlのパス構築に使う
+from src.yolo_detection.image_cache import build_image_cache_for_dataset, make_cached_trainer
+from src.yolo_detection.artifact_store import ArtifactStore, detach_run_dir
 
 
-def train_yolov8_model(epochs=200, imgsz=640, batch=16, model_name='yolov8n.pt', project_name='detect', run_name='train_ep200_final'): # run_nameをユニークなものに変更
+def train_yolov8_model(epochs=200, imgsz=640, batch=16, model_name='yolov8n.pt', project_name='detect', run_name='train_ep200_final', # run_nameをユニークなものに変更
+                       image_cache=False, exist_ok=False, store_artifacts=True, artifact_store=None, resume=False):
     """
     YOLOv8モデルをカスタムデータセットでトレーニングします。
+
+    image_cache=True の場合、画像を imgsz ごとに一度だけデコード・リサイズした memmap ストア
+    (image_cache.py) から読み込み、毎エポックのJPEGデコードを省きます。
+    ストアは画像の内容ハッシュと imgsz が一致する限り、次回以降の学習でも再利用されます。
+
+    store_artifacts=True の場合、学習後にラン出力を成果物ストア (artifact_store.py) に取り込みます。
+    同じ内容のファイルは1つにまとめられ、ラン内のファイル (重みと results.csv を除く) はストアへのハードリンクに置き換わります。
+
+    resume=True の場合、project_name/run_name の weights/last.pt から中断した学習を再開します。
     """
     print(f"\n--- Starting YOLOv8 Training ({run_name}) ---")
 
-    model = YOLO(model_name)
+    run_dir = os.path.join(project_name, run_name)
+    if exist_ok or resume:
+        # 既存のラン出力がストアへのハードリンクの場合、上書きでストアを壊さないよう通常のファイルに戻す
+        detach_run_dir(run_dir)
+
+    model = YOLO(os.path.join(run_dir, 'weights', 'last.pt') if resume else model_name)
     data_yaml_path = os.path.join(DATA_DIR, 'datasets', 'data.yaml')
 
+    train_kwargs = {}
+    if image_cache:
+        store = build_image_cache_for_dataset(data_yaml_path, imgsz)
+        train_kwargs['trainer'] = make_cached_trainer(store)
+
     results = model.train(
         data=data_yaml_path,
         epochs=epochs,
@@ -29,12 +51,18 @@ def train_yolov8_model(epochs=200, imgsz=640, batch=16, model_name='yolov8n.pt',
         batch=batch,
         project=project_name,
         name=run_name,
-        exist_ok=False,
+        exist_ok=exist_ok,
+        resume=resume,
+        **train_kwargs,
     )
 
     print(f"DEBUG: Results should be saved to: {results.save_dir}")
 
     print(f"YOLOv8 Training completed. Results saved to {results.save_dir}")
+
+    if store_artifacts:
+        store = artifact_store or ArtifactStore()
+        store.ingest_run(str(results.save_dir), extra={'data': data_yaml_path, 'image_cache': image_cache})
     return results.save_dir
 
 if __name__ == '__main__':
@@ -0,0 +1,24 @@
+# tests/conftest.py
+
+import os
+import sys
+
+import pytest
+
+# プロジェクトルートをsys.pathに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+
+@pytest.fixture
+def router(tmp_path):
+    """一時ディレクトリのシャード (2つ) を db_manager のルーターにする。終わったら元のルーターに戻す"""
+    from src.database import db_manager
+    from src.database.shard_router import ShardRouter
+
+    shard_router = ShardRouter(str(tmp_path / 'shards'), num_shards=2, dedicated=False)
+    previous = db_manager.use_router(shard_router)
+    yield shard_router
+    db_manager.use_router(previous)
+    shard_router.close()
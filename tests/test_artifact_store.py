@@ -0,0 +1,104 @@
+# tests/test_artifact_store.py
+
+import os
+
+import pytest
+
+from src.yolo_detection.artifact_store import ArtifactStore, detach_run_dir
+
+RESULTS_HEADER = 'epoch,metrics/mAP50(B),metrics/mAP50-95(B),time\n'
+
+
+def _make_run(run_dir, map50_95, weights=b'weights', plot=b'plot'):
+    os.makedirs(os.path.join(run_dir, 'weights'), exist_ok=True)
+    files = {
+        'args.yaml': b'model: yolov8n.pt\nepochs: 2\nimgsz: 640\n',
+        'results.csv': f'{RESULTS_HEADER}1,0.1,0.05,10\n2,0.2,{map50_95},20\n'.encode(),
+        'train_batch0.jpg': plot,
+        'weights/best.pt': weights,
+        'weights/last.pt': weights + b'-last',
+    }
+    for rel_path, data in files.items():
+        with open(os.path.join(run_dir, rel_path), 'wb') as f:
+            f.write(data)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / 'store'))
+
+
+def test_ingest_records_manifest_and_deduplicates(store, tmp_path):
+    _make_run(str(tmp_path / 'run1'), 0.3)
+    _make_run(str(tmp_path / 'run2'), 0.4, weights=b'other')
+
+    first = store.ingest_run(str(tmp_path / 'run1'), run_id='run1')
+    store.ingest_run(str(tmp_path / 'run2'), run_id='run2')
+
+    assert first['args']['epochs'] == 2
+    assert first['metrics']['best_map50_95'] == 0.3
+    assert set(first['weights']) == {'weights/best.pt', 'weights/last.pt'}
+    rows = {row['run_id']: row for row in store.compare_runs()}
+    assert rows['run2']['best_map50_95'] == 0.4
+    # 同じプロットは1つのオブジェクトになり、両方のランからハードリンクされる
+    plot1, plot2 = (os.path.join(str(tmp_path), run, 'train_batch0.jpg') for run in ('run1', 'run2'))
+    assert os.path.samefile(plot1, plot2)
+
+
+def test_weights_and_results_stay_writable_after_ingest(store, tmp_path):
+    run_dir = str(tmp_path / 'run1')
+    _make_run(run_dir, 0.3)
+    store.ingest_run(run_dir, run_id='run1')
+
+    # 学習の再開はその場で書き換える
+    with open(os.path.join(run_dir, 'weights', 'last.pt'), 'wb') as f:
+        f.write(b'resumed')
+    with open(os.path.join(run_dir, 'results.csv'), 'a') as f:
+        f.write('3,0.3,0.5,30\n')
+
+    restored = store.restore_run('run1', str(tmp_path / 'restored'))
+    with open(os.path.join(restored, 'weights', 'last.pt'), 'rb') as f:
+        assert f.read() == b'weights-last'
+
+
+def test_detach_makes_linked_files_independent(store, tmp_path):
+    run_dir = str(tmp_path / 'run1')
+    _make_run(run_dir, 0.3)
+    store.ingest_run(run_dir, run_id='run1')
+    plot = os.path.join(run_dir, 'train_batch0.jpg')
+    assert os.stat(plot).st_nlink == 2
+
+    detach_run_dir(run_dir)
+    with open(plot, 'wb') as f:
+        f.write(b'new plot')
+
+    sha = store.load_manifest('run1')['files']['train_batch0.jpg']['sha256']
+    with open(store.object_path(sha), 'rb') as f:
+        assert f.read() == b'plot'
+
+
+def test_gc_keeps_pinned_and_best_runs(store, tmp_path):
+    for i, score in enumerate([0.9, 0.1, 0.2, 0.3]):
+        _make_run(str(tmp_path / f'run{i}'), score, weights=f'w{i}'.encode())
+        store.ingest_run(str(tmp_path / f'run{i}'), run_id=f'run{i}', link_back=False)
+    store.set_pinned('run1')
+
+    result = store.gc(keep_last=1, keep_best=1)
+
+    assert result['removed_runs'] == ['run2']
+    assert sorted(m['run_id'] for m in store.list_runs()) == ['run0', 'run1', 'run3']
+    assert result['freed_bytes'] > 0
+    assert result['linked_bytes'] == 0
+
+
+def test_gc_does_not_count_bytes_still_linked_from_run_dirs(store, tmp_path):
+    for i in range(2):
+        _make_run(str(tmp_path / f'run{i}'), 0.1 * (i + 1), plot=f'plot{i}'.encode())
+        store.ingest_run(str(tmp_path / f'run{i}'), run_id=f'run{i}')
+
+    result = store.gc(keep_last=1, keep_best=0)
+
+    assert result['removed_runs'] == ['run0']
+    # run0 のディレクトリが残っているので、ハードリンクされたプロットは解放されない
+    assert result['linked_bytes'] == len(b'plot0')
+    assert os.path.exists(str(tmp_path / 'run0' / 'train_batch0.jpg'))
@@ -0,0 +1,11 @@
+# tests/test_async_load_test.py
+
+from src.benchmarks.async_load_test import _percentile
+
+
+def test_percentile_stays_within_the_samples():
+    values = [0.10, 0.20, 0.30, 1.17]
+    assert _percentile(values, 99) <= max(values)
+    assert _percentile(values, 50) == 0.25
+    assert _percentile([0.5], 99) == 0.5
+    assert _percentile([], 99) == 0.0
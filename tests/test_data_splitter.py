@@ -0,0 +1,88 @@
+# tests/test_data_splitter.py
+
+import os
+
+from src.data_preparation.data_splitter import (assign_splits, load_assignments, load_links, materialize_links,
+                                                split_dataset)
+
+RATIOS = {'train': 0.5, 'val': 0.25, 'test': 0.25}
+
+
+def _make_source(source_dir, names):
+    os.makedirs(source_dir, exist_ok=True)
+    for name in names:
+        with open(os.path.join(source_dir, f'{name}.jpg'), 'wb') as f:
+            f.write(name.encode())
+        with open(os.path.join(source_dir, f'{name}.txt'), 'w') as f:
+            f.write('0 0.5 0.5 0.1 0.1\n')
+
+
+def _split(source_dir, target_dir, **kwargs):
+    return split_dataset(source_dir=source_dir, target_dir=target_dir, ratios=RATIOS, stratify=False,
+                         mode='hardlink', **kwargs)
+
+
+def test_assign_splits_keeps_previous_assignments():
+    images = [f'img{i}.jpg' for i in range(8)]
+    strata = {image: 'all' for image in images}
+    first = assign_splits(images, strata, ratios=RATIOS, seed=1)
+
+    second = assign_splits(images + ['new.jpg'], {**strata, 'new.jpg': 'all'}, ratios=RATIOS, seed=2, previous=first)
+
+    assert {image: second[image] for image in images} == first
+    assert second['new.jpg'] in RATIOS
+
+
+def test_hardlink_split_links_images_and_labels(tmp_path):
+    source, target = str(tmp_path / 'src'), str(tmp_path / 'datasets')
+    _make_source(source, [f'img{i}' for i in range(8)])
+
+    assignments = _split(source, target)
+
+    for image, split in assignments.items():
+        linked = os.path.join(target, split, 'images', image)
+        assert os.path.samefile(linked, os.path.join(source, image))
+        assert os.path.exists(os.path.join(target, split, 'labels', image.replace('.jpg', '.txt')))
+    assert load_links(target) == set(assignments.items())
+
+
+def test_resplit_keeps_files_this_tool_did_not_create(tmp_path):
+    source, target = str(tmp_path / 'src'), str(tmp_path / 'datasets')
+    _make_source(source, [f'img{i}' for i in range(8)])
+    _split(source, target)
+    # convert_class_ids.py が書き出した Roboflow の画像など
+    roboflow = os.path.join(target, 'train', 'images', 'roboflow_0001.jpg')
+    with open(roboflow, 'wb') as f:
+        f.write(b'roboflow')
+
+    _split(source, target, reshuffle=True, seed=7)
+
+    assert os.path.exists(roboflow)
+
+
+def test_removed_source_image_is_unlinked(tmp_path):
+    source, target = str(tmp_path / 'src'), str(tmp_path / 'datasets')
+    _make_source(source, [f'img{i}' for i in range(8)])
+    first = _split(source, target)
+    os.remove(os.path.join(source, 'img0.jpg'))
+    os.remove(os.path.join(source, 'img0.txt'))
+
+    second = _split(source, target)
+
+    assert 'img0.jpg' not in second
+    assert not os.path.lexists(os.path.join(target, first['img0.jpg'], 'images', 'img0.jpg'))
+    assert not os.path.lexists(os.path.join(target, first['img0.jpg'], 'labels', 'img0.txt'))
+    assert load_assignments(target) == second
+
+
+def test_reassigned_image_is_moved_not_duplicated(tmp_path):
+    source, target = str(tmp_path / 'src'), str(tmp_path / 'datasets')
+    _make_source(source, ['a', 'b'])
+    materialize_links({'a.jpg': 'train', 'b.jpg': 'val'}, source, target, ratios=RATIOS)
+
+    materialize_links({'a.jpg': 'val', 'b.jpg': 'val'}, source, target, ratios=RATIOS,
+                      previous_links={('a.jpg', 'train'), ('b.jpg', 'val')})
+
+    assert not os.path.lexists(os.path.join(target, 'train', 'images', 'a.jpg'))
+    assert os.path.exists(os.path.join(target, 'val', 'images', 'a.jpg'))
+    assert os.path.exists(os.path.join(target, 'val', 'images', 'b.jpg'))
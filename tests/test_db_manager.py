@@ -0,0 +1,152 @@
+# tests/test_db_manager.py
+
+import pytest
+
+from src.database import db_manager
+from src.database.inventory_events import event_batch, UndoConflictError
+
+HH = 'hh-test'
+
+
+def _active(household_id=HH):
+    return sorted((row['standard_name'], row['yolo_class'], row['quantity'], row['detected_by'])
+                  for row in db_manager.get_all_food_items(household_id=household_id))
+
+
+# --- apply_scan_counts ---
+
+def test_scan_counts_update_one_row_per_class(router):
+    first = db_manager.apply_scan_counts({'egg': 3, 'milk': 1}, household_id=HH)
+    second = db_manager.apply_scan_counts({'egg': 2, 'milk': 1}, household_id=HH)
+
+    assert len(first['inserted']) == 2
+    assert second['inserted'] == []
+    assert sorted(second['updated']) == sorted(first['inserted'])
+    assert _active() == [('egg', 'egg', 2, 'yolo'), ('milk', 'milk', 1, 'yolo')]
+
+
+def test_scan_counts_merge_duplicate_generic_rows(router):
+    db_manager.add_food_item('egg', 'egg', 1, 'yolo', household_id=HH)
+    db_manager.add_food_item('egg', 'egg', 1, 'yolo', household_id=HH)
+
+    result = db_manager.apply_scan_counts({'egg': 4}, household_id=HH)
+
+    assert len(result['merged']) == 1
+    assert _active() == [('egg', 'egg', 4, 'yolo')]
+
+
+def test_scan_counts_do_not_reduce_receipt_rows(router):
+    db_manager.add_food_item('牛乳', 'milk', 2, 'ocr', household_id=HH)
+
+    db_manager.apply_scan_counts({'milk': 1}, household_id=HH)
+    assert _active() == [('牛乳', 'milk', 2, 'ocr')]
+
+    # 見えた数の方が多ければ、レシート由来の行に差分を足す
+    db_manager.apply_scan_counts({'milk': 3}, household_id=HH)
+    assert _active() == [('牛乳', 'milk', 3, 'ocr')]
+
+
+def test_scan_counts_generic_row_holds_only_the_remainder(router):
+    db_manager.add_food_item('egg', 'egg', 5, 'yolo', household_id=HH)
+    db_manager.add_food_item('卵', 'egg', 4, 'ocr', household_id=HH)
+
+    db_manager.apply_scan_counts({'egg': 6}, household_id=HH)
+
+    assert _active() == [('egg', 'egg', 2, 'yolo'), ('卵', 'egg', 4, 'ocr')]
+
+
+def test_scan_counts_missing_policy_consumes_unseen_rows(router):
+    db_manager.apply_scan_counts({'egg': 1, 'milk': 1}, household_id=HH)
+
+    result = db_manager.apply_scan_counts({'egg': 1}, missing_policy='consumed',
+                                          detectable_classes={'egg', 'milk'}, household_id=HH)
+
+    assert len(result['missing']) == 1
+    assert _active() == [('egg', 'egg', 1, 'yolo')]
+
+
+def test_scan_counts_ignore_classes_the_detector_cannot_see(router):
+    db_manager.apply_scan_counts({'egg': 1, 'milk': 1}, household_id=HH)
+
+    result = db_manager.apply_scan_counts({'egg': 1}, missing_policy='consumed',
+                                          detectable_classes={'egg'}, household_id=HH)
+
+    assert result['missing'] == []
+    assert len(_active()) == 2
+
+
+def test_scan_counts_reject_unknown_missing_policy(router):
+    with pytest.raises(ValueError):
+        db_manager.apply_scan_counts({'egg': 1}, missing_policy='drop', household_id=HH)
+
+
+def test_scan_records_series_and_model_variant(router):
+    first = db_manager.apply_scan_counts({'egg': 3}, household_id=HH, model_variant='best@480')
+    second = db_manager.apply_scan_counts({}, detectable_classes={'egg'}, household_id=HH)
+
+    series = db_manager.get_scan_history(HH, yolo_class='egg')
+    assert [(scan_id, count) for _, scan_id, _, count in series] == [(first['scan_id'], 3), (second['scan_id'], 0)]
+    assert db_manager.get_scan_variants(HH) == {first['scan_id']: 'best@480', second['scan_id']: None}
+
+
+# --- undo_batch ---
+
+def test_undo_batch_restores_inventory_and_scan_history(router):
+    db_manager.apply_scan_counts({'egg': 2}, household_id=HH)
+    with event_batch() as batch_id:
+        db_manager.apply_scan_counts({'egg': 5, 'milk': 1}, household_id=HH)
+    assert _active() == [('egg', 'egg', 5, 'yolo'), ('milk', 'milk', 1, 'yolo')]
+
+    db_manager.undo_batch(batch_id, household_id=HH)
+
+    assert _active() == [('egg', 'egg', 2, 'yolo')]
+    assert [count for _, _, _, count in db_manager.get_scan_history(HH, yolo_class='egg')] == [2]
+    with pytest.raises(ValueError):
+        db_manager.undo_batch(batch_id, household_id=HH)
+
+
+def test_undo_batch_refuses_when_a_later_batch_changed_the_item(router):
+    with event_batch() as first:
+        db_manager.apply_scan_counts({'egg': 2}, household_id=HH)
+    with event_batch():
+        db_manager.apply_scan_counts({'egg': 4}, household_id=HH)
+
+    with pytest.raises(UndoConflictError):
+        db_manager.undo_batch(first, household_id=HH)
+    db_manager.undo_batch(first, household_id=HH, force=True)
+    assert _active() == []
+
+
+# --- 在庫キャッシュ ---
+
+def test_cache_sees_committed_writes(router):
+    assert _active() == []
+    item_id = db_manager.add_food_item('卵', 'egg', 6, 'ocr', household_id=HH)
+    assert _active() == [('卵', 'egg', 6, 'ocr')]
+
+    db_manager.update_food_item_quantity(item_id, 3, household_id=HH)
+    assert _active() == [('卵', 'egg', 3, 'ocr')]
+
+    db_manager.mark_as_consumed_or_discarded(item_id, household_id=HH)
+    assert _active() == []
+    assert db_manager.inventory_cache_stats()['hits'] > 0
+
+
+def test_cache_ignores_rolled_back_transaction(router):
+    db_manager.add_food_item('卵', 'egg', 6, 'ocr', household_id=HH)
+    _active()
+
+    with pytest.raises(RuntimeError):
+        with db_manager.transaction(HH):
+            db_manager.add_food_item('牛乳', 'milk', 1, 'ocr', household_id=HH)
+            raise RuntimeError('abort')
+
+    assert _active() == [('卵', 'egg', 6, 'ocr')]
+
+
+def test_cache_is_per_household(router):
+    db_manager.add_food_item('卵', 'egg', 6, 'ocr', household_id=HH)
+    db_manager.add_food_item('牛乳', 'milk', 1, 'ocr', household_id='other')
+
+    assert _active() == [('卵', 'egg', 6, 'ocr')]
+    assert _active('other') == [('牛乳', 'milk', 1, 'ocr')]
@@ -0,0 +1,84 @@
+# tests/test_receipt_fingerprints.py
+
+import pytest
+
+from src.database import db_manager
+from src.database.inventory_events import event_batch
+from src.database.receipt_fingerprints import dhash_bands, hamming_distance
+
+HH = 'hh-test'
+DHASH = 0x0123_4567_89AB_CDEF
+
+
+def _fingerprint(sha1='a' * 40, dhash=DHASH, header='header-1', text='text-1'):
+    return {'image_sha1': sha1, 'dhash': dhash, 'dhash_fine': '0' * 64, 'header_hash': header, 'text_hash': text,
+            'store': 'store', 'receipt_date': '2025-07-15 10:30', 'total': 1000, 'items': [['牛乳', 1.0]]}
+
+
+def test_dhash_bands_cover_the_whole_hash():
+    bands = dhash_bands(DHASH)
+    assert len(bands) == 4
+    assert sum(value << (16 * band) for band, value in bands) == DHASH
+    assert hamming_distance(DHASH, DHASH ^ 0b101) == 2
+
+
+def test_same_file_is_an_exact_duplicate(router):
+    first, duplicate = db_manager.register_receipt(_fingerprint(), household_id=HH)
+    assert duplicate is None
+
+    match = db_manager.find_duplicate_receipt_image(_fingerprint(dhash=DHASH ^ 0xFF), household_id=HH)
+    assert match == {'receipt_id': first, 'reason': 'image_exact', 'distance': 0}
+
+
+def test_near_photo_is_only_a_candidate_before_ocr(router):
+    first, _ = db_manager.register_receipt(_fingerprint(), household_id=HH)
+
+    match = db_manager.find_duplicate_receipt_image(_fingerprint(sha1='b' * 40, dhash=DHASH ^ 0b1),
+                                                    household_id=HH)
+
+    assert match == {'receipt_id': first, 'reason': 'image_near', 'distance': 1}
+
+
+def test_near_photo_with_a_different_header_is_applied(router):
+    db_manager.register_receipt(_fingerprint(), household_id=HH)
+
+    # 同じ店の同じ形のレシートでも、日時と合計が違えば別の買い物
+    _, duplicate = db_manager.register_receipt(
+        _fingerprint(sha1='b' * 40, dhash=DHASH, header='header-2', text='text-2'), household_id=HH)
+
+    assert duplicate is None
+    assert [row['status'] for row in db_manager.list_receipts(HH)] == ['applied', 'applied']
+
+
+def test_near_photo_without_a_header_is_flagged(router):
+    first, _ = db_manager.register_receipt(_fingerprint(), household_id=HH)
+
+    second, duplicate = db_manager.register_receipt(
+        _fingerprint(sha1='b' * 40, dhash=DHASH ^ 0b1, header=None, text=None), household_id=HH)
+
+    assert duplicate['reason'] == 'image_near'
+    assert duplicate['receipt_id'] == first
+    assert db_manager.list_receipts(HH, status='flagged')[0]['receipt_id'] == second
+
+
+@pytest.mark.parametrize('column, reason', [('text', 'text'), ('header', 'header')])
+def test_same_content_from_a_different_photo_is_flagged(router, column, reason):
+    first, _ = db_manager.register_receipt(_fingerprint(), household_id=HH)
+
+    other = {'text': 'text-2', 'header': 'header-2'}
+    other.pop(column)
+    _, duplicate = db_manager.register_receipt(
+        _fingerprint(sha1='b' * 40, dhash=~DHASH & (2 ** 64 - 1), **other), household_id=HH)
+
+    assert duplicate == {'receipt_id': first, 'reason': reason, 'distance': None}
+
+
+def test_undone_receipt_can_be_imported_again(router):
+    with event_batch() as batch_id:
+        db_manager.register_receipt(_fingerprint(), household_id=HH)
+        db_manager.add_food_item('牛乳', 'milk', 1, 'ocr', household_id=HH)
+
+    db_manager.undo_batch(batch_id, household_id=HH)
+
+    assert db_manager.list_receipts(HH) == []
+    assert db_manager.find_duplicate_receipt_image(_fingerprint(), household_id=HH) is None
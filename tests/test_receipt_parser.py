@@ -0,0 +1,85 @@
+# tests/test_receipt_parser.py
+
+import json
+import re
+import threading
+import time
+
+from src.llm.response_cache import LLMResponseCache
+from src.ocr_processing.receipt_parser import HybridReceiptParser
+
+
+class SlowClient:
+    """応答に時間がかかる同期のLLMクライアント。同時に実行中のリクエスト数の最大値を記録する"""
+    model_name = 'slow'
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, json_output=True):
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            lines = json.loads(re.search(r'```json\s*(\[.*?\])\s*```', prompt, re.S).group(1))
+            return json.dumps({'items': [{'id': line['id'], 'name': line['text'].split()[0], 'quantity': 1}
+                                         for line in lines]}, ensure_ascii=False)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _receipts(n):
+    return [[f'ｵｰｶﾞﾆｯｸﾍﾞｼﾞ{i} 100円'] for i in range(n)]
+
+
+def test_parser_batches_unknown_lines_and_caches_them():
+    client = SlowClient(latency=0.0)
+    parser = HybridReceiptParser(client=client, cache=LLMResponseCache(':memory:'), batch_size=4)
+
+    first = parser.parse_many(_receipts(8))
+    calls = parser.stats['llm_calls']
+    second = parser.parse_many(_receipts(8))
+
+    assert calls == 2
+    assert parser.stats['llm_calls'] == calls
+    assert [items[0]['item_name'] for items in first] == [items[0]['item_name'] for items in second]
+
+
+def test_timed_out_requests_still_count_against_max_concurrency():
+    client = SlowClient(latency=0.2)
+    parser = HybridReceiptParser(client=client, cache=LLMResponseCache(':memory:'), batch_size=1,
+                                 max_concurrency=2, timeout=0.05, max_retries=2, retry_backoff=0.0)
+
+    parser.parse_many(_receipts(4))
+
+    assert client.peak <= 2
+    assert parser.stats['llm_timeouts'] > 0
+    assert parser.stats['failed_batches'] == 4
+
+
+def test_response_cache_can_be_used_from_another_thread():
+    cache = LLMResponseCache(':memory:')
+    cache.put('key', 'value')
+    results = []
+
+    thread = threading.Thread(target=lambda: results.append((cache.get('key'), cache.get_many(['key', 'missing']))))
+    thread.start()
+    thread.join()
+
+    assert results == [('value', {'key': 'value'})]
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = LLMResponseCache(':memory:', max_entries=2)
+    cache.put('a', '1')
+    cache.put('b', '2')
+    cache.get('a')
+    cache.put('c', '3')
+
+    assert cache.get('b') is None
+    assert cache.get_many(['a', 'c']) == {'a': '1', 'c': '3'}
@@ -0,0 +1,94 @@
+# tests/test_shard_router.py
+
+import sqlite3
+from datetime import datetime
+
+from src.database import db_manager
+from src.database.inventory_archive import archive_inactive_items
+from src.database.shard_router import ShardRouter
+
+HH = 'hh-test'
+
+
+def _legacy_db(path):
+    """シャーディング前の形式 (household_id 列なし) のDBを作る"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE food_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, standard_name TEXT, yolo_class TEXT, quantity REAL,
+            purchase_date TEXT, expiry_date TEXT, detected_by TEXT, last_seen_date TEXT, status TEXT
+        )
+    ''')
+    conn.executemany('INSERT INTO food_items (standard_name, yolo_class, quantity, purchase_date, expiry_date, '
+                     'detected_by, last_seen_date, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                         ('牛乳', 'milk', 1, '2024-01-01', '2024/01/10', 'ocr', '2024-01-01', 'active'),
+                         ('ハム', 'ham', 1, '2024-01-01', None, 'ocr', '2024-01-01', 'consumed'),
+                     ])
+    conn.commit()
+    conn.close()
+
+
+def test_stale_router_write_lands_in_migrated_shard(router, tmp_path):
+    item_id = db_manager.add_food_item('卵', 'egg', 6, 'ocr', household_id=HH)
+    source = router.shard_for(HH)
+    target = 1 - source
+
+    # 別のプロセスのルーターが世帯を移す (このルーターは古い割り当てをキャッシュしたまま)
+    other = ShardRouter(router.shard_dir, num_shards=2, init_schema=router.init_schema)
+    other.migrate_household(HH, target, db_manager.HOUSEHOLD_TABLES)
+    other.close()
+
+    db_manager.update_food_item_quantity(item_id, 3, household_id=HH)
+
+    assert router.shard_for(HH) == target
+    assert router.shard_connection(source).execute(
+        'SELECT COUNT(*) FROM food_items WHERE household_id = ?', (HH,)).fetchone()[0] == 0
+    row = router.shard_connection(target).execute(
+        'SELECT quantity FROM food_items WHERE household_id = ? AND id = ?', (HH, item_id)).fetchone()
+    assert row['quantity'] == 3
+
+
+def test_migrate_household_back_and_forth(router):
+    db_manager.add_food_item('卵', 'egg', 6, 'ocr', household_id=HH)
+    source = router.shard_for(HH)
+
+    router.migrate_household(HH, 1 - source, db_manager.HOUSEHOLD_TABLES)
+    router.migrate_household(HH, source, db_manager.HOUSEHOLD_TABLES)
+    db_manager.add_food_item('牛乳', 'milk', 1, 'ocr', household_id=HH)
+
+    assert router.shard_for(HH) == source
+    assert sorted(row['standard_name'] for row in db_manager.get_all_food_items(household_id=HH)) == ['卵', '牛乳']
+
+
+def test_legacy_import_does_not_modify_the_legacy_file(router, tmp_path):
+    legacy_path = str(tmp_path / 'inventory.db')
+    _legacy_db(legacy_path)
+    with open(legacy_path, 'rb') as f:
+        before = f.read()
+
+    db_manager.import_legacy_database(legacy_path, household_id=HH)
+
+    with open(legacy_path, 'rb') as f:
+        assert f.read() == before
+    rows = db_manager.get_all_food_items(status='all', household_id=HH)
+    assert sorted((row['standard_name'], row['status'], row['expiry_date']) for row in rows) == [
+        ('ハム', 'consumed', None), ('牛乳', 'active', '2024-01-10')]
+
+
+def test_imported_rows_survive_checkpoint_pruning_and_archiving(router, tmp_path):
+    legacy_path = str(tmp_path / 'inventory.db')
+    _legacy_db(legacy_path)
+    db_manager.import_legacy_database(legacy_path, household_id=HH)
+    events = db_manager.get_inventory_events(HH)
+    assert sorted(event['event_type'] for event in events) == ['imported', 'imported']
+
+    # 取り込み時のチェックポイントが消えるまでチェックポイントを作る
+    for i in range(4):
+        db_manager.add_food_item(f'item{i}', 'egg', 1, 'ocr', household_id=HH)
+        db_manager.create_checkpoint(HH)
+    # 取り込んだ行は取り込み時刻ではなく最終確認日で保持期間を数える
+    results = archive_inactive_items(router=router, report=False, vacuum=False, retention_days=30)
+
+    assert sum(result['archived'] for result in results.values()) == 1
+    names = {row['standard_name'] for row in db_manager.get_inventory_at(datetime.now(), HH, status='all')}
+    assert {'牛乳', 'ハム'} <= names